@@ -0,0 +1,95 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""
+ABC algorithm for COVID-19 modelling on the host CPU.
+
+Runs the model of ``ABC_IPU.py`` with the vectorised NumPy backend in
+``abc_numpy.py``, either as rejection ABC or as SMC-ABC.
+See README for model background.
+"""
+
+import os
+
+import numpy as np
+
+import abc_numpy
+import covid_data
+from argparser import get_cpu_argparser
+
+
+def main(args):
+    """Run inference and report accepted samples per second."""
+    if args.samples_filepath:
+        assert os.path.exists(
+            os.path.dirname(os.path.abspath(args.samples_filepath))
+        ), "Path to save samples (--samples-fn) does not exist."
+
+    country_data_train, population = covid_data.get_numpy_data(args.country)
+    if args.n_days is not None:
+        country_data_train = country_data_train[:, : args.n_days]
+
+    rng = np.random.default_rng(args.seed)
+    with abc_numpy.Simulator(
+        country_data_train,
+        population,
+        n_workers=args.n_workers,
+        seed=args.seed,
+        early_termination=not args.no_early_termination,
+    ) as simulator:
+        run_kwargs = dict(
+            simulator=simulator,
+            tolerance=args.tolerance,
+            n_samples_target=args.n_samples_target,
+            n_samples_per_batch=args.n_samples_per_batch,
+            max_n_runs=args.max_n_runs,
+            rng=rng,
+        )
+        if args.mode == "smc":
+            result = abc_numpy.smc_abc(
+                quantile=args.smc_quantile,
+                max_generations=args.smc_max_generations,
+                initial_tolerance=args.smc_initial_tolerance,
+                **run_kwargs,
+            )
+        else:
+            result = abc_numpy.rejection_abc(**run_kwargs)
+
+    n_runs = max(result.n_runs, 1)
+    if args.sparse_output:
+        print(
+            f"{result.duration:.3f} \t {1e3*result.duration/n_runs:.3f} \t " f"{result.accepted_samples_per_second:.3f}"
+        )
+    else:
+        work_fraction = result.n_sample_days / max(result.n_simulations * (country_data_train.shape[1] - 1), 1)
+        print(
+            f"Running {args.mode} ABC inference for {args.country} on CPU\n"
+            f"\tBatch size: {args.n_samples_per_batch}\n"
+            f"\tTolerance: {args.tolerance}"
+            f"\tTarget number of samples: {args.n_samples_target}"
+            f"\tWorkers: {args.n_workers}"
+        )
+        print("=========================================")
+        print("CPU runs completed in {0:.3f} seconds\n".format(result.duration))
+        print(f"Samples collected: {result.n_accepted:.0f}")
+        print(f"Number of runs: {result.n_runs:.0f}")
+        print(f"Number of simulations: {result.n_simulations:.0f}")
+        print(f"Fraction of simulated days after early termination: {work_fraction:.3f}")
+        print("Time per run: {0:.3f} milliseconds\n".format(1e3 * result.duration / n_runs))
+        if args.mode == "smc":
+            print("Tolerance schedule: " + ", ".join(f"{t:.4g}" for t in result.tolerances))
+            print("Effective sample sizes: " + ", ".join(f"{e:.1f}" for e in result.effective_sample_sizes))
+        print(f"Accepted samples per second: {result.accepted_samples_per_second:.3f}")
+
+    if not result.converged:
+        if args.mode == "smc" and result.n_accepted >= args.n_samples_target:
+            raise NotImplementedError(
+                "Target tolerance not reached. Increase --smc-max-generations or decrease --smc-quantile."
+            )
+        raise NotImplementedError("Too few iterations. Increase max_num_runs parameter.")
+
+    if args.samples_filepath:
+        # Save an unweighted sample of the accepted parameters if filepath given
+        np.savetxt(args.samples_filepath, result.resample(result.n_accepted, rng), delimiter=",")
+
+
+if __name__ == "__main__":
+    main(get_cpu_argparser().parse_args())
@@ -0,0 +1,410 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""
+Vectorised NumPy backend for the COVID-19 ABC model.
+
+Simulates the same stochastic model as ``ABC_IPU.py`` so that inference can be
+run and benchmarked on a CPU-only host. Two inference modes are provided:
+
+* ``rejection_abc``: rejection ABC with a single fixed tolerance, equivalent
+  to the IPU implementation.
+* ``smc_abc``: sequential Monte Carlo ABC (population Monte Carlo) with an
+  adaptive, decreasing tolerance schedule and importance-weighted resampling
+  of the previous population.
+
+In both modes a simulation is terminated early as soon as its running
+distance exceeds the current tolerance. The distance is a sum of per-series
+Euclidean norms over days, which can only grow as days are added, so the
+running distance is a lower bound of the final one and early rejection never
+changes which samples are accepted.
+"""
+import multiprocessing
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+# State transition matrix     S   I  A  R  D  Ru
+MIXING_MATRIX = np.array(
+    [
+        [-1, 1, 0, 0, 0, 0],  # S + I -> 2I
+        [0, -1, 1, 0, 0, 0],  # I -> A
+        [0, 0, -1, 1, 0, 0],  # A -> R
+        [0, 0, -1, 0, 1, 0],  # A -> D
+        [0, -1, 0, 0, 0, 1],
+    ],  # I -> Ru
+    dtype=np.float32,
+)
+# theta ~ U(l,u) theta = [alpha_0,alpha,beta,gamma,delta,eta,n,kappa,-log w]
+UNIFORM_PRIOR_LOWER_LIMIT = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 2.0], dtype=np.float32)
+UNIFORM_PRIOR_UPPER_LIMIT = np.array([1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 20.0, 100.0, 6.0], dtype=np.float32)
+N_PARAMS = UNIFORM_PRIOR_LOWER_LIMIT.shape[0]
+# Maximum number of rounds of SMC proposals drawn to fill one batch
+MAX_PROPOSAL_ROUNDS = 100
+
+
+def sample_prior(n_samples, rng):
+    """Draw ``[n_samples, N_PARAMS]`` parameter vectors from the uniform prior."""
+    u = rng.random((n_samples, N_PARAMS), dtype=np.float32)
+    return UNIFORM_PRIOR_LOWER_LIMIT + u * (UNIFORM_PRIOR_UPPER_LIMIT - UNIFORM_PRIOR_LOWER_LIMIT)
+
+
+def in_prior_support(param_vector):
+    """Boolean mask of the parameter vectors with non-zero prior density."""
+    return np.all(
+        (param_vector >= UNIFORM_PRIOR_LOWER_LIMIT) & (param_vector <= UNIFORM_PRIOR_UPPER_LIMIT),
+        axis=1,
+    )
+
+
+def simulate(param_vector, country_data, population, rng, tolerance=np.inf):
+    """Simulate the model for every parameter vector and return its distance to the data.
+
+    Args:
+        param_vector: ``[n_samples, N_PARAMS]`` parameters
+            ``[alpha_0, alpha, beta, gamma, delta, eta, n, kappa, -log w]``.
+        country_data: ``[3, n_days]`` observed active cases, recoveries and deaths.
+        population: Total population of the country.
+        rng: ``np.random.Generator`` used for the day-to-day noise.
+        tolerance: Samples whose running distance exceeds this value stop
+            being simulated. Their returned distance is the running distance
+            at the day they stopped, which is a lower bound of the full one
+            and is already above ``tolerance``.
+
+    Returns:
+        distances: ``[n_samples]`` summed Euclidean distances to the data.
+        n_sample_days: Number of (sample, day) pairs actually simulated.
+    """
+    n_samples = param_vector.shape[0]
+    country_data = np.asarray(country_data, dtype=np.float32)
+    n_days = country_data.shape[1]
+    P = np.float32(population)
+    A_0, R_0, D_0 = country_data[:, 0]
+
+    p = np.ascontiguousarray(param_vector.T, dtype=np.float32)
+    w = np.power(np.float32(10.0), p[8])
+
+    # State vector rows are [S, I, A, R, D, Ru]
+    X = np.zeros([6, n_samples], dtype=np.float32)
+    X[0] = P - p[7] * A_0 - (A_0 + R_0 + D_0)
+    X[1] = p[7] * A_0
+    X[2] = A_0
+    X[3] = R_0
+    X[4] = D_0
+
+    transition = np.ascontiguousarray(MIXING_MATRIX.T)
+    alive = np.arange(n_samples)
+    squared_errors = np.zeros([3, n_samples], dtype=np.float32)
+    running_distances = np.zeros(n_samples, dtype=np.float32)
+    distances = np.empty(n_samples, dtype=np.float32)
+    n_sample_days = 0
+
+    for day in range(1, n_days):
+        n_sample_days += alive.shape[0]
+        S, I, A = X[0], X[1], X[2]
+        U = A / w
+        with np.errstate(over="ignore"):
+            # U^n overflowing to inf gives the correct limit alpha_t = alpha_0
+            alpha_t = p[0] + p[1] / (1.0 + np.power(U, p[6]))
+        h = np.stack([(S * I / P) * alpha_t, I * p[3], A * p[2], A * p[4], I * p[2] * p[5]])
+        normal_sample = h + np.sqrt(h) * rng.standard_normal(h.shape, dtype=np.float32)
+        Y = np.clip(np.floor(normal_sample), 0.0, P)
+        X = np.clip(X + transition @ Y, 0.0, P)
+
+        squared_errors += np.square(country_data[:, day, None] - X[2:5])
+        running_distances = np.sqrt(squared_errors).sum(axis=0)
+
+        rejected = running_distances > tolerance
+        if rejected.any():
+            distances[alive[rejected]] = running_distances[rejected]
+            kept = ~rejected
+            alive = alive[kept]
+            p = p[:, kept]
+            w = w[kept]
+            X = X[:, kept]
+            squared_errors = squared_errors[:, kept]
+            running_distances = running_distances[kept]
+            if alive.shape[0] == 0:
+                break
+
+    distances[alive] = running_distances
+    return distances, n_sample_days
+
+
+# Per-process state of the simulator workers, set by `_init_worker`.
+_worker_state = {}
+
+
+def _init_worker(country_data, population):
+    _worker_state["country_data"] = country_data
+    _worker_state["population"] = population
+
+
+def _simulate_chunk(args):
+    param_vector, tolerance, seed_sequence = args
+    rng = np.random.default_rng(seed_sequence)
+    return simulate(param_vector, _worker_state["country_data"], _worker_state["population"], rng, tolerance)
+
+
+class Simulator:
+    """Batched simulator, optionally sharded across a pool of worker processes.
+
+    Each call splits the batch into ``n_workers`` contiguous chunks. Every
+    chunk gets its own child of a single ``np.random.SeedSequence``, so
+    results are reproducible for a fixed seed and number of workers.
+    With ``early_termination=False`` every sample is simulated for all days
+    and the tolerance is only applied by the caller, as on the IPU.
+    """
+
+    def __init__(self, country_data, population, n_workers=1, seed=None, early_termination=True):
+        self.country_data = np.asarray(country_data, dtype=np.float32)
+        self.population = population
+        self.n_workers = n_workers
+        self.early_termination = early_termination
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.pool = None
+        if n_workers > 1:
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                n_workers, initializer=_init_worker, initargs=(self.country_data, self.population)
+            )
+        self.n_simulations = 0
+        self.n_sample_days = 0
+
+    @property
+    def n_days(self):
+        return self.country_data.shape[1]
+
+    def __call__(self, param_vector, tolerance=np.inf):
+        """Return the distances of ``param_vector`` to the data, see `simulate`."""
+        if not self.early_termination:
+            tolerance = np.inf
+        n_chunks = min(self.n_workers, max(param_vector.shape[0], 1))
+        seeds = self.seed_sequence.spawn(n_chunks)
+        if self.pool is None:
+            distances, n_sample_days = simulate(
+                param_vector, self.country_data, self.population, np.random.default_rng(seeds[0]), tolerance
+            )
+        else:
+            chunks = np.array_split(param_vector, n_chunks)
+            results = self.pool.map(_simulate_chunk, [(c, tolerance, s) for c, s in zip(chunks, seeds)])
+            distances = np.concatenate([r[0] for r in results])
+            n_sample_days = sum(r[1] for r in results)
+        self.n_simulations += param_vector.shape[0]
+        self.n_sample_days += n_sample_days
+        return distances
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@dataclass
+class ABCResult:
+    """Accepted samples of an ABC run and the statistics of how they were obtained."""
+
+    param_vector: np.ndarray
+    distances: np.ndarray
+    weights: np.ndarray
+    n_runs: int
+    n_simulations: int
+    n_sample_days: int
+    duration: float
+    tolerances: List[float] = field(default_factory=list)
+    effective_sample_sizes: List[float] = field(default_factory=list)
+    converged: bool = True
+
+    @property
+    def n_accepted(self):
+        return self.param_vector.shape[0]
+
+    @property
+    def accepted_samples_per_second(self):
+        return self.n_accepted / self.duration if self.duration > 0 else float("inf")
+
+    def resample(self, n_samples, rng):
+        """Draw an unweighted sample of parameter vectors from the weighted population."""
+        idx = rng.choice(self.n_accepted, size=n_samples, p=self.weights)
+        return self.param_vector[idx]
+
+
+def effective_sample_size(weights):
+    return 1.0 / np.sum(np.square(weights))
+
+
+def _collect_accepted(simulator, propose, tolerance, n_target, max_n_runs):
+    """Simulate batches of proposals until ``n_target`` are within ``tolerance``."""
+    accepted_params, accepted_distances = [], []
+    n_accepted = 0
+    n_runs = 0
+    while n_accepted < n_target and n_runs < max_n_runs:
+        param_vector = propose()
+        distances = simulator(param_vector, tolerance)
+        acceptance_vector = distances <= tolerance
+        accepted_params.append(param_vector[acceptance_vector])
+        accepted_distances.append(distances[acceptance_vector])
+        n_accepted += int(acceptance_vector.sum())
+        n_runs += 1
+    param_vector = np.concatenate(accepted_params)[:n_target]
+    distances = np.concatenate(accepted_distances)[:n_target]
+    return param_vector, distances, n_runs
+
+
+def rejection_abc(simulator, tolerance, n_samples_target, n_samples_per_batch, max_n_runs, rng):
+    """Rejection ABC: sample the prior in batches until enough samples are accepted."""
+    start_time = time.time()
+    param_vector, distances, n_runs = _collect_accepted(
+        simulator,
+        lambda: sample_prior(n_samples_per_batch, rng),
+        tolerance,
+        n_samples_target,
+        max_n_runs,
+    )
+    n_accepted = param_vector.shape[0]
+    return ABCResult(
+        param_vector=param_vector,
+        distances=distances,
+        weights=np.full(n_accepted, 1.0 / max(n_accepted, 1)),
+        n_runs=n_runs,
+        n_simulations=simulator.n_simulations,
+        n_sample_days=simulator.n_sample_days,
+        duration=time.time() - start_time,
+        tolerances=[float(tolerance)],
+        effective_sample_sizes=[float(n_accepted)],
+        converged=n_accepted >= n_samples_target,
+    )
+
+
+def _log_sum_exp(x, axis):
+    x_max = np.max(x, axis=axis, keepdims=True)
+    return np.squeeze(x_max, axis=axis) + np.log(np.sum(np.exp(x - x_max), axis=axis))
+
+
+def _perturbation_kernel(param_vector, weights):
+    """Cholesky factor of the Beaumont et al. (2009) kernel: twice the weighted covariance."""
+    mean = weights @ param_vector
+    centred = param_vector - mean
+    covariance = 2.0 * (centred.T * weights) @ centred
+    # Parameters can collapse onto a bound, keep the factorisation well defined.
+    jitter = 1e-9 * np.square(UNIFORM_PRIOR_UPPER_LIMIT - UNIFORM_PRIOR_LOWER_LIMIT)
+    return np.linalg.cholesky(covariance + np.diag(jitter))
+
+
+def _importance_weights(new_params, old_params, old_weights, cholesky):
+    """Importance weights ``prior(x) / sum_j w_j K(x | x_j)`` for a uniform prior, normalised."""
+    new_white = np.linalg.solve(cholesky, new_params.T.astype(np.float64))
+    old_white = np.linalg.solve(cholesky, old_params.T.astype(np.float64))
+    squared_distances = (
+        np.sum(np.square(new_white), axis=0)[:, None]
+        + np.sum(np.square(old_white), axis=0)[None, :]
+        - 2.0 * new_white.T @ old_white
+    )
+    log_denominator = _log_sum_exp(np.log(old_weights)[None, :] - 0.5 * squared_distances, axis=1)
+    log_weights = -log_denominator
+    log_weights -= _log_sum_exp(log_weights, axis=0)
+    return np.exp(log_weights)
+
+
+def smc_abc(
+    simulator,
+    tolerance,
+    n_samples_target,
+    n_samples_per_batch,
+    max_n_runs,
+    rng,
+    quantile=0.5,
+    max_generations=20,
+    initial_tolerance=np.inf,
+):
+    """Sequential Monte Carlo ABC with an adaptive tolerance schedule.
+
+    The first population is drawn from the prior with ``initial_tolerance``.
+    Each following generation uses the ``quantile`` of the previous
+    population's distances as its tolerance, clamped below by the target
+    ``tolerance``. Proposals are drawn by importance-weighted resampling of
+    the previous population followed by a Gaussian perturbation, and the new
+    population is re-weighted accordingly. Stops once a population has been
+    accepted at the target ``tolerance`` or after ``max_generations``.
+
+    Args:
+        simulator: A `Simulator`.
+        tolerance: Target ABC acceptance tolerance.
+        n_samples_target: Number of particles in every population.
+        n_samples_per_batch: Number of proposals simulated at once.
+        max_n_runs: Maximum number of batches per generation. If a
+            generation does not fill its population within this budget the
+            previous population is returned with ``converged=False``.
+        rng: ``np.random.Generator`` used for proposals.
+        quantile: Quantile of the current distances used as next tolerance.
+        max_generations: Maximum number of populations, including the first.
+        initial_tolerance: Tolerance of the first population.
+    """
+    start_time = time.time()
+    n_runs_total = 0
+    current_tolerance = max(float(initial_tolerance), float(tolerance))
+    param_vector, distances, n_runs = _collect_accepted(
+        simulator,
+        lambda: sample_prior(n_samples_per_batch, rng),
+        current_tolerance,
+        n_samples_target,
+        max_n_runs,
+    )
+    n_runs_total += n_runs
+    weights = np.full(param_vector.shape[0], 1.0 / max(param_vector.shape[0], 1))
+    tolerances = [current_tolerance]
+    effective_sample_sizes = [effective_sample_size(weights)]
+    converged = param_vector.shape[0] >= n_samples_target
+
+    while converged and current_tolerance > tolerance and len(tolerances) < max_generations:
+        next_tolerance = max(float(np.quantile(distances, quantile)), float(tolerance))
+        cholesky = _perturbation_kernel(param_vector.astype(np.float64), weights)
+
+        def propose():
+            # Proposals outside the prior have zero weight, redraw them so
+            # that every batch is simulated at full size.
+            proposals = []
+            n_proposals = 0
+            for _ in range(MAX_PROPOSAL_ROUNDS):
+                idx = rng.choice(param_vector.shape[0], size=n_samples_per_batch, p=weights)
+                noise = rng.standard_normal((n_samples_per_batch, N_PARAMS)) @ cholesky.T
+                candidates = (param_vector[idx] + noise).astype(np.float32)
+                candidates = candidates[in_prior_support(candidates)]
+                proposals.append(candidates)
+                n_proposals += candidates.shape[0]
+                if n_proposals >= n_samples_per_batch:
+                    break
+            return np.concatenate(proposals)[:n_samples_per_batch]
+
+        new_params, new_distances, n_runs = _collect_accepted(
+            simulator, propose, next_tolerance, n_samples_target, max_n_runs
+        )
+        n_runs_total += n_runs
+        if new_params.shape[0] < n_samples_target:
+            converged = False
+            break
+
+        weights = _importance_weights(new_params, param_vector, weights, cholesky)
+        param_vector, distances = new_params, new_distances
+        current_tolerance = next_tolerance
+        tolerances.append(current_tolerance)
+        effective_sample_sizes.append(effective_sample_size(weights))
+
+    return ABCResult(
+        param_vector=param_vector,
+        distances=distances,
+        weights=weights,
+        n_runs=n_runs_total,
+        n_simulations=simulator.n_simulations,
+        n_sample_days=simulator.n_sample_days,
+        duration=time.time() - start_time,
+        tolerances=tolerances,
+        effective_sample_sizes=effective_sample_sizes,
+        converged=converged and current_tolerance <= tolerance,
+    )
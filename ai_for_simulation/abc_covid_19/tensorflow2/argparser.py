@@ -82,3 +82,44 @@ def get_argparser():
         help="Filepath to store accepted parameter samples. " "Samples will NOT be saved if this arg not given.",
     )
     return ap
+
+
+def get_cpu_argparser():
+    """Argument parser for the NumPy CPU backend.
+
+    Extends the IPU arguments, the IPU-specific ones (replication, outfeed
+    and enqueue options) are ignored.
+    """
+    ap = get_argparser()
+    ap.set_defaults(n_samples_per_batch=100000)
+    ap.add_argument(
+        "--mode",
+        type=str,
+        default="rejection",
+        choices=("rejection", "smc"),
+        help="Rejection ABC with a fixed tolerance, or sequential Monte Carlo "
+        "ABC with an adaptive tolerance schedule ending at --tolerance.",
+    )
+    ap.add_argument("-w", "--n-workers", type=int, default=1, help="Number of simulator worker processes.")
+    ap.add_argument("--seed", type=int, required=False, help="Seed for the random number generators.")
+    ap.add_argument(
+        "--no-early-termination",
+        action="store_true",
+        help="Simulate every sample for all days, even once its running distance exceeds the tolerance.",
+    )
+    ap.add_argument(
+        "--smc-quantile",
+        type=float,
+        default=0.5,
+        help="Quantile of the current population distances used as the next SMC tolerance.",
+    )
+    ap.add_argument(
+        "--smc-max-generations", type=int, default=20, help="Maximum number of SMC populations, including the first."
+    )
+    ap.add_argument(
+        "--smc-initial-tolerance",
+        type=float,
+        default=float("inf"),
+        help="Tolerance of the first SMC population, drawn from the prior.",
+    )
+    return ap
@@ -26,7 +26,7 @@ Only the data numbers in the COUNTRY_DATA_TRAIN and COUNTRY_DATA_TEST
 variables were extracted from the dataset.
 Graphcore contributed the respective code.
 """
-import tensorflow as tf
+import numpy as np
 
 COUNTRY_DATA_TRAIN = {}
 COUNTRY_DATA_TEST = {}
@@ -34,11 +34,23 @@ POPULATION = {}
 
 
 def get_data(name="Italy"):
-    """Interface for Covid data extraction.
+    """Interface for Covid data extraction as TensorFlow constants.
 
     Supported countries: ``Italy``, ``New_Zealand``, ``US``.
     """
-    COUNTRY_DATA_TRAIN["Italy"] = tf.constant(
+    import tensorflow as tf
+
+    country_data_train, population = get_numpy_data(name)
+    return tf.constant(country_data_train, dtype=tf.float32), population
+
+
+def get_numpy_data(name="Italy"):
+    """Interface for Covid data extraction as NumPy arrays.
+
+    Used by the CPU backend, which does not depend on TensorFlow.
+    Supported countries: ``Italy``, ``New_Zealand``, ``US``.
+    """
+    COUNTRY_DATA_TRAIN["Italy"] = np.array(
         [
             [
                 155,
@@ -194,10 +206,10 @@ def get_data(name="Italy"):
                 19468,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
-    COUNTRY_DATA_TEST["Italy"] = tf.constant(
+    COUNTRY_DATA_TEST["Italy"] = np.array(
         [
             [
                 155,
@@ -587,10 +599,10 @@ def get_data(name="Italy"):
                 34738,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
-    COUNTRY_DATA_TRAIN["New_Zealand"] = tf.constant(
+    COUNTRY_DATA_TRAIN["New_Zealand"] = np.array(
         [
             [
                 102,
@@ -746,10 +758,10 @@ def get_data(name="Italy"):
                 21,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
-    COUNTRY_DATA_TEST["New_Zealand"] = tf.constant(
+    COUNTRY_DATA_TEST["New_Zealand"] = np.array(
         [
             [
                 102,
@@ -1118,10 +1130,10 @@ def get_data(name="Italy"):
                 22,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
-    COUNTRY_DATA_TRAIN["US"] = tf.constant(
+    COUNTRY_DATA_TRAIN["US"] = np.array(
         [
             [
                 107,
@@ -1277,10 +1289,10 @@ def get_data(name="Italy"):
                 47195,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
-    COUNTRY_DATA_TEST["US"] = tf.constant(
+    COUNTRY_DATA_TEST["US"] = np.array(
         [
             [
                 107,
@@ -1649,7 +1661,7 @@ def get_data(name="Italy"):
                 128441,
             ],
         ],
-        dtype=tf.float32,
+        dtype=np.float32,
     )
 
     POPULATION["Italy"] = 60.36e6
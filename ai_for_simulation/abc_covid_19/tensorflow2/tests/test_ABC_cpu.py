@@ -0,0 +1,114 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Tests for the NumPy CPU backend of the COVID-19 ABC algorithm"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from examples_tests.test_util import SubProcessChecker
+
+current_path = Path(__file__).parent.parent
+sys.path.append(str(current_path))
+
+import abc_numpy
+import covid_data
+
+
+class ZeroNoise:
+    """Stands in for a ``np.random.Generator`` to make the simulation deterministic."""
+
+    def standard_normal(self, shape, dtype):
+        return np.zeros(shape, dtype=dtype)
+
+
+@pytest.fixture
+def italy():
+    country_data, population = covid_data.get_numpy_data("Italy")
+    return country_data[:, :20], population
+
+
+def test_early_termination_keeps_acceptance(italy):
+    country_data, population = italy
+    param_vector = abc_numpy.sample_prior(2000, np.random.default_rng(0))
+    full_distances, full_days = abc_numpy.simulate(param_vector, country_data, population, ZeroNoise())
+    tolerance = np.quantile(full_distances, 0.2)
+    distances, days = abc_numpy.simulate(param_vector, country_data, population, ZeroNoise(), tolerance)
+
+    accepted = full_distances <= tolerance
+    np.testing.assert_array_equal(distances <= tolerance, accepted)
+    np.testing.assert_allclose(distances[accepted], full_distances[accepted], rtol=1e-6)
+    # Early terminated distances are lower bounds of the full ones
+    assert np.all(distances[~accepted] <= full_distances[~accepted] * (1 + 1e-6))
+    assert full_days == param_vector.shape[0] * (country_data.shape[1] - 1)
+    assert days < full_days
+
+
+def test_simulator_reproducible_across_runs(italy):
+    param_vector = abc_numpy.sample_prior(200, np.random.default_rng(0))
+    results = []
+    for _ in range(2):
+        with abc_numpy.Simulator(*italy, n_workers=2, seed=3) as simulator:
+            results.append(simulator(param_vector))
+    np.testing.assert_array_equal(results[0], results[1])
+
+
+def test_rejection_abc(italy):
+    rng = np.random.default_rng(0)
+    with abc_numpy.Simulator(*italy, seed=0) as simulator:
+        result = abc_numpy.rejection_abc(
+            simulator, tolerance=2e4, n_samples_target=5, n_samples_per_batch=1000, max_n_runs=100, rng=rng
+        )
+    assert result.converged
+    assert result.n_accepted == 5
+    assert np.all(result.distances <= 2e4)
+    assert np.all(abc_numpy.in_prior_support(result.param_vector))
+    np.testing.assert_allclose(result.weights.sum(), 1.0)
+
+
+def test_smc_abc_tolerance_schedule(italy):
+    rng = np.random.default_rng(0)
+    with abc_numpy.Simulator(*italy, seed=0) as simulator:
+        result = abc_numpy.smc_abc(
+            simulator,
+            tolerance=2e4,
+            n_samples_target=50,
+            n_samples_per_batch=1000,
+            max_n_runs=100,
+            rng=rng,
+            quantile=0.3,
+        )
+    assert result.converged
+    assert result.n_accepted == 50
+    assert np.all(np.diff(result.tolerances) <= 0)
+    assert result.tolerances[-1] == 2e4
+    assert np.all(result.distances <= 2e4)
+    assert np.all(abc_numpy.in_prior_support(result.param_vector))
+    np.testing.assert_allclose(result.weights.sum(), 1.0)
+    assert result.resample(10, rng).shape == (10, abc_numpy.N_PARAMS)
+
+
+def test_importance_weights_uniform_for_identical_particles():
+    param_vector = np.tile(abc_numpy.sample_prior(1, np.random.default_rng(0)), (4, 1))
+    weights = np.full(4, 0.25)
+    cholesky = np.eye(abc_numpy.N_PARAMS)
+    new_weights = abc_numpy._importance_weights(param_vector, param_vector, weights, cholesky)
+    np.testing.assert_allclose(new_weights, weights)
+
+
+class AbcCpuTest(SubProcessChecker):
+    """Test simple command line executions of the CPU backend"""
+
+    def test_rejection(self):
+        self.run_command(
+            "python3 ABC_CPU.py -cn Italy -n 20 -t 2e4 -b 2000 -s 5 --seed 1",
+            current_path,
+            ["Accepted samples per second"],
+        )
+
+    def test_smc(self):
+        self.run_command(
+            "python3 ABC_CPU.py --mode smc -cn New_Zealand -n 20 -t 2e3 -b 2000 -s 50 "
+            "--smc-quantile 0.3 --seed 1 -w 2",
+            current_path,
+            ["Tolerance schedule", "Accepted samples per second"],
+        )
@@ -0,0 +1,80 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Host throughput of the PackedBatchGenerator, in packs per second.
+
+Uses a synthetic dataset with the size of the ogbg-molhiv training fold, so no
+download is needed, and times the packs produced by the generator itself and
+through its `tf.data` pipeline.
+"""
+import argparse
+import time
+
+import numpy as np
+from ogb.utils.features import get_atom_feature_dims, get_bond_feature_dims
+
+from data_utils.data_generators import PackedBatchGenerator
+
+MOLHIV_TRAIN_GRAPHS = 32901
+
+
+def synthetic_molecules(n_graphs, seed=0, mean_nodes=25.5, max_nodes=120):
+    """(graph, label) tuples in the OGB format, with molhiv-like sizes: chains of atoms closed by a few rings."""
+    rng = np.random.default_rng(seed)
+    graphs = []
+    for n_nodes in np.clip(rng.normal(mean_nodes, 12, n_graphs).astype(np.int64), 2, max_nodes):
+        bonds = [(i, i + 1) for i in range(n_nodes - 1)]
+        for _ in range(rng.integers(0, 4)):
+            i, j = sorted(rng.choice(n_nodes, 2, replace=False))
+            if j - i > 1:
+                bonds.append((i, j))
+        bonds = np.array(bonds, dtype=np.int64)
+        edge_index = np.concatenate([bonds, bonds[:, ::-1]]).T
+        graph = {
+            "num_nodes": int(n_nodes),
+            "node_feat": rng.integers(0, get_atom_feature_dims(), (n_nodes, len(get_atom_feature_dims()))),
+            "edge_feat": rng.integers(0, get_bond_feature_dims(), (edge_index.shape[1], len(get_bond_feature_dims()))),
+            "edge_index": np.ascontiguousarray(edge_index),
+        }
+        graphs.append((graph, (rng.uniform(size=1) < 0.035).astype(np.int64)))
+    return graphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-graphs", type=int, default=MOLHIV_TRAIN_GRAPHS)
+    parser.add_argument("--n-packs-per-batch", type=int, default=24)
+    parser.add_argument("--n-packing-workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--n-packs", type=int, default=10000, help="Packs timed for each configuration")
+    parser.add_argument("--tf-dataset", action="store_true", help="Also time the packs through `get_tf_dataset`")
+    args = parser.parse_args()
+
+    graphs = synthetic_molecules(args.n_graphs)
+    print(f"{'workers':>8} {'generator (packs/s)':>20} {'tf.data (packs/s)':>18}")
+    for n_packing_workers in args.n_packing_workers:
+        generator_kwargs = dict(
+            n_packs_per_batch=args.n_packs_per_batch,
+            max_graphs_per_pack=16,
+            max_nodes_per_pack=248,
+            max_edges_per_pack=512,
+            n_packing_workers=n_packing_workers,
+            graphs=graphs,
+        )
+        generator = PackedBatchGenerator(**generator_kwargs)
+        start = time.perf_counter()
+        for _ in range(args.n_packs):
+            next(generator)
+        generator_packs_per_second = args.n_packs / (time.perf_counter() - start)
+
+        tf_packs_per_second = float("nan")
+        if args.tf_dataset:
+            n_batches = args.n_packs // args.n_packs_per_batch
+            ds = iter(PackedBatchGenerator(**generator_kwargs).get_tf_dataset())
+            next(ds)
+            start = time.perf_counter()
+            for _ in range(n_batches):
+                next(ds)
+            tf_packs_per_second = n_batches * args.n_packs_per_batch / (time.perf_counter() - start)
+        print(f"{n_packing_workers:>8} {generator_packs_per_second:>20.0f} {tf_packs_per_second:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
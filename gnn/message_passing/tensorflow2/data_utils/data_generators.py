@@ -1,7 +1,10 @@
 # Copyright (c) 2022 Graphcore Ltd. All rights reserved.
 
 import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import List, Optional
 
 import numpy as np
 import tensorflow as tf
@@ -14,6 +17,57 @@ NODE_FEATURE_DIMS = len(get_atom_feature_dims())
 EDGE_FEATURE_DIMS = len(get_bond_feature_dims())
 
 
+def concatenated_ranges(starts, lengths):
+    """Indices of the concatenated ranges `starts[i]:starts[i] + lengths[i]`, the range each of them comes from
+    and the position of the first index of each range."""
+    range_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.cumsum(lengths) - lengths
+    indices = np.arange(positions[-1] + lengths[-1]) + np.repeat(starts - positions, lengths)
+    return indices, range_ids, positions
+
+
+@dataclass
+class GraphArrays:
+    """
+    The graphs of a dataset concatenated into one array per field, in a CSR-like layout.
+
+    The nodes of graph `i` are the rows `node_offsets[i]:node_offsets[i + 1]` of `node_features`, its edges the rows
+      `edge_offsets[i]:edge_offsets[i + 1]` of `edge_features` and `edge_idx`. The edge indices are local to each
+      graph. The features and edge indices end with a row of zeros, which is gathered for the padding of the packs.
+    """
+
+    node_features: np.ndarray
+    edge_features: np.ndarray
+    edge_idx: np.ndarray
+    node_offsets: np.ndarray
+    edge_offsets: np.ndarray
+    labels: np.ndarray
+
+    @classmethod
+    def from_graphs(cls, graphs):
+        """Converts a list of (graph, label) tuples, with graphs in the OGB dictionary format."""
+        return cls(
+            node_features=cls.concatenate_with_padding([graph["node_feat"] for graph, _ in graphs]),
+            edge_features=cls.concatenate_with_padding([graph["edge_feat"] for graph, _ in graphs]),
+            edge_idx=cls.concatenate_with_padding([graph["edge_index"].T for graph, _ in graphs]),
+            node_offsets=np.cumsum([0] + [graph["num_nodes"] for graph, _ in graphs]),
+            edge_offsets=np.cumsum([0] + [len(graph["edge_feat"]) for graph, _ in graphs]),
+            labels=np.array([label for _, label in graphs], dtype=np.float64).reshape(len(graphs)),
+        )
+
+    @staticmethod
+    def concatenate_with_padding(arrays):
+        padding = np.zeros((1,) + arrays[0].shape[1:], dtype=np.int32)
+        return np.concatenate(arrays + [padding]).astype(np.int32, order="C")
+
+    def __post_init__(self):
+        self.n_nodes = np.diff(self.node_offsets)
+        self.n_edges = np.diff(self.edge_offsets)
+
+    def __len__(self):
+        return len(self.labels)
+
+
 @dataclass
 class PackedBatchGenerator:
     """
@@ -22,6 +76,11 @@ class PackedBatchGenerator:
     Each 'pack' of a batch is guaranteed to only exchange information with other members of the same 'pack'. This
       allows the use of 'batched' gather/scatter implementations. In this case, the compiler is able to use this
       constraint in order to improve throughput.
+
+    The packs are assembled `n_packs_per_batch` at a time into a ring of preallocated batch buffers. `__next__`
+      returns views of them, which are overwritten once `len(self.batch_buffers) - 1` more batches have been filled,
+      and `batches` copies of whole batches for `tf.data`. With `n_packing_workers`, a pool of threads fills that many
+      batches of packs ahead.
     """
 
     n_packs_per_batch: int
@@ -33,19 +92,23 @@ class PackedBatchGenerator:
     data_root: str = "./datasets/"
     fold: str = "train"
     dataset_name: str = "ogbg-molhiv"
+    n_packing_workers: int = 0
+    # (graph, label) tuples used instead of the `fold` of `dataset_name`
+    graphs: Optional[List] = None
 
     def __post_init__(self):
         # initializes the dataset and calculates the packing assignments
-        self.dataset = GraphPropPredDataset(name=self.dataset_name)
-
-        self.n_graphs_per_epoch = len(self.dataset.get_idx_split()[self.fold])
-        self.dataset = [self.dataset[fold_idx] for fold_idx in self.dataset.get_idx_split()[self.fold]]
-
-        self.n_edges = []
-        self.n_nodes = []
-        for g, _ in self.dataset:
-            self.n_edges.append(len(g["edge_feat"]))
-            self.n_nodes.append(g["num_nodes"])
+        if self.graphs is None:
+            dataset = GraphPropPredDataset(name=self.dataset_name)
+            graphs = [dataset[fold_idx] for fold_idx in dataset.get_idx_split()[self.fold]]
+        else:
+            graphs = self.graphs
+        # the graphs are only kept as concatenated arrays
+        self.graph_arrays = GraphArrays.from_graphs(graphs)
+        self.n_graphs_per_epoch = len(self.graph_arrays)
+
+        self.n_edges = self.graph_arrays.n_edges.tolist()
+        self.n_nodes = self.graph_arrays.n_nodes.tolist()
 
         self.planned_strategy = packing_strategy_finder.StrategyPlanner(
             n_edges=self.n_edges,
@@ -66,21 +129,68 @@ class PackedBatchGenerator:
 
         self.label_dtype = tf.int32
 
+        # the packs of the previous batch can still be in use while the current one is read
+        self.batch_buffers = [
+            self.get_empty_batch_dict(self.n_packs_per_batch) for _ in range(self.n_packing_workers + 2)
+        ]
+        self.n_batches_filled = 0
+        self.pending_batches = deque()
+        self.current_packs = deque()
+        self.executor = ThreadPoolExecutor(self.n_packing_workers) if self.n_packing_workers > 0 else None
+
     def __iter__(self):
         return self
 
     def __next__(self):
-        if not self.pack_indices and self.n_batches > 0:
-            self.pack_indices = next(self.pack_indices_generator)
-            self.n_batches -= 1
-
-        if not self.pack_indices:
-            raise StopIteration
-
-        current_pack_indices = self.pack_indices.pop()
-        batch_dictionary = self.get_packed_datum(current_pack_indices)
-
-        return batch_dictionary
+        if not self.current_packs:
+            packed_batch = self.next_packed_batch()
+            if packed_batch is None:
+                raise StopIteration
+            n_packs = len(packed_batch["labels"])
+            self.current_packs.extend(
+                {key: value[idx] for key, value in packed_batch.items()} for idx in range(n_packs)
+            )
+        return self.current_packs.popleft()
+
+    def batches(self):
+        """Yields copies of the batches of `n_packs_per_batch` packs, dropping the last incomplete one."""
+        while True:
+            packed_batch = self.next_packed_batch()
+            if packed_batch is None or len(packed_batch["labels"]) < self.n_packs_per_batch:
+                return
+            yield {key: value.copy() for key, value in packed_batch.items()}
+
+    def next_packed_batch(self):
+        """The next packs, at most `n_packs_per_batch` of them, None once all the epochs are done."""
+        if self.executor is None:
+            packs = self.next_packs()
+            return self.get_packed_batch(packs, self.next_batch_buffer()) if packs else None
+
+        # keep the workers busy with the following batches
+        while len(self.pending_batches) <= self.n_packing_workers:
+            packs = self.next_packs()
+            if not packs:
+                break
+            self.pending_batches.append(self.executor.submit(self.get_packed_batch, packs, self.next_batch_buffer()))
+        return self.pending_batches.popleft().result() if self.pending_batches else None
+
+    def next_packs(self):
+        """The dataset indices of the graphs of the next packs, empty once all the epochs are done."""
+        packs = []
+        while len(packs) < self.n_packs_per_batch:
+            if not self.pack_indices and self.n_batches > 0:
+                self.pack_indices = next(self.pack_indices_generator)
+                self.n_batches -= 1
+
+            if not self.pack_indices:
+                break
+            packs.append(self.pack_indices.pop())
+        return packs
+
+    def next_batch_buffer(self):
+        batch_dict = self.batch_buffers[self.n_batches_filled % len(self.batch_buffers)]
+        self.n_batches_filled += 1
+        return batch_dict
 
     def get_ground_truth_and_masks(self):
         assert not self.randomize, "getting the ground truth and masks can only be done without randomization"
@@ -89,73 +199,122 @@ class PackedBatchGenerator:
         # -1. will represent masking
         ground_truths = np.full([self.packs_per_epoch, self.max_graphs_per_pack], -1.0)
         # 'reversed' matches the implicit reversal caused by 'popping' in the __next__ method
-        for batch_idx, pack in enumerate(reversed(local_pack_indices)):
-            for gt_idx, graph_idx_in_dataset in enumerate(pack):
-                ground_truths[batch_idx, gt_idx] = self.dataset[graph_idx_in_dataset][1]
+        packs = list(reversed(local_pack_indices))
+        n_graphs = np.array([len(pack) for pack in packs])
+        gt_idx, batch_idx, _ = concatenated_ranges(np.zeros_like(n_graphs), n_graphs)
+        ground_truths[batch_idx, gt_idx] = self.graph_arrays.labels[np.concatenate(packs)]
 
         include_sample_mask = ground_truths != -1.0
         return ground_truths, include_sample_mask
 
-    def get_empty_batch_dict(self):
+    def get_empty_batch_dict(self, n_packs=None):
+        """Padding for a pack, or for `n_packs` packs stacked along a leading dimension."""
         # the dummy node is the last of each pack
         dummy_node_idx = self.max_nodes_per_pack - 1
         # the dummy graph is the last of each pack
         dummy_graph_idx = self.max_graphs_per_pack - 1
+        batch_shape = [] if n_packs is None else [n_packs]
 
         batch_dict = dict()
-        batch_dict["edge_graph_idx"] = np.full([self.max_edges_per_pack], dummy_graph_idx).astype(np.int32)
-        batch_dict["edge_features"] = np.zeros([self.max_edges_per_pack, EDGE_FEATURE_DIMS], dtype=np.int32)
-        batch_dict["edge_idx"] = np.full([self.max_edges_per_pack, 2], dummy_node_idx).astype(np.int32)
+        batch_dict["edge_graph_idx"] = np.full(batch_shape + [self.max_edges_per_pack], dummy_graph_idx).astype(
+            np.int32
+        )
+        batch_dict["edge_features"] = np.zeros(
+            batch_shape + [self.max_edges_per_pack, EDGE_FEATURE_DIMS], dtype=np.int32
+        )
+        batch_dict["edge_idx"] = np.full(batch_shape + [self.max_edges_per_pack, 2], dummy_node_idx).astype(np.int32)
 
-        batch_dict["node_graph_idx"] = np.full([self.max_nodes_per_pack], dummy_graph_idx).astype(np.int32)
-        batch_dict["node_features"] = np.zeros([self.max_nodes_per_pack, NODE_FEATURE_DIMS], dtype=np.int32)
+        batch_dict["node_graph_idx"] = np.full(batch_shape + [self.max_nodes_per_pack], dummy_graph_idx).astype(
+            np.int32
+        )
+        batch_dict["node_features"] = np.zeros(
+            batch_shape + [self.max_nodes_per_pack, NODE_FEATURE_DIMS], dtype=np.int32
+        )
         # this is used for masking: for a graph id that corresponds to '-1' label, we will not include its loss
-        batch_dict["labels"] = -np.ones([self.max_graphs_per_pack])
+        batch_dict["labels"] = -np.ones(batch_shape + [self.max_graphs_per_pack])
         return batch_dict
 
     def get_packed_datum(self, pack):
-        packed_datum = self.get_empty_batch_dict()
-        # we will count the entries as we pack, to maintain the IDs properly
-        graph_ctr, edges_ctr, nodes_ctr = 0, 0, 0
-        for graph_idx in pack:
-            graph, ground_truth_label = self.dataset[graph_idx]
-            this_graph_n_edges = len(graph["edge_feat"])
-            packed_datum["edge_graph_idx"][edges_ctr : edges_ctr + this_graph_n_edges] = graph_ctr
-            packed_datum["edge_features"][edges_ctr : edges_ctr + this_graph_n_edges, :] = graph["edge_feat"]
-            # offsetting the edge indices by the accumulated number of nodes
-            packed_datum["edge_idx"][edges_ctr : edges_ctr + this_graph_n_edges, :] = graph["edge_index"].T + nodes_ctr
-
-            packed_datum["node_graph_idx"][nodes_ctr : nodes_ctr + graph["num_nodes"]] = graph_ctr
-            packed_datum["node_features"][nodes_ctr : nodes_ctr + graph["num_nodes"], :] = graph["node_feat"]
-
-            packed_datum["labels"][graph_ctr] = ground_truth_label
-
-            graph_ctr += 1
-            edges_ctr += this_graph_n_edges
-            nodes_ctr += graph["num_nodes"]
-
-        return packed_datum
+        packed_batch = self.get_packed_batch([pack], self.get_empty_batch_dict(1))
+        return {key: value[0] for key, value in packed_batch.items()}
+
+    def get_packed_batch(self, packs, batch_dict):
+        """
+        Packs the graphs of each of `packs` into the rows of `batch_dict`, from `get_empty_batch_dict(len(packs))`.
+
+        Every field is gathered at once from the concatenated arrays, for all the packs. Returns views of the rows of
+          `batch_dict` that were filled.
+        """
+        graphs = self.graph_arrays
+        n_graphs = np.array([len(pack) for pack in packs])
+        graph_idx = np.concatenate(packs)
+        graph_ctr, pack_of_graph, first_graph = concatenated_ranges(np.zeros_like(n_graphs), n_graphs)
+
+        n_nodes, n_edges = graphs.n_nodes[graph_idx], graphs.n_edges[graph_idx]
+        node_rows, node_graph, first_node = concatenated_ranges(graphs.node_offsets[graph_idx], n_nodes)
+        edge_rows, edge_graph, first_edge = concatenated_ranges(graphs.edge_offsets[graph_idx], n_edges)
+        # the position of each node and edge in its pack, from the position of the first one of the pack
+        pack_first_node = np.repeat(first_node[first_graph], n_graphs)
+        pack_first_edge = np.repeat(first_edge[first_graph], n_graphs)
+        node_slot = pack_of_graph[node_graph] * self.max_nodes_per_pack - pack_first_node[node_graph]
+        node_slot += np.arange(len(node_rows))
+        edge_slot = pack_of_graph[edge_graph] * self.max_edges_per_pack - pack_first_edge[edge_graph]
+        edge_slot += np.arange(len(edge_rows))
+
+        # the row every slot of the batch is gathered from, the padding slots from the row of zeros
+        n_packs = len(packs)
+        node_source = np.full(n_packs * self.max_nodes_per_pack, len(graphs.node_features) - 1)
+        node_source[node_slot] = node_rows
+        edge_source = np.full(n_packs * self.max_edges_per_pack, len(graphs.edge_features) - 1)
+        edge_source[edge_slot] = edge_rows
+
+        edge_graph_idx = batch_dict["edge_graph_idx"][:n_packs].reshape(-1)
+        edge_graph_idx.fill(self.max_graphs_per_pack - 1)
+        edge_graph_idx[edge_slot] = graph_ctr[edge_graph]
+        edge_features = batch_dict["edge_features"][:n_packs].reshape(-1, EDGE_FEATURE_DIMS)
+        np.take(graphs.edge_features, edge_source, axis=0, out=edge_features, mode="clip")
+        # offsetting the edge indices by the number of nodes before their graph in the pack, the padding edges
+        #   connect the dummy node to itself
+        edge_idx_offsets = np.full(len(edge_source), self.max_nodes_per_pack - 1)
+        edge_idx_offsets[edge_slot] = np.repeat(first_node - pack_first_node, n_edges)
+        edge_idx = batch_dict["edge_idx"][:n_packs].reshape(-1, 2)
+        np.take(graphs.edge_idx, edge_source, axis=0, out=edge_idx, mode="clip")
+        edge_idx += edge_idx_offsets[:, None]
+
+        node_graph_idx = batch_dict["node_graph_idx"][:n_packs].reshape(-1)
+        node_graph_idx.fill(self.max_graphs_per_pack - 1)
+        node_graph_idx[node_slot] = graph_ctr[node_graph]
+        node_features = batch_dict["node_features"][:n_packs].reshape(-1, NODE_FEATURE_DIMS)
+        np.take(graphs.node_features, node_source, axis=0, out=node_features, mode="clip")
+
+        batch_dict["labels"][:n_packs] = -1
+        batch_dict["labels"][pack_of_graph, graph_ctr] = graphs.labels[graph_idx]
+
+        return {key: value[:n_packs] for key, value in batch_dict.items()}
 
     def get_tf_dataset(self):
         n_edges = self.max_edges_per_pack
         n_nodes = self.max_nodes_per_pack
         n_graphs = self.max_graphs_per_pack
 
+        n_packs = self.n_packs_per_batch
+
+        # the packs are assembled a batch at a time, one call of the generator per batch
         ds = tf.data.Dataset.from_generator(
-            self.__iter__,
+            self.batches,
             output_signature=(
                 {
-                    "node_graph_idx": tf.TensorSpec(shape=(n_nodes,), dtype=tf.int32),
-                    "node_features": tf.TensorSpec(shape=(n_nodes, NODE_FEATURE_DIMS), dtype=tf.float32),
-                    "edge_graph_idx": tf.TensorSpec(shape=(n_edges,), dtype=tf.int32),
-                    "edge_features": tf.TensorSpec(shape=(n_edges, EDGE_FEATURE_DIMS), dtype=tf.float32),
-                    "edge_idx": tf.TensorSpec(shape=(n_edges, 2), dtype=tf.int32),
-                    "labels": tf.TensorSpec(shape=(n_graphs,), dtype=self.label_dtype),
+                    "node_graph_idx": tf.TensorSpec(shape=(n_packs, n_nodes), dtype=tf.int32),
+                    "node_features": tf.TensorSpec(shape=(n_packs, n_nodes, NODE_FEATURE_DIMS), dtype=tf.float32),
+                    "edge_graph_idx": tf.TensorSpec(shape=(n_packs, n_edges), dtype=tf.int32),
+                    "edge_features": tf.TensorSpec(shape=(n_packs, n_edges, EDGE_FEATURE_DIMS), dtype=tf.float32),
+                    "edge_idx": tf.TensorSpec(shape=(n_packs, n_edges, 2), dtype=tf.int32),
+                    "labels": tf.TensorSpec(shape=(n_packs, n_graphs), dtype=self.label_dtype),
                 }
             ),
         )
         # repeating silences some errors (but won't affect any results)
-        ds = ds.batch(self.n_packs_per_batch, drop_remainder=True).repeat()
+        ds = ds.repeat()
         ds = ds.map(self.batch_to_outputs)
         return ds
 
@@ -1,7 +1,6 @@
 # Copyright (c) 2022 Graphcore Ltd. All rights reserved.
 
 """Longest-pack-first histogram-packing."""
-import copy
 import logging
 from collections import defaultdict
 from dataclasses import dataclass
@@ -9,86 +8,32 @@ from typing import List, Union
 
 import numpy as np
 
+from data_utils.histogram_packing import pack_dlpfhp
+
 
 def pack_using_dlpfhp(data_list, max_edges_per_pack, max_nodes_per_pack, max_graphs_per_pack, heuristic=np.multiply):
     """Dual Longest-pack-first histogram-packing algorithm."""
     assert len(data_list[0]) == 3, "make sure the data-list has three parts per entry"
 
-    data_list = [(e * n, e, n, count) for e, n, count in data_list]
-    data_list.sort(reverse=True)
-
-    max_size = heuristic(max_edges_per_pack, max_nodes_per_pack)
-    # Initialize main strategy data dictionary.
-    # The key indicates how many tokens are left for full length.
-    # The value is a list of tuples, consisting of counts and respective packs.
-    # A pack is a (sorted) list of sequence length values that get concatenated.
-    tmp_strategies_per_length = defaultdict(list)
-    strategies_per_length = defaultdict(list)
-
-    for size, edges_length, nodes_length, n_sequences_to_bin in data_list:
-        # the keys represent how much space is left to achieve the full length
-        offset = 0
-        while n_sequences_to_bin > 0:
-            keys = [key for key in tmp_strategies_per_length if key >= size + offset]
-            offset = max_size + 1 if not keys else min(keys) - size
-
-            if (size + offset) in tmp_strategies_per_length:
-                # reversed so the 'pop' is easier to index
-                for i in reversed(range(len(tmp_strategies_per_length[size + offset]))):
-                    len_edges, len_nodes, n_sequences_to_pack = tmp_strategies_per_length[size + offset][i]
-                    if (
-                        (edges_length + sum(len_edges)) <= max_edges_per_pack
-                        and (nodes_length + sum(len_nodes)) <= max_nodes_per_pack
-                        and len(len_edges) < max_graphs_per_pack
-                    ):
-                        tmp_strategies_per_length[size + offset].pop(i)
-                        new_len_edges = len_edges + [edges_length]
-                        new_len_nodes = len_nodes + [nodes_length]
-
-                        new_size = heuristic(
-                            max_edges_per_pack - sum(new_len_edges), max_nodes_per_pack - sum(new_len_nodes)
-                        )
-                        new_count = min(n_sequences_to_pack, n_sequences_to_bin)
-                        # adjust strategies
-                        if n_sequences_to_pack > new_count:
-                            tmp_strategies_per_length[size + offset].append(
-                                (len_edges, len_nodes, n_sequences_to_pack - new_count)
-                            )
-
-                        # get rid of the key if the value is []
-                        if not tmp_strategies_per_length[size + offset]:
-                            tmp_strategies_per_length.pop(size + offset)
-
-                        tmp_strategies_per_length[new_size].append((new_len_edges, new_len_nodes, new_count))
-                        n_sequences_to_bin -= new_count
-                        offset = 0
-                        break
-            offset += 1
-            if offset + size > max_size:
-                new_size = heuristic(max_edges_per_pack - edges_length, max_nodes_per_pack - nodes_length)
-                if new_size == 0:
-                    strategies_per_length[0].append(([edges_length], [nodes_length], n_sequences_to_bin))
-                else:
-                    tmp_strategies_per_length[new_size].append(([edges_length], [nodes_length], n_sequences_to_bin))
-                break
-
-    # merge all strategies
-    for key in tmp_strategies_per_length:
-        strategies_per_length[key].extend(tmp_strategies_per_length[key])
-
-    # flatten strategies dictionary
+    shapes = [(e, n) for e, n, _ in data_list]
+    counts = [count for _, _, count in data_list]
+    strategies = pack_dlpfhp(
+        shapes, counts, (max_edges_per_pack, max_nodes_per_pack), max_graphs_per_pack, heuristic=heuristic
+    )
+
+    # flatten strategies, as (edges, nodes) lists of the graphs in each pack
     strategy_set, strategy_repeat_count = [], []
-    for key in strategies_per_length:
-        for len_edges, len_nodes, n_sequences_to_pack in strategies_per_length[key]:
-            strategy_set.append((len_edges, len_nodes))
-            strategy_repeat_count.append(n_sequences_to_pack)
+    for n_sequences_to_pack, pack, _ in strategies:
+        len_edges, len_nodes = zip(*pack)
+        strategy_set.append((list(len_edges), list(len_nodes)))
+        strategy_repeat_count.append(n_sequences_to_pack)
 
-    # calculating efficiency
+    # calculating efficiency, using the edges and nodes summed up while packing
     n_empty_edges, n_empty_nodes, n_empty_graphs = 0, 0, 0
-    for count, [pack_edges, pack_nodes] in zip(strategy_repeat_count, strategy_set):
-        n_empty_edges += count * (max_edges_per_pack - sum(pack_edges))
-        n_empty_nodes += count * (max_nodes_per_pack - sum(pack_nodes))
-        n_empty_graphs += count * (max_graphs_per_pack - len(pack_edges))
+    for count, pack, (pack_edges, pack_nodes) in strategies:
+        n_empty_edges += count * (max_edges_per_pack - pack_edges)
+        n_empty_nodes += count * (max_nodes_per_pack - pack_nodes)
+        n_empty_graphs += count * (max_graphs_per_pack - len(pack))
 
     packs = int(sum(strategy_repeat_count))
     token_efficiency = (
@@ -145,7 +90,8 @@ class StrategyPlanner:
     def pack_indices_generator(self):
         # shuffle the ids so that the same packs are generated with different samples
         while True:
-            shape_to_idx = copy.deepcopy(self.shape_to_idx_orig)
+            # the ids are integers, copying the lists is enough
+            shape_to_idx = defaultdict(list, {shape: list(ids) for shape, ids in self.shape_to_idx_orig.items()})
             if self.randomize:
                 for shape in shape_to_idx:
                     np.random.shuffle(shape_to_idx[shape])
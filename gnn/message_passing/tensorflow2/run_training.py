@@ -40,6 +40,7 @@ flags.DEFINE_enum("adam_m_dtype", "float16", ("float16", "float32"), "dtype for
 flags.DEFINE_enum("adam_v_dtype", "float32", ("float16", "float32"), "dtype for the v part of the adam optimizer")
 
 flags.DEFINE_enum("dataset_name", "ogbg-molhiv", ("ogbg-molhiv",), help="which dataset to use")
+flags.DEFINE_integer("n_packing_workers", 0, "threads filling batches of training packs ahead (0 packs them on demand)")
 
 flags.DEFINE_boolean("generated_data", False, "Use randomly generated data instead of a real dataset.")
 flags.DEFINE_integer("generated_data_n_nodes", 24, "nodes per graph for the randomly generated dataset")
@@ -104,6 +105,7 @@ def main(_):
             max_edges_per_pack=FLAGS.n_edges_per_pack,
             max_nodes_per_pack=FLAGS.n_nodes_per_pack,
             n_epochs=FLAGS.epochs,
+            n_packing_workers=FLAGS.n_packing_workers,
         )
 
     ds = batch_generator.get_tf_dataset()
@@ -0,0 +1,99 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import numpy as np
+import pytest
+
+from benchmark_data_generator import synthetic_molecules
+from data_utils.data_generators import PackedBatchGenerator
+
+GENERATOR_KWARGS = dict(
+    n_packs_per_batch=4, max_graphs_per_pack=8, max_nodes_per_pack=128, max_edges_per_pack=256, n_epochs=1
+)
+
+
+def pack_graph_by_graph(generator, graphs, pack):
+    """Reference packing, copying the graphs one at a time into a new batch dictionary."""
+    packed_datum = generator.get_empty_batch_dict()
+    graph_ctr, edges_ctr, nodes_ctr = 0, 0, 0
+    for graph_idx in pack:
+        graph, ground_truth_label = graphs[graph_idx]
+        this_graph_n_edges = len(graph["edge_feat"])
+        packed_datum["edge_graph_idx"][edges_ctr : edges_ctr + this_graph_n_edges] = graph_ctr
+        packed_datum["edge_features"][edges_ctr : edges_ctr + this_graph_n_edges, :] = graph["edge_feat"]
+        packed_datum["edge_idx"][edges_ctr : edges_ctr + this_graph_n_edges, :] = graph["edge_index"].T + nodes_ctr
+        packed_datum["node_graph_idx"][nodes_ctr : nodes_ctr + graph["num_nodes"]] = graph_ctr
+        packed_datum["node_features"][nodes_ctr : nodes_ctr + graph["num_nodes"], :] = graph["node_feat"]
+        packed_datum["labels"][graph_ctr] = ground_truth_label[0]
+        graph_ctr += 1
+        edges_ctr += this_graph_n_edges
+        nodes_ctr += graph["num_nodes"]
+    return packed_datum
+
+
+@pytest.fixture(name="graphs", scope="module")
+def graphs_fixture():
+    graphs = synthetic_molecules(300, max_nodes=60)
+    # graphs without any edge
+    graphs[3][0]["edge_feat"] = graphs[3][0]["edge_feat"][:0]
+    graphs[3][0]["edge_index"] = graphs[3][0]["edge_index"][:, :0]
+    return graphs
+
+
+def packs_of(generator):
+    packs = []
+    while True:
+        next_packs = generator.next_packs()
+        if not next_packs:
+            return packs
+        packs.extend(next_packs)
+
+
+@pytest.mark.parametrize("randomize", [False, True])
+@pytest.mark.parametrize("n_packing_workers", [0, 2])
+def test_packs_match_graph_by_graph_packing(graphs, randomize, n_packing_workers):
+    reference = PackedBatchGenerator(**GENERATOR_KWARGS, randomize=randomize, graphs=graphs)
+    np.random.seed(0)
+    packs = packs_of(reference)
+
+    generator = PackedBatchGenerator(
+        **GENERATOR_KWARGS, randomize=randomize, n_packing_workers=n_packing_workers, graphs=graphs
+    )
+    np.random.seed(0)
+    # the packs are views of the reused buffers
+    packed_data = [{key: value.copy() for key, value in packed_datum.items()} for packed_datum in generator]
+    assert len(packed_data) == len(packs)
+    for packed_datum, pack in zip(packed_data, packs):
+        expected = pack_graph_by_graph(reference, graphs, pack)
+        for key, value in expected.items():
+            assert packed_datum[key].dtype == value.dtype
+            np.testing.assert_array_equal(packed_datum[key], value)
+
+
+def test_batches_match_graph_by_graph_packing(graphs):
+    reference = PackedBatchGenerator(**GENERATOR_KWARGS, randomize=False, graphs=graphs)
+    packs = packs_of(reference)
+    generator = PackedBatchGenerator(**GENERATOR_KWARGS, randomize=False, n_packing_workers=1, graphs=graphs)
+    batches = list(generator.batches())
+
+    n_packs_per_batch = GENERATOR_KWARGS["n_packs_per_batch"]
+    # the last incomplete batch is dropped
+    assert len(batches) == len(packs) // n_packs_per_batch
+    for batch_idx, batch in enumerate(batches):
+        batch_packs = packs[batch_idx * n_packs_per_batch : (batch_idx + 1) * n_packs_per_batch]
+        expected = [pack_graph_by_graph(reference, graphs, pack) for pack in batch_packs]
+        for key, value in batch.items():
+            np.testing.assert_array_equal(value, np.stack([packed_datum[key] for packed_datum in expected]))
+
+
+def test_ground_truth_and_masks(graphs):
+    generator = PackedBatchGenerator(**GENERATOR_KWARGS, randomize=False, graphs=graphs)
+    ground_truths, include_sample_mask = generator.get_ground_truth_and_masks()
+
+    # the packs of an epoch, in the order they are returned
+    packs = packs_of(PackedBatchGenerator(**GENERATOR_KWARGS, randomize=False, graphs=graphs))[: len(ground_truths)]
+    assert ground_truths.shape == (generator.packs_per_epoch, GENERATOR_KWARGS["max_graphs_per_pack"])
+    for batch_idx, pack in enumerate(packs):
+        expected = np.full(GENERATOR_KWARGS["max_graphs_per_pack"], -1.0)
+        expected[: len(pack)] = [graphs[graph_idx][1][0] for graph_idx in pack]
+        np.testing.assert_array_equal(ground_truths[batch_idx], expected)
+    np.testing.assert_array_equal(include_sample_mask, ground_truths != -1.0)
@@ -0,0 +1,90 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from data_utils.histogram_packing import pack_dlpfhp, pack_lpfhp, pack_spfhp
+from data_utils.packing_strategy_finder import StrategyPlanner, pack_using_dlpfhp
+
+PACKED_BERT_HISTOGRAM_PACKING = (
+    Path(__file__).absolute().parents[4] / "tutorials" / "blogs_code" / "packedBERT" / "histogram_packing.py"
+)
+
+
+def random_graphs(seed, n_graphs=500):
+    rng = np.random.default_rng(seed)
+    n_nodes = rng.integers(2, 60, n_graphs)
+    n_edges = np.clip(2 * n_nodes + rng.integers(-3, 10, n_graphs), 0, None)
+    return n_edges.tolist(), n_nodes.tolist()
+
+
+def test_pack_using_dlpfhp_small_example():
+    data_list = [(6, 4, 2), (3, 2, 3), (1, 1, 1)]
+    strategy_set, strategy_repeat_count, efficiency = pack_using_dlpfhp(data_list, 10, 6, 3)
+    assert strategy_set == [([6, 3], [4, 2]), ([3, 1], [2, 1])]
+    np.testing.assert_array_equal(strategy_repeat_count, [2, 1])
+    np.testing.assert_allclose(efficiency, (100 * 22 / 30, 100 * 15 / 18, 100 * 6 / 9))
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("max_graphs_per_pack", [1, 3, 16])
+def test_pack_using_dlpfhp_packs_every_graph(seed, max_graphs_per_pack):
+    n_edges, n_nodes = random_graphs(seed)
+    data = Counter(zip(n_edges, n_nodes))
+    data_list = [(e, n, count) for (e, n), count in data.items()]
+    strategy_set, strategy_repeat_count, _ = pack_using_dlpfhp(data_list, 256, 128, max_graphs_per_pack)
+
+    packed = Counter()
+    for (len_edges, len_nodes), count in zip(strategy_set, strategy_repeat_count):
+        assert sum(len_edges) <= 256 and sum(len_nodes) <= 128
+        assert len(len_edges) <= max_graphs_per_pack
+        for shape in zip(len_edges, len_nodes):
+            packed[shape] += count
+    assert packed == data
+
+
+def test_strategy_planner_indices():
+    n_edges, n_nodes = random_graphs(0, n_graphs=200)
+    planner = StrategyPlanner(n_edges, n_nodes, 256, 128, 4, randomize=False)
+    pack_indices = next(planner.pack_indices_generator())
+    assert len(pack_indices) == planner.packs_per_epoch
+    assert sorted(idx for pack in pack_indices for idx in pack) == list(range(200))
+
+
+@pytest.mark.parametrize("pack", [pack_spfhp, pack_lpfhp])
+def test_sequence_packing(pack):
+    rng = np.random.default_rng(0)
+    histogram = rng.integers(0, 20, 64)
+    lengths = [(length,) for length in range(1, 65)]
+    strategies = pack(lengths, histogram, (64,), 4)
+
+    packed = np.zeros(64, dtype=np.int64)
+    for count, items, sums in strategies:
+        assert sums == (sum(length for (length,) in items),)
+        assert sums[0] <= 64 and len(items) <= 4
+        for (length,) in items:
+            packed[length - 1] += count
+    np.testing.assert_array_equal(packed, histogram)
+
+
+def test_multi_dimensional_packing():
+    items = [(3, 1, 2), (2, 2, 2), (1, 3, 1)]
+    for pack in [pack_spfhp, pack_lpfhp, pack_dlpfhp]:
+        strategies = pack(items, [5, 4, 3], (6, 6, 6), 3)
+        packed = Counter()
+        for count, pack_items, sums in strategies:
+            assert sums == tuple(np.sum(pack_items, axis=0)) and max(sums) <= 6
+            for item in pack_items:
+                packed[item] += count
+        assert packed == Counter(dict(zip(items, [5, 4, 3])))
+
+
+def test_histogram_packing_in_sync():
+    """The example keeps its own copy of the packing module shared with the packed BERT blog code"""
+    if not PACKED_BERT_HISTOGRAM_PACKING.exists():
+        pytest.skip("The packed BERT blog code is not in this checkout")
+    local_copy = Path(__file__).absolute().parents[1] / "data_utils" / "histogram_packing.py"
+    assert local_copy.read_text() == PACKED_BERT_HISTOGRAM_PACKING.read_text()
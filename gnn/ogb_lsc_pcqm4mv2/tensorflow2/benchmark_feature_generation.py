@@ -0,0 +1,95 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import time
+
+import numpy as np
+
+from data_utils.feature_generation.laplacian_features import get_laplacian_features, get_laplacian_features_batched
+from data_utils.feature_generation.random_walk_features import (
+    get_random_walk_landing_probs,
+    get_random_walk_landing_probs_batched,
+)
+
+
+def molecule_like_graphs(num_graphs, min_nodes, max_nodes, rings_per_node, seed=0):
+    """Random spanning trees with a few ring closures, bidirectional like the PCQM4Mv2 molecules."""
+    rng = np.random.default_rng(seed)
+    graphs = []
+    for num_nodes in rng.integers(min_nodes, max_nodes + 1, size=num_graphs):
+        senders = np.array([rng.integers(0, node) for node in range(1, num_nodes)], dtype=np.int64)
+        receivers = np.arange(1, num_nodes, dtype=np.int64)
+        num_rings = rng.binomial(num_nodes, rings_per_node) if num_nodes > 2 else 0
+        if num_rings > 0:
+            ring_closures = np.stack([rng.choice(num_nodes, size=2, replace=False) for _ in range(num_rings)])
+            senders = np.append(senders, ring_closures[:, 0])
+            receivers = np.append(receivers, ring_closures[:, 1])
+        edges = np.stack([np.append(senders, receivers), np.append(receivers, senders)])
+        graphs.append(dict(num_nodes=int(num_nodes), edge_index=edges))
+    return graphs
+
+
+def max_abs_difference(per_graph, batched):
+    return max(np.nanmax(np.abs(a - b), initial=0.0) for a, b in zip(per_graph, batched))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the per graph and batched Laplacian and random walk features on molecule like graphs"
+    )
+    parser.add_argument("--num-graphs", type=int, default=20000)
+    parser.add_argument("--min-nodes", type=int, default=1)
+    parser.add_argument("--max-nodes", type=int, default=30)
+    parser.add_argument("--rings-per-node", type=float, default=0.08, help="Probability of a ring closure per node")
+    parser.add_argument("--batch-size", type=int, default=4096, help="Maximum number of graphs per batched call")
+    parser.add_argument("--max-freqs", type=int, default=8)
+    parser.add_argument("--eigvec-norm", type=str, default="L2")
+    parser.add_argument("--remove-first", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--k-steps", type=int, nargs="+", default=list(range(1, 17)))
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    graphs = molecule_like_graphs(args.num_graphs, args.min_nodes, args.max_nodes, args.rings_per_node)
+    lap_options = dict(max_freqs=args.max_freqs, eigvec_norm=args.eigvec_norm, remove_first=args.remove_first)
+
+    start = time.perf_counter()
+    per_graph_lap = [get_laplacian_features(graph, **lap_options) for graph in graphs]
+    per_graph_lap_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched_lap = get_laplacian_features_batched(graphs, batch_size=args.batch_size, **lap_options)
+    batched_lap_time = time.perf_counter() - start
+    lap_difference = max(
+        max_abs_difference([features[idx] for features in per_graph_lap], [features[idx] for features in batched_lap])
+        for idx in range(2)
+    )
+
+    start = time.perf_counter()
+    per_graph_rw = [
+        get_random_walk_landing_probs(graph["edge_index"], graph["num_nodes"], args.k_steps) for graph in graphs
+    ]
+    per_graph_rw_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched_rw = get_random_walk_landing_probs_batched(
+        [graph["edge_index"] for graph in graphs],
+        [graph["num_nodes"] for graph in graphs],
+        args.k_steps,
+        batch_size=args.batch_size,
+    )
+    batched_rw_time = time.perf_counter() - start
+    rw_difference = max_abs_difference(per_graph_rw, batched_rw)
+
+    print(f"{len(graphs)} graphs of {args.min_nodes} to {args.max_nodes} nodes")
+    print(f"{'feature':<14}{'per graph mol/s':>18}{'batched mol/s':>16}{'speedup':>10}{'max abs diff':>16}")
+    for name, per_graph_time, batched_time, difference in [
+        ("laplacian_eig", per_graph_lap_time, batched_lap_time, lap_difference),
+        ("random_walk", per_graph_rw_time, batched_rw_time, rw_difference),
+    ]:
+        print(
+            f"{name:<14}{len(graphs) / per_graph_time:>18.0f}{len(graphs) / batched_time:>16.0f}"
+            f"{per_graph_time / batched_time:>9.1f}x{difference:>16.3g}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,7 @@
 import numpy as np
 import scipy
 
-from data_utils.feature_generation.utils import get_laplacian
+from data_utils.feature_generation.utils import edges_to_dense_adjacency_batched, get_laplacian, group_by_num_nodes
 
 # This section has been adapted from the Graph-GPS code and converted to numpy
 
@@ -32,18 +32,19 @@ from data_utils.feature_generation.utils import get_laplacian
 def eigvec_normalizer(eig_vecs, eig_vals, normalization="L2", eps=1e-12):
     """
     Implement different eigenvector normalizations.
+    The eigenvectors are the columns of the last two axes, leading axes are batch axes.
     """
     if normalization == "L1":
         # L1 normalization: eigvec / sum(abs(eigvec))
-        denom = np.linalg.norm(eig_vecs, ord=1, axis=0, keepdims=True)
+        denom = np.linalg.norm(eig_vecs, ord=1, axis=-2, keepdims=True)
 
     elif normalization == "L2":
         # L2 normalization: eigvec / sqrt(sum(eigvec^2))
-        denom = np.linalg.norm(eig_vecs, ord=2, axis=0, keepdims=True)
+        denom = np.linalg.norm(eig_vecs, ord=2, axis=-2, keepdims=True)
 
     elif normalization == "abs-max":
         # AbsMax normalization: eigvec / max|eigvec|
-        denom = np.max(np.abs(eig_vecs), axis=0)
+        denom = np.max(np.abs(eig_vecs), axis=-2, keepdims=True)
 
     elif normalization == "wavelength":
         # These are placeholders that we can fill if needed.
@@ -60,7 +61,7 @@ def eigvec_normalizer(eig_vecs, eig_vals, normalization="L2", eps=1e-12):
     else:
         raise NotImplementedError(f"Unsupported normalization `{normalization}`")
 
-    denom = np.tile(np.clip(denom, a_min=eps, a_max=None), (eig_vecs.shape[0], 1))
+    denom = np.clip(denom, a_min=eps, a_max=None)
     eig_vecs = eig_vecs / denom
 
     return eig_vecs
@@ -70,34 +71,36 @@ def get_lap_decomp_stats(evals, evects, max_freqs, eigvec_norm="L2"):
     """Compute Laplacian eigen-decomposition-based PE stats of the given graph.
 
     Args:
-        evals, evects: Precomputed eigen-decomposition
+        evals, evects: Precomputed eigen-decomposition, optionally stacked for graphs with the same number of nodes
         max_freqs: Maximum number of top smallest frequencies / eigenvecs to use
         eigvec_norm: Normalization for the eigen vectors of the Laplacian
     Returns:
-        Tensor (num_nodes, max_freqs, 1) eigenvalues repeated for each node
-        Tensor (num_nodes, max_freqs) of eigenvector values per node
+        Tensor ([batch,] num_nodes, max_freqs, 1) eigenvalues repeated for each node
+        Tensor ([batch,] num_nodes, max_freqs) of eigenvector values per node
     """
-    num_nodes = len(evals)  # Number of nodes, including disconnected nodes.
+    num_nodes = evals.shape[-1]  # Number of nodes, including disconnected nodes.
+    batch_pad = ((0, 0),) * (evals.ndim - 1)
 
     # Keep up to the maximum desired number of frequencies.
-    idx = evals.argsort()[:max_freqs]
-    evals, evects = evals[idx], np.real(evects[:, idx])
+    idx = evals.argsort(axis=-1)[..., :max_freqs]
+    evals = np.take_along_axis(evals, idx, axis=-1)
+    evects = np.real(np.take_along_axis(evects, idx[..., np.newaxis, :], axis=-1))
     evals = np.clip(evals, a_min=0, a_max=None)
 
     # Normalize and pad eigen vectors.
     evects = eigvec_normalizer(evects, evals, normalization=eigvec_norm)
     if num_nodes < max_freqs:
-        eig_vecs = np.pad(evects, ((0, 0), (0, max_freqs - num_nodes)), "constant", constant_values=np.nan)
+        eig_vecs = np.pad(evects, batch_pad + ((0, 0), (0, max_freqs - num_nodes)), "constant", constant_values=np.nan)
     else:
         eig_vecs = evects
 
     # Pad and save eigenvalues.
     if num_nodes < max_freqs:
-        eig_vals = np.pad(evals, (0, max_freqs - num_nodes), "constant", constant_values=np.nan)
+        eig_vals = np.pad(evals, batch_pad + ((0, max_freqs - num_nodes),), "constant", constant_values=np.nan)
     else:
         eig_vals = evals
 
-    eig_vals = np.tile(eig_vals, (num_nodes, 1))
+    eig_vals = np.repeat(np.expand_dims(eig_vals, axis=-2), num_nodes, axis=-2)
     eig_vals = np.expand_dims(eig_vals, axis=-1)
 
     return eig_vals, eig_vecs
@@ -161,6 +164,66 @@ def get_laplacian_features(
     return (evals, evects)
 
 
+def get_laplacian_features_batched(
+    data, max_freqs=3, eigvec_norm="L2", eigval_inverse=False, eigval_norm=False, remove_first=False, batch_size=4096
+):
+    """
+    `get_laplacian_features` of a list of graphs. The Laplacians of up to `batch_size` graphs with the same number
+    of nodes are stacked and decomposed with a single `np.linalg.eigh`.
+    """
+    lap_feats = [None] * len(data)
+    for num_nodes, graph_idxs in group_by_num_nodes([item["num_nodes"] for item in data], batch_size):
+        edge_index = [data[idx]["edge_index"] for idx in graph_idxs]
+        # If only one node or no edges, set eigenvalue/vector to zero
+        is_trivial = np.array([num_nodes == 1 or edges.shape[1] < 1 for edges in edge_index])
+        if is_trivial.any():
+            evals = np.zeros((is_trivial.sum(), num_nodes, max_freqs, 1))
+            evects = np.zeros((is_trivial.sum(), num_nodes, max_freqs))
+            evals, evects = _update_eigen_features(evals, evects, eigval_inverse, eigval_norm, remove_first)
+            for batch_idx, graph_idx in enumerate(graph_idxs[is_trivial]):
+                lap_feats[graph_idx] = (evals[batch_idx], evects[batch_idx])
+        if is_trivial.all():
+            continue
+
+        # L = D - A, without self loops, in float32 as in `get_laplacian_features`
+        adj = edges_to_dense_adjacency_batched(
+            [edges for edges, trivial in zip(edge_index, is_trivial) if not trivial], num_nodes, without_self_loops=True
+        ).astype(np.float32)
+        laplacian = np.subtract(0, adj)
+        diagonal = np.arange(num_nodes)
+        laplacian[:, diagonal, diagonal] = adj.sum(axis=-1)
+        evals, evects = np.linalg.eigh(laplacian)
+
+        evals, evects = get_lap_decomp_stats(evals=evals, evects=evects, max_freqs=max_freqs, eigvec_norm=eigvec_norm)
+        evals, evects = _update_eigen_features(evals, evects, eigval_inverse, eigval_norm, remove_first)
+        for batch_idx, graph_idx in enumerate(graph_idxs[~is_trivial]):
+            lap_feats[graph_idx] = (evals[batch_idx], evects[batch_idx])
+    return lap_feats
+
+
+def _update_eigen_features(evals, evects, eigval_inverse, eigval_norm, remove_first):
+    """The options of `get_laplacian_features` applied to [batch, num_nodes, max_freqs(, 1)] features."""
+    if remove_first:
+        evals = evals[:, :, 1:]
+        evects = evects[:, :, 1:]
+
+    if eigval_inverse:
+        evals = evals.copy()
+        evals[np.isnan(evals)] = 0.0
+        evals[evals > 1e-10] = 1.0 / evals[evals > 1e-10]
+
+    if eigval_norm:
+        # The norm of each graph separately, as the vectorised norm can round differently
+        norm = np.array([np.linalg.norm(graph_evals[0]) for graph_evals in evals], dtype=evals.dtype)
+        norm[norm == 0] = 1.0
+        evals = evals / norm[:, np.newaxis, np.newaxis, np.newaxis]
+    return evals, evects
+
+
 def get_laplacian_features_from_dataset(dataset_item, item_options):
     lap_feats = get_laplacian_features(dataset_item, **item_options)
     return lap_feats
+
+
+def get_laplacian_features_from_dataset_batched(dataset_items, item_options):
+    return get_laplacian_features_batched(dataset_items, **item_options)
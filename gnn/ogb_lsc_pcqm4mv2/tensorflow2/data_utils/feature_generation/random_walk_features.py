@@ -23,7 +23,13 @@
 
 import numpy as np
 
-from data_utils.feature_generation.utils import edges_to_dense_adjacency, get_out_degrees, safe_inv
+from data_utils.feature_generation.utils import (
+    edges_to_dense_adjacency,
+    edges_to_dense_adjacency_batched,
+    get_out_degrees,
+    group_by_num_nodes,
+    safe_inv,
+)
 
 
 def get_random_walk_landing_probs(edges, num_nodes, k_steps=[1], edge_weights=None, space_dim=0):
@@ -55,8 +61,47 @@ def get_random_walk_landing_probs(edges, num_nodes, k_steps=[1], edge_weights=No
     return random_walk_landing_probs
 
 
+def get_random_walk_landing_probs_batched(edges, num_nodes, k_steps=[1], space_dim=0, batch_size=4096):
+    """
+    `get_random_walk_landing_probs` of a list of graphs. The transition matrices of up to `batch_size` graphs with
+    the same number of nodes are stacked, and the powers for all `k_steps` come from a single chain of products
+    P^k = P^(k-1) P.
+    """
+    random_walk_landing_probs = [None] * len(edges)
+    for graph_num_nodes, graph_idxs in group_by_num_nodes(num_nodes, batch_size):
+        # P = D^-1 * A
+        # This is doing row-normalize of the adjacency matrices
+        adj = edges_to_dense_adjacency_batched([edges[idx] for idx in graph_idxs], graph_num_nodes)
+        P = safe_inv(adj.sum(axis=-1))[..., np.newaxis] * adj
+
+        diagonals = {0: np.ones((len(graph_idxs), graph_num_nodes))}
+        max_k = max(k_steps)
+        P_k = None  # P^(k-1), None for the identity
+        for k in range(1, max_k + 1):
+            if k == max_k:
+                # Only the diagonal of the last power is used, which does not need the full product
+                diagonals[k] = np.diagonal(P, axis1=-2, axis2=-1) if P_k is None else np.einsum("bij,bji->bi", P_k, P)
+            else:
+                P_k = P if P_k is None else np.einsum("bij,bjk->bik", P_k, P, optimize=True)
+                diagonals[k] = np.diagonal(P_k, axis1=-2, axis2=-1)
+
+        landing_probs = np.stack([diagonals[k] * (k ** (space_dim / 2)) for k in k_steps], axis=-1)
+        for batch_idx, graph_idx in enumerate(graph_idxs):
+            random_walk_landing_probs[graph_idx] = landing_probs[batch_idx]
+    return random_walk_landing_probs
+
+
 def get_random_walk_landing_probs_from_dataset(dataset_item, item_options):
     random_walk_landing_probs = get_random_walk_landing_probs(
         dataset_item["edge_index"], dataset_item["num_nodes"], **item_options
     )
     return (random_walk_landing_probs,)
+
+
+def get_random_walk_landing_probs_from_dataset_batched(dataset_items, item_options):
+    random_walk_landing_probs = get_random_walk_landing_probs_batched(
+        [dataset_item["edge_index"] for dataset_item in dataset_items],
+        [dataset_item["num_nodes"] for dataset_item in dataset_items],
+        **item_options,
+    )
+    return [(landing_probs,) for landing_probs in random_walk_landing_probs]
@@ -79,3 +79,38 @@ def edges_to_dense_adjacency(edges, num_nodes):
         (np.ones((edges.shape[1])), (edges[0, :], edges[1, :])), shape=(num_nodes, num_nodes), dtype=np.int32
     )
     return adj.toarray()
+
+
+def group_by_num_nodes(num_nodes, batch_size=None):
+    """
+    Groups the graphs by their number of nodes.
+
+    Args:
+        num_nodes: Number of nodes of each graph
+        batch_size: Maximum number of graphs per group, all graphs of the same size in one group if None
+    Yields:
+        The number of nodes of the group and the indices of its graphs
+    """
+    num_nodes = np.asarray(num_nodes)
+    order = np.argsort(num_nodes, kind="stable")
+    sizes, starts = np.unique(num_nodes[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+    for size, start, stop in zip(sizes, starts, stops):
+        step = batch_size or stop - start
+        for batch_start in range(start, stop, step):
+            yield int(size), order[batch_start : min(batch_start + step, stop)]
+
+
+def edges_to_dense_adjacency_batched(edges, num_nodes, without_self_loops=False):
+    """
+    Stacks the dense adjacencies of graphs with the same number of nodes in a [len(edges), num_nodes, num_nodes]
+    array. As in `edges_to_dense_adjacency` duplicated edges are summed.
+    """
+    num_edges = [graph_edges.shape[1] for graph_edges in edges]
+    senders, receivers = np.concatenate(edges, axis=1).astype(np.int64)
+    graph_idxs = np.repeat(np.arange(len(edges)), num_edges)
+    flat_idxs = (graph_idxs * num_nodes + senders) * num_nodes + receivers
+    if without_self_loops:
+        flat_idxs = flat_idxs[senders != receivers]
+    adj = np.bincount(flat_idxs, minlength=len(edges) * num_nodes**2)
+    return adj.reshape(len(edges), num_nodes, num_nodes)
@@ -19,8 +19,14 @@ from data_utils.feature_generation.generic_features import (
     trim_chemical_features,
 )
 
-from data_utils.feature_generation.laplacian_features import get_laplacian_features_from_dataset
-from data_utils.feature_generation.random_walk_features import get_random_walk_landing_probs_from_dataset
+from data_utils.feature_generation.laplacian_features import (
+    get_laplacian_features_from_dataset,
+    get_laplacian_features_from_dataset_batched,
+)
+from data_utils.feature_generation.random_walk_features import (
+    get_random_walk_landing_probs_from_dataset,
+    get_random_walk_landing_probs_from_dataset_batched,
+)
 
 
 def preprocess_dataset(dataset, options, load_ensemble_cache=True, folds=None, split_mode=None, ensemble=False):
@@ -51,6 +57,7 @@ def preprocess_dataset(dataset, options, load_ensemble_cache=True, folds=None, s
     logging.info(f"Preprocessing features in order: {features}")
     for feature in features:
         feature_options = options.dataset.features[feature]
+        batch_preprocess_fn = None
         if feature == "chemical_features":
             item_keys = ("node_feat", "edge_feat")
             feature_options["chemical_node_features"] = options.dataset.chemical_node_features
@@ -61,9 +68,11 @@ def preprocess_dataset(dataset, options, load_ensemble_cache=True, folds=None, s
         elif feature == "random_walk":
             item_keys = ("random_walk_landing_probs",)
             preprocess_fn = get_random_walk_landing_probs_from_dataset
+            batch_preprocess_fn = get_random_walk_landing_probs_from_dataset_batched
         elif feature == "laplacian_eig":
             item_keys = ("lap_eig_vals", "lap_eig_vecs")
             preprocess_fn = get_laplacian_features_from_dataset
+            batch_preprocess_fn = get_laplacian_features_from_dataset_batched
         elif feature == "centrality_encoding":
             item_keys = ("centrality_encoding",)
             preprocess_fn = get_centrality_encoding_from_dataset
@@ -97,6 +106,7 @@ def preprocess_dataset(dataset, options, load_ensemble_cache=True, folds=None, s
             item_keys=item_keys,
             item_options=feature_options,
             preprocess_fn=preprocess_fn,
+            batch_preprocess_fn=batch_preprocess_fn,
             load_from_cache=load_ensemble_cache if ensemble else options.dataset.load_from_cache,
             save_to_cache=options.dataset.save_to_cache,
             cache_root=options.dataset.cache_path,
@@ -119,6 +129,7 @@ def preprocess_items(
     item_options,
     item_keys,
     preprocess_fn,
+    batch_preprocess_fn=None,
     load_from_cache=False,
     save_to_cache=False,
     cache_root=Path("."),
@@ -136,12 +147,28 @@ def preprocess_items(
         logging.info(f"Could not load preprocessed dataset item {item_name} from {cache_path}")
 
     # Do preprocessing
+    if batch_preprocess_fn is not None:
+        # Preprocess all the items at once, the function returns one item for each input item
+        dataset_idxs = [
+            dataset_idx
+            for dataset_idx in range(len(dataset.dataset))
+            if folds is None or dataset.dataset_idx_in_splits(dataset_idx, folds)
+        ]
+        logging.info(f"Generating {item_name} features of {len(dataset_idxs)} items in batches...")
+        batch_preprocessed_items = batch_preprocess_fn(
+            [dataset.dataset[dataset_idx][0] for dataset_idx in dataset_idxs], item_options
+        )
+        batch_preprocessed_items = dict(zip(dataset_idxs, batch_preprocessed_items))
+
     for dataset_idx in tqdm(range(len(dataset.dataset)), desc=f"Generating {item_name} features..."):
         if folds is None or dataset.dataset_idx_in_splits(
             dataset_idx,
             folds,
         ):
-            preprocessed_item = preprocess_fn(dataset.dataset[dataset_idx][0], item_options)
+            if batch_preprocess_fn is not None:
+                preprocessed_item = batch_preprocessed_items.pop(dataset_idx)
+            else:
+                preprocessed_item = preprocess_fn(dataset.dataset[dataset_idx][0], item_options)
         else:
             preprocessed_item = [np.nan for _ in item_keys]
 
@@ -31,11 +31,21 @@ import torch
 from torch_geometric.utils import remove_self_loops
 
 from data_utils.feature_generation.generic_features import _preprocess_item_send_rcv
-from data_utils.feature_generation.laplacian_features import eigvec_normalizer, get_laplacian_features
-from data_utils.feature_generation.random_walk_features import edges_to_dense_adjacency, get_random_walk_landing_probs
+from data_utils.feature_generation.laplacian_features import (
+    eigvec_normalizer,
+    get_laplacian_features,
+    get_laplacian_features_batched,
+)
+from data_utils.feature_generation.random_walk_features import (
+    edges_to_dense_adjacency,
+    get_random_walk_landing_probs,
+    get_random_walk_landing_probs_batched,
+)
 from data_utils.feature_generation.utils import (
+    edges_to_dense_adjacency_batched,
     get_in_degrees,
     get_out_degrees,
+    group_by_num_nodes,
     normalize_edge_index,
     remove_self_loops,
     safe_inv,
@@ -50,6 +60,22 @@ def get_example_edges(num_nodes):
     return edges
 
 
+def get_example_graphs():
+    """Graphs of different sizes with rings, and some with no edges, self loops or duplicated edges"""
+    rng = np.random.default_rng(0)
+    graphs = []
+    for num_nodes in rng.integers(1, 16, size=60).tolist() + [1, 2, 3, 5]:
+        edges = get_example_edges(num_nodes)
+        if num_nodes > 3:
+            ring = rng.choice(num_nodes, size=2, replace=False)
+            edges = np.hstack((edges, ring[:, np.newaxis], ring[::-1, np.newaxis]))
+        graphs.append(dict(num_nodes=num_nodes, edge_index=edges))
+    graphs.append(dict(num_nodes=4, edge_index=np.zeros((2, 0), dtype=np.int64)))
+    graphs.append(dict(num_nodes=4, edge_index=np.array([[0, 1, 1, 2, 2], [1, 0, 1, 3, 3]])))
+    graphs.append(dict(num_nodes=6, edge_index=np.array([[0, 0, 1, 5, 4, 3], [1, 1, 0, 5, 3, 4]])))
+    return graphs
+
+
 @pytest.mark.parametrize("num_nodes", [1, 10, 100])
 @pytest.mark.parametrize("max_freqs", [1, 3, 10, 20])
 def test_get_laplacian_features(num_nodes, max_freqs):
@@ -223,6 +249,73 @@ def test_random_walk_landing_probs_small(num_nodes, k_steps):
     assert random_walk_landing_probs.shape == (num_nodes, len(k_steps))
 
 
+@pytest.mark.parametrize("max_freqs", [1, 3, 10])
+@pytest.mark.parametrize("eigvec_norm", ["L1", "L2", "abs-max"])
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"remove_first": True},
+        {"remove_first": True, "eigval_inverse": True},
+        {"remove_first": True, "eigval_inverse": True, "eigval_norm": True},
+        {"eigval_inverse": True, "eigval_norm": True},
+    ],
+)
+def test_get_laplacian_features_batched(max_freqs, eigvec_norm, options):
+    if options.get("remove_first") and max_freqs == 1:
+        pytest.skip("No frequencies are left when removing the first one")
+    graphs = get_example_graphs()
+    batched = get_laplacian_features_batched(graphs, max_freqs=max_freqs, eigvec_norm=eigvec_norm, **options)
+    assert len(batched) == len(graphs)
+    for graph, (eig_val, eig_vec) in zip(graphs, batched):
+        expected_eig_val, expected_eig_vec = get_laplacian_features(
+            graph, max_freqs=max_freqs, eigvec_norm=eigvec_norm, **options
+        )
+        assert eig_val.dtype == expected_eig_val.dtype and eig_vec.dtype == expected_eig_vec.dtype
+        # Including the NaN padding of the graphs with fewer nodes than frequencies
+        np.testing.assert_array_equal(eig_val, expected_eig_val)
+        np.testing.assert_array_equal(eig_vec, expected_eig_vec)
+
+
+@pytest.mark.parametrize("k_steps", [[1], [0, 2], [4, 6, 12, 24], [5, 1, 3]])
+@pytest.mark.parametrize("space_dim", [0, 1])
+@pytest.mark.parametrize("batch_size", [None, 3])
+def test_get_random_walk_landing_probs_batched(k_steps, space_dim, batch_size):
+    graphs = get_example_graphs()
+    batched = get_random_walk_landing_probs_batched(
+        [graph["edge_index"] for graph in graphs],
+        [graph["num_nodes"] for graph in graphs],
+        k_steps,
+        space_dim=space_dim,
+        batch_size=batch_size,
+    )
+    assert len(batched) == len(graphs)
+    for graph, landing_probs in zip(graphs, batched):
+        expected = get_random_walk_landing_probs(graph["edge_index"], graph["num_nodes"], k_steps, space_dim=space_dim)
+        assert landing_probs.shape == expected.shape
+        # The powers are products in a different order than `np.linalg.matrix_power`
+        np.testing.assert_allclose(landing_probs, expected, rtol=1e-12, atol=1e-15)
+
+
+def test_group_by_num_nodes():
+    num_nodes = [3, 1, 3, 2, 3, 1, 3]
+    groups = list(group_by_num_nodes(num_nodes, batch_size=3))
+    assert [size for size, _ in groups] == [1, 2, 3, 3]
+    assert [idxs.tolist() for _, idxs in groups] == [[1, 5], [3], [0, 2, 4], [6]]
+    assert [idxs.tolist() for _, idxs in group_by_num_nodes(num_nodes)] == [[1, 5], [3], [0, 2, 4, 6]]
+
+
+def test_edges_to_dense_adjacency_batched():
+    graphs = get_example_graphs()
+    edges = [graph["edge_index"] for graph in graphs if graph["num_nodes"] == 4]
+    adj = edges_to_dense_adjacency_batched(edges, 4)
+    assert adj.shape == (len(edges), 4, 4)
+    for graph_edges, graph_adj in zip(edges, adj):
+        np.testing.assert_array_equal(graph_adj, edges_to_dense_adjacency(graph_edges.astype(np.int64), 4))
+    adj = edges_to_dense_adjacency_batched(edges, 4, without_self_loops=True)
+    assert np.all(np.diagonal(adj, axis1=-2, axis2=-1) == 0)
+
+
 def test_senders_receivers():
     edges = np.array([[0, 1, 1, 0, 3, 1, 3, 4], [1, 0, 0, 1, 1, 3, 4, 3]])
     edge_feat = np.zeros([8, 3])
@@ -0,0 +1,81 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+from torch_geometric.data import Batch, Data
+
+from interaction_graph import CellListInteractionGraph, PackedInteractionGraphLoader
+from utils import KNNInteractionGraph
+
+
+def qm9_like_molecules(num_atoms, min_atoms, max_atoms, spread, seed=0):
+    """Random molecules of `min_atoms` to `max_atoms` atoms, with `num_atoms` atoms in total"""
+    generator = torch.Generator().manual_seed(seed)
+    molecules, total = [], 0
+    while total < num_atoms:
+        size = min(int(torch.randint(min_atoms, max_atoms + 1, (), generator=generator)), num_atoms - total)
+        pos = torch.randn((size, 3), generator=generator) * spread
+        molecules.append(Data(z=torch.ones(size, dtype=torch.long), pos=pos, y=torch.zeros(1)))
+        total += size
+    return molecules
+
+
+def current_rss_mib():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def construct(method, num_atoms, args):
+    """Builds the interaction graph of one batch, returns the time and the peak memory above the initial one"""
+    molecules = qm9_like_molecules(num_atoms, args.min_atoms, args.max_atoms, args.spread)
+    batch = Batch.from_data_list(molecules)
+    initial_rss = current_rss_mib()
+    start = time.perf_counter()
+    if method == "knn":
+        edge_index, _ = KNNInteractionGraph(k=args.k, cutoff=args.cutoff)(batch.pos, batch.batch)
+    else:
+        transform = CellListInteractionGraph(k=args.k, cutoff=args.cutoff)
+        graphs = [transform(molecule) for molecule in molecules]
+        loader = PackedInteractionGraphLoader(
+            graphs,
+            num_graphs=len(graphs) + 1,
+            num_nodes=num_atoms + 1,
+            num_edges=num_atoms * args.k,
+            cutoff=args.cutoff,
+        )
+        edge_index = loader.pack(graphs).edge_index
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, max(peak_rss - initial_rss, 0.0), len(molecules), edge_index.shape[1]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Time and peak memory of the KNN and cell list interaction graph construction on the CPU"
+    )
+    parser.add_argument("--batch-atoms", type=int, nargs="+", default=[512, 1024, 2048, 4096, 8192])
+    parser.add_argument("--k", type=int, default=28)
+    parser.add_argument("--cutoff", type=float, default=10.0)
+    parser.add_argument("--min-atoms", type=int, default=9, help="Smallest number of atoms of a molecule")
+    parser.add_argument("--max-atoms", type=int, default=29, help="Largest number of atoms of a molecule")
+    parser.add_argument("--spread", type=float, default=1.5, help="Standard deviation of the atom positions in Å")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    # a new process for each construction, so that the peak memory of one does not hide the next
+    context = multiprocessing.get_context("spawn")
+    print(f"{'batch atoms':>12}{'molecules':>11}{'method':>11}{'seconds':>10}{'peak MiB':>10}{'edges':>10}")
+    for num_atoms in args.batch_atoms:
+        for method in ["knn", "cell list"]:
+            with context.Pool(1) as pool:
+                elapsed, peak, num_molecules, num_edges = pool.apply(construct, (method, num_atoms, args))
+            print(f"{num_atoms:>12}{num_molecules:>11}{method:>11}{elapsed:>10.4f}{peak:>10.1f}{num_edges:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from torch_geometric.data import Data
+
+
+def cell_list_neighbors(pos: np.ndarray, k: int, cutoff: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    k-nearest neighbors within the cutoff of each atom of a single molecule
+
+    :param pos (ndarray): Coordinates of each atom with shape [num_atoms, 3].
+    :param k (int): Maximum number of neighbors of each atom.
+    :param cutoff (float): Maximum distance between neighbors.
+
+    The atoms are binned in cubic cells with the cutoff as side, so that only
+    the atoms of the 27 cells around the cell of each atom are candidate
+    neighbors. For molecules of a bounded atom density this takes O(num_atoms)
+    time and memory instead of the O(num_atoms^2) of the full distance matrix.
+
+    Returns the edge_index with shape [2, num_edges] of the (neighbor, atom)
+    pairs, ordered by atom and then by distance as in `KNNInteractionGraph`,
+    and the edge_weight with the distance of each pair.
+    """
+    pos = np.asarray(pos, dtype=np.float32)
+    num_atoms = pos.shape[0]
+    if num_atoms == 0:
+        return np.zeros((2, 0), dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    cells = np.floor((pos - pos.min(axis=0)) / cutoff).astype(np.int64)
+    grid = cells.max(axis=0) + 3
+    # offset by one so that the cells around every atom are in the grid
+    cell_ids = np.ravel_multi_index((cells + 1).T, grid)
+    atoms_by_cell = np.argsort(cell_ids, kind="stable")
+    sorted_cell_ids = cell_ids[atoms_by_cell]
+
+    offsets = np.stack(np.meshgrid(*[np.arange(-1, 2)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    neighbor_cells = np.ravel_multi_index((cells[:, None] + 1 + offsets).reshape(-1, 3).T, grid)
+    starts = np.searchsorted(sorted_cell_ids, neighbor_cells, side="left")
+    counts = np.searchsorted(sorted_cell_ids, neighbor_cells, side="right") - starts
+
+    # candidate (atom, neighbor) pairs of all the atoms in the surrounding cells
+    atoms = np.repeat(np.repeat(np.arange(num_atoms), len(offsets)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    neighbors = atoms_by_cell[np.repeat(starts, counts) + positions]
+
+    distances = np.sqrt(np.sum(np.square(pos[neighbors] - pos[atoms]), axis=-1))
+    keep = (atoms != neighbors) & (distances <= cutoff)
+    atoms, neighbors, distances = atoms[keep], neighbors[keep], distances[keep]
+
+    # keep the k nearest neighbors of each atom
+    order = np.lexsort((neighbors, distances, atoms))
+    atoms, neighbors, distances = atoms[order], neighbors[order], distances[order]
+    rank = np.arange(len(atoms)) - np.searchsorted(atoms, atoms, side="left")
+    keep = rank < k
+    edge_index = np.stack([neighbors[keep], atoms[keep]])
+    return edge_index, distances[keep]
+
+
+class CellListInteractionGraph:
+    """
+    Transform adding the interaction graph of a molecule, as `edge_index` and
+    `edge_weight` attributes, computed on the host with `cell_list_neighbors`.
+
+    The neighbors of each atom are the same as the ones of
+    `KNNInteractionGraph` with the same k and cutoff, without the padding edges
+    of the atoms with fewer than k neighbors.
+    """
+
+    def __init__(self, k: int, cutoff: float = 10.0):
+        self.k = k
+        self.cutoff = cutoff
+
+    def __call__(self, data: Data) -> Data:
+        edge_index, edge_weight = cell_list_neighbors(data.pos.numpy(), self.k, self.cutoff)
+        data = data.clone()
+        data.edge_index = torch.from_numpy(edge_index)
+        data.edge_weight = torch.from_numpy(edge_weight)
+        return data
+
+
+class InteractionGraphCache(torch.utils.data.Dataset):
+    """
+    Items of a dataset with their interaction graph, computed on the first
+    access of each item only.
+    """
+
+    def __init__(self, dataset: Sequence[Data], interaction_graph: CellListInteractionGraph):
+        self.dataset = dataset
+        self.interaction_graph = interaction_graph
+        self.cache: List[Optional[Data]] = [None] * len(dataset)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx: int) -> Data:
+        if self.cache[idx] is None:
+            self.cache[idx] = self.interaction_graph(self.dataset[idx])
+        return self.cache[idx]
+
+
+class PackedInteractionGraphLoader:
+    """
+    Packs molecules with a precomputed interaction graph, for instance from an
+    `InteractionGraphCache`, into batches of fixed size.
+
+    :param dataset: Molecules with z, pos, y, edge_index and edge_weight.
+    :param num_graphs (int): Number of graphs of each batch, the last graph
+        is the padding molecule as assumed by `TrainingModule`.
+    :param num_nodes (int): Number of atoms of each batch, including at least
+        one atom of the padding molecule.
+    :param num_edges (int): Number of edges of each batch.
+    :param cutoff (float): The cutoff of the interaction graph, used as the
+        weight of the padding edges so that they do not contribute to the
+        continuous filters of SchNet.
+    :param shuffle (bool): Pack the molecules in a random order.
+
+    Molecules are added to a batch in order until one of the limits is
+    reached. The shapes of the batches only depend on these limits: the
+    padding atoms belong to the padding molecule, the padding edges are self
+    loops of its first atom with the cutoff as weight, and the targets of the
+    graph slots without a molecule are NaN.
+    """
+
+    def __init__(
+        self,
+        dataset: Sequence[Data],
+        num_graphs: int,
+        num_nodes: int,
+        num_edges: int,
+        cutoff: float = 10.0,
+        shuffle: bool = False,
+    ):
+        self.dataset = dataset
+        self.num_graphs = num_graphs
+        self.num_nodes = num_nodes
+        self.num_edges = num_edges
+        self.cutoff = cutoff
+        self.shuffle = shuffle
+
+    def __iter__(self) -> Iterator[Data]:
+        indices = torch.randperm(len(self.dataset)) if self.shuffle else torch.arange(len(self.dataset))
+        molecules, num_nodes, num_edges = [], 0, 0
+        for idx in indices.tolist():
+            molecule = self.dataset[idx]
+            if molecule.num_nodes > self.num_nodes - 1 or molecule.edge_index.shape[1] > self.num_edges:
+                raise ValueError(
+                    f"Molecule {idx} with {molecule.num_nodes} atoms and {molecule.edge_index.shape[1]} edges does"
+                    f" not fit in a batch of {self.num_nodes} atoms, including one padding atom, and"
+                    f" {self.num_edges} edges."
+                )
+            if (
+                len(molecules) == self.num_graphs - 1
+                or num_nodes + molecule.num_nodes > self.num_nodes - 1
+                or num_edges + molecule.edge_index.shape[1] > self.num_edges
+            ):
+                yield self.pack(molecules)
+                molecules, num_nodes, num_edges = [], 0, 0
+            molecules.append(molecule)
+            num_nodes += molecule.num_nodes
+            num_edges += molecule.edge_index.shape[1]
+        if molecules:
+            yield self.pack(molecules)
+
+    def pack(self, molecules: List[Data]) -> Data:
+        """Concatenates the molecules and pads them to the fixed batch size"""
+        num_atoms = [molecule.num_nodes for molecule in molecules]
+        node_offsets = np.cumsum([0] + num_atoms[:-1])
+        num_real_nodes = sum(num_atoms)
+        num_real_edges = sum(molecule.edge_index.shape[1] for molecule in molecules)
+
+        z = torch.zeros(self.num_nodes, dtype=molecules[0].z.dtype)
+        z[:num_real_nodes] = torch.cat([molecule.z for molecule in molecules])
+        pos = torch.zeros((self.num_nodes, 3), dtype=molecules[0].pos.dtype)
+        pos[:num_real_nodes] = torch.cat([molecule.pos for molecule in molecules])
+        batch = torch.full((self.num_nodes,), self.num_graphs - 1, dtype=torch.long)
+        batch[:num_real_nodes] = torch.repeat_interleave(torch.arange(len(molecules)), torch.tensor(num_atoms))
+
+        edge_index = torch.full((2, self.num_edges), num_real_nodes, dtype=torch.long)
+        edge_index[:, :num_real_edges] = torch.cat(
+            [molecule.edge_index + int(offset) for molecule, offset in zip(molecules, node_offsets)], dim=1
+        )
+        edge_weight = torch.full((self.num_edges,), self.cutoff, dtype=torch.float)
+        edge_weight[:num_real_edges] = torch.cat([molecule.edge_weight for molecule in molecules])
+
+        y = torch.full((self.num_graphs,), float("nan"))
+        y[: len(molecules)] = torch.cat([molecule.y.view(-1) for molecule in molecules])
+        return Data(z=z, pos=pos, batch=batch, edge_index=edge_index, edge_weight=edge_weight, y=y)
@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+from torch_geometric.nn.models import SchNet
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from interaction_graph import (
+    CellListInteractionGraph,
+    InteractionGraphCache,
+    PackedInteractionGraphLoader,
+    cell_list_neighbors,
+)
+from utils import KNNInteractionGraph, PackedSchNet, PackedTrainingModule
+
+
+def random_molecules(num_molecules, max_atoms, spread, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    molecules = []
+    for _ in range(num_molecules):
+        num_atoms = int(torch.randint(1, max_atoms + 1, (), generator=generator))
+        pos = torch.randn((num_atoms, 3), generator=generator) * spread
+        z = torch.randint(1, 10, (num_atoms,), generator=generator)
+        y = torch.randn(1, generator=generator)
+        molecules.append(Data(z=z, pos=pos, y=y))
+    return molecules
+
+
+def neighbor_sets(edge_index, edge_weight, cutoff):
+    """The (neighbor, atom) pairs, without the padding edges of KNNInteractionGraph"""
+    real = edge_weight < cutoff
+    return set(map(tuple, edge_index[:, real].t().tolist()))
+
+
+@pytest.mark.parametrize("k, cutoff, spread", [(28, 10.0, 1.5), (6, 2.0, 3.0), (3, 5.0, 2.0), (40, 1.0, 4.0)])
+def test_cell_list_cmp_knn(k, cutoff, spread):
+    molecules = random_molecules(12, 40, spread)
+    batch = Batch.from_data_list(molecules)
+    knn_edge_index, knn_edge_weight = KNNInteractionGraph(k=k, cutoff=cutoff)(batch.pos, batch.batch)
+
+    transform = CellListInteractionGraph(k=k, cutoff=cutoff)
+    offset = 0
+    edge_index, edge_weight = [], []
+    for molecule in molecules:
+        graph = transform(molecule)
+        assert torch.all(graph.edge_index[0] != graph.edge_index[1])
+        edge_index.append(graph.edge_index + offset)
+        edge_weight.append(graph.edge_weight)
+        offset += molecule.num_nodes
+    edge_index, edge_weight = torch.cat(edge_index, dim=1), torch.cat(edge_weight)
+
+    assert neighbor_sets(edge_index, edge_weight, cutoff) == neighbor_sets(knn_edge_index, knn_edge_weight, cutoff)
+    # the KNN edges ordered as the cell list ones, by atom and then by distance
+    real = knn_edge_weight < cutoff
+    torch.testing.assert_close(edge_weight, knn_edge_weight[real])
+    assert torch.equal(edge_index, knn_edge_index[:, real])
+
+
+def test_cell_list_neighbors_sparse_molecule():
+    # a chain of atoms spanning many cells, each atom only has its two neighbors in the chain
+    pos = torch.zeros((100, 3))
+    pos[:, 0] = torch.arange(100) * 1.5
+    edge_index, edge_weight = cell_list_neighbors(pos.numpy(), k=4, cutoff=2.0)
+    assert edge_index.shape == (2, 2 * 99)
+    assert sorted(map(tuple, edge_index.T.tolist())) == sorted(
+        [(i + 1, i) for i in range(99)] + [(i, i + 1) for i in range(99)]
+    )
+    torch.testing.assert_close(torch.from_numpy(edge_weight), torch.full((2 * 99,), 1.5))
+
+
+def test_interaction_graph_cache():
+    molecules = random_molecules(5, 10, 1.5)
+    calls = []
+
+    def transform(data):
+        calls.append(data)
+        return CellListInteractionGraph(k=4)(data)
+
+    cache = InteractionGraphCache(molecules, transform)
+    first = [cache[idx] for idx in range(len(cache))]
+    second = [cache[idx] for idx in range(len(cache))]
+    assert len(calls) == len(molecules)
+    assert all(a is b for a, b in zip(first, second))
+
+
+def test_packed_batches_cmp_knn_schnet():
+    torch.manual_seed(0)
+    k, cutoff = 28, 10.0
+    molecules = random_molecules(30, 20, 1.5)
+    dataset = InteractionGraphCache(molecules, CellListInteractionGraph(k=k, cutoff=cutoff))
+    num_graphs, num_nodes, num_edges = 8, 96, 1500
+    loader = PackedInteractionGraphLoader(dataset, num_graphs, num_nodes, num_edges, cutoff=cutoff)
+
+    packed_model = PackedSchNet(cutoff=cutoff).eval()
+    model = SchNet(cutoff=cutoff, interaction_graph=KNNInteractionGraph(k=k, cutoff=cutoff)).eval()
+    model.load_state_dict(packed_model.state_dict())
+
+    num_molecules = 0
+    for data in loader:
+        assert data.z.shape == (num_nodes,) and data.pos.shape == (num_nodes, 3) and data.batch.shape == (num_nodes,)
+        assert data.edge_index.shape == (2, num_edges) and data.edge_weight.shape == (num_edges,)
+        assert data.y.shape == (num_graphs,)
+        packed = ~torch.isnan(data.y)
+        batch_molecules = molecules[num_molecules : num_molecules + int(packed.sum())]
+        num_molecules += len(batch_molecules)
+
+        with torch.no_grad():
+            prediction = packed_model(data.z, data.pos, data.batch, data.edge_index, data.edge_weight).view(-1)
+            unpacked = Batch.from_data_list(batch_molecules)
+            # topk of KNNInteractionGraph needs at least k atoms, fewer than k neighbors are found either way
+            model.interaction_graph = KNNInteractionGraph(k=min(k, unpacked.num_nodes), cutoff=cutoff)
+            expected = model(unpacked.z, unpacked.pos, unpacked.batch).view(-1)
+        torch.testing.assert_close(prediction[packed], expected, rtol=1e-4, atol=1e-4)
+        torch.testing.assert_close(data.y[packed], unpacked.y)
+    assert num_molecules == len(molecules)
+
+
+def test_packed_training_module():
+    torch.manual_seed(0)
+    cutoff = 10.0
+    molecules = random_molecules(10, 20, 1.5)
+    dataset = InteractionGraphCache(molecules, CellListInteractionGraph(k=28, cutoff=cutoff))
+    num_graphs = 8
+    loader = PackedInteractionGraphLoader(dataset, num_graphs, num_nodes=64, num_edges=1024, cutoff=cutoff)
+    model = PackedTrainingModule(PackedSchNet(cutoff=cutoff), batch_size=num_graphs)
+    for data in loader:
+        prediction, loss = model(data.z, data.pos, data.batch, data.edge_index, data.edge_weight, data.y)
+        packed = ~torch.isnan(data.y[:-1])
+        torch.testing.assert_close(loss, torch.mean((prediction[packed] - data.y[:-1][packed]) ** 2))
+        loss.backward()
+        assert all(torch.isfinite(p.grad).all() for p in model.parameters() if p.grad is not None)
@@ -5,6 +5,7 @@ import torch.nn.functional as F
 
 from torch_geometric.data import Data
 from torch_geometric.nn import to_fixed_size
+from torch_geometric.nn.models import SchNet
 
 
 class ShiftedSoftplus(torch.nn.Module):
@@ -52,6 +53,61 @@ class TrainingModule(torch.nn.Module):
         return prediction, loss
 
 
+class PackedTrainingModule(TrainingModule):
+    """
+    TrainingModule for the batches of `PackedInteractionGraphLoader`, which
+    passes the precomputed interaction graph to a `PackedSchNet`.  The graphs
+    of a batch without a molecule have a NaN target and are left out of the
+    mean squared error, as well as the padding molecule at the end.
+    """
+
+    def forward(self, z, pos, batch, edge_index, edge_weight, target):
+        prediction = self.model(z, pos, batch, edge_index, edge_weight).view(-1)
+
+        # slice off the padding molecule and mask the empty graphs
+        prediction = prediction[0:-1]
+        target = target[0:-1]
+        mask = ~torch.isnan(target)
+        squared_error = (prediction - torch.nan_to_num(target)).square() * mask
+        loss = squared_error.sum() / mask.sum()
+        return prediction, loss
+
+
+class PackedSchNet(SchNet):
+    """
+    SchNet taking the interaction graph of the batch as inputs, precomputed on
+    the host by `PackedInteractionGraphLoader`, instead of computing it from
+    the atom positions with the `interaction_graph` module.
+    """
+
+    def forward(self, z, pos, batch, edge_index, edge_weight):
+        if self.dipole:
+            raise NotImplementedError("PackedSchNet does not support dipole moment predictions.")
+
+        h = self.embedding(z)
+        edge_attr = self.distance_expansion(edge_weight)
+
+        for interaction in self.interactions:
+            h = h + interaction(h, edge_index, edge_weight, edge_attr)
+
+        h = self.lin1(h)
+        h = self.act(h)
+        h = self.lin2(h)
+
+        if self.mean is not None and self.std is not None:
+            h = h * self.std + self.mean
+
+        if self.atomref is not None:
+            h = h + self.atomref(z)
+
+        out = self.readout(h, batch, dim=0)
+
+        if self.scale is not None:
+            out = self.scale * out
+
+        return out
+
+
 class KNNInteractionGraph(torch.nn.Module):
     def __init__(self, k: int, cutoff: float = 10.0):
         super().__init__()
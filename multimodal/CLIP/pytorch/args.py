@@ -166,6 +166,12 @@ def parse_args(args=None):
     parser.add_argument("--grid_size", type=int, default=7, help="")
     parser.add_argument("--vocab_size", type=int, default=49408, help="The size of vocabulary")
     parser.add_argument("--truncate", type=str_to_bool, default=True, help="")
+    parser.add_argument(
+        "--tokenizer_workers",
+        type=int,
+        default=0,
+        help="The number of processes tokenizing the captions, 0 tokenizes them in the main process",
+    )
     parser.add_argument("--beta1", type=float, default=0.9, help="set the beta1 for the optimizer")
     parser.add_argument("--beta2", type=float, default=0.98, help="set the beta2 for the optimizer")
     parser.add_argument("--eps", type=float, default=1e-6, help="set the eps for the optimizer")
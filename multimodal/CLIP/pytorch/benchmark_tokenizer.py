@@ -0,0 +1,62 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Words per second of the CLIP tokenizer on synthetic captions.
+
+The captions are made of vocabulary words drawn from a Zipf distribution, some
+of them misspelt so that the BPE cache keeps missing. The BPE merges are timed
+alone, on every distinct word, then whole captions are encoded with
+`encode_batch` in this process and in a pool of processes.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from datasets.simple_tokenizer import SimpleTokenizer, default_bpe
+
+
+def synthetic_captions(tokenizer, num_captions, seed=0, words_per_caption=(5, 20), typo_rate=0.1):
+    rng = np.random.default_rng(seed)
+    words = [token[: -len("</w>")] for token in tokenizer.encoder if token.endswith("</w>") and token[:-4].isalpha()]
+    letters = list("abcdefghijklmnopqrstuvwxyz")
+    captions = []
+    for num_words in rng.integers(*words_per_caption, num_captions):
+        caption = []
+        for rank in rng.zipf(1.2, num_words):
+            word = words[min(rank, len(words)) - 1]
+            if rng.uniform() < typo_rate:
+                position = rng.integers(len(word) + 1)
+                word = word[:position] + rng.choice(letters) + word[position:]
+            caption.append(word)
+        captions.append(" ".join(caption))
+    return captions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bpe-vocab-path", type=str, default=default_bpe())
+    parser.add_argument("--num-captions", type=int, default=100000)
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--cache-size", type=int, default=2**17)
+    args = parser.parse_args()
+
+    tokenizer = SimpleTokenizer(args.bpe_vocab_path, cache_size=args.cache_size)
+    captions = synthetic_captions(tokenizer, args.num_captions)
+    num_words = sum(len(caption.split()) for caption in captions)
+
+    distinct_words = sorted({word for caption in captions for word in caption.split()})
+    start = time.perf_counter()
+    for word in distinct_words:
+        tokenizer._word_ids(word)
+    print(f"BPE merges, uncached: {len(distinct_words) / (time.perf_counter() - start):.0f} words/s")
+
+    for num_workers in args.num_workers:
+        tokenizer = SimpleTokenizer(args.bpe_vocab_path, cache_size=args.cache_size)
+        start = time.perf_counter()
+        tokenizer.encode_batch(captions, truncate=True, num_workers=num_workers)
+        words_per_second = num_words / (time.perf_counter() - start)
+        hit_rate = f", cache hit rate {tokenizer.cache_info()['hit_rate']:.3f}" if num_workers == 0 else ""
+        print(f"encode_batch, {num_workers} workers: {words_per_second:.0f} words/s{hit_rate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -201,6 +201,7 @@ def build_loaders(config, opts, async_dataloader, return_remaining=False):
             config.bpe_vocab_path,
             context_length=config.context_length,
             truncate=config.truncate,
+            num_workers=config.tokenizer_workers,
         )
         image_values = dataframe["image"].values
 
@@ -230,7 +231,11 @@ def build_loaders(config, opts, async_dataloader, return_remaining=False):
 
 
 def tokenize(
-    texts: Union[str, List[str]], bpe_vocab_path: str, context_length: int = 77, truncate: bool = False
+    texts: Union[str, List[str]],
+    bpe_vocab_path: str,
+    context_length: int = 77,
+    truncate: bool = False,
+    num_workers: int = 0,
 ) -> torch.LongTensor:
     """
     Returns the tokenized representation of given input string(s)
@@ -242,6 +247,8 @@ def tokenize(
         The context length to use; all CLIP models use 77 as the context length
     truncate: bool
         Whether to truncate the text in case its encoding is longer than the context length
+    num_workers: int
+        The number of processes tokenizing the texts, 0 tokenizes them in this process
     Returns
     -------
     A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
@@ -250,18 +257,4 @@ def tokenize(
     if isinstance(texts, str):
         texts = [texts]
 
-    sot_token = _tokenizer.encoder["<|startoftext|>"]
-    eot_token = _tokenizer.encoder["<|endoftext|>"]
-    all_tokens = [[sot_token] + _tokenizer.encode(text) + [eot_token] for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
-
-    for i, tokens in enumerate(all_tokens):
-        if len(tokens) > context_length:
-            if truncate:
-                tokens = tokens[:context_length]
-                tokens[-1] = eot_token
-            else:
-                raise RuntimeError(f"Input {texts[i]} is too long for context length {context_length}")
-        result[i, : len(tokens)] = torch.tensor(tokens)
-
-    return result
+    return _tokenizer.encode_batch(texts, context_length, truncate=truncate, num_workers=num_workers)
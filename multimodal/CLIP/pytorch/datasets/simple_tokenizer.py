@@ -4,12 +4,17 @@
 # This file has been modified by Graphcore
 
 import gzip
+import heapq
 import html
+import itertools
 import os
+from concurrent.futures import ProcessPoolExecutor
 from functools import lru_cache
 
 import ftfy
+import numpy as np
 import regex as re
+import torch
 
 
 @lru_cache()
@@ -58,16 +63,23 @@ def basic_clean(text):
     return text.strip()
 
 
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
 def whitespace_clean(text):
-    text = re.sub(r"\s+", " ", text)
+    text = WHITESPACE_PATTERN.sub(" ", text)
     text = text.strip()
     return text
 
 
 class SimpleTokenizer(object):
-    def __init__(self, bpe_path: str):
+    def __init__(self, bpe_path: str, cache_size: int = 2**17):
+        self.bpe_path = bpe_path
+        self.cache_size = cache_size
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
+        # maps the bytes of a latin-1 decoded string to their unicode strings
+        self.byte_table = str.maketrans({chr(b): c for b, c in self.byte_encoder.items()})
         merges = gzip.open(bpe_path).read().decode("utf-8").split("\n")
         merges = merges[1 : 49152 - 256 - 2 + 1]
         merges = [tuple(merge.split()) for merge in merges]
@@ -79,62 +91,145 @@ class SimpleTokenizer(object):
         self.encoder = dict(zip(vocab, range(len(vocab))))
         self.decoder = {v: k for k, v in self.encoder.items()}
         self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {"<|startoftext|>": "<|startoftext|>", "<|endoftext|>": "<|endoftext|>"}
+        # rank and merged token id of each pair of token ids, the pair id being first * vocab size + second
+        self.pair_ranks = {}
+        for rank, (first, second) in enumerate(merges):
+            pair_id = self.encoder[first] * len(self.encoder) + self.encoder[second]
+            self.pair_ranks.setdefault(pair_id, (rank, self.encoder[first + second]))
+        self.special_tokens = {"<|startoftext|>", "<|endoftext|>"}
+        # bounded LRU cache of the token ids of each word, see `cache_info`
+        self.word_ids = lru_cache(maxsize=cache_size)(self._word_ids)
         self.pat = re.compile(
             r"""<\|startoftext\|>|<\|endoftext\|>|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""",
             re.IGNORECASE,
         )
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["word_ids"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.word_ids = lru_cache(maxsize=self.cache_size)(self._word_ids)
+
+    def cache_info(self):
+        """Hits, misses and size of the BPE cache, with its hit rate."""
+        info = self.word_ids.cache_info()
+        lookups = info.hits + info.misses
+        return dict(info._asdict(), hit_rate=info.hits / lookups if lookups else 0.0)
+
+    def _bpe_ids(self, token):
+        """Token ids of a byte-encoded word.
+
+        The pairs of adjacent symbols are merged in order of rank from a heap,
+        over a linked list of the symbols, so a word of n symbols takes
+        O(n log n). As a merge always ranks after the merges making its two
+        symbols, this merges every occurrence of the lowest ranked pair, left
+        to right, before any other pair, exactly like the original loop.
+        """
+        if token in self.special_tokens:
+            return (self.encoder[token],)
+        encoder, pair_ranks, vocab_size = self.encoder, self.pair_ranks, len(self.encoder)
+        symbols = [encoder[c] for c in token[:-1]]
+        symbols.append(encoder[token[-1] + "</w>"])
+        n = len(symbols)
+        # heap of (rank, position, first, second) for the pairs starting at each position
+        heap = []
+        for i in range(n - 1):
+            merge = pair_ranks.get(symbols[i] * vocab_size + symbols[i + 1])
+            if merge is not None:
+                heap.append((merge[0], i, symbols[i], symbols[i + 1]))
+        if not heap:
+            return tuple(symbols)
+        heapq.heapify(heap)
+        next_position = list(range(1, n + 1))
+        previous_position = list(range(-1, n - 1))
+        while heap:
+            rank, i, first, second = heapq.heappop(heap)
+            j = next_position[i]
+            # skip the pairs changed by an earlier merge
+            if j == n or symbols[i] != first or symbols[j] != second:
+                continue
+            merged = pair_ranks[first * vocab_size + second][1]
+            symbols[i], symbols[j] = merged, None
+            k = next_position[j]
+            next_position[i] = k
+            if k < n:
+                previous_position[k] = i
+                merge = pair_ranks.get(merged * vocab_size + symbols[k])
+                if merge is not None:
+                    heapq.heappush(heap, (merge[0], i, merged, symbols[k]))
+            h = previous_position[i]
+            if h >= 0:
+                merge = pair_ranks.get(symbols[h] * vocab_size + merged)
+                if merge is not None:
+                    heapq.heappush(heap, (merge[0], h, symbols[h], merged))
+        return tuple(symbol for symbol in symbols if symbol is not None)
+
+    def _word_ids(self, word):
+        return self._bpe_ids(word.encode("utf-8").decode("latin-1").translate(self.byte_table))
+
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token[:-1]) + (token[-1] + "</w>",)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token + "</w>"
-
-        while True:
-            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float("inf")))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                    new_word.append(first + second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = " ".join(word)
-        self.cache[token] = word
-        return word
+        if token in self.special_tokens:
+            return token
+        return " ".join(self.decoder[token_id] for token_id in self._bpe_ids(token))
 
     def encode(self, text):
         bpe_tokens = []
         text = whitespace_clean(basic_clean(text)).lower()
-        for token in re.findall(self.pat, text):
-            token = "".join(self.byte_encoder[b] for b in token.encode("utf-8"))
-            bpe_tokens.extend(self.encoder[bpe_token] for bpe_token in self.bpe(token).split(" "))
+        for word in self.pat.findall(text):
+            bpe_tokens.extend(self.word_ids(word))
         return bpe_tokens
 
+    def encode_batch(self, texts, context_length=77, truncate=False, num_workers=0, chunk_size=4096):
+        """Token ids of a batch of texts, between the start and end of text tokens.
+
+        Args:
+            texts: the texts to encode
+            context_length: length of the padded token ids
+            truncate: whether to truncate the texts longer than the context length,
+                else they raise a RuntimeError
+            num_workers: processes encoding chunks of `chunk_size` texts, 0 encodes
+                them in this process
+
+        Returns:
+            torch.LongTensor of shape [len(texts), context_length], padded with 0
+        """
+        if num_workers > 0:
+            chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=(self,)) as pool:
+                all_tokens = list(itertools.chain.from_iterable(pool.map(_encode_chunk, chunks)))
+        else:
+            all_tokens = [self.encode(text) for text in texts]
+
+        sot_token = self.encoder["<|startoftext|>"]
+        eot_token = self.encoder["<|endoftext|>"]
+        result = np.zeros((len(all_tokens), context_length), dtype=np.int64)
+        for i, tokens in enumerate(all_tokens):
+            if len(tokens) + 2 > context_length:
+                if truncate:
+                    tokens = tokens[: context_length - 2]
+                else:
+                    raise RuntimeError(f"Input {texts[i]} is too long for context length {context_length}")
+            result[i, 0] = sot_token
+            result[i, 1 : len(tokens) + 1] = tokens
+            result[i, len(tokens) + 1] = eot_token
+        return torch.from_numpy(result)
+
     def decode(self, tokens):
         text = "".join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode("utf-8", errors="replace").replace("</w>", " ")
         return text
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_chunk(texts):
+    return [_worker_tokenizer.encode(text) for text in texts]
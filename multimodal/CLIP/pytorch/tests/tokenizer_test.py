@@ -0,0 +1,80 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import os
+
+import import_helper
+import pytest
+import torch
+from datasets.simple_tokenizer import SimpleTokenizer, default_bpe, get_pairs
+
+pytestmark = pytest.mark.skipif(not os.path.exists(default_bpe()), reason="The BPE vocabulary is not downloaded")
+
+CAPTIONS = [
+    "A photo of a dog &amp; a cat, running on the beach!!",
+    "Ünïcödé テキスト 中文 emoji 😀 12345 can't won't",
+    "<|startoftext|>hello<|endoftext|>",
+    "   spaces\tand\nnewlines  ",
+    "unbelievably antidisestablishmentarianism aaaaaaaaaaaa",
+]
+
+
+def merge_loop_bpe(tokenizer, token):
+    """The original BPE, merging every occurrence of the lowest ranked pair at each step."""
+    word = tuple(token[:-1]) + (token[-1] + "</w>",)
+    pairs = get_pairs(word)
+    if not pairs:
+        return token + "</w>"
+    while True:
+        bigram = min(pairs, key=lambda pair: tokenizer.bpe_ranks.get(pair, float("inf")))
+        if bigram not in tokenizer.bpe_ranks:
+            break
+        first, second = bigram
+        new_word = []
+        i = 0
+        while i < len(word):
+            if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+                new_word.append(first + second)
+                i += 2
+            else:
+                new_word.append(word[i])
+                i += 1
+        word = tuple(new_word)
+        if len(word) == 1:
+            break
+        pairs = get_pairs(word)
+    return " ".join(word)
+
+
+@pytest.fixture(name="tokenizer", scope="module")
+def tokenizer_fixture():
+    return SimpleTokenizer(default_bpe(), cache_size=64)
+
+
+def test_bpe_matches_merge_loop(tokenizer):
+    words = [word[:-4] for word in list(tokenizer.encoder)[512:2000:7] if word.endswith("</w>")]
+    words += [a + b for a, b in zip(words, words[1:])] + ["a", "aaaaaaa", "ababababa", "zzxqj"]
+    for word in words:
+        assert tokenizer.bpe(word) == merge_loop_bpe(tokenizer, word)
+
+
+def test_encode_batch(tokenizer):
+    tokens = tokenizer.encode_batch(CAPTIONS, context_length=77)
+    sot_token, eot_token = tokenizer.encoder["<|startoftext|>"], tokenizer.encoder["<|endoftext|>"]
+    for row, caption in zip(tokens, CAPTIONS):
+        expected = [sot_token] + tokenizer.encode(caption) + [eot_token]
+        assert row.tolist() == expected + [0] * (77 - len(expected))
+    assert torch.equal(tokenizer.encode_batch(CAPTIONS, num_workers=2, chunk_size=2), tokens)
+
+    truncated = tokenizer.encode_batch(CAPTIONS, context_length=8, truncate=True)
+    assert torch.equal(truncated[:, :7], tokens[:, :7])
+    assert torch.all(truncated[:, 7][tokens[:, 8] != 0] == eot_token)
+    with pytest.raises(RuntimeError):
+        tokenizer.encode_batch(CAPTIONS, context_length=8)
+
+
+def test_cache_is_bounded(tokenizer):
+    tokenizer.encode("the cat and the dog and the bird")
+    tokenizer.encode(" ".join("word" + chr(97 + i % 26) + chr(97 + i // 26) for i in range(200)))
+    info = tokenizer.cache_info()
+    assert info["currsize"] == info["maxsize"] == 64
+    assert 0.0 < info["hit_rate"] < 1.0
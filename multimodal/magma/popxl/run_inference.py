@@ -4,6 +4,7 @@ from configs import CONFIG_DIR, MagmaConfig
 from inference import inference
 from utils.setup import magma_config_setup, set_random_seeds
 from utils.sampling import generate
+from utils.prefix_cache import PrefixCache, PrefixCachedGenerator
 
 from modelling.gptj.embedding import GPTJEmbeddingsTP
 from modelling.magma_mapping import load_magma, magma_mapping
@@ -19,7 +20,7 @@ from functools import partial
 import numpy as np
 import random
 import torch
-from typing import Literal
+from typing import Literal, Optional
 
 
 def init_inference_session(key: Literal["magma_v1_500", "magma_v1_1024"] = "magma_v1_500"):
@@ -120,6 +121,53 @@ def run_inference(
     return tokenizer.decode(output, skip_special_tokens=True)
 
 
+def init_host_generator(magma, prefix_cache: Optional[PrefixCache] = None) -> PrefixCachedGenerator:
+    """
+    Generator running the pytorch magma model on the host, which resumes from the image prefixes
+    and decoder states cached by prefix_cache.
+
+    Args:
+        - magma: the pretrained magma model, as returned by `load_magma`.
+        - prefix_cache (PrefixCache): cache shared by the requests, None to process the full prefix of each request.
+    """
+    magma = magma.float().eval()
+
+    def decode(embeddings, past_key_values):
+        outputs = magma.lm(inputs_embeds=embeddings, past_key_values=past_key_values, use_cache=True)
+        return outputs.logits, outputs.past_key_values
+
+    return PrefixCachedGenerator(magma.image_prefix, magma.word_embedding, decode, prefix_cache)
+
+
+def run_inference_host(
+    generator: PrefixCachedGenerator,
+    config,
+    tokenizer,
+    image_url,
+    text_prompt,
+    seed: int,
+    system_prompt: str = "",
+    top_p: float = 0.9,
+    top_k: float = 0.0,
+    temperature: float = 0.7,
+    max_out_tokens: float = 6,
+):
+    """
+    Run magma inference on the host using the given text prompt and image url.
+    The image prefix and the decoder state after the image, the system prompt and the text prompt
+    are reused from the prefix cache of the generator for the following requests.
+    """
+    image = ImageInput(image_url)
+    img = image.get_transformed_image(clip_preprocess(config.visual.image_resolution)).float()
+    segments = [tokenizer.encode(prompt) for prompt in (system_prompt, text_prompt) if prompt]
+
+    set_random_seeds(seed)
+    sample = partial(generate, top_k=top_k, top_p=top_p, temperature=temperature)
+    with timer("Generating answer"), torch.no_grad():
+        output = generator.generate(img, segments, sample, max_out_tokens, eos_token_id=tokenizer.eos_token_id)
+    return tokenizer.decode(output, skip_special_tokens=True)
+
+
 if __name__ == "__main__":
     session, config, tokenizer = init_inference_session("magma_v1_500")
     img = "https://www.art-prints-on-demand.com/kunst/thomas_cole/woods_hi.jpg"
@@ -0,0 +1,188 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import time
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+from transformers import GPTJConfig as GPTJConfigHF, GPTJForCausalLM
+
+from utils.prefix_cache import LRUCache, PrefixCache, PrefixCachedGenerator, image_hash
+
+
+class TinyMagma(nn.Module):
+    """
+    CPU executable magma: a tiny image encoder with the 144 image
+    prefix tokens of magma in front of a tiny GPT-J
+    """
+
+    def __init__(self, hidden_size=64, vocab_size=128, image_resolution=96):
+        super().__init__()
+        self.image_prefix = nn.Sequential(
+            nn.Conv2d(3, hidden_size, kernel_size=image_resolution // 12, stride=image_resolution // 12),
+            nn.Flatten(2),
+        )
+        self.ln = nn.LayerNorm(hidden_size)
+        config = GPTJConfigHF(
+            vocab_size=vocab_size, n_positions=1024, n_embd=hidden_size, n_layer=2, n_head=8, rotary_dim=8
+        )
+        self.lm = GPTJForCausalLM(config)
+        self.word_embedding = self.lm.transformer.wte
+
+    def encode_image(self, image):
+        return self.ln(self.image_prefix(image).transpose(1, 2))
+
+    def decode(self, embeddings, past_key_values):
+        outputs = self.lm(inputs_embeds=embeddings, past_key_values=past_key_values, use_cache=True)
+        return outputs.logits, outputs.past_key_values
+
+    def generator(self, prefix_cache=None):
+        return PrefixCachedGenerator(self.encode_image, self.word_embedding, self.decode, prefix_cache)
+
+
+def greedy(logits):
+    return torch.argmax(logits, dim=-1)
+
+
+def random_requests(num_images, num_questions, system_prompt_len, vocab_size=128, image_resolution=96):
+    generator = torch.Generator().manual_seed(0)
+    system_prompt = torch.randint(0, vocab_size, (system_prompt_len,), generator=generator).tolist()
+    images = [
+        torch.rand(1, 3, image_resolution, image_resolution, generator=generator, dtype=torch.float64)
+        for _ in range(num_images)
+    ]
+    requests = []
+    for image in images:
+        for _ in range(num_questions):
+            question = torch.randint(0, vocab_size, (5,), generator=generator).tolist()
+            # a copy of the image, the cache is keyed by the content
+            requests.append((image.clone(), [system_prompt, question]))
+    return requests
+
+
+@pytest.fixture
+def tiny_magma():
+    torch.manual_seed(0)
+    return TinyMagma().double().eval()
+
+
+def test_lru_cache():
+    cache = LRUCache(max_bytes=3 * 8)
+    for key in "abc":
+        cache.put(key, np.zeros(1))
+    assert cache.get("a") is not None
+    cache.put("d", np.zeros(1))
+    # b is the least recently used
+    assert "b" not in cache and all(key in cache for key in "acd")
+    assert cache.get("b") is None
+    cache.put("e", np.zeros(4))
+    assert "e" not in cache
+    assert cache.metrics() == {"hits": 1, "misses": 1, "evictions": 1, "entries": 3, "bytes": 24}
+
+
+def test_image_hash():
+    image = torch.rand(1, 3, 8, 8)
+    assert image_hash(image) == image_hash(image.clone()) == image_hash(image.numpy().copy())
+    assert image_hash(image) != image_hash(image.double())
+    assert image_hash(image) != image_hash(image.reshape(1, 3, 4, 16))
+    other = image.clone()
+    other[0, 0, 0, 0] += 1
+    assert image_hash(image) != image_hash(other)
+
+
+@pytest.mark.parametrize("max_state_bytes", [2**30, 2**20])
+def test_prefix_cache_cmp_no_cache(tiny_magma, max_state_bytes):
+    requests = random_requests(num_images=3, num_questions=3, system_prompt_len=32)
+    prefix_cache = PrefixCache(max_state_bytes=max_state_bytes)
+    cached = tiny_magma.generator(prefix_cache)
+    uncached = tiny_magma.generator()
+
+    with torch.no_grad():
+        for image, segments in requests:
+            expected_logits, _ = uncached.prefill(image, segments)
+            logits, _ = cached.prefill(image, segments)
+            assert torch.equal(logits, expected_logits)
+            assert cached.generate(image, segments, greedy, 8) == uncached.generate(image, segments, greedy, 8)
+
+            def sample(logits):
+                return torch.multinomial(torch.softmax(logits, dim=-1), 1)
+
+            torch.manual_seed(1)
+            expected = uncached.generate(image, segments, sample, 8)
+            torch.manual_seed(1)
+            assert cached.generate(image, segments, sample, 8) == expected
+
+    metrics = prefix_cache.metrics()
+    if max_state_bytes == 2**30:
+        # each image misses once, then the full prompts are cached
+        assert metrics["image_prefix"] == {
+            "hits": 0,
+            "misses": 3,
+            "evictions": 0,
+            "entries": 3,
+            "bytes": 3 * 144 * 64 * 8,
+        }
+        assert metrics["decoder_state"]["misses"] == 3
+        assert metrics["decoder_state"]["hits"] == 3 * 3 * 3 - 3
+        assert metrics["decoder_state"]["evictions"] == 0
+        assert metrics["decoder_state"]["entries"] == 3 * (2 + 3)
+    else:
+        assert metrics["decoder_state"]["evictions"] > 0
+        assert metrics["decoder_state"]["bytes"] <= max_state_bytes
+
+
+class InPlaceState:
+    """Decoder state updated in place, as the Cache objects of transformers"""
+
+    def __init__(self):
+        self.embeddings = torch.zeros(1, 0, 4)
+
+    def update(self, embeddings):
+        self.embeddings = torch.cat([self.embeddings, embeddings], dim=1)
+        return self
+
+
+def in_place_decode(embeddings, past):
+    state = (past or InPlaceState()).update(embeddings)
+    # the logits of each position depend on all the positions before it
+    logits = torch.cumsum(state.embeddings, dim=1)[:, -embeddings.shape[1] :]
+    return logits, state
+
+
+def test_prefix_cache_in_place_state():
+    requests = random_requests(num_images=2, num_questions=3, system_prompt_len=8, vocab_size=4, image_resolution=4)
+
+    def encode_image(image):
+        return image.reshape(1, -1, 4).float()
+
+    def embed_tokens(tokens):
+        return torch.nn.functional.one_hot(tokens, 4).float()
+
+    prefix_cache = PrefixCache()
+    cached = PrefixCachedGenerator(encode_image, embed_tokens, in_place_decode, prefix_cache)
+    uncached = PrefixCachedGenerator(encode_image, embed_tokens, in_place_decode)
+    for image, segments in requests:
+        expected_logits, expected_state = uncached.prefill(image, segments)
+        logits, state = cached.prefill(image, segments)
+        assert torch.equal(logits, expected_logits)
+        assert torch.equal(state.embeddings, expected_state.embeddings)
+        assert cached.generate(image, segments, greedy, 4) == uncached.generate(image, segments, greedy, 4)
+    # the tensors in the attributes of the states are counted
+    assert prefix_cache.metrics()["decoder_state"]["bytes"] > 0
+
+
+def test_prefix_cache_latency(tiny_magma):
+    requests = random_requests(num_images=2, num_questions=4, system_prompt_len=256)
+    latencies = {}
+    with torch.no_grad():
+        for name, prefix_cache in [("uncached", None), ("cached", PrefixCache())]:
+            generator = tiny_magma.generator(prefix_cache)
+            durations = []
+            for image, segments in requests:
+                start = time.perf_counter()
+                generator.generate(image, segments, greedy, 4)
+                durations.append(time.perf_counter() - start)
+            # the requests after the first question about each image
+            latencies[name] = np.mean([d for i, d in enumerate(durations) if i % 4])
+    print(f"Per request latency: {latencies}, speedup: {latencies['uncached'] / latencies['cached']:.2f}x")
+    assert latencies["cached"] < latencies["uncached"]
@@ -0,0 +1,248 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import copy
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+__all__ = ["LRUCache", "PrefixCache", "PrefixCachedGenerator", "image_hash"]
+
+
+def image_hash(image) -> str:
+    """
+    Hash of the content of an image tensor or array,
+    including its shape and dtype
+    """
+    if isinstance(image, torch.Tensor):
+        image = image.detach().cpu().numpy()
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256(f"{image.shape}{image.dtype}".encode())
+    digest.update(image.data)
+    return digest.hexdigest()
+
+
+def _is_state_object(value) -> bool:
+    # objects holding tensors in their attributes, such as the Cache objects of transformers
+    return hasattr(value, "__dict__") and not isinstance(value, type) and not callable(value)
+
+
+def nbytes(value) -> int:
+    """Size of the tensors and arrays nested in tuples, lists, dicts and the attributes of objects"""
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if _is_state_object(value):
+        return nbytes(vars(value))
+    return 0
+
+
+def clone_state(value):
+    """
+    Copy of the tensors nested in tuples, lists, dicts and the attributes of objects.
+    The Cache objects of recent transformers versions are updated in place by the model.
+    """
+    if isinstance(value, torch.Tensor):
+        return value.clone()
+    if isinstance(value, (tuple, list)):
+        return type(value)(clone_state(v) for v in value)
+    if isinstance(value, dict):
+        return {k: clone_state(v) for k, v in value.items()}
+    if _is_state_object(value):
+        copied = copy.copy(value)
+        vars(copied).update((k, clone_state(v)) for k, v in vars(value).items())
+        return copied
+    return value
+
+
+class LRUCache:
+    """
+    Least recently used cache on the host, bounded by the
+    size in bytes of its values
+
+    Args:
+        - max_bytes (int): values are evicted, least recently used first,
+          until the cache holds at most max_bytes. A value larger than
+          max_bytes is not stored.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key: Hashable, value: Any):
+        size = nbytes(value)
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+        }
+
+
+class PrefixCache:
+    """
+    Image prefix embeddings, keyed by the hash of the image content,
+    and decoder states after the image prefix and after each segment
+    of the prompts, keyed by the image hash and the tokens of the
+    segments before them
+
+    Args:
+        - max_image_bytes (int): size of the image prefix embeddings LRU
+        - max_state_bytes (int): size of the decoder states LRU
+    """
+
+    def __init__(self, max_image_bytes: int = 2**28, max_state_bytes: int = 2**31):
+        self.image_prefixes = LRUCache(max_image_bytes)
+        self.states = LRUCache(max_state_bytes)
+
+    @staticmethod
+    def state_key(image_key: str, segments: Sequence[Sequence[int]]) -> Tuple:
+        return (image_key, tuple(tuple(int(t) for t in segment) for segment in segments))
+
+    def metrics(self) -> Dict[str, Dict[str, int]]:
+        return {"image_prefix": self.image_prefixes.metrics(), "decoder_state": self.states.metrics()}
+
+
+class PrefixCachedGenerator:
+    """
+    Autoregressive generation for an image and a text prompt, resuming
+    from the longest prefix cached by a `PrefixCache`
+
+    The prompt is given as segments of tokens, for instance a shared
+    system prompt and a question. The image prefix and each segment are
+    processed by their own decoder call, with or without the cache, so
+    that resuming from a cached prefix gives the same outputs as
+    processing the full prompt: only the segments after the cached
+    prefix are processed.
+
+    Args:
+        - encode_image: image -> [1, image_seq_len, hidden] image prefix embeddings
+        - embed_tokens: [1, seq] tokens -> [1, seq, hidden] word embeddings
+        - decode: ([1, seq, hidden] embeddings, past state or None) ->
+          ([1, seq, vocab] logits, past state). decode can update the
+          past state in place, as the Cache objects of transformers: the
+          states are copied when they are stored in the prefix cache and
+          when they are resumed from it
+        - prefix_cache: PrefixCache, or None to process the full prefix
+          for every request
+    """
+
+    def __init__(
+        self,
+        encode_image: Callable,
+        embed_tokens: Callable,
+        decode: Callable,
+        prefix_cache: Optional[PrefixCache] = None,
+    ):
+        self.encode_image = encode_image
+        self.embed_tokens = embed_tokens
+        self.decode = decode
+        self.prefix_cache = prefix_cache
+
+    def image_prefix(self, image, image_key: str):
+        if self.prefix_cache is None:
+            return self.encode_image(image)
+        image_embed = self.prefix_cache.image_prefixes.get(image_key)
+        if image_embed is None:
+            image_embed = self.encode_image(image)
+            self.prefix_cache.image_prefixes.put(image_key, image_embed)
+        return image_embed
+
+    def prefill(self, image, segments: Sequence[Sequence[int]]):
+        """
+        Returns the logits of the last token of the prompt and
+        the state of the decoder after the prompt
+        """
+        image_key = image_hash(image) if self.prefix_cache is not None else None
+        # the longest cached prefix, 0 is the state after the image prefix
+        num_cached, state = -1, None
+        if self.prefix_cache is not None:
+            for num_segments in range(len(segments), -1, -1):
+                key = self.prefix_cache.state_key(image_key, segments[:num_segments])
+                if key in self.prefix_cache.states:
+                    last_logits, past = self.prefix_cache.states.get(key)
+                    num_cached, state = num_segments, (last_logits, clone_state(past))
+                    break
+            else:
+                self.prefix_cache.states.misses += 1
+
+        if state is None:
+            logits, past = self.decode(self.image_prefix(image, image_key), None)
+            state = (logits[:, -1], past)
+            num_cached = 0
+            if self.prefix_cache is not None:
+                self.prefix_cache.states.put(
+                    self.prefix_cache.state_key(image_key, []), (logits[:, -1], clone_state(past))
+                )
+
+        last_logits, past = state
+        for num_segments in range(num_cached + 1, len(segments) + 1):
+            tokens = torch.tensor([list(segments[num_segments - 1])], dtype=torch.long)
+            logits, past = self.decode(self.embed_tokens(tokens), past)
+            last_logits = logits[:, -1]
+            if self.prefix_cache is not None:
+                key = self.prefix_cache.state_key(image_key, segments[:num_segments])
+                self.prefix_cache.states.put(key, (last_logits, clone_state(past)))
+        return last_logits, past
+
+    def generate(
+        self,
+        image,
+        segments: Sequence[Sequence[int]],
+        sample: Callable,
+        max_out_tokens: int,
+        eos_token_id: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Generates up to max_out_tokens tokens after the image and the
+        prompt, `sample` maps [1, vocab] logits to the next token
+        """
+        last_logits, past = self.prefill(image, segments)
+        output = []
+        while True:
+            next_token = int(sample(last_logits))
+            output.append(next_token)
+            if next_token == eos_token_id or len(output) == max_out_tokens:
+                break
+            logits, past = self.decode(self.embed_tokens(torch.tensor([[next_token]], dtype=torch.long)), past)
+            last_logits = logits[:, -1]
+        return output
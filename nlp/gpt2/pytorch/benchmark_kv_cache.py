@@ -0,0 +1,164 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import time
+
+import torch
+from transformers import GPT2Config, GPT2Model
+
+from model.kv_cache import GPT2AttentionKVCache, generate, python_for_loop, use_kv_cache_attention
+
+
+class GPT2AttentionShiftedCache(GPT2AttentionKVCache):
+    """
+    The attention of the previous generation loop, as `OptimizedGPT2AttentionCache` without the IPU layout
+    custom op: the key and value of the new token are concatenated in front of the cache, shifted by one token.
+    """
+
+    def forward(
+        self,
+        hidden_states,
+        layer_past=None,
+        attention_mask=None,
+        head_mask=None,
+        encoder_hidden_states=None,
+        encoder_attention_mask=None,
+        use_cache=False,
+        output_attentions=False,
+    ):
+        query, key, value = self.c_attn(hidden_states).split(self.split_size, dim=2)
+
+        query = self._split_heads(query, self.num_heads, self.head_dim)
+        key = self._split_heads(key, self.num_heads, self.head_dim)
+        value = self._split_heads(value, self.num_heads, self.head_dim)
+
+        if layer_past is not None:
+            past_key, past_value = layer_past
+            key = torch.cat((key, past_key[:, :, :-1, :]), dim=-2)
+            value = torch.cat((value, past_value[:, :, :-1, :]), dim=-2)
+
+        present = (key, value)
+        attn_output, _ = self.optimized_attn(query, key, value, attention_mask, head_mask)
+        attn_output = self._merge_heads(attn_output, self.num_heads, self.head_dim)
+        attn_output = self.c_proj(attn_output)
+        return (attn_output, present)
+
+
+def shifted_cache_generate(model, context, dynamic_mask, position_ids, output_len, topk=1):
+    """The previous generation loop of `GPT2Wrapper`, which rebuilds the whole cache at every step"""
+    config = model.config
+    batch_size, input_len = context.shape
+    kv_size = (batch_size, config.n_head, input_len + output_len, config.n_embd // config.n_head)
+    past_key_values = [[torch.zeros(kv_size, dtype=model.dtype)] * 2 for _ in range(config.n_layer)]
+    position_ids_stage_1 = torch.arange(0, input_len, dtype=torch.long).unsqueeze(0)
+    hidden_states = model(context, position_ids=position_ids_stage_1, past_key_values=None, return_dict=False)
+
+    new_past_keys, new_past_values = [], []
+    for (past_key, past_value), (present_key, present_value) in zip(past_key_values, hidden_states[1]):
+        new_past_keys.append(torch.cat((present_key, past_key[:, :, :-input_len, :]), dim=-2))
+        new_past_values.append(torch.cat((present_value, past_value[:, :, :-input_len, :]), dim=-2))
+    past_keys, past_values = torch.stack(new_past_keys, dim=0), torch.stack(new_past_values, dim=0)
+
+    index_one_hot = torch.nn.functional.one_hot(position_ids, num_classes=input_len).to(hidden_states[0].dtype)
+    last_hidden = torch.matmul(index_one_hot, hidden_states[0]).view(batch_size, -1)
+    (_, next_token) = torch.topk(torch.matmul(last_hidden, model.wte.weight.T), 1)
+    record = torch.cat((next_token.to(torch.int64), torch.zeros(batch_size, output_len - 1, dtype=torch.int64)), -1)
+
+    def body(context, dynamic_mask, position_ids, record, past_keys, past_values):
+        past_key_values = [[past_keys[index], past_values[index]] for index in range(config.n_layer)]
+        hidden_states = model(
+            context,
+            attention_mask=dynamic_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            return_dict=False,
+        )
+        present_keys = torch.stack([k for (k, v) in hidden_states[1]], dim=0)
+        present_values = torch.stack([v for (k, v) in hidden_states[1]], dim=0)
+        next_token_logits = torch.matmul(hidden_states[0], model.wte.weight.T).view(batch_size, -1)
+        (_, next_token) = torch.topk(next_token_logits, topk)
+        random_choice_idx = torch.argmax(torch.randn((1, topk)), axis=1)
+        next_token = next_token[:, random_choice_idx]
+        next_dynamic_mask = torch.cat((torch.ones(batch_size, 1, dtype=torch.int64), dynamic_mask[:, :-1]), dim=-1)
+        next_record = torch.cat((next_token.to(torch.int64), record[:, :-1]), dim=-1)
+        return next_token, next_dynamic_mask, position_ids + 1, next_record, present_keys, present_values
+
+    # the record holds the newest token first
+    inputs = [next_token, dynamic_mask, position_ids + 1, torch.roll(record, 0), past_keys, past_values]
+    outputs = python_for_loop(output_len - 1, body, inputs)
+    return torch.flip(outputs[3], dims=[1])
+
+
+def random_gpt2(attention_class, seed=0, **config):
+    torch.manual_seed(seed)
+    config = GPT2Config(**config)
+    return use_kv_cache_attention(GPT2Model(config).eval(), attention_class)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Tokens/sec of the in place and of the shifted key/value caches on the CPU with a random GPT2"
+    )
+    parser.add_argument("--output-len", type=int, nargs="+", default=[32, 64, 128, 256])
+    parser.add_argument("--input-len", type=int, default=64)
+    parser.add_argument("--prompt-len", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--n-layer", type=int, default=6)
+    parser.add_argument("--n-embd", type=int, default=384)
+    parser.add_argument("--n-head", type=int, default=6)
+    parser.add_argument("--vocab-size", type=int, default=8192)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    n_positions = args.input_len + max(args.output_len)
+    config = dict(
+        n_layer=args.n_layer,
+        n_embd=args.n_embd,
+        n_head=args.n_head,
+        vocab_size=args.vocab_size,
+        n_positions=n_positions,
+    )
+    kv_cache_model = random_gpt2(GPT2AttentionKVCache, **config)
+    shifted_model = random_gpt2(GPT2AttentionShiftedCache, **config)
+
+    prompt = torch.randint(0, args.vocab_size, (args.prompt_len,))
+    context = torch.zeros(args.batch_size, args.input_len, dtype=torch.int64)
+    context[:, : args.prompt_len] = prompt
+    position_ids = torch.full((args.batch_size, 1), args.prompt_len - 1, dtype=torch.int64)
+
+    print(f"{'output len':>10}{'shifted tok/s':>15}{'in place tok/s':>16}{'speedup':>9}{'same tokens':>13}")
+    with torch.no_grad():
+        for output_len in args.output_len:
+            dynamic_mask = torch.zeros(args.batch_size, args.input_len + output_len, dtype=torch.int64)
+            dynamic_mask[:, : args.prompt_len + 1] = 1
+
+            start = time.perf_counter()
+            shifted = shifted_cache_generate(shifted_model, context, dynamic_mask, position_ids, output_len)
+            shifted_time = time.perf_counter() - start
+            start = time.perf_counter()
+            in_place = generate(kv_cache_model, context, position_ids, output_len)
+            in_place_time = time.perf_counter() - start
+
+            num_tokens = args.batch_size * output_len
+            print(
+                f"{output_len:>10}{num_tokens / shifted_time:>15.1f}{num_tokens / in_place_time:>16.1f}"
+                f"{shifted_time / in_place_time:>8.2f}x{str(torch.equal(shifted, in_place)):>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+import torch.nn as nn
+from transformers.models.gpt2.modeling_gpt2 import GPT2Attention
+
+
+def python_for_loop(count, body, inputs):
+    """`poptorch.for_loop` on the CPU"""
+    for _ in range(count):
+        inputs = body(*inputs)
+    return inputs
+
+
+def kv_cache_slots(position_ids, max_len):
+    """Slots of the cache where the keys and values of the tokens at `position_ids` are written"""
+    return torch.remainder(position_ids, max_len)
+
+
+def kv_cache_mask(position_ids, max_len):
+    """
+    [batch, max_len] mask of the slots holding the tokens of each row up to `position_ids` [batch, 1].
+    Once a row has more tokens than slots, its oldest tokens are overwritten and all the slots are valid.
+    """
+    slots = torch.arange(max_len, dtype=position_ids.dtype).unsqueeze(0)
+    return ((slots <= position_ids) | (position_ids >= max_len)).to(torch.int64)
+
+
+class GPT2AttentionKVCache(GPT2Attention):
+    """
+    GPT2 attention writing the keys and values of its tokens in place into a preallocated cache.
+
+    `layer_past` is `(past_key, past_value, slots)`: the [batch, n_head, max_len, head_dim] cache of the layer
+    and the [batch, seq] slots of the input tokens in it. Without an `attention_mask` the tokens are a prompt,
+    which only attends to itself with the causal mask. Otherwise the tokens attend to the slots of the cache
+    selected by `attention_mask`, and each token of a block of consecutive tokens also ignores the slots of
+    the tokens after it in the block.
+    """
+
+    def optimized_attn(self, query, key, value, attention_mask=None, head_mask=None):
+        attn_weights = torch.matmul(query, key.transpose(-1, -2))
+
+        if self.scale_attn_weights:
+            attn_weights *= 1.0 / (value.size(-1) ** 0.5)
+
+        # Layer-wise attention scaling
+        if self.scale_attn_by_inverse_layer_idx:
+            attn_weights = attn_weights / float(self.layer_idx + 1)
+
+        if attention_mask is not None:
+            # Apply the attention mask
+            attn_weights = attn_weights + attention_mask
+        else:
+            key_length = key.size(-2)
+            causal_mask = self.bias[:, :, :key_length, :key_length]
+            attn_weights -= 1e4 * (1 - causal_mask)
+
+        attn_weights = attn_weights.type(value.dtype)
+        attn_weights = nn.Softmax(dim=-1)(attn_weights)
+        attn_weights = self.attn_dropout(attn_weights)
+
+        # Mask heads if we want to
+        if head_mask is not None:
+            attn_weights = attn_weights * head_mask
+
+        attn_output = torch.matmul(attn_weights, value)
+        return attn_output, attn_weights
+
+    def forward(
+        self,
+        hidden_states,
+        layer_past=None,
+        attention_mask=None,
+        head_mask=None,
+        encoder_hidden_states=None,
+        encoder_attention_mask=None,
+        use_cache=False,
+        output_attentions=False,
+    ):
+        if encoder_hidden_states is not None:
+            raise ValueError("GPT2AttentionKVCache does not support cross attention.")
+
+        query, key, value = self.c_attn(hidden_states).split(self.split_size, dim=2)
+
+        query = self._split_heads(query, self.num_heads, self.head_dim)
+        key = self._split_heads(key, self.num_heads, self.head_dim)
+        value = self._split_heads(value, self.num_heads, self.head_dim)
+
+        if layer_past is not None:
+            past_key, past_value, slots = layer_past
+            index = slots[:, None, :, None].expand_as(key)
+            past_key.scatter_(-2, index, key)
+            past_value.scatter_(-2, index, value)
+
+        if layer_past is None or attention_mask is None:
+            attn_output, attn_weights = self.optimized_attn(query, key, value, None, head_mask)
+        else:
+            if query.size(-2) > 1:
+                cache_slots = torch.arange(past_key.size(-2), dtype=slots.dtype).view(1, 1, 1, -1)
+                later_in_block = (cache_slots > slots[:, None, :, None]) & (cache_slots <= slots[:, None, -1:, None])
+                attention_mask = attention_mask.masked_fill(later_in_block, torch.finfo(attention_mask.dtype).min)
+            attn_output, attn_weights = self.optimized_attn(query, past_key, past_value, attention_mask, head_mask)
+
+        if use_cache is True:
+            present = (key, value) if layer_past is None else (past_key, past_value)
+        else:
+            present = None
+
+        attn_output = self._merge_heads(attn_output, self.num_heads, self.head_dim)
+        attn_output = self.c_proj(attn_output)
+        attn_output = self.resid_dropout(attn_output)
+
+        outputs = (attn_output, present)
+        if output_attentions:
+            outputs += (attn_weights,)
+        return outputs
+
+
+def use_kv_cache_attention(model, attention_class=GPT2AttentionKVCache):
+    """Replaces the attention of each layer of a GPT2Model by `attention_class`, keeping its weights"""
+    for layer in model.h:
+        attn = attention_class(model.config, layer_idx=layer.attn.layer_idx)
+        attn.load_state_dict(layer.attn.state_dict())
+        attn.train(layer.attn.training)
+        layer.attn = attn
+    return model
+
+
+def generate(model, context, position_ids, output_len, topk=1, for_loop=python_for_loop):
+    """
+    Generates `output_len` tokens after each prompt with a GPT2Model using `GPT2AttentionKVCache`.
+
+    :param context: [batch, input_len] prompts, padded on the right.
+    :param position_ids: [batch, 1] position of the last token of each prompt, the prompts can have
+        different lengths.
+    :param topk: The tokens are chosen at random among the topk most likely ones, except the first one.
+    :param for_loop: Loop over the generation steps, `poptorch.for_loop` on the IPU.
+    Returns the [batch, output_len] generated tokens.
+
+    The keys and values of all the layers are kept in [n_layer, batch, n_head, max_len, head_dim] buffers,
+    with `max_len = input_len + output_len`. Each step writes the keys and values of the new token in place
+    at the slot of its position, and the attention mask selects the slots holding the tokens of each row,
+    so the cache is never copied or shifted.
+    """
+    config = model.config
+    batch_size, input_len = context.shape
+    max_len = input_len + output_len
+    cache_shape = (config.n_layer, batch_size, config.n_head, max_len, config.n_embd // config.n_head)
+    past_keys = torch.zeros(cache_shape, dtype=model.dtype)
+    past_values = torch.zeros(cache_shape, dtype=model.dtype)
+
+    # 1 stage: the prompts, all the rows have the positions 0 to input_len - 1
+    prompt_position_ids = torch.arange(0, input_len, dtype=torch.long).unsqueeze(0).expand(batch_size, -1)
+    past_key_values = [(past_keys[index], past_values[index], prompt_position_ids) for index in range(config.n_layer)]
+    hidden_states = model(context, position_ids=prompt_position_ids, past_key_values=past_key_values, return_dict=False)
+
+    index_one_hot = torch.nn.functional.one_hot(position_ids, num_classes=input_len).to(hidden_states[0].dtype)
+    last_hidden = torch.matmul(index_one_hot, hidden_states[0]).view(batch_size, -1)
+    next_token_logits = torch.matmul(last_hidden, model.wte.weight.T)
+    (next_token_value, next_token) = torch.topk(next_token_logits, 1)
+    record = torch.zeros(batch_size, output_len, dtype=torch.int64)
+    record[:, :1] = next_token
+    step = torch.ones(batch_size, 1, dtype=torch.int64)
+
+    # 2 stage: one token per step
+    def body(context, position_ids, step, record, past_keys, past_values):
+        slots = kv_cache_slots(position_ids, max_len)
+        past_key_values = [(past_keys[index], past_values[index], slots) for index in range(config.n_layer)]
+        hidden_states = model(
+            context,
+            attention_mask=kv_cache_mask(position_ids, max_len),
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            return_dict=False,
+        )
+        next_token_logits = torch.matmul(hidden_states[0], model.wte.weight.T).view(batch_size, -1)
+        (next_token_value, next_token) = torch.topk(next_token_logits, topk)
+        # We simply do a random selection after topk to avoid repetitions
+        # Notice: Here we use 'argmax' + 'randn' instead of 'randint' which is unsupported.
+        random_choice_idx = torch.argmax(torch.randn((1, topk)), axis=1)
+        next_token = next_token[:, random_choice_idx]
+        record.scatter_(1, step, next_token.to(torch.int64))
+        return next_token, position_ids + 1, step + 1, record, past_keys, past_values
+
+    outputs = for_loop(output_len - 1, body, [next_token, position_ids + 1, step, record, past_keys, past_values])
+    return outputs[3]
@@ -20,6 +20,8 @@ import torch.nn as nn
 from transformers.models.gpt2.modeling_gpt2 import GPT2Attention
 import numpy as np
 
+from model.kv_cache import GPT2AttentionKVCache
+
 
 class OptimizedGPT2Attention(GPT2Attention):
     def optimized_attn(self, query, key, value, attention_mask=None, head_mask=None):
@@ -307,3 +309,9 @@ class OptimizedGPT2AttentionCache(GPT2Attention):
         if output_attentions:
             outputs += (attn_weights,)
         return outputs
+
+
+class OptimizedGPT2AttentionKVCache(GPT2AttentionKVCache):
+    """GPT2AttentionKVCache with the layout of the attention weights and values optimized for latency"""
+
+    optimized_attn = OptimizedGPT2AttentionCache.optimized_attn
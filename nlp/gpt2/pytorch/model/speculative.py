@@ -0,0 +1,153 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+
+from model.kv_cache import kv_cache_mask, kv_cache_slots
+
+
+def top_k_probs(logits, topk):
+    """
+    Probabilities of sampling from the softmax of the `topk` largest logits, all the logits when topk is None.
+    topk=1 is greedy decoding, all the probability is on the first largest logit.
+    """
+    if topk == 1:
+        return torch.nn.functional.one_hot(torch.argmax(logits, dim=-1), logits.size(-1)).to(logits.dtype)
+    if topk is not None:
+        kth_largest = torch.topk(logits, topk, dim=-1).values[..., -1:]
+        logits = logits.masked_fill(logits < kth_largest, float("-inf"))
+    return torch.softmax(logits, dim=-1)
+
+
+def sample(probs):
+    """[batch, 1] tokens sampled from the [batch, vocab] probabilities"""
+    return torch.multinomial(probs, 1)
+
+
+def empty_kv_cache(model, batch_size, max_len):
+    """Keys and values of all the layers of a GPT2Model using `GPT2AttentionKVCache`"""
+    config = model.config
+    cache_shape = (config.n_layer, batch_size, config.n_head, max_len, config.n_embd // config.n_head)
+    return torch.zeros(cache_shape, dtype=model.dtype), torch.zeros(cache_shape, dtype=model.dtype)
+
+
+def cached_logits(model, tokens, position_ids, kv_cache, prompt=False):
+    """
+    [batch, seq, vocab] logits of `tokens` at `position_ids` [batch, seq], writing their keys and values in
+    `kv_cache`. The tokens attend to all the tokens of the cache before them, or only to each other for a prompt.
+    """
+    past_keys, past_values = kv_cache
+    max_len = past_keys.size(-2)
+    slots = kv_cache_slots(position_ids, max_len)
+    past_key_values = [(past_keys[index], past_values[index], slots) for index in range(model.config.n_layer)]
+    hidden_states = model(
+        tokens,
+        attention_mask=None if prompt else kv_cache_mask(position_ids[:, -1:], max_len),
+        position_ids=position_ids,
+        past_key_values=past_key_values,
+        return_dict=False,
+    )
+    return torch.matmul(hidden_states[0], model.wte.weight.T)
+
+
+def speculative_generate(target, draft, context, position_ids, output_len, gamma=4, topk=1):
+    """
+    Generates `output_len` tokens after each prompt with the `target` GPT2Model, with the tokens proposed by
+    the smaller `draft` GPT2Model. Both models use `GPT2AttentionKVCache` and the same vocabulary.
+
+    :param context: [batch, input_len] prompts, padded on the right.
+    :param position_ids: [batch, 1] position of the last token of each prompt.
+    :param gamma: Number of tokens proposed by the draft model for each call of the target model.
+    :param topk: The tokens are sampled from the softmax of the topk largest logits, topk=1 is greedy.
+    Returns the [batch, output_len] generated tokens and a dictionary of statistics.
+
+    At each step the draft model proposes `gamma` tokens one by one, and the target model computes the
+    probabilities of all of them in a single call. A proposed token d is accepted with probability
+    min(1, p(d) / q(d)), where p and q are the target and draft probabilities. At the first rejection the
+    next token is sampled from max(0, p - q) normalised, and if all the tokens are accepted from the target
+    probabilities after the last one. The tokens are then distributed as if sampled from the target model
+    alone, and are the greedy tokens of the target model for topk=1.
+
+    The keys and values of each token are written at the slot of its position, so rejecting tokens rolls the
+    caches back by moving the position of each row only: the slots of the rejected tokens are masked out and
+    overwritten by the next step. The rows accept different numbers of tokens and move independently.
+    """
+    batch_size, input_len = context.shape
+    max_len = input_len + output_len + gamma
+    target_cache = empty_kv_cache(target, batch_size, max_len)
+    draft_cache = empty_kv_cache(draft, batch_size, max_len)
+    rows = torch.arange(batch_size)
+    offsets = torch.arange(gamma + 1).unsqueeze(0)
+
+    prompt_position_ids = torch.arange(0, input_len, dtype=torch.long).unsqueeze(0).expand(batch_size, -1)
+    logits = cached_logits(target, context, prompt_position_ids, target_cache, prompt=True)
+    cached_logits(draft, context, prompt_position_ids, draft_cache, prompt=True)
+    last = sample(top_k_probs(logits[rows, position_ids[:, 0]], topk))
+    # the last token is not in the caches yet, the token before it is in both
+    prev = torch.gather(context, 1, position_ids)
+    position_ids = position_ids + 1
+
+    # the last column collects the writes of the tokens which are not kept
+    record = torch.zeros(batch_size, output_len + gamma + 1, dtype=torch.int64)
+    record[:, :1] = last
+    length = torch.ones(batch_size, 1, dtype=torch.int64)
+    stats = {"target_calls": 1, "draft_calls": 1, "proposed": 0, "accepted": 0, "row_target_calls": batch_size}
+
+    while bool((length < output_len).any()):
+        active = length < output_len
+
+        # the draft model proposes gamma tokens, first catching up with the token before the last one, which
+        # is not in its cache if all the proposed tokens were accepted at the previous step
+        tokens, draft_position_ids = torch.cat((prev, last), dim=-1), position_ids + torch.tensor([[-1, 0]])
+        proposed, draft_probs = [], []
+        for _ in range(gamma):
+            probs = top_k_probs(cached_logits(draft, tokens, draft_position_ids, draft_cache)[:, -1], topk)
+            tokens, draft_position_ids = sample(probs), draft_position_ids[:, -1:] + 1
+            proposed.append(tokens)
+            draft_probs.append(probs)
+        proposed, draft_probs = torch.cat(proposed, dim=-1), torch.stack(draft_probs, dim=1)
+
+        # the target model scores the last token and the proposed ones in one call
+        tokens, target_position_ids = torch.cat((last, proposed), dim=-1), position_ids + offsets
+        target_probs = top_k_probs(cached_logits(target, tokens, target_position_ids, target_cache), topk)
+
+        p = torch.gather(target_probs[:, :-1], -1, proposed.unsqueeze(-1)).squeeze(-1)
+        q = torch.gather(draft_probs, -1, proposed.unsqueeze(-1)).squeeze(-1)
+        accepted = torch.rand(p.shape, dtype=p.dtype) * q < p
+        num_accepted = torch.cumprod(accepted.to(torch.int64), dim=-1).sum(-1, keepdim=True)
+        residual_probs = torch.cat((torch.clamp(target_probs[:, :-1] - draft_probs, min=0), target_probs[:, -1:]), 1)
+        next_token = sample(residual_probs[rows, num_accepted[:, 0]])
+
+        # keep the accepted tokens and the next one, of the rows which are not done only
+        tokens = torch.cat((proposed, proposed[:, :1]), dim=-1).scatter(1, num_accepted, next_token)
+        keep = (offsets <= num_accepted) & active
+        record.scatter_(1, torch.where(keep, length + offsets, record.size(1) - 1), tokens)
+        prev_token = torch.where(
+            num_accepted > 0, torch.gather(proposed, 1, torch.clamp(num_accepted - 1, min=0)), last
+        )
+        prev = torch.where(active, prev_token, prev)
+        last = torch.where(active, next_token, last)
+        num_tokens = torch.where(active, num_accepted + 1, 0)
+        position_ids = position_ids + num_tokens
+        length = length + num_tokens
+
+        stats["target_calls"] += 1
+        stats["draft_calls"] += gamma
+        stats["proposed"] += gamma * int(active.sum())
+        stats["accepted"] += int(num_accepted[active].sum())
+        stats["row_target_calls"] += int(active.sum())
+
+    stats["acceptance_rate"] = stats["accepted"] / max(stats["proposed"], 1)
+    stats["tokens_per_target_call"] = int(length.sum()) / stats.pop("row_target_calls")
+    return record[:, :output_len], stats
@@ -0,0 +1,78 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import time
+
+import torch
+from transformers import GPT2Model, GPT2Tokenizer
+
+from model.kv_cache import generate, use_kv_cache_attention
+from model.speculative import speculative_generate
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+
+def set_args():
+    """
+    Sets up the arguments.
+    """
+    parser = argparse.ArgumentParser(description="Speculative decoding with a draft and a target GPT2 on the host")
+    parser.add_argument("--model-name-or-path", type=str, default="gpt2-medium", help="Target model")
+    parser.add_argument("--draft-model-name-or-path", type=str, default="gpt2", help="Draft model")
+    parser.add_argument("--gamma", type=int, default=4, help="Number of tokens proposed for each target call")
+    parser.add_argument("--topk", default=1, type=int, help="Sample from the topk tokens, 1 is greedy")
+    parser.add_argument("--prompt", type=str, default="My name is", help="Prompt as input")
+    parser.add_argument("--output-len", type=int, default=64, help="Number of tokens to generate")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch size (default = 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the sampling")
+    return parser.parse_args()
+
+
+def main():
+    args = set_args()
+    target = use_kv_cache_attention(GPT2Model.from_pretrained(args.model_name_or_path).eval())
+    draft = use_kv_cache_attention(GPT2Model.from_pretrained(args.draft_model_name_or_path).eval())
+    tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+
+    text_ids = tokenizer.encode(args.prompt, add_special_tokens=False)
+    context = torch.tensor(text_ids).repeat(args.batch_size, 1)
+    position_ids = torch.full((args.batch_size, 1), len(text_ids) - 1, dtype=torch.int64)
+
+    with torch.no_grad():
+        start_time = time.time()
+        record, stats = speculative_generate(
+            target, draft, context, position_ids, args.output_len, gamma=args.gamma, topk=args.topk
+        )
+        speculative_time = time.time() - start_time
+        if args.topk == 1:
+            start_time = time.time()
+            expected = generate(target, context, position_ids, args.output_len)
+            target_time = time.time() - start_time
+            logging.info("Same tokens as the target model alone: {}".format(torch.equal(record, expected)))
+            logging.info("Speedup over the target model alone: {:.2f}x".format(target_time / speculative_time))
+
+    for row in range(args.batch_size):
+        logging.info("Output: {}".format(tokenizer.decode(text_ids + record[row].tolist())))
+    logging.info(
+        "Acceptance rate: {0:.3f}; tokens per target call: {1:.2f}; target calls: {2}; draft calls: {3}".format(
+            stats["acceptance_rate"], stats["tokens_per_target_call"], stats["target_calls"], stats["draft_calls"]
+        )
+    )
+    logging.info("Throughput: {:.1f} tokens/sec".format(args.batch_size * args.output_len / speculative_time))
+
+
+if __name__ == "__main__":
+    main()
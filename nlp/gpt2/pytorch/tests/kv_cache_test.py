@@ -0,0 +1,75 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+from transformers import GPT2LMHeadModel
+
+import import_helper
+from benchmark_kv_cache import GPT2AttentionShiftedCache, random_gpt2, shifted_cache_generate
+from model.kv_cache import GPT2AttentionKVCache, generate, kv_cache_mask, kv_cache_slots
+
+# a large initializer range, so that the random model does not repeat the same token
+config = dict(n_layer=2, n_embd=64, n_head=4, vocab_size=256, n_positions=128, initializer_range=0.5)
+
+
+def test_kv_cache_mask():
+    position_ids = torch.tensor([[0], [2], [4], [5], [11]])
+    expected = torch.tensor(
+        [[1, 0, 0, 0, 0], [1, 1, 1, 0, 0], [1, 1, 1, 1, 1], [1, 1, 1, 1, 1], [1, 1, 1, 1, 1]], dtype=torch.int64
+    )
+    assert torch.equal(kv_cache_mask(position_ids, 5), expected)
+    assert torch.equal(kv_cache_slots(position_ids, 5), torch.tensor([[0], [2], [4], [0], [1]]))
+
+
+@pytest.mark.parametrize("prompt_len, input_len, output_len", [(7, 16, 20), (1, 8, 5), (16, 16, 12)])
+def test_kv_cache_cmp_shifted_cache(prompt_len, input_len, output_len):
+    model = random_gpt2(GPT2AttentionKVCache, **config)
+    shifted_model = random_gpt2(GPT2AttentionShiftedCache, **config)
+    torch.manual_seed(1)
+    context = torch.zeros(3, input_len, dtype=torch.int64)
+    context[:, :prompt_len] = torch.randint(0, config["vocab_size"], (prompt_len,))
+    position_ids = torch.full((3, 1), prompt_len - 1, dtype=torch.int64)
+    dynamic_mask = torch.zeros(3, input_len + output_len, dtype=torch.int64)
+    dynamic_mask[:, : prompt_len + 1] = 1
+
+    with torch.no_grad():
+        expected = shifted_cache_generate(shifted_model, context, dynamic_mask, position_ids, output_len)
+        output = generate(model, context, position_ids, output_len)
+    assert len(set(output[0].tolist())) > 1
+    assert torch.equal(output, expected)
+
+
+def test_kv_cache_variable_prompt_lengths():
+    model = random_gpt2(GPT2AttentionKVCache, **config)
+    torch.manual_seed(0)
+    reference = GPT2LMHeadModel(model.config)
+    reference.transformer.load_state_dict(model.state_dict())
+    reference.tie_weights()
+    reference.eval()
+
+    torch.manual_seed(1)
+    prompt_lens, input_len, output_len = [3, 10, 6], 12, 9
+    context = torch.zeros(len(prompt_lens), input_len, dtype=torch.int64)
+    for row, prompt_len in enumerate(prompt_lens):
+        context[row, :prompt_len] = torch.randint(0, config["vocab_size"], (prompt_len,))
+    position_ids = torch.tensor(prompt_lens).unsqueeze(-1) - 1
+
+    with torch.no_grad():
+        output = generate(model, context, position_ids, output_len)
+        for row, prompt_len in enumerate(prompt_lens):
+            expected = reference.generate(
+                context[row : row + 1, :prompt_len], max_new_tokens=output_len, do_sample=False, pad_token_id=0
+            )
+            assert torch.equal(output[row], expected[0, prompt_len:])
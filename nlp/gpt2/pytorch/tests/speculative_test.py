@@ -0,0 +1,94 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import math
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2Model
+
+import import_helper
+from model.kv_cache import generate, use_kv_cache_attention
+from model.speculative import speculative_generate, top_k_probs
+
+
+def random_gpt2(seed, vocab_size, n_layer, n_embd):
+    torch.manual_seed(seed)
+    # a large initializer range, so that the random model does not repeat the same token
+    config = GPT2Config(
+        n_layer=n_layer, n_embd=n_embd, n_head=4, vocab_size=vocab_size, n_positions=64, initializer_range=0.5
+    )
+    return use_kv_cache_attention(GPT2Model(config).eval())
+
+
+def random_prompts(prompt_lens, input_len, vocab_size):
+    context = torch.zeros(len(prompt_lens), input_len, dtype=torch.int64)
+    for row, prompt_len in enumerate(prompt_lens):
+        context[row, :prompt_len] = torch.randint(0, vocab_size, (prompt_len,))
+    return context, torch.tensor(prompt_lens).unsqueeze(-1) - 1
+
+
+@pytest.mark.parametrize("gamma", [1, 3, 6])
+def test_speculative_greedy_cmp_target(gamma):
+    target = random_gpt2(0, vocab_size=64, n_layer=3, n_embd=64)
+    draft = random_gpt2(1, vocab_size=64, n_layer=1, n_embd=32)
+    torch.manual_seed(2)
+    context, position_ids = random_prompts([5, 12, 1, 8], 12, 64)
+
+    with torch.no_grad():
+        expected = generate(target, context, position_ids, 20)
+        output, stats = speculative_generate(target, draft, context, position_ids, 20, gamma=gamma)
+        assert torch.equal(output, expected)
+        assert 0 < stats["acceptance_rate"] < 1
+
+        # a draft model proposing the tokens of the target model
+        output, stats = speculative_generate(target, target, context, position_ids, 20, gamma=gamma)
+        assert torch.equal(output, expected)
+        assert stats["acceptance_rate"] == 1
+        # the prompt call generates one token, each next call gamma + 1 tokens
+        num_calls = 1 + math.ceil(19 / (gamma + 1))
+        assert stats["target_calls"] == num_calls
+        assert stats["tokens_per_target_call"] == (1 + (num_calls - 1) * (gamma + 1)) / num_calls
+
+
+def sequence_probs(model, prompt, output_len, topk):
+    """Exact probabilities of all the sequences of `output_len` tokens after the prompt"""
+    sequences = torch.tensor(list(itertools.product(range(model.config.vocab_size), repeat=output_len)))
+    tokens = torch.cat((prompt.expand(len(sequences), -1), sequences), dim=-1)
+    logits = torch.matmul(model(tokens, return_dict=False)[0], model.wte.weight.T)
+    probs = top_k_probs(logits[:, len(prompt) - 1 : -1], topk)
+    return torch.gather(probs, -1, sequences.unsqueeze(-1)).squeeze(-1).prod(-1)
+
+
+def test_speculative_sampling_distribution():
+    vocab_size, output_len, topk, num_samples = 6, 3, 3, 8000
+    target = random_gpt2(0, vocab_size=vocab_size, n_layer=2, n_embd=32)
+    draft = random_gpt2(1, vocab_size=vocab_size, n_layer=1, n_embd=32)
+    prompt = torch.tensor([1, 4, 2, 0])
+    context = prompt.expand(num_samples, -1)
+    position_ids = torch.full((num_samples, 1), len(prompt) - 1)
+
+    with torch.no_grad():
+        target_probs = sequence_probs(target, prompt, output_len, topk)
+        draft_probs = sequence_probs(draft, prompt, output_len, topk)
+        torch.manual_seed(3)
+        output, stats = speculative_generate(target, draft, context, position_ids, output_len, gamma=2, topk=topk)
+
+    sequences = (output * vocab_size ** torch.arange(output_len - 1, -1, -1)).sum(-1)
+    sample_probs = torch.bincount(sequences, minlength=len(target_probs)) / num_samples
+    # the draft model alone is far from the target distribution, the speculative samples are not
+    assert 0.5 * torch.abs(draft_probs - target_probs).sum() > 0.2
+    assert 0.5 * torch.abs(sample_probs - target_probs).sum() < 0.04
+    assert 0 < stats["acceptance_rate"] < 1
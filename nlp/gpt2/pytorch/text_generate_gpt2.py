@@ -29,7 +29,8 @@ from transformers.models.gpt2.modeling_gpt2 import GPT2MLP
 
 from ipu_options import load_custom_ops
 from tools import _get_layer_ipu, str_to_bool
-from model.optimized_gpt2_attn import OptimizedGPT2AttentionBuffer, OptimizedGPT2AttentionCache
+from model.kv_cache import generate
+from model.optimized_gpt2_attn import OptimizedGPT2AttentionBuffer, OptimizedGPT2AttentionKVCache
 
 MODEL_CONFIG = {
     "gpt2": "config/config.json",
@@ -116,7 +117,7 @@ class GPT2Wrapper(torch.nn.Module):
         )
         for layer in self.model.h:
             if self.args.poptorch_loop:
-                GPT2Attn = OptimizedGPT2AttentionCache(self.model.config)
+                GPT2Attn = OptimizedGPT2AttentionKVCache(self.model.config)
             else:
                 GPT2Attn = OptimizedGPT2AttentionBuffer(self.model.config)
             MLP = GPT2MLP(inner_dim, self.model.config)
@@ -127,89 +128,10 @@ class GPT2Wrapper(torch.nn.Module):
 
     def forward(self, context, dynamic_mask, position_ids):
         if self.args.poptorch_loop:
-            # 1 stage
-            kv_size = (
-                self.model.config.batch,
-                self.model.config.n_head,
-                self.model.config.seq,
-                int(self.model.config.n_embd / self.model.config.n_head),
+            # The keys and values are written in place into a preallocated cache
+            return generate(
+                self.model, context, position_ids, self.count, topk=self.args.topk, for_loop=poptorch.for_loop
             )
-            # past key value
-            past_key_values = [[torch.zeros(kv_size), torch.zeros(kv_size)] for _ in range(self.model.config.n_layer)]
-            new_past_keys = []
-            new_past_values = []
-            position_ids_stage_1 = torch.arange(0, self.args.input_len, dtype=torch.long).unsqueeze(0)
-            hidden_states = self.model(
-                context, position_ids=position_ids_stage_1, past_key_values=None, return_dict=False
-            )
-
-            presents = hidden_states[1]
-            for ((past_key, past_value), (present_key, present_value)) in zip(past_key_values, presents):
-                past_key = torch.cat((present_key, past_key[:, :, : -self.model.config.input_len, :]), dim=-2)
-                past_value = torch.cat((present_value, past_value[:, :, : -self.model.config.input_len, :]), dim=-2)
-                new_past_keys.append(past_key)
-                new_past_values.append(past_value)
-            new_past_keys_tensor = torch.stack(new_past_keys, dim=0)
-            new_past_values_tensor = torch.stack(new_past_values, dim=0)
-
-            index_one_hot = torch.nn.functional.one_hot(position_ids, num_classes=self.args.input_len).to(torch.float)
-            last_hidden = torch.matmul(index_one_hot, hidden_states[0]).view(self.args.batch_size, -1)
-            next_token_logits = torch.matmul(last_hidden, self.model.wte.weight.T)
-            (next_token_value, next_token) = torch.topk(next_token_logits, 1)
-            new_context = next_token
-            new_position_ids = position_ids + 1
-            record = torch.ones(self.args.batch_size, self.count).to(torch.int64) * (0)
-            new_record = torch.cat((next_token.to(torch.int64), record[:, :-1]), dim=-1)
-            # 2 stage
-
-            def body(context, dynamic_mask, position_ids, record, past_keys, past_values):
-                past_key_values = []
-                for index in range(self.model.config.n_layer):
-                    key_ = past_keys[index, :, :, :, :]
-                    value_ = past_values[index, :, :, :, :]
-                    past_key_values.append([key_, value_])
-                hidden_states = self.model(
-                    context,
-                    attention_mask=dynamic_mask,
-                    position_ids=position_ids,
-                    past_key_values=past_key_values,
-                    return_dict=False,
-                )
-                presents = hidden_states[1]
-                present_keys = torch.stack([k for (k, v) in presents], dim=0)
-                present_values = torch.stack([v for (k, v) in presents], dim=0)
-
-                next_token_logits = torch.matmul(hidden_states[0], self.model.wte.weight.T).view(
-                    self.args.batch_size, -1
-                )
-                (next_token_value, next_token) = torch.topk(next_token_logits, self.args.topk)
-                # We simply do a random selection after topk to avoid repetitions
-                # Notice: Here we use 'argmax' + 'randn' instead of 'randint' which is unsupported.
-                random_choice_idx = torch.argmax(torch.randn((1, self.args.topk)), axis=1)
-                next_token = next_token[:, random_choice_idx]
-
-                next_dynamic_mask = torch.cat(
-                    (torch.ones(self.args.batch_size, 1).to(torch.int64), dynamic_mask[:, :-1]), dim=-1
-                )
-                next_id = next_token
-                next_position_ids = position_ids + 1
-                next_record = torch.cat((next_token.to(torch.int64), record[:, :-1]), dim=-1)
-
-                return next_id, next_dynamic_mask, next_position_ids, next_record, present_keys, present_values
-
-            (
-                new_context,
-                dynamic_mask,
-                new_position_ids,
-                new_record,
-                new_past_keys_tensor,
-                new_past_values_tensor,
-            ) = poptorch.for_loop(
-                self.count - 1,
-                body,
-                [new_context, dynamic_mask, new_position_ids, new_record, new_past_keys_tensor, new_past_values_tensor],
-            )
-            return new_record
         else:
             hidden_states = self.model(
                 context, attention_mask=dynamic_mask, position_ids=position_ids, past_key_values=None, return_dict=False
@@ -322,7 +244,7 @@ def main():
                 record = model(input_ids_all_pad, dynamic_mask, position_ids)
                 end_time = time.time()
                 model_time.append(end_time - start_time)
-                output_tokens = torch.flip(record, dims=[1]).to(torch.int64)
+                output_tokens = record.to(torch.int64)
                 all_ids = torch.concat(
                     [input_ids_all.view(args.batch_size, -1).to(torch.int64), output_tokens], axis=-1
                 )
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import time
+
+import torch
+from transformers.models.gptj import GPTJConfig as HFConfig
+from transformers.models.gptj.modeling_gptj import GPTJForCausalLM
+
+from utils.inference import batch_inference, batch_score, causal_lm_logprobs, causal_lm_next_token
+
+
+def tiny_gptj(
+    vocab_size: int, hidden_size: int, layers: int, heads: int, sequence_length: int, eos_token_id: int
+) -> GPTJForCausalLM:
+    config = HFConfig(
+        vocab_size=vocab_size,
+        n_positions=sequence_length,
+        n_embd=hidden_size,
+        n_layer=layers,
+        n_head=heads,
+        rotary_dim=hidden_size // heads // 2,
+        tie_word_embeddings=False,
+        bos_token_id=eos_token_id,
+        eos_token_id=eos_token_id,
+    )
+    return GPTJForCausalLM(config).eval()
+
+
+def generative_predictions(answers, candidates):
+    """Index of the candidate the generated tokens start with, -1 if none (like `postprocess_mnli_predictions`)"""
+    predictions = []
+    for answer in answers:
+        answer = answer.tolist()
+        matches = [i for i, candidate in enumerate(candidates) if answer[: len(candidate)] == candidate]
+        predictions.append(max(matches, key=lambda i: len(candidates[i])) if matches else -1)
+    return predictions
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the scoring MNLI evaluation with the generative one on a tiny random GPT-J on the CPU"
+    )
+    parser.add_argument("--examples", type=int, default=256, help="Number of synthetic prompts")
+    parser.add_argument("--prompt-length", type=int, nargs=2, default=[40, 90], help="Range of the prompt lengths")
+    parser.add_argument(
+        "--candidates",
+        type=str,
+        nargs="+",
+        default=["11", "12", "13"],
+        help="Token ids of the candidate continuations, e.g. '11 14' for a two token candidate",
+    )
+    parser.add_argument(
+        "--label-bias",
+        type=float,
+        default=8.0,
+        help="Bias of the LM head towards the candidate tokens, so that the random model answers with a label",
+    )
+    parser.add_argument(
+        "--output-length",
+        type=int,
+        default=5,
+        help="Maximum number of tokens generated by the generative path, as the default `inference.output_length`",
+    )
+    parser.add_argument("--micro-batch-size", type=int, default=8)
+    parser.add_argument("--vocab-size", type=int, default=1024)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--heads", type=int, default=8)
+    parser.add_argument("--eos-token-id", type=int, default=0)
+    parser.add_argument("--pad-token-id", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    torch.manual_seed(0)
+    candidates = [[int(token) for token in candidate.split()] for candidate in args.candidates]
+    sequence_length = args.prompt_length[1] + max(args.output_length, max(len(candidate) for candidate in candidates))
+    model = tiny_gptj(args.vocab_size, args.hidden_size, args.layers, args.heads, sequence_length, args.eos_token_id)
+    with torch.no_grad():
+        # stands in for the fine-tuning, which makes the model answer with one of the labels
+        model.lm_head.bias[sorted({token for candidate in candidates for token in candidate})] += args.label_bias
+
+    low = args.pad_token_id + 1
+    prompts = [
+        torch.randint(low, args.vocab_size, (int(torch.randint(*args.prompt_length, ())),))
+        for _ in range(args.examples)
+    ]
+
+    start = time.perf_counter()
+    answers = batch_inference(
+        iter(prompts),
+        causal_lm_next_token(model),
+        sequence_length,
+        eos_token_id=args.eos_token_id,
+        pad_token_id=args.pad_token_id,
+        output_length=args.output_length,
+        micro_batch_size=args.micro_batch_size,
+    )
+    generative_time = time.perf_counter() - start
+    generated = generative_predictions(answers, candidates)
+
+    start = time.perf_counter()
+    scores = batch_score(
+        prompts,
+        candidates,
+        causal_lm_logprobs(model),
+        sequence_length,
+        pad_token_id=args.pad_token_id,
+        micro_batch_size=args.micro_batch_size,
+    )
+    scoring_time = time.perf_counter() - start
+    scored = scores.argmax(dim=1).tolist()
+
+    agreement = sum(g == s for g, s in zip(generated, scored)) / len(prompts)
+    unknown = sum(g == -1 for g in generated) / len(prompts)
+    print(f"generative: {len(prompts) / generative_time:0.1f} examples/sec, {100 * unknown:0.1f}% without a label")
+    print(f"scoring:    {len(prompts) / scoring_time:0.1f} examples/sec")
+    labelled = [(g, s) for g, s in zip(generated, scored) if g != -1]
+    labelled_agreement = sum(g == s for g, s in labelled) / max(len(labelled), 1)
+    print(
+        f"speedup {generative_time / scoring_time:0.2f}x, agreement {100 * agreement:0.1f}%, "
+        f"{100 * labelled_agreement:0.1f}% on the examples answered with a label"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -169,6 +169,9 @@ class Inference(Config):
     output_length: int = 5
     """Number of tokens to generate"""
 
+    scoring: bool = flag(False)
+    """Classify by scoring the label continuations with a single forward pass instead of generating an answer"""
+
 
 @dataclass
 class GPTJConfig(Config):
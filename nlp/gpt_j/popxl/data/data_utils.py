@@ -4,7 +4,8 @@ import torch
 import popdist
 import numpy as np
 from torch.utils.data import Dataset, DistributedSampler, DataLoader, RandomSampler
-from typing import Iterator, Optional, Sized, Dict
+from typing import Iterator, Optional, Sized, Dict, Union
+from collections import deque
 import math
 import os
 
@@ -27,6 +28,67 @@ class WorkerInit:
         np.random.seed((self.seed + worker_id) % np.iinfo(np.uint32).max)
 
 
+class IndexPermutation:
+    """Seeded pseudo random permutation of [0, size), computed index by index without materialising it.
+
+    A balanced Feistel network is a bijection of [0, 4**half_bits) for any round function; indices that land
+    outside of [0, size) are mapped again until they land inside (cycle walking), which keeps it a bijection of
+    [0, size). Since 4**half_bits < 4 * size, an index needs less than 4 walks on average.
+    """
+
+    rounds = 4
+
+    def __init__(self, size: int, seed: int = 0):
+        self.size = size
+        self.half_bits = max((size - 1).bit_length() + 1, 2) // 2
+        self.mask = np.uint64((1 << self.half_bits) - 1)
+        self.keys = np.random.SeedSequence(seed).generate_state(self.rounds, dtype=np.uint64)
+
+    def _round(self, right: np.ndarray, key: np.uint64) -> np.ndarray:
+        # splitmix64 finalizer, the uint64 arithmetic wraps around
+        x = (right ^ key) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (x ^ (x >> np.uint64(31))) & self.mask
+
+    def _feistel(self, x: np.ndarray) -> np.ndarray:
+        half_bits = np.uint64(self.half_bits)
+        left, right = x >> half_bits, x & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << half_bits) | right
+
+    def __call__(self, positions: Union[np.ndarray, range]) -> np.ndarray:
+        """Indices at `positions` of the permutation, as an int64 array"""
+        x = self._feistel(np.asarray(positions, dtype=np.uint64))
+        outside = np.flatnonzero(x >= self.size)
+        while outside.size > 0:
+            x[outside] = self._feistel(x[outside])
+            outside = outside[x[outside] >= self.size]
+        return x.astype(np.int64)
+
+    def __getitem__(self, position: int) -> int:
+        if not 0 <= position < self.size:
+            raise IndexError(f"Position {position} out of range for a permutation of size {self.size}")
+        return int(self(np.array([position]))[0])
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def permuted_indices(
+    size: int, positions: range, seed: int, shuffle: bool = True, chunk_size: int = 65536
+) -> Iterator[int]:
+    """Indices at `positions` of a seeded permutation of [0, size), positions past the end wrap around.
+    Only `chunk_size` indices are computed at a time."""
+    permutation = IndexPermutation(size, seed) if shuffle else None
+    for start in range(0, len(positions), chunk_size):
+        chunk_positions = positions[start : start + chunk_size]
+        chunk = np.arange(chunk_positions.start, chunk_positions.stop, chunk_positions.step, dtype=np.int64)
+        chunk %= size
+        yield from (permutation(chunk) if shuffle else chunk).tolist()
+
+
 class DistributedSampler(torch.utils.data.DistributedSampler):
     def __init__(
         self,
@@ -78,32 +140,14 @@ class DistributedSampler(torch.utils.data.DistributedSampler):
         self.shuffle = shuffle
 
     def __iter__(self) -> Iterator:
-        if self.shuffle:
-            # deterministically shuffle based on epoch and seed
-            g = torch.Generator()
-            g.manual_seed(self.seed + self.epoch)
-            indices = torch.randperm(len(self.dataset), generator=g).tolist()  # type: ignore[arg-type]
-        else:
-            indices = list(range(len(self.dataset)))  # type: ignore[arg-type]
-
-        if not self.drop_last:
-            # add extra samples to make it evenly divisible
-            padding_size = self.total_size - len(indices)
-            if padding_size <= len(indices):
-                indices += indices[:padding_size]
-            else:
-                indices += (indices * math.ceil(padding_size / len(indices)))[:padding_size]
-        else:
-            # remove tail of data to make it evenly divisible.
-            indices = indices[: self.total_size]
-        assert len(indices) == self.total_size
-
-        # subsample
-        indices = indices[self.rank : self.total_size : self.num_replicas]
-        indices = indices[self.start_index :]
-        assert len(indices) == self.num_samples - self.start_index
-
-        return iter(indices)
+        # deterministically shuffle based on epoch and seed. The replica takes every `num_replicas` position of the
+        # permutation from `rank`, with the positions past the end of the dataset wrapping around to make the
+        # dataset evenly divisible. The skipped positions and the other replicas' positions are never computed.
+        positions = range(
+            self.rank + self.start_index * self.num_replicas, self.total_size, self.num_replicas
+        )  # type: ignore[arg-type]
+        assert len(positions) == self.num_samples - self.start_index
+        return permuted_indices(len(self.dataset), positions, self.seed + self.epoch, self.shuffle)
 
     def get_state(self) -> Dict:
         return {"start_index": self.start_index, "seed": self.seed, "epoch": self.epoch}
@@ -136,9 +180,8 @@ class StatefulRandomSampler(torch.utils.data.RandomSampler):
         return len(self.data_source)
 
     def __iter__(self) -> Iterator[int]:
-        generator = torch.Generator()
-        generator.manual_seed(self.seed + self.epoch)
-        yield from torch.randperm(self.num_samples, generator=generator).tolist()[self.start_index :]
+        # the permutation is computed on demand, resuming from `start_index` costs nothing
+        yield from permuted_indices(self.num_samples, range(self.start_index, self.num_samples), self.seed + self.epoch)
 
     def get_state(self) -> Dict:
         return {"start_index": self.start_index, "seed": self.seed, "epoch": self.epoch}
@@ -152,6 +195,40 @@ class StatefulRandomSampler(torch.utils.data.RandomSampler):
         self.epoch = epoch
 
 
+class DispatchRecord:
+    """Sizes of the batches of sampler indices dispatched to the workers, in order.
+
+    With `num_workers > 0` the dataloader dispatches up to `prefetch_factor` batches per worker ahead of the batches
+    it returns, so the position of the sampler is ahead of the training. The batches are returned in the order they
+    were dispatched, so the number of sampler indices consumed by the training is the sum of the sizes of the first
+    batches returned. Only the sizes of the batches in flight are kept.
+    """
+
+    def __init__(self, index_sampler):
+        self.index_sampler = index_sampler
+        self.sizes = deque()
+        self.returned_batches = 0
+        self.returned_samples = 0
+
+    def __iter__(self):
+        self.sizes.clear()
+        self.returned_batches = 0
+        self.returned_samples = 0
+        for indices in self.index_sampler:
+            self.sizes.append(len(indices) if isinstance(indices, (list, tuple)) else 1)
+            yield indices
+
+    def __len__(self):
+        return len(self.index_sampler)
+
+    def samples_returned(self, num_batches: int) -> int:
+        """Number of sampler indices in the first `num_batches` batches dispatched this epoch"""
+        while self.returned_batches < num_batches:
+            self.returned_samples += self.sizes.popleft()
+            self.returned_batches += 1
+        return self.returned_samples
+
+
 class StatefulDataLoader(DataLoader):
     r"""DataLoader which keeps track of its own state and can be saved and resumed.
     Combines a dataset and a random sampler, and provides an iterable over
@@ -178,11 +255,19 @@ class StatefulDataLoader(DataLoader):
 
         DataLoader.__init__(self, dataset=dataset, sampler=sampler, *args, **kwargs)
         self.epochs = 0
+        self._dispatch_record = None
+
+    @property
+    def _index_sampler(self):
+        # record the size of each batch, the last batch or a custom batch sampler may not have `batch_size` indices
+        if getattr(self, "_dispatch_record", None) is None:
+            self._dispatch_record = DispatchRecord(super()._index_sampler)
+        return self._dispatch_record
 
     @property
     def last_index(self):
         if self._iterator:
-            return self.sampler.start_index + self._iterator._num_yielded * self.batch_size
+            return self.sampler.start_index + self._dispatch_record.samples_returned(self._iterator._num_yielded)
         else:
             return self.sampler.start_index
 
@@ -8,11 +8,13 @@ from datasets import load_dataset
 from transformers import AutoTokenizer
 from .hf_data_utils import group_texts
 
+MNLI_CLASS_LABELS = ["entailment", "neutral", "contradiction"]
+
 
 def form_training_prompts(example):
     hypothesis = example["hypothesis"]
     premise = example["premise"]
-    class_label = ["entailment", "neutral", "contradiction"][example["label"]]
+    class_label = MNLI_CLASS_LABELS[example["label"]]
 
     example["text"] = f"mnli hypothesis: {hypothesis} premise: {premise} target: {class_label}<|endoftext|>"
     return example
@@ -27,11 +29,13 @@ def form_validation_prompts(example):
 
 
 def prepare_validation_features(dataset, tokenizer):
-    tokenized_examples = []
-    for example in dataset["text"]:
-        tokenized_example = tokenizer.encode(example, return_tensors="pt").squeeze()
-        tokenized_examples.append(tokenized_example)
-    return {"input_ids": tokenized_examples, "label": dataset["label"]}
+    tokenized_examples = tokenizer(dataset["text"], return_attention_mask=False)
+    return {"input_ids": tokenized_examples["input_ids"], "label": dataset["label"]}
+
+
+def mnli_label_continuations(tokenizer):
+    """Token ids of the label continuation of a validation prompt, for each class in the order of the label ids."""
+    return [tokenizer.encode(f" {class_label}") for class_label in MNLI_CLASS_LABELS]
 
 
 def extract_class_label(s: str) -> str:
@@ -40,8 +44,7 @@ def extract_class_label(s: str) -> str:
     s = s.strip()
     # no need if decoded using skip special tokens
     s = s.replace("<|endoftext|>", "")
-    class_labels = ["entailment", "neutral", "contradiction"]
-    if s in class_labels:
+    if s in MNLI_CLASS_LABELS:
         return s
     else:
         return "unknown"
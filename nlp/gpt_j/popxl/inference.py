@@ -21,13 +21,15 @@ from popxl_addons.task_session import TaskSession
 from config import CONFIG_DIR, GPTJConfig
 from modelling.embedding import GPTJEmbeddingsTP
 from modelling.decoder import GPTJDecoderBlockTP
-from modelling.gptj_lm import GPTJLMHeadTP, generate_greedy_tp
+from modelling.gptj_lm import GPTJLMHeadTP, generate_greedy_tp, next_token_logprobs_tp
 from utils.setup import gptj_config_setup
 
 __all__ = ["inference"]
 
 
-def inference(config: GPTJConfig) -> TaskSession:
+def inference(config: GPTJConfig, score_positions: int = 0) -> TaskSession:
+    """Greedy next token session, or if `score_positions` > 0 a session returning the next token log-probabilities
+    at `score_positions` positions of each sequence, see `utils.inference.batch_score`."""
     assert config.model.eval, "Eval mode must be True"
     assert config.execution.data_parallel == 1, "You can't use DP for inference"
     replicas = config.execution.tensor_parallel
@@ -44,10 +46,20 @@ def inference(config: GPTJConfig) -> TaskSession:
             # -----  Define input and output streams -----
             shard_size = ceil(config.model.embedding.vocab_size / config.execution.tensor_parallel)
             input_shape = (config.execution.micro_batch_size * config.model.sequence_length,)
-            input_streams = addons.InputStreams(
-                words=(input_shape, popxl.int32), last_token_indices=((config.execution.micro_batch_size,), popxl.int32)
-            )
-            output_streams = addons.OutputStreams(next_token=((config.execution.micro_batch_size,), popxl.int32))
+            if score_positions > 0:
+                scores_shape = (config.execution.micro_batch_size, score_positions)
+                input_streams = addons.InputStreams(
+                    words=(input_shape, popxl.int32), score_positions=(scores_shape, popxl.int32)
+                )
+                output_streams = addons.OutputStreams(
+                    logprobs=((*scores_shape, config.model.embedding.vocab_size), popxl.float32)
+                )
+            else:
+                input_streams = addons.InputStreams(
+                    words=(input_shape, popxl.int32),
+                    last_token_indices=((config.execution.micro_batch_size,), popxl.int32),
+                )
+                output_streams = addons.OutputStreams(next_token=((config.execution.micro_batch_size,), popxl.int32))
 
             # ----- Build compute graphs -----
 
@@ -86,7 +98,10 @@ def inference(config: GPTJConfig) -> TaskSession:
             # ---- Execute ----
             with popxl.in_sequence():
                 word = ops.host_load(input_streams.words)
-                last_token_indices = ops.host_load(input_streams.last_token_indices)
+                if score_positions > 0:
+                    token_indices = ops.host_load(input_streams.score_positions)
+                else:
+                    last_token_indices = ops.host_load(input_streams.last_token_indices)
                 # Embeddings
                 load_graph, names = load_remote_graph(embeddings_buffers)
                 embedding_vars = NamedTensors.pack(names, load_graph.call(0))
@@ -109,8 +124,12 @@ def inference(config: GPTJConfig) -> TaskSession:
                 load_graph, names = load_remote_graph(lm_buffers)
                 squad_vars = NamedTensors.pack(names, load_graph.call(0))
                 (logits,) = lm_graph.bind(squad_vars).call(x)
-                next_token_id = generate_greedy_tp(config, logits, last_token_indices)
-                ops.host_store(output_streams.next_token, next_token_id.reshape_(output_streams.next_token.shape))
+                if score_positions > 0:
+                    logprobs = next_token_logprobs_tp(config, logits, token_indices)
+                    ops.host_store(output_streams.logprobs, logprobs)
+                else:
+                    next_token_id = generate_greedy_tp(config, logits, last_token_indices)
+                    ops.host_store(output_streams.next_token, next_token_id.reshape_(output_streams.next_token.shape))
 
         # Run `OpToIdentityPattern` among others part of `PreAliasPatterns`
         apply_pre_alias_patterns(ir, level="default")
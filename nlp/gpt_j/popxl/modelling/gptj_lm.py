@@ -59,6 +59,36 @@ def generate_greedy_tp(config: GPTJConfig, logits: popxl.Tensor, last_token_inde
     return ops.argmax(next_token_logits, dim=1)
 
 
+def next_token_logprobs_tp(config: GPTJConfig, logits: popxl.Tensor, token_indices: popxl.Tensor):
+    """
+    Next token log-probabilities at some positions of each sequence, to score continuations without generating them.
+    Args:
+        logits (popxl.Tensor, int32): Sharded logits for the whole sequence. Shape (seq_len, vocab_shard_size)
+        token_indices (popxl.Tensor, int32): Positions in each sequence of the tokens predicting the next token.
+                                             It should be of shape (micro_batch_size, n_positions).
+    Returns:
+        (popxl.Tensor, float32): log-probabilities, of shape (micro_batch_size, n_positions, vocab_size)
+    """
+    tp = config.execution.tensor_parallel
+    micro_batch_size, n_positions = token_indices.shape
+    offsetted_batch_indices = popxl.constant(
+        np.arange(0, micro_batch_size).reshape(-1, 1) * config.model.sequence_length, dtype=popxl.int32
+    )
+    offsetted_indices = (token_indices + offsetted_batch_indices).reshape_((micro_batch_size * n_positions,))
+    next_token_logits = logits[offsetted_indices]  # (tp, mb_size * n_positions, vocab_shard_size)
+
+    # gather tensor parallel shards and get full logits: (mb_size * n_positions, vocab_size)
+    next_token_logits = ops.collectives.replicated_all_gather(
+        next_token_logits, group=popxl.gcg().ir.replica_grouping(group_size=tp), output_shape="new_axis"
+    )
+    next_token_logits = next_token_logits.transpose((1, 0, 2)).reshape_(
+        (micro_batch_size * n_positions, config.model.embedding.vocab_size)
+    )
+
+    logprobs = ops.log(ops.softmax(ops.cast(next_token_logits, popxl.float32), axis=1))
+    return logprobs.reshape_((micro_batch_size, n_positions, config.model.embedding.vocab_size))
+
+
 class GPTJLMHeadTP(addons.Module):
     def __init__(self, config: GPTJConfig):
         """
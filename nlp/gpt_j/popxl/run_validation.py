@@ -22,8 +22,13 @@ from modelling.embedding import GPTJEmbeddingsTP
 from popxl_addons import TaskSession, timer
 from utils.setup import gptj_config_setup
 from utils.utils import tensor_parallel_input, repeat
-from utils.inference import batch_inference
-from data.mnli_data import form_validation_prompts, prepare_validation_features, postprocess_mnli_predictions
+from utils.inference import batch_inference, batch_score, score_positions
+from data.mnli_data import (
+    form_validation_prompts,
+    prepare_validation_features,
+    postprocess_mnli_predictions,
+    mnli_label_continuations,
+)
 from config import GPTJConfig
 from modelling.hf_mapping import hf_mapping_lm_tp
 
@@ -81,6 +86,45 @@ def run_validation(
     return answers
 
 
+def run_scoring_validation(
+    config: GPTJConfig, session: TaskSession, dataset, tokenizer, trained_session: Optional[TaskSession] = None
+):
+    """
+    Predict the class whose label continuation has the highest summed log-probability, with a single forward pass per
+    micro batch instead of a generation loop. The session must be built with
+    `inference(config, score_positions(mnli_label_continuations(tokenizer)))` and opened before calling
+    run_scoring_validation. Returns the predicted label ids.
+    """
+    if config.checkpoint.load:
+        session.load_checkpoint(config.checkpoint.load)
+    elif trained_session:
+        session.load_from_session(trained_session)
+
+    tp = config.execution.tensor_parallel
+    rf = config.execution.tensor_parallel * config.execution.data_parallel
+
+    def logprobs(inputs, positions):
+        data_map = {}
+        words = to_numpy(inputs, session.inputs.words.dtype).reshape(-1, *session.inputs.words.shape)
+        data_map[session.inputs.words] = tensor_parallel_input(
+            words, tp, rf, partial(GPTJEmbeddingsTP.offset_input, config=config)
+        ).squeeze()
+        data_map[session.inputs.score_positions] = repeat(to_numpy(positions, session.inputs.score_positions.dtype), tp)
+        # identical for all tp, take first
+        return torch.from_numpy(session.run(data_map)[session.outputs.logprobs][0])
+
+    with timer("Running validation"):
+        scores = batch_score(
+            dataset["input_ids"],
+            mnli_label_continuations(tokenizer),
+            logprobs,
+            config.model.sequence_length,
+            pad_token_id=tokenizer.pad_token_id,
+            micro_batch_size=config.execution.micro_batch_size,
+        )
+    return scores.argmax(dim=1).tolist()
+
+
 def main():
     # --- Config ---
     config, args, _ = gptj_config_setup(
@@ -109,18 +153,25 @@ def main():
 
     # --- Model ---
     max_len = reduce(lambda l, e: max(l, len(e["input_ids"])), dataset, 0)
-    config.model.sequence_length = max_len + config.inference.output_length
-    logging.info(f"Reducing sequence length to {max_len}")
-
-    session = inference(config)
+    if config.inference.scoring:
+        positions = score_positions(mnli_label_continuations(tokenizer))
+        config.model.sequence_length = max_len + positions - 1
+        session = inference(config, score_positions=positions)
+    else:
+        config.model.sequence_length = max_len + config.inference.output_length
+        session = inference(config)
+    logging.info(f"Reducing sequence length to {config.model.sequence_length}")
 
     pretrained = GPTJForCausalLM.from_pretrained("Graphcore/gptj-mnli")
 
     with session:
         with timer("Loading HF Graphcore/gptj-mnli model to IPU"):
             session.write_variables_data(hf_mapping_lm_tp(config, session, pretrained))
-        answers = run_validation(config, session, dataset, tokenizer)
-        formatted_answers = postprocess_mnli_predictions(answers)
+        if config.inference.scoring:
+            formatted_answers = run_scoring_validation(config, session, dataset, tokenizer)
+        else:
+            answers = run_validation(config, session, dataset, tokenizer)
+            formatted_answers = postprocess_mnli_predictions(answers)
 
     metrics = metric.compute(predictions=formatted_answers, references=dataset["label"])
     logging.info(metrics)
@@ -0,0 +1,100 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import tracemalloc
+
+import numpy as np
+import pytest
+import torch
+
+from data.data_utils import DistributedSampler, IndexPermutation, StatefulDataLoader, StatefulRandomSampler
+
+
+class LargeDataset:
+    """Dataset of which only the length is used"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1000, 4097])
+def test_index_permutation_is_bijective(size):
+    permutation = IndexPermutation(size, seed=3)
+    indices = permutation(np.arange(size))
+    np.testing.assert_array_equal(np.sort(indices), np.arange(size))
+    assert [permutation[i] for i in range(size)] == indices.tolist()
+
+
+def test_index_permutation_is_reproducible():
+    size = 10000
+    first = IndexPermutation(size, seed=5)(np.arange(size))
+    np.testing.assert_array_equal(first, IndexPermutation(size, seed=5)(np.arange(size)))
+    assert not np.array_equal(first, IndexPermutation(size, seed=6)(np.arange(size)))
+    assert not np.array_equal(first, np.arange(size))
+
+
+def test_sampler_resume():
+    dataset = LargeDataset(1000)
+    full = list(StatefulRandomSampler(dataset, seed=7, epoch=2))
+    assert sorted(full) == list(range(1000))
+    resumed = list(StatefulRandomSampler(dataset, seed=7, epoch=2, start_index=321))
+    assert resumed == full[321:]
+    assert list(StatefulRandomSampler(dataset, seed=7, epoch=3)) != full
+
+
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_distributed_sampler_shards(drop_last):
+    dataset = LargeDataset(1003)
+    replicas = 4
+    samplers = [
+        DistributedSampler(dataset, num_instances=replicas, rank=rank, seed=11, drop_last=drop_last)
+        for rank in range(replicas)
+    ]
+    shards = [list(sampler) for sampler in samplers]
+    assert all(len(shard) == samplers[0].num_samples for shard in shards)
+    # every index once, and the padding taken from the start of the permutation
+    interleaved = [index for step in zip(*shards) for index in step]
+    permutation = IndexPermutation(len(dataset), seed=11)
+    assert interleaved == [permutation[position % len(dataset)] for position in range(len(interleaved))]
+    resumed = DistributedSampler(dataset, num_instances=replicas, rank=2, seed=11, drop_last=drop_last, start_index=50)
+    assert list(resumed) == shards[2][50:]
+
+
+def test_billion_samples_without_allocation():
+    dataset = LargeDataset(10**9)
+    tracemalloc.start()
+    sampler = StatefulRandomSampler(dataset, seed=1, start_index=10**9 - 10)
+    # not list(sampler), which preallocates `len(sampler)` elements
+    tail = [index for index in sampler]
+    distributed = DistributedSampler(dataset, num_instances=64, rank=63, seed=1, start_index=10**9 // 64 - 5)
+    shard_tail = [index for index in distributed]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 10 * 2**20
+    assert len(tail) == 10 and len(set(tail)) == 10
+    assert all(0 <= index < 10**9 for index in tail + shard_tail)
+    permutation = IndexPermutation(10**9, seed=1)
+    assert tail == [permutation[position] for position in range(10**9 - 10, 10**9)]
+    assert shard_tail == [permutation[position] for position in range(10**9 - 5 * 64 + 63, 10**9, 64)]
+
+
+@pytest.mark.parametrize("batch_size, drop_last", [(3, True), (3, False), (None, False)])
+def test_dataloader_resume_with_workers(batch_size, drop_last):
+    dataset = np.arange(50)
+    kwargs = dict(batch_size=batch_size, drop_last=drop_last, num_workers=2, prefetch_factor=3, seed=13)
+    full = [torch.as_tensor(x).reshape(-1).tolist() for x in StatefulDataLoader(dataset, **kwargs)]
+
+    dl1 = StatefulDataLoader(dataset, **kwargs)
+    consumed = []
+    for step, x in enumerate(dl1):
+        consumed.append(torch.as_tensor(x).reshape(-1).tolist())
+        if step == 6:
+            break
+    # the workers have prefetched batches past the ones returned
+    state = dl1.get_state()
+
+    dl2 = StatefulDataLoader(dataset, **kwargs)
+    dl2.set_state(state)
+    consumed += [torch.as_tensor(x).reshape(-1).tolist() for x in dl2]
+    assert consumed == full
@@ -0,0 +1,65 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import pytest
+import torch
+
+# HF
+from transformers.models.gptj import GPTJConfig as HFConfig
+from transformers.models.gptj.modeling_gptj import GPTJForCausalLM
+
+from utils.inference import batch_inference, batch_score, candidate_rows, causal_lm_logprobs, causal_lm_next_token
+
+
+def tiny_gptj(sequence_length):
+    config = HFConfig(
+        n_layer=2,
+        vocab_size=64,
+        n_positions=sequence_length,
+        n_embd=32,
+        n_head=4,
+        rotary_dim=4,
+        tie_word_embeddings=False,
+    )
+    return GPTJForCausalLM(config).eval()
+
+
+def test_candidate_rows():
+    rows, row_of_candidate = candidate_rows([[5], [6], [7]])
+    assert rows == [[]]
+    assert row_of_candidate == [0, 0, 0]
+
+    rows, row_of_candidate = candidate_rows([[5], [7, 8, 9], [7, 8], [7, 6, 1]])
+    assert rows == [[7, 8], [7, 6]]
+    assert row_of_candidate == [0, 0, 0, 1]
+
+
+@pytest.mark.parametrize("candidates", [[[3], [4], [5]], [[3, 7], [3, 8], [5], [6, 2, 9]]])
+def test_batch_score_cmp_full_sequences(candidates):
+    torch.manual_seed(42)
+    sequence_length = 24
+    model = tiny_gptj(sequence_length)
+    prompts = [torch.randint(2, 64, (length,)) for length in (5, 9, 13, 7, 11)]
+
+    scores = batch_score(prompts, candidates, causal_lm_logprobs(model), sequence_length, micro_batch_size=3)
+
+    expected = torch.zeros((len(prompts), len(candidates)))
+    with torch.no_grad():
+        for p, prompt in enumerate(prompts):
+            for c, candidate in enumerate(candidates):
+                tokens = torch.cat([prompt, torch.tensor(candidate)])
+                logprobs = torch.log_softmax(model(tokens.unsqueeze(0)).logits[0], dim=-1)
+                positions = torch.arange(len(prompt) - 1, len(tokens) - 1)
+                expected[p, c] = logprobs[positions, torch.tensor(candidate)].sum()
+    torch.testing.assert_close(scores, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_score_cmp_generation():
+    torch.manual_seed(42)
+    sequence_length = 16
+    model = tiny_gptj(sequence_length)
+    prompts = [torch.randint(2, 64, (length,)) for length in (5, 9, 13, 7)]
+    # every token is a candidate, the best single token continuation is the greedy next token
+    scores = batch_score(prompts, [[token] for token in range(64)], causal_lm_logprobs(model), sequence_length)
+    answers = batch_inference(
+        iter(prompts), causal_lm_next_token(model), sequence_length, eos_token_id=-1, output_length=1
+    )
+    assert scores.argmax(dim=1).tolist() == [int(answer[0]) for answer in answers]
@@ -1,5 +1,5 @@
 # Copyright (c) 2022 Graphcore Ltd. All rights reserved.
-from typing import Callable, Iterable, List, Optional
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
 import torch
 
 
@@ -109,6 +109,126 @@ def batch_inference(
                 sample_id += 1
 
 
+def candidate_rows(candidates: Sequence[Sequence[int]]) -> Tuple[List[List[int]], List[int]]:
+    """Deduplicate the shared prefixes of candidate continuations.
+        The log-probabilities of every token that can follow a prefix are read at the same position, so a candidate
+        is scored in any sequence that contains all its tokens but the last one. Single token candidates are all
+        scored from the last position of the prompt.
+        Example: candidates [[5], [6], [7, 8]] need a single sequence per prompt, `prompt 7`.
+
+    Args:
+        candidates (Sequence[Sequence[int]]): token ids of each candidate continuation
+
+    Returns:
+        Tuple[List[List[int]], List[int]]: continuations to append to each prompt, and the index of the continuation
+            in which each candidate is scored.
+    """
+    rows = []
+    row_of_candidate = [0] * len(candidates)
+    # longest first, so that the shorter candidates are scored in the rows of the longer ones
+    for i in sorted(range(len(candidates)), key=lambda i: len(candidates[i]), reverse=True):
+        prefix = list(candidates[i][:-1])
+        for r, row in enumerate(rows):
+            if row[: len(prefix)] == prefix:
+                row_of_candidate[i] = r
+                break
+        else:
+            rows.append(prefix)
+            row_of_candidate[i] = len(rows) - 1
+    return rows, row_of_candidate
+
+
+def score_positions(candidates: Sequence[Sequence[int]]) -> int:
+    """Number of positions of each sequence at which `batch_score` needs the next token log-probabilities"""
+    rows, _ = candidate_rows(candidates)
+    return max(len(row) for row in rows) + 1
+
+
+def batch_score(
+    prompts: Sequence[Sequence[int]],
+    candidates: Sequence[Sequence[int]],
+    logprobs_fn: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+    sequence_length: int,
+    pad_token_id: int = 0,
+    micro_batch_size: int = 1,
+) -> torch.Tensor:
+    """Scores candidate continuations of each prompt by their summed log-probabilities, with a single forward pass
+        per micro batch and no generation loop. The shared prefixes of the candidates are scored once, see
+        `candidate_rows`, so that for single token candidates each prompt is a single sequence.
+
+    Args:
+        prompts (Sequence[Sequence[int]]): token ids of each prompt
+        candidates (Sequence[Sequence[int]]): token ids of each candidate continuation, the same for all the prompts
+        logprobs_fn (Callable[[torch.Tensor, torch.Tensor], torch.Tensor]): Next token log-probabilities at some
+                                positions of each sequence. Inputs of the callable are the token ids of shape
+                                (micro_batch_size, sequence_length) and the positions of shape
+                                (micro_batch_size, `score_positions(candidates)`). Returned tensor is of shape
+                                (micro_batch_size, `score_positions(candidates)`, vocab_size).
+        sequence_length (int): length of the sequences
+        pad_token_id (int, optional): token index used for padding. Defaults to 0.
+        micro_batch_size (int, optional): size of batches. Defaults to 1.
+
+    Returns:
+        torch.Tensor: summed log-probabilities of shape (len(prompts), len(candidates))
+    """
+    rows, row_of_candidate = candidate_rows(candidates)
+    num_positions = max(len(row) for row in rows) + 1
+    candidates_of_row = [[i for i in range(len(candidates)) if row_of_candidate[i] == r] for r in range(len(rows))]
+    candidate_tokens = [torch.tensor(candidate, dtype=torch.long) for candidate in candidates]
+    candidate_positions = [torch.arange(len(candidate)) for candidate in candidates]
+
+    sequences = [(p, r) for p in range(len(prompts)) for r in range(len(rows))]
+    scores = torch.zeros((len(prompts), len(candidates)))
+    batch = torch.full((micro_batch_size, sequence_length), pad_token_id).long()
+    positions = torch.zeros((micro_batch_size, num_positions)).long()
+    for start in range(0, len(sequences), micro_batch_size):
+        batch_sequences = sequences[start : start + micro_batch_size]
+        batch.fill_(pad_token_id)
+        positions.zero_()
+        for b, (p, r) in enumerate(batch_sequences):
+            prompt = torch.as_tensor(prompts[p], dtype=torch.long).reshape(-1)
+            tokens = torch.cat([prompt, torch.tensor(rows[r], dtype=torch.long)])
+            if tokens.numel() > sequence_length:
+                raise ValueError(
+                    f"Prompt {p} and its continuation are longer than the sequence length {sequence_length}"
+                )
+            batch[b, : tokens.numel()] = tokens
+            # the last token of the prompt predicts the first token of the candidates, and so on
+            positions[b] = prompt.numel() - 1 + torch.arange(num_positions).clamp(max=len(rows[r]))
+        logprobs = logprobs_fn(batch, positions)
+        for b, (p, r) in enumerate(batch_sequences):
+            for i in candidates_of_row[r]:
+                scores[p, i] = logprobs[b, candidate_positions[i], candidate_tokens[i]].sum()
+    return scores
+
+
+def causal_lm_logprobs(
+    model: Callable[[torch.Tensor], torch.Tensor]
+) -> Callable[[torch.Tensor, torch.Tensor], torch.Tensor]:
+    """`logprobs_fn` of `batch_score` for a causal LM on the host, such as a HuggingFace `GPTJForCausalLM`"""
+
+    @torch.no_grad()
+    def logprobs_fn(inputs: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        logits = model(inputs).logits
+        logits = logits[torch.arange(inputs.shape[0]).unsqueeze(1), positions]
+        return torch.log_softmax(logits.float(), dim=-1)
+
+    return logprobs_fn
+
+
+def causal_lm_next_token(
+    model: Callable[[torch.Tensor], torch.Tensor]
+) -> Callable[[torch.Tensor, torch.Tensor], torch.Tensor]:
+    """Greedy `next_token_fn` of `batch_inference` for a causal LM on the host"""
+
+    @torch.no_grad()
+    def next_token_fn(inputs: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        logits = model(inputs).logits
+        return logits[torch.arange(inputs.shape[0]), lengths - 1].argmax(dim=-1)
+
+    return next_token_fn
+
+
 if __name__ == "__main__":
     import random
 
@@ -0,0 +1,179 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""
+CPU benchmark of the critic cover and of the expected values of a training step.
+
+Compares the vectorised `gaussian_cover` with the loops over the clusterings and
+their clusters it replaces, and for the expected values and gradients of a step,
+the critics broadcasting their translations over the data batch with the
+critics contracting them, evaluated once per sample or with the evaluations
+fused by `fused_expected_values`, for a growing number of critics and
+instruments.
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import tf2_AdGMoM
+from tf2_AdGMoM import (
+    GaussianVectorizedCritic,
+    KerasModeler,
+    expected_values,
+    fused_expected_values,
+    gaussian_cover,
+    gaussian_kernel,
+)
+
+
+def loop_gaussian_cover(data_z, cluster_labels, n_instruments, min_cluster_size=50):
+    """Reference implementation of `gaussian_cover`, one cluster at a time."""
+    center_grid = []
+    precision_grid = []
+    normalizers = []
+    for tree in range(cluster_labels.shape[1]):
+        for leaf in np.unique(cluster_labels[:, tree]):
+            if leaf < 0:
+                continue
+            center = np.mean(data_z[cluster_labels[:, tree].flatten() == leaf, :], axis=0)
+            distance = np.linalg.norm(data_z - center, axis=1) / data_z.shape[1]
+            precision = 1.0 / (np.sqrt(2) * (np.sort(distance)[min_cluster_size]))
+            normalizer = (
+                (precision**n_instruments)
+                * np.sum(np.exp(-((precision * distance) ** 2)))
+                / (np.power(2.0 * np.pi, n_instruments / 2.0))
+            )
+            normalizers.append(normalizer)
+            center_grid.append(center)
+            precision_grid.append(precision)
+    return np.array(normalizers), np.array(precision_grid), np.array(center_grid)
+
+
+class BroadcastGaussianCritic(GaussianVectorizedCritic):
+    """Reference `GaussianVectorizedCritic`, broadcasting the translations over the data batch."""
+
+    def predict(self, data_x):
+        n_instruments = data_x.shape[1]
+        size_n = data_x.shape[0]
+        size_d = n_instruments
+        size_k = self.size_k
+        translation = tf.reshape(self._translation, [1, size_k, n_instruments, self.num_reduced_dims])
+        normalized_translation = tf.nn.l2_normalize(translation, 2, epsilon=1e-7)
+        t_x = tf.reshape(data_x, [size_n, 1, 1, size_d])
+        casted_center = tf.reshape(tf.transpose(self._center), [1, size_k, 1, size_d])
+        t_x = tf.broadcast_to(t_x, tf.constant([size_n, size_k, 1, size_d]))
+        casted_center = tf.broadcast_to(casted_center, tf.constant([size_n, size_k, 1, size_d]))
+        t_normalized_translation = tf.broadcast_to(
+            normalized_translation, tf.constant([size_n, size_k, n_instruments, self.num_reduced_dims])
+        )
+        norm_input = tf.matmul(t_x - casted_center, t_normalized_translation)
+        batch_kernel_data = tf.reshape(norm_input, [size_n, size_k, self.num_reduced_dims])
+        return gaussian_kernel(batch_kernel_data, precision=self._precision, normalizer=self._normalizer)
+
+
+def moments_and_gradients(s1, s2, s3, modeler, critic, fusion="none"):
+    """The expected values of a training step and the gradients of the modeler and critics sums.
+
+    With fusion "none" the critics are evaluated once per sample, as before, with "all" once for
+    the three samples, and with "forward" once for s1 and s3, which are not differentiated, as in
+    the training graphs.
+    """
+    if fusion == "forward":
+        e1, e3 = fused_expected_values([s1, s3], modeler, critic)
+    variables = modeler.trainable_variables + critic.trainable_variables
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch(variables)
+        if fusion == "all":
+            e1, e2, e3 = fused_expected_values([s1, s2, s3], modeler, critic)
+        else:
+            if fusion == "none":
+                e1 = expected_values(s1, modeler, critic)
+                e3 = expected_values(s3, modeler, critic)
+            e2 = expected_values(s2, modeler, critic)
+        e1 = tf.stop_gradient(e1)
+        u_ft = tf.pow(tf.stop_gradient(e3), 2)
+        total_modeler_sum = 2 * tf.reduce_sum(tf.multiply(tf.multiply(e2, tf.stop_gradient(critic.weights)), e1))
+        total_critics_sum = -2 * tf.reduce_sum(tf.multiply(e2, e1))
+    modeler_gradients = tape.gradient(total_modeler_sum, modeler.trainable_variables)
+    critic_gradients = tape.gradient(total_critics_sum, critic.trainable_variables)
+    del tape
+    return e1, e2, u_ft, modeler_gradients, critic_gradients
+
+
+def random_problem(n_samples, n_instruments, n_critics, hidden_layers, seed=0, critic_class=GaussianVectorizedCritic):
+    """A modeler, a critic and the data of a training step."""
+    tf.random.set_seed(seed)
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 2, size=(n_samples, n_instruments)).astype(np.float32)
+    w = (x[:, :1] + rng.normal(0, 1, size=(n_samples, 1))).astype(np.float32)
+    y = (np.sin(w) + rng.normal(0, 0.1, size=(n_samples, 1))).astype(np.float32)
+    labels = rng.integers(0, n_critics, size=(n_samples, 1))
+    labels[:n_critics, 0] = np.arange(n_critics)
+    _, precisions, centers = gaussian_cover(x, labels, n_instruments, min_cluster_size=min(50, n_samples - 1))
+    modeler = KerasModeler(hidden_layers, 1, optimizer=tf.keras.optimizers.Adam())
+    modeler.model.build((None, 1))
+    critic = critic_class(
+        optimizer=tf.keras.optimizers.Adam(),
+        center=centers.astype(np.float32),
+        precision=precisions.astype(np.float32),
+        normalizer=np.ones(n_critics, dtype=np.float32),
+        n_instruments=n_instruments,
+        n_critics=n_critics,
+    )
+    data = {"Y": tf.constant(y), "W": tf.constant(w), "X": tf.constant(x)}
+    return modeler, critic, data, labels
+
+
+def timeit(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-critics", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--n-instruments", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--n-samples", type=int, default=1000)
+    parser.add_argument("--n-trees", type=int, default=5, help="Number of clusterings of the cover")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--batch-size-hedge", type=int, default=1000)
+    parser.add_argument("--hidden-layers", type=int, nargs="*", default=[100, 100, 100])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    tf2_AdGMoM.conf = argparse.Namespace(rho="regression")
+
+    fusions = {"none": "per sample", "all": "fused s1|s2|s3", "forward": "fused s1|s3"}
+    print(
+        "critics\tinstruments\tcover: loops (s)\tvectorised (s)\tstep: broadcast critics (s)\t"
+        + "\t".join(f"{name} (s)" for name in fusions.values())
+    )
+    for n_critics in args.n_critics:
+        for n_instruments in args.n_instruments:
+            modeler, critic, data, _ = random_problem(args.n_samples, n_instruments, n_critics, args.hidden_layers)
+            x = data["X"].numpy()
+            labels = np.random.default_rng(1).integers(0, n_critics, size=(args.n_samples, args.n_trees))
+            loop_time = timeit(lambda: loop_gaussian_cover(x, labels, n_instruments), 1)
+            vectorised_time = timeit(lambda: gaussian_cover(x, labels, n_instruments), 3)
+
+            s1, s2 = [{k: v[: args.batch_size] for k, v in data.items()} for _ in range(2)]
+            s3 = {k: v[: args.batch_size_hedge] for k, v in data.items()}
+            _, broadcast_critic, _, _ = random_problem(
+                args.n_samples, n_instruments, n_critics, args.hidden_layers, critic_class=BroadcastGaussianCritic
+            )
+            step_times = []
+            for step_critic, fusion in [(broadcast_critic, "none")] + [(critic, fusion) for fusion in fusions]:
+                step = tf.function(
+                    lambda: moments_and_gradients(s1, s2, s3, modeler, step_critic, fusion=fusion), jit_compile=True
+                )
+                step_times.append(timeit(step, args.repeats))
+            print(
+                f"{n_critics}\t{n_instruments}\t\t{loop_time:.4f}\t\t\t{vectorised_time:.4f}\t\t"
+                + "\t\t".join(f"{step_time:.4f}" for step_time in step_times)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 # Copyright (c) 2020 Graphcore Ltd. All rights reserved.
 """Tests for the AdGMoM reimplementation."""
+import argparse
+import numpy as np
 import pytest
+import tensorflow as tf
 from examples_tests.test_util import SubProcessChecker
 from pathlib import Path
 
+import tf2_AdGMoM
+from benchmark_critics import BroadcastGaussianCritic, loop_gaussian_cover, moments_and_gradients, random_problem
+from tf2_AdGMoM import gaussian_cover, get_data_clustering
+
 
 current_path = Path(__file__).parent
 
@@ -15,3 +22,57 @@ class AdgmomTest(SubProcessChecker):
     def test_default(self):
         """Test the default"""
         self.run_command("python tf2_AdGMoM.py", current_path, ["Iterations", "6000"])
+
+
+@pytest.fixture
+def regression_conf(monkeypatch):
+    monkeypatch.setattr(tf2_AdGMoM, "conf", argparse.Namespace(rho="regression"), raising=False)
+
+
+@pytest.mark.parametrize("n_instruments", [1, 3])
+@pytest.mark.parametrize("outlier_label", [None, -1, -2])
+def test_gaussian_cover(n_instruments, outlier_label):
+    """Test the vectorised cover against the loops over the clusters"""
+    rng = np.random.default_rng(0)
+    data_z = rng.normal(0, 2, size=(500, n_instruments)).astype(np.float32)
+    # 4 clusterings with different numbers of clusters, some points are in no cluster
+    cluster_labels = np.stack([rng.integers(0, n, size=500) for n in [1, 7, 20, 3]], axis=1)
+    if outlier_label is not None:
+        cluster_labels[rng.random(cluster_labels.shape) < 0.3] = outlier_label
+    expected = loop_gaussian_cover(data_z, cluster_labels, n_instruments)
+    result = gaussian_cover(data_z, cluster_labels, n_instruments)
+    for value, expected_value in zip(result, expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-5, atol=1e-6)
+
+
+def test_random_points_clustering():
+    """Each random point covers its closest points"""
+    data_z = np.random.default_rng(0).normal(size=(300, 2)).astype(np.float32)
+    np.random.seed(0)
+    _, precisions, centers = get_data_clustering(data_z, None, 2, n_critics=10, cluster_type="random_points")
+    np.random.seed(0)
+    center_ids = np.random.choice(np.arange(300), size=10, replace=False)
+    for center_id, center in zip(center_ids, centers.numpy()):
+        members = np.argsort(np.linalg.norm(data_z - data_z[center_id], axis=1))[:50]
+        np.testing.assert_allclose(center, data_z[members].mean(0), rtol=1e-5, atol=1e-6)
+    assert precisions.shape == (10,)
+
+
+@pytest.mark.parametrize("n_instruments", [1, 4])
+def test_critic_predict(n_instruments):
+    """Test the critics against the critics broadcasting their translations"""
+    _, critic, data, _ = random_problem(300, n_instruments, 20, [8])
+    _, broadcast_critic, _, _ = random_problem(300, n_instruments, 20, [8], critic_class=BroadcastGaussianCritic)
+    np.testing.assert_allclose(critic.predict(data["X"]), broadcast_critic.predict(data["X"]), rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize("fusion", ["all", "forward"])
+def test_fused_expected_values(regression_conf, fusion):
+    """Test the fused critics evaluations against one evaluation per sample with the reference critics"""
+    modeler, critic, data, _ = random_problem(400, 2, 30, [16, 16])
+    _, broadcast_critic, _, _ = random_problem(400, 2, 30, [16, 16], critic_class=BroadcastGaussianCritic)
+    s1, s2, s3 = [{k: v[start:end] for k, v in data.items()} for start, end in [(0, 100), (100, 200), (0, 400)]]
+    expected = moments_and_gradients(s1, s2, s3, modeler, broadcast_critic, fusion="none")
+    result = moments_and_gradients(s1, s2, s3, modeler, critic, fusion=fusion)
+    for value, expected_value in zip(tf.nest.flatten(result), tf.nest.flatten(expected)):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-4, atol=1e-6)
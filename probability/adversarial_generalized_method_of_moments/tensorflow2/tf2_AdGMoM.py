@@ -86,6 +86,45 @@ def get_tf_data(n_samples, n_instruments, iv_strength, tau_fn):
     return tf.constant(x), tf.constant(w), tf.constant(y)
 
 
+def gaussian_cover(data_z, cluster_labels, n_instruments, min_cluster_size=50):
+    """Return the centers, precisions, and normalizers of the clusters of one or more clusterings.
+
+    `cluster_labels` has one column per clustering, for instance per tree of a forest,
+    and the label of each data point in each of them. Negative labels are not clusters.
+    The clusters are ordered by clustering and by label.
+    """
+    n_samples, n_clusterings = cluster_labels.shape
+    # All the negative labels share the -1 slot excluded from the clusters, else a -2 label of one
+    # clustering would have the id of the largest label of the previous one
+    cluster_labels = np.maximum(cluster_labels, -1)
+    # One id per (clustering, label) pair, ordered by clustering and by label
+    n_labels = cluster_labels.max() + 2
+    pair_ids = np.arange(n_clusterings) * n_labels + cluster_labels + 1
+    pair_ids, cluster_index = np.unique(pair_ids, return_inverse=True)
+    members = np.repeat(np.arange(n_samples), n_clusterings)
+    # The centers are the means of the members of each cluster
+    sums = np.zeros((len(pair_ids), data_z.shape[1]))
+    counts = np.zeros(len(pair_ids))
+    np.add.at(sums, cluster_index.reshape(-1), data_z[members])
+    np.add.at(counts, cluster_index.reshape(-1), 1)
+    is_cluster = pair_ids % n_labels > 0
+    centers = (sums[is_cluster] / counts[is_cluster, np.newaxis]).astype(data_z.dtype)
+
+    # |z - c|^2 = |z|^2 + |c|^2 - 2 z.c for all the data points and centers at once
+    data_z64, centers64 = data_z.astype(np.float64), centers.astype(np.float64)
+    squared_distances = (
+        np.sum(centers64**2, axis=1)[:, np.newaxis] + np.sum(data_z64**2, axis=1) - 2 * centers64 @ data_z64.T
+    )
+    distances = np.sqrt(np.maximum(squared_distances, 0)) / data_z.shape[1]
+    precisions = 1.0 / (np.sqrt(2) * np.partition(distances, min_cluster_size, axis=1)[:, min_cluster_size])
+    normalizers = (
+        (precisions**n_instruments)
+        * np.sum(np.exp(-((precisions[:, np.newaxis] * distances) ** 2)), axis=1)
+        / (np.power(2.0 * np.pi, n_instruments / 2.0))
+    )
+    return normalizers, precisions, centers
+
+
 def get_data_clustering(
     data_z,
     data_p,
@@ -97,6 +136,7 @@ def get_data_clustering(
     critic_type="Gaussian",
 ):
     """Return the centers, precisions, and normalizers of a data cover."""
+    data_z = np.array(data_z)
     if cluster_type == "forest":
         from sklearn.ensemble import RandomForestRegressor
 
@@ -105,46 +145,27 @@ def get_data_clustering(
         )
         dtree.fit(data_z, data_p)
         cluster_labels = dtree.apply(data_z)
-        cluster_ids = [np.unique(cluster_labels[:, c]) for c in range(cluster_labels.shape[1])]
     elif cluster_type == "kmeans":
         from sklearn.cluster import KMeans
 
         kmeans = KMeans(n_clusters=n_critics).fit(data_z)
         cluster_labels = kmeans.labels_.reshape(-1, 1)
-        cluster_ids = [np.unique(cluster_labels)]
     elif cluster_type == "random_points":
+        # One clustering per center, with the closest points as its single cluster
         center_ids = np.random.choice(np.arange(data_z.shape[0]), size=n_critics, replace=False)
-        cluster_labels = np.zeros((data_z.shape[0], n_critics))
-        cluster_ids = np.ones((n_critics, 1))
-        for it, center in enumerate(center_ids):
-            distances = np.linalg.norm(data_z - data_z[center], axis=1)
-            cluster_members = np.argsort(distances)[:min_cluster_size]
-            cluster_labels[cluster_members, it] = 1
+        distances = np.linalg.norm(data_z[np.newaxis] - data_z[center_ids, np.newaxis], axis=-1)
+        cluster_members = np.argsort(distances, axis=1)[:, :min_cluster_size]
+        cluster_labels = np.full((data_z.shape[0], n_critics), -1)
+        cluster_labels[cluster_members, np.arange(n_critics)[:, np.newaxis]] = 0
     else:
         raise Exception("Unknown option {}".format(cluster_type))
 
     if critic_type == "Gaussian":
         # We put a symmetric gaussian encompassing
         # all the data points of each cluster of each clustering
-        center_grid = []
-        precision_grid = []
-        normalizers = []
-
-        data_z = np.array(data_z)
-
-        for tree in range(cluster_labels.shape[1]):
-            for leaf in cluster_ids[tree]:
-                center = np.mean(data_z[cluster_labels[:, tree].flatten() == leaf, :], axis=0)
-                distance = np.linalg.norm(data_z - center, axis=1) / data_z.shape[1]
-                precision = 1.0 / (np.sqrt(2) * (np.sort(distance)[min_cluster_size]))
-                normalizer = (
-                    (precision**n_instruments)
-                    * np.sum(np.exp(-((precision * distance) ** 2)))
-                    / (np.power(2.0 * np.pi, n_instruments / 2.0))
-                )
-                normalizers.append(normalizer)
-                center_grid.append(center)
-                precision_grid.append(precision)
+        normalizers, precision_grid, center_grid = gaussian_cover(
+            data_z, cluster_labels, n_instruments, min_cluster_size=min_cluster_size
+        )
         # The proposed normalizing constant results in too small function values
         # which result in too small losses and respective lack of scaling
         # when using the exp function for the weights update.
@@ -272,25 +293,16 @@ class GaussianVectorizedCritic:
             # data preprocessing to arrange for batch operation
             # The first two dimensions become batch dimension:
             # One for the data batch and the other for the critics batch.
-            # We do it this way because `tf.matmul` treats all dimensions
-            # except for the last two in each tensor as batch dimensions.
-            t_x = tf.reshape(data_x, [size_n, 1, 1, size_d])
-            casted_center = tf.reshape(tf.transpose(self._center), [1, size_k, 1, size_d])
-
-            # data broadcasting for batch operation
-            t_x = tf.broadcast_to(t_x, tf.constant([size_n, size_k, 1, size_d]))
-            casted_center = tf.broadcast_to(casted_center, tf.constant([size_n, size_k, 1, size_d]))
-            t_normalized_translation = tf.broadcast_to(
-                normalized_translation, tf.constant([size_n, size_k, n_instruments, self.num_reduced_dims])
-            )
+            t_x = tf.reshape(data_x, [size_n, 1, size_d])
+            casted_center = tf.reshape(tf.transpose(self._center), [1, size_k, size_d])
 
             # Note that (a^T V)((a^T V)^T) = a^T*VV^T*a = a^T*W*a
             # where `a = x - center`
             # thus allowing us to calculate the W-matrix weight norm
-            # in `gaussian_kernel`
-            norm_input = tf.matmul(t_x - casted_center, t_normalized_translation)
-
-            batch_kernel_data = tf.reshape(norm_input, [size_n, size_k, self.num_reduced_dims])
+            # in `gaussian_kernel`.
+            # The translations are contracted with the differences of all the
+            # data points without being broadcast over the data batch.
+            batch_kernel_data = tf.einsum("nkd,kdr->nkr", t_x - casted_center, normalized_translation[0])
 
             output = gaussian_kernel(batch_kernel_data, precision=self._precision, normalizer=self._normalizer)
             return output
@@ -347,17 +359,34 @@ def expected_values(data, modeler, critic):
         return result
 
 
+def fused_expected_values(samples, modeler, critic):
+    """Calculate one expected value per critic for each of the samples.
+
+    Same as `expected_values` for each sample, but the critics are
+    evaluated once on the concatenation of the samples. Gradients go
+    through all the samples, so only fuse samples that are
+    differentiated together, or not at all.
+    """
+    with tf.name_scope("FusedExpectedValues"):
+        sizes = [data["X"].shape[0] for data in samples]
+        critic_values = tf.split(critic.predict(tf.concat([data["X"] for data in samples], axis=0)), sizes, axis=0)
+        return [
+            tf.math.reduce_mean(tf.multiply(RHO[conf.rho](data["Y"], data["W"], modeler), values), axis=0)
+            for data, values in zip(samples, critic_values)
+        ]
+
+
 @tf.function(experimental_compile=True)
 def training_loop(modeler, critic):
     """Main IPU training loop with inner computational graph."""
 
     def computational_graph(max_loss, s1, s2, s3):
         weights = critic.weights
-        with tf.name_scope("Exp1"):
-            e1 = tf.stop_gradient(expected_values(s1, modeler, critic))
-
-        with tf.name_scope("Exp3"):
-            u_ft = tf.pow(tf.stop_gradient(expected_values(s3, modeler, critic)), 2)
+        with tf.name_scope("Exp1Exp3"):
+            # Neither is differentiated, so the critics are evaluated once for both samples
+            e1, e3 = fused_expected_values([s1, s3], modeler, critic)
+            e1 = tf.stop_gradient(e1)
+            u_ft = tf.pow(tf.stop_gradient(e3), 2)
 
         variables = modeler.trainable_variables + critic.trainable_variables
 
@@ -412,11 +441,11 @@ def cpu_graph_wrapper(modeler, critic):
     def cpu_computational_graph_copy(max_loss, s1, s2, s3):
         """Copy of computational_graph to use on CPU."""
         weights = critic.weights
-        with tf.name_scope("Exp1"):
-            e1 = tf.stop_gradient(expected_values(s1, modeler, critic))
-
-        with tf.name_scope("Exp3"):
-            u_ft = tf.pow(tf.stop_gradient(expected_values(s3, modeler, critic)), 2)
+        with tf.name_scope("Exp1Exp3"):
+            # Neither is differentiated, so the critics are evaluated once for both samples
+            e1, e3 = fused_expected_values([s1, s3], modeler, critic)
+            e1 = tf.stop_gradient(e1)
+            u_ft = tf.pow(tf.stop_gradient(e3), 2)
 
         variables = modeler.trainable_variables + critic.trainable_variables
 
@@ -0,0 +1,88 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Padding efficiency and host throughput of the batching stages.
+
+A synthetic stream of fbank features, with AISHELL-like utterance lengths, is
+batched and padded by the `static`, `dynamic` and `bucket` batch types of
+`src/iterator/processor.py`. The static and dynamic batches are sorted over a
+`sort_size` buffer first, as in `configs/train.yaml`. As every new batch shape
+needs its own IPU executable, their rows are padded again to `max_length` by
+`IPUCollateFn`, the last efficiency column accounts for this padding too.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+
+import src.iterator.processor as processor
+
+
+def synthetic_fbank_stream(num_utterances, num_mel_bins=80, max_length=1220, seed=0):
+    """Utterances of 1 to 12 seconds, about 4.5 seconds long on average, with 100 frames per second."""
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(np.log(420), 0.35, num_utterances).astype(np.int64), 100, max_length)
+    generator = torch.Generator().manual_seed(seed)
+    return [
+        dict(key=key, label=list(range(1, length // 30)), feat=torch.randn(length, num_mel_bins, generator=generator))
+        for key, length in enumerate(lengths.tolist())
+    ]
+
+
+def batches(samples, args, **batch_conf):
+    if batch_conf["batch_type"] == "bucket":
+        return processor.batch(iter(samples), **batch_conf)
+    sorted_samples = processor.sort(iter(samples), args.sort_size)
+    return processor.padding(processor.batch(sorted_samples, **batch_conf))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-utterances", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-frames-in-batch", type=int, default=12000)
+    parser.add_argument("--sort-size", type=int, default=500)
+    parser.add_argument("--num-buckets", type=int, default=8)
+    parser.add_argument("--window-size", type=int, default=10000)
+    parser.add_argument("--max-length", type=int, default=1220)
+    args = parser.parse_args()
+
+    random.seed(0)
+    samples = synthetic_fbank_stream(args.num_utterances, max_length=args.max_length)
+    bucket_conf = dict(
+        batch_type="bucket",
+        batch_size=args.batch_size,
+        num_buckets=args.num_buckets,
+        window_size=args.window_size,
+        max_length=args.max_length,
+    )
+    modes = [
+        ("static", dict(batch_type="static", batch_size=args.batch_size)),
+        ("dynamic", dict(batch_type="dynamic", max_frames_in_batch=args.max_frames_in_batch)),
+        ("bucket", bucket_conf),
+        ("bucket concat", dict(bucket_conf, concat=True)),
+    ]
+    frames = sum(x["feat"].size(0) for x in samples)
+    print(
+        f"{'batch type':>14} {'batches':>8} {'shapes':>7} {'efficiency (%)':>15} {'fixed shape (%)':>16} "
+        f"{'frames/s':>12}"
+    )
+    for name, batch_conf in modes:
+        start = time.perf_counter()
+        shapes, padded_frames, rows, num_batches = set(), 0, 0, 0
+        for batch in batches(samples, args, **batch_conf):
+            feats = batch[1]
+            shapes.add(tuple(feats.shape))
+            padded_frames += feats.size(0) * feats.size(1)
+            rows += feats.size(0)
+            num_batches += 1
+        duration = time.perf_counter() - start
+        fixed_shape_frames = padded_frames if batch_conf["batch_type"] == "bucket" else rows * args.max_length
+        print(
+            f"{name:>14} {num_batches:>8} {len(shapes):>7} {100 * frames / padded_frames:>15.2f} "
+            f"{100 * frames / fixed_shape_frames:>16.2f} {frames / duration:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
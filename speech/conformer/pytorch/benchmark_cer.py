@@ -0,0 +1,77 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import time
+
+import numpy as np
+
+from src.utils.batch_cer import BatchCalculator
+from src.utils.compute_cer import Calculator, score_utterances
+
+
+def synthetic_utterances(num_utterances, vocab_size, min_len, max_len, error_rate, seed=0):
+    """Character references and hypotheses with substitutions, deletions and insertions at error_rate each"""
+    rng = np.random.default_rng(seed)
+    vocab = [chr(0x4E00 + i) for i in range(vocab_size)]
+    labs, recs = [], []
+    for length in rng.integers(min_len, max_len + 1, num_utterances):
+        lab = rng.choice(vocab, length).tolist()
+        rec = []
+        for token in lab:
+            error = rng.random()
+            if error < error_rate:
+                rec.append(rng.choice(vocab))
+            elif error >= 2 * error_rate:
+                rec.append(token)
+            if rng.random() < error_rate:
+                rec.append(rng.choice(vocab))
+        labs.append(lab)
+        recs.append(rec)
+    return labs, recs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time of the CER scoring of synthetic hypotheses and references")
+    parser.add_argument("--num-utterances", type=int, default=2000)
+    parser.add_argument("--vocab-size", type=int, default=4000)
+    parser.add_argument("--min-len", type=int, default=5)
+    parser.add_argument("--max-len", type=int, default=40, help="AISHELL transcripts have up to about 40 characters")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[64, 256, 1024])
+    args = parser.parse_args()
+
+    labs, recs = synthetic_utterances(args.num_utterances, args.vocab_size, args.min_len, args.max_len, args.error_rate)
+    start = time.perf_counter()
+    calculator = Calculator()
+    expected = [calculator.calculate(list(lab), list(rec)) for lab, rec in zip(labs, recs)]
+    reference_time = time.perf_counter() - start
+    print(f"{'scorer':>22}{'seconds':>10}{'utt/s':>10}{'speedup':>9}{'same counts':>13}")
+    print(f"{'Calculator':>22}{reference_time:>10.3f}{len(labs) / reference_time:>10.0f}{1:>8.2f}x{'':>13}")
+
+    for batch_size in args.batch_size:
+        start = time.perf_counter()
+        batch_calculator = BatchCalculator()
+        results = score_utterances(batch_calculator, labs, recs, batch_size)
+        batch_time = time.perf_counter() - start
+        same = results == expected and batch_calculator.data == calculator.data
+        name = f"BatchCalculator({batch_size})"
+        print(
+            f"{name:>22}{batch_time:>10.3f}{len(labs) / batch_time:>10.0f}"
+            f"{reference_time / batch_time:>8.2f}x{str(same):>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
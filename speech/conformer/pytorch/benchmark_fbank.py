@@ -0,0 +1,85 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Host throughput of the fbank and SpecAugment stages, in utterances per second.
+
+Synthetic 16kHz waveforms, with AISHELL-like durations, go through a DataLoader
+either per sample, with `compute_fbank` and `spec_aug` before `static_batch`
+and `padding`, or per batch, with `batch_compute_fbank` and `batch_spec_aug`
+after `static_batch`, for each number of workers.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+
+import src.iterator.processor as processor
+from src.iterator.dataset import Processor
+
+FBANK_CONF = dict(num_mel_bins=80, frame_shift=10, frame_length=25, dither=0.1)
+SPEC_AUG_CONF = dict(num_t_mask=2, num_f_mask=2, max_t=50, max_f=10)
+
+
+class SyntheticWaveforms(IterableDataset):
+    """Utterances of 1 to 12 seconds, split between the workers."""
+
+    def __init__(self, num_utterances, sample_rate=16000, seed=0):
+        self.num_utterances = num_utterances
+        self.sample_rate = sample_rate
+        self.seed = seed
+
+    def set_epoch(self, epoch):
+        pass
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        rng = np.random.default_rng(self.seed)
+        durations = np.clip(rng.lognormal(np.log(4.2), 0.35, self.num_utterances), 1.0, 12.0)
+        generator = torch.Generator().manual_seed(self.seed + worker_id)
+        for key in range(worker_id, self.num_utterances, num_workers):
+            wav = 0.1 * torch.randn(1, int(durations[key] * self.sample_rate), generator=generator)
+            yield dict(key=key, label=[1] * int(durations[key] * 3), wav=wav, sample_rate=self.sample_rate)
+
+
+def per_sample_pipeline(source, batch_size):
+    dataset = Processor(source, processor.compute_fbank, **FBANK_CONF)
+    dataset = Processor(dataset, processor.spec_aug, **SPEC_AUG_CONF)
+    dataset = Processor(dataset, processor.static_batch, batch_size)
+    return Processor(dataset, processor.padding)
+
+
+def batched_pipeline(source, batch_size):
+    dataset = Processor(source, processor.static_batch, batch_size)
+    dataset = Processor(dataset, processor.batch_compute_fbank, **FBANK_CONF)
+    return Processor(dataset, processor.batch_spec_aug, **SPEC_AUG_CONF)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-utterances", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--num-threads", type=int, default=1, help="Intra-op threads of each worker")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    print(f"{'workers':>8} {'per sample (utt/s)':>19} {'batched (utt/s)':>16}")
+    for num_workers in args.num_workers:
+        throughputs = []
+        for pipeline in [per_sample_pipeline, batched_pipeline]:
+            dataset = pipeline(SyntheticWaveforms(args.num_utterances), args.batch_size)
+            loader = DataLoader(
+                dataset,
+                batch_size=None,
+                num_workers=num_workers,
+                worker_init_fn=lambda _: torch.set_num_threads(args.num_threads),
+            )
+            start = time.perf_counter()
+            num_utterances = sum(len(batch[0]) for batch in loader)
+            throughputs.append(num_utterances / (time.perf_counter() - start))
+        print(f"{num_workers:>8} {throughputs[0]:>19.1f} {throughputs[1]:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -163,26 +163,37 @@ def Dataset(data_type, data_list_file, symbol_table, conf, bpe_model=None, non_l
     filter_conf = conf.get("filter_conf", {})
     dataset = Processor(dataset, processor.filter, **filter_conf)
 
+    # the batch fbank extracts the features of whole batches, after batching
+    batch_fbank = conf.get("batch_fbank", False)
     fbank_conf = conf.get("fbank_conf", {})
-    dataset = Processor(dataset, processor.compute_fbank, **fbank_conf)
-
     spec_aug = conf.get("spec_aug", True)
-    if spec_aug:
-        spec_aug_conf = conf.get("spec_aug_conf", {})
-        dataset = Processor(dataset, processor.spec_aug, **spec_aug_conf)
+    spec_aug_conf = conf.get("spec_aug_conf", {})
+    if not batch_fbank:
+        dataset = Processor(dataset, processor.compute_fbank, **fbank_conf)
+        if spec_aug:
+            dataset = Processor(dataset, processor.spec_aug, **spec_aug_conf)
 
     if shuffle:
         shuffle_conf = conf.get("shuffle_conf", {})
         dataset = Processor(dataset, processor.shuffle, **shuffle_conf)
 
+    batch_conf = conf.get("batch_conf", {})
+    # the bucket batch groups the utterances by length and pads them itself
+    bucket = batch_conf.get("batch_type", "static") == "bucket"
+    assert not (bucket and batch_fbank), "The bucket batch needs the features of every utterance"
+
     sort = conf.get("sort", True)
-    if sort:
+    if sort and not bucket:
         sort_conf = conf.get("sort_conf", {})
         dataset = Processor(dataset, processor.sort, **sort_conf)
 
-    batch_conf = conf.get("batch_conf", {})
     dataset = Processor(dataset, processor.batch, **batch_conf)
-    dataset = Processor(dataset, processor.padding)
+    if batch_fbank:
+        dataset = Processor(dataset, processor.batch_compute_fbank, **fbank_conf)
+        if spec_aug:
+            dataset = Processor(dataset, processor.batch_spec_aug, **spec_aug_conf)
+    elif not bucket:
+        dataset = Processor(dataset, processor.padding)
     return dataset
 
 
@@ -17,8 +17,10 @@ This script has been adapted from some of the original WeNet repo found here:
 [
     https://github.com/wenet-e2e/wenet/blob/main/wenet/dataset/processor.py
 ]
-Main change:
+Main changes:
     modified the padding function's label_lengths dtype
+    added the bucket batch type, padding the utterances to a fixed set of lengths
+    added batch_compute_fbank and batch_spec_aug, extracting the features after batching
 """
 
 import logging
@@ -26,9 +28,12 @@ import json
 import random
 import re
 import tarfile
+from bisect import bisect_left
+from collections import Counter
 from subprocess import PIPE, Popen
 from urllib.parse import urlparse
 
+import numpy as np
 import torch
 import torchaudio
 import torchaudio.compliance.kaldi as kaldi
@@ -287,6 +292,88 @@ def compute_fbank(data, num_mel_bins=23, frame_length=25, frame_shift=10, dither
         yield dict(key=sample["key"], label=sample["label"], feat=mat)
 
 
+def worker_generator(seed=None):
+    """torch.Generator for the random ops of a data worker
+
+    Args:
+        seed: seed of the first worker, offset by the worker id. When None
+            the generator is seeded from `random`, seeded differently in
+            every worker and epoch
+
+    Returns:
+        torch.Generator
+    """
+    if seed is None:
+        return torch.Generator().manual_seed(random.getrandbits(63))
+    worker_info = torch.utils.data.get_worker_info()
+    return torch.Generator().manual_seed(seed + (0 if worker_info is None else worker_info.id))
+
+
+def batch_compute_fbank(data, num_mel_bins=23, frame_length=25, frame_shift=10, dither=0.0, seed=None):
+    """Extract fbank of a whole batch at once, after batching the waveforms
+
+    The padded waveforms are split into frames with `unfold` and the frames
+    of every utterance, picked with a length mask, go through one batched
+    real FFT and one matmul with the mel filterbank. This matches `compute_fbank` followed by `padding`,
+    with the same kaldi options, apart from the dither noise drawn from a
+    `worker_generator(seed)`.
+
+    Args:
+        data: Iterable[List[{key, wav, label, sample_rate}]]
+
+    Returns:
+        Iterable[Tuple(keys, feats, labels, feats lengths, label lengths)]
+    """
+    generator = worker_generator(seed)
+    mel_banks = {}
+    for sample in data:
+        assert isinstance(sample, list)
+        sample_rate = sample[0]["sample_rate"]
+        assert all(x["sample_rate"] == sample_rate for x in sample)
+        window_size = int(sample_rate * frame_length * 0.001)
+        window_shift = int(sample_rate * frame_shift * 0.001)
+        padded_window_size = 1 << (window_size - 1).bit_length()
+        if sample_rate not in mel_banks:
+            banks, _ = kaldi.get_mel_banks(
+                num_mel_bins, padded_window_size, float(sample_rate), 20.0, 0.0, 100.0, -500.0, 1.0
+            )
+            window = torch.hann_window(window_size, periodic=False, dtype=torch.float32).pow(0.85)
+            mel_banks[sample_rate] = (torch.nn.functional.pad(banks, (0, 1)).T.contiguous(), window)
+        banks, window = mel_banks[sample_rate]
+
+        # kaldi frames with snip_edges, only the frames fully inside the waveform
+        wav_lengths = torch.tensor([x["wav"].size(1) for x in sample])
+        feats_length = torch.clamp((wav_lengths - window_size) // window_shift + 1, min=0).to(torch.int32)
+        order = torch.argsort(feats_length, descending=True)
+        feats_lengths = feats_length[order]
+        sorted_keys = [sample[i]["key"] for i in order]
+        sorted_labels = [torch.tensor(sample[i]["label"], dtype=torch.int64) for i in order]
+        label_lengths = torch.tensor([x.size(0) for x in sorted_labels], dtype=torch.int32)
+        padding_labels = pad_sequence(sorted_labels, batch_first=True, padding_value=-1)
+
+        waveforms = pad_sequence([sample[i]["wav"][0] for i in order], batch_first=True) * (1 << 15)
+        if waveforms.size(1) < window_size:
+            waveforms = torch.nn.functional.pad(waveforms, (0, window_size - waveforms.size(1)))
+        # only the frames of the utterances, size (frames, window_size)
+        length_mask = torch.arange(int(feats_lengths.max())) < feats_lengths[:, None]
+        frames = waveforms.unfold(1, window_size, window_shift)[:, : length_mask.size(1)][length_mask]
+        if dither != 0.0:
+            frames += torch.randn(frames.shape, generator=generator).mul_(dither)
+        frames -= frames.mean(dim=1, keepdim=True)
+        # preemphasis, frames[:, j] -= 0.97 * frames[:, max(0, j - 1)]
+        frames[:, 1:] -= 0.97 * frames[:, :-1]
+        frames[:, 0] *= 1 - 0.97
+        frames *= window
+        # power spectrum, size (frames, padded_window_size // 2 + 1)
+        spectrum = torch.fft.rfft(frames, n=padded_window_size)
+        spectrum = spectrum.real.square() + spectrum.imag.square()
+        feats = torch.matmul(spectrum, banks).clamp_min_(torch.finfo(torch.float32).eps).log_()
+        padded_feats = feats.new_zeros(length_mask.shape + (num_mel_bins,))
+        padded_feats[length_mask] = feats
+
+        yield (sorted_keys, padded_feats, padding_labels, feats_lengths, label_lengths)
+
+
 def __tokenize_by_bpe_model(sp, txt):
     tokens = []
     # CJK(China Japan Korea) unicode range is [U+4E00, U+9FFF], ref:
@@ -405,6 +492,41 @@ def spec_aug(data, num_t_mask=2, num_f_mask=2, max_t=50, max_f=10, max_w=80):
         yield sample
 
 
+def batch_spec_aug(data, num_t_mask=2, num_f_mask=2, max_t=50, max_f=10, max_w=80, seed=None):
+    """Do spec augmentation of a whole padded batch at once
+
+    Same masks as `spec_aug`, drawn as batched boolean tensors from a
+    `worker_generator(seed)` instead of one `random` call per mask.
+
+    Args:
+        data: Iterable[Tuple(keys, feats, labels, feats lengths, label lengths)]
+        num_t_mask: number of time mask to apply
+        num_f_mask: number of freq mask to apply
+        max_t: max width of time mask
+        max_f: max width of freq mask
+        max_w: max width of time warp
+
+    Returns
+        Iterable[Tuple(keys, feats, labels, feats lengths, label lengths)]
+    """
+    generator = worker_generator(seed)
+    for sample in data:
+        keys, feats, labels, feats_lengths, label_lengths = sample
+        batch_size, max_frames, max_freq = feats.shape
+        # time mask, starting in the frames of each utterance
+        t_start = (torch.rand(batch_size, num_t_mask, generator=generator) * feats_lengths[:, None]).long()
+        t_end = t_start + torch.randint(1, max_t + 1, (batch_size, num_t_mask), generator=generator)
+        t = torch.arange(max_frames)[None, None, :]
+        t_mask = ((t >= t_start[:, :, None]) & (t < t_end[:, :, None])).any(dim=1)
+        # freq mask
+        f_start = torch.randint(0, max_freq, (batch_size, num_f_mask), generator=generator)
+        f_end = f_start + torch.randint(1, max_f + 1, (batch_size, num_f_mask), generator=generator)
+        f = torch.arange(max_freq)[None, None, :]
+        f_mask = ((f >= f_start[:, :, None]) & (f < f_end[:, :, None])).any(dim=1)
+        feats = feats.masked_fill(t_mask[:, :, None] | f_mask[:, None, :], 0)
+        yield (keys, feats, labels, feats_lengths, label_lengths)
+
+
 def shuffle(data, shuffle_size=10000):
     """Local shuffle the data
 
@@ -429,8 +551,15 @@ def shuffle(data, shuffle_size=10000):
         yield x
 
 
+def sample_frames(sample):
+    """Number of frames of a sample, from its feat, or else from its wav with 100 frames every second"""
+    if "feat" in sample:
+        return sample["feat"].size(0)
+    return sample["wav"].size(1) * 100 // sample["sample_rate"]
+
+
 def sort(data, sort_size=500):
-    """Sort the data by feature length.
+    """Sort the data by feature length, or waveform length before fbank.
     Sort is used after shuffle and before batch, so we can group
     utts with similar lengths into a batch, and `sort_size` should
     be less than `shuffle_size`
@@ -447,12 +576,12 @@ def sort(data, sort_size=500):
     for sample in data:
         buf.append(sample)
         if len(buf) >= sort_size:
-            buf.sort(key=lambda x: x["feat"].size(0))
+            buf.sort(key=sample_frames)
             for x in buf:
                 yield x
             buf = []
     # The sample left over
-    buf.sort(key=lambda x: x["feat"].size(0))
+    buf.sort(key=sample_frames)
     for x in buf:
         yield x
 
@@ -491,9 +620,7 @@ def dynamic_batch(data, max_frames_in_batch=12000):
     buf = []
     longest_frames = 0
     for sample in data:
-        assert "feat" in sample
-        assert isinstance(sample["feat"], torch.Tensor)
-        new_sample_frames = sample["feat"].size(0)
+        new_sample_frames = sample_frames(sample)
         longest_frames = max(longest_frames, new_sample_frames)
         frames_after_padding = longest_frames * (len(buf) + 1)
         if frames_after_padding > max_frames_in_batch:
@@ -506,12 +633,188 @@ def dynamic_batch(data, max_frames_in_batch=12000):
         yield buf
 
 
-def batch(data, batch_type="static", batch_size=16, max_frames_in_batch=12000):
-    """Wrapper for static/dynamic batch"""
+def optimal_bucket_lengths(lengths, counts, num_buckets):
+    """Choose the bucket lengths minimising the padding of a length histogram
+
+    Every utterance is padded to the smallest bucket length not below its
+    own length. The bucket lengths are picked among the observed lengths by
+    solving this 1-D quantisation with dynamic programming, so the total
+    number of padding frames is minimal.
+
+    Args:
+        lengths: distinct lengths, in increasing order
+        counts: number of utterances of each length
+        num_buckets: maximum number of buckets
+
+    Returns:
+        List[int]: bucket lengths in increasing order, the last one is max(lengths)
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    num_buckets = min(num_buckets, len(lengths))
+    # utterances and frames of lengths[: j + 1]
+    cum_counts = np.cumsum(counts)
+    cum_frames = np.cumsum(counts * lengths)
+    # padding[j]: least padding of lengths[: j + 1] split into k buckets, the last one ending at lengths[j]
+    padding = (lengths * cum_counts - cum_frames).astype(np.float64)
+    # previous bucket ending at lengths[i], then one bucket of lengths[i + 1 : j + 1]
+    # costs padding[i] + lengths[j] * (cum_counts[j] - cum_counts[i]) - (cum_frames[j] - cum_frames[i])
+    before = np.triu(np.ones((len(lengths), len(lengths)), dtype=bool), 1)
+    columns = np.arange(len(lengths))
+    previous_ends = []
+    for _ in range(num_buckets - 1):
+        cost = np.where(before, padding[:, None] - np.outer(cum_counts, lengths) + cum_frames[:, None], np.inf)
+        previous_end = np.argmin(cost, axis=0)
+        padding = cost[previous_end, columns] + lengths * cum_counts - cum_frames
+        previous_ends.append(previous_end)
+    ends = [len(lengths) - 1]
+    for previous_end in reversed(previous_ends):
+        ends.append(previous_end[ends[-1]])
+    return lengths[ends[::-1]].tolist()
+
+
+def pad_bucket(rows, bucket_length, batch_size):
+    """Pad the rows of a bucket into fixed-shape tensors
+
+    Args:
+        rows: List[List[{key, feat, label}]], the utterances of every row
+        bucket_length: number of frames of every row
+        batch_size: number of rows, missing rows are all padding
+
+    Returns:
+        Tuple(keys, feats, labels, feats lengths, label lengths, segment ids),
+        with the keys, labels and lengths of the utterances in row order,
+        feats of shape (batch_size, bucket_length, num_mel_bins) and segment
+        ids of shape (batch_size, bucket_length), 0 for the padding frames
+        and 1, 2, ... for the utterances concatenated in a row
+    """
+    samples = [x for row in rows for x in row]
+    feats = torch.zeros(batch_size, bucket_length, samples[0]["feat"].size(1), dtype=samples[0]["feat"].dtype)
+    segment_ids = torch.zeros(batch_size, bucket_length, dtype=torch.int32)
+    for row_idx, row in enumerate(rows):
+        start = 0
+        for segment_id, x in enumerate(row, 1):
+            end = start + x["feat"].size(0)
+            feats[row_idx, start:end] = x["feat"]
+            segment_ids[row_idx, start:end] = segment_id
+            start = end
+    keys = [x["key"] for x in samples]
+    feats_lengths = torch.tensor([x["feat"].size(0) for x in samples], dtype=torch.int32)
+    labels = [torch.tensor(x["label"], dtype=torch.int64) for x in samples]
+    label_lengths = torch.tensor([x.size(0) for x in labels], dtype=torch.int32)
+    padding_labels = pad_sequence(labels, batch_first=True, padding_value=-1)
+    return (keys, feats, padding_labels, feats_lengths, label_lengths, segment_ids)
+
+
+def bucket_batch(
+    data, batch_size=16, num_buckets=8, window_size=10000, bucket_lengths=None, max_length=None, concat=False
+):
+    """Batch the data into a fixed set of length buckets
+
+    The bucket lengths minimising the padding are computed from the length
+    histogram of the first `window_size` utterances, unless `bucket_lengths`
+    is given, and are kept for the rest of the stream so the batches only
+    ever have `len(bucket_lengths)` shapes. Each window is shuffled and its
+    utterances go to the shortest bucket they fit in; a bucket is emitted
+    once its `batch_size` rows are full. With `concat`, an utterance is
+    rather appended to the open row, of its bucket or a longer one, that
+    it fills best, and only gets a row of its own when none has room.
+
+    Args:
+        data: Iterable[{key, feat, label}]
+        batch_size: rows in one batch
+        num_buckets: number of buckets to compute
+        window_size: buffer size for the length histogram and the shuffle
+        bucket_lengths: fixed bucket lengths, instead of computing them
+        max_length: length of the longest bucket, use the `max_length` of
+            `filter` so that no later utterance is longer than every bucket
+        concat: whether to concatenate several utterances in a row
+
+    Returns:
+        Iterable[Tuple(keys, feats, labels, feats lengths, label lengths)],
+        padded to `batch_size` rows, or the tuples of `pad_bucket`, with
+        the lengths of every utterance and the segment ids, with `concat`
+    """
+    buckets = sorted(bucket_lengths) if bucket_lengths is not None else None
+    # rows of each bucket, then the frames used in each row
+    rows, row_frames = None, None
+
+    def emit(bucket_idx):
+        batch = pad_bucket(rows[bucket_idx], buckets[bucket_idx], batch_size)
+        rows[bucket_idx], row_frames[bucket_idx] = [], []
+        if concat:
+            return batch
+        # one utterance per row, the padding rows get a length of 0
+        keys, feats, labels, feats_lengths, label_lengths, _ = batch
+        missing = batch_size - len(keys)
+        labels = torch.nn.functional.pad(labels, (0, 0, 0, missing), value=-1)
+        feats_lengths = torch.nn.functional.pad(feats_lengths, (0, missing))
+        label_lengths = torch.nn.functional.pad(label_lengths, (0, missing))
+        return (keys, feats, labels, feats_lengths, label_lengths)
+
+    def assign(window):
+        nonlocal buckets, rows, row_frames
+        if buckets is None:
+            histogram = Counter(x["feat"].size(0) for x in window)
+            if max_length is not None:
+                histogram.setdefault(max_length, 0)
+            lengths = sorted(histogram)
+            buckets = optimal_bucket_lengths(lengths, [histogram[length] for length in lengths], num_buckets)
+        if rows is None:
+            rows = [[] for _ in buckets]
+            row_frames = [[] for _ in buckets]
+        random.shuffle(window)
+        for sample in window:
+            num_frames = sample["feat"].size(0)
+            bucket_idx = bisect_left(buckets, num_frames)
+            if bucket_idx == len(buckets):
+                logging.warning("Dropping {} of {} frames, longer than every bucket".format(sample["key"], num_frames))
+                continue
+            if concat:
+                # best fit: the open row, in any bucket, with the fewest frames left after this utterance
+                _, fit_bucket_idx, row_idx = min(
+                    (
+                        (buckets[i] - used - num_frames, i, j)
+                        for i in range(bucket_idx, len(buckets))
+                        for j, used in enumerate(row_frames[i])
+                        if used + num_frames <= buckets[i]
+                    ),
+                    default=(None, None, None),
+                )
+                if row_idx is not None:
+                    rows[fit_bucket_idx][row_idx].append(sample)
+                    row_frames[fit_bucket_idx][row_idx] += num_frames
+                    continue
+                if len(rows[bucket_idx]) == batch_size:
+                    yield emit(bucket_idx)
+            rows[bucket_idx].append([sample])
+            row_frames[bucket_idx].append(num_frames)
+            if not concat and len(rows[bucket_idx]) == batch_size:
+                yield emit(bucket_idx)
+
+    buf = []
+    for sample in data:
+        buf.append(sample)
+        if len(buf) >= window_size:
+            yield from assign(buf)
+            buf = []
+    # The sample left over
+    if len(buf) > 0:
+        yield from assign(buf)
+    if rows is not None:
+        for bucket_idx, bucket_rows in enumerate(rows):
+            if len(bucket_rows) > 0:
+                yield emit(bucket_idx)
+
+
+def batch(data, batch_type="static", batch_size=16, max_frames_in_batch=12000, **bucket_conf):
+    """Wrapper for static/dynamic/bucket batch"""
     if batch_type == "static":
         return static_batch(data, batch_size)
     elif batch_type == "dynamic":
         return dynamic_batch(data, max_frames_in_batch)
+    elif batch_type == "bucket":
+        return bucket_batch(data, batch_size, **bucket_conf)
     else:
         logging.fatal("Unsupported batch type {}".format(batch_type))
 
@@ -0,0 +1,185 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Batched version of the `Calculator` of compute_cer.py: the tokens are mapped to
+ints, the Levenshtein distances of a batch of utterances are computed along the
+anti-diagonals of padded NumPy tables and the alignments are traced back for all
+the utterances at once. The counts, the alignments and the per token statistics
+are the same as the ones of `Calculator`, including the choice between
+alignments of the same distance.
+"""
+
+import numpy as np
+
+# the operations of the alignment, in the columns of the token statistics
+NON, COR, SUB, DEL, INS = 0, 1, 2, 3, 4
+ALL = 0
+OPERATIONS = {COR: "cor", SUB: "sub", DEL: "del", INS: "ins"}
+
+
+def edit_distance_tables(labs, recs):
+    """
+    Levenshtein distance tables of a batch of utterances.
+
+    :param labs: [batch, max_lab_len] reference token ids, padded.
+    :param recs: [batch, max_rec_len] recognised token ids, padded.
+    Returns the [batch, max_lab_len + 1, max_rec_len + 1] distances and operations. All the cells of an
+    anti-diagonal only depend on the two previous anti-diagonals, so each anti-diagonal is computed at once for
+    the whole batch. Padding cells are computed too, and never used by the cells of the utterances.
+    """
+    batch_size, max_lab_len = labs.shape
+    max_rec_len = recs.shape[1]
+    dist = np.zeros((batch_size, max_lab_len + 1, max_rec_len + 1), dtype=np.int32)
+    ops = np.zeros((batch_size, max_lab_len + 1, max_rec_len + 1), dtype=np.int8)
+    dist[:, :, 0] = np.arange(max_lab_len + 1)
+    dist[:, 0, :] = np.arange(max_rec_len + 1)
+    ops[:, 1:, 0] = DEL
+    ops[:, 0, 1:] = INS
+
+    for diagonal in range(2, max_lab_len + max_rec_len + 1):
+        i = np.arange(max(1, diagonal - max_rec_len), min(max_lab_len, diagonal - 1) + 1)
+        j = diagonal - i
+        # Calculator keeps the first of deletion, insertion and correct or substitution with the smallest distance
+        min_dist = dist[:, i - 1, j] + 1
+        min_op = np.full(min_dist.shape, DEL, dtype=np.int8)
+        ins_dist = dist[:, i, j - 1] + 1
+        is_ins = ins_dist < min_dist
+        min_dist = np.where(is_ins, ins_dist, min_dist)
+        min_op[is_ins] = INS
+        mismatch = labs[:, i - 1] != recs[:, j - 1]
+        diag_dist = dist[:, i - 1, j - 1] + mismatch
+        is_diag = diag_dist < min_dist
+        dist[:, i, j] = np.where(is_diag, diag_dist, min_dist)
+        ops[:, i, j] = np.where(is_diag, np.where(mismatch, SUB, COR), min_op)
+    return dist, ops
+
+
+def trace_back(ops, lab_lens, rec_lens):
+    """
+    Alignments of a batch of utterances from their operation tables, traced back from the last tokens of all the
+    utterances together. Returns the [steps, batch] operations and the indices of the reference and recognised
+    tokens before each of them, from the end of the utterances. Finished utterances have the NON operation.
+    """
+    batch = np.arange(ops.shape[0])
+    i, j = lab_lens.copy(), rec_lens.copy()
+    steps_ops, steps_i, steps_j = [], [], []
+    while True:
+        op = ops[batch, i, j]
+        if not np.any(op != NON):
+            break
+        steps_ops.append(op)
+        steps_i.append(i)
+        steps_j.append(j)
+        i = i - ((op == COR) | (op == SUB) | (op == DEL))
+        j = j - ((op == COR) | (op == SUB) | (op == INS))
+    if not steps_ops:
+        empty = np.zeros((0, len(batch)), dtype=np.int64)
+        return empty.astype(np.int8), empty, empty
+    return np.stack(steps_ops), np.stack(steps_i), np.stack(steps_j)
+
+
+def pad_ids(sentences, padding):
+    lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+    ids = np.full((len(sentences), max(lengths.max(initial=0), 1)), padding, dtype=np.int64)
+    for row, sentence in enumerate(sentences):
+        ids[row, : len(sentence)] = sentence
+    return ids, lengths
+
+
+class BatchCalculator:
+    """
+    `Calculator` scoring batches of utterances. The statistics of each token are kept in a
+    [num_tokens, 5] array with the all, cor, sub, del and ins counts.
+    """
+
+    def __init__(self):
+        self.token_ids = {}
+        self.tokens = []
+        self.counts = np.zeros((0, 5), dtype=np.int64)
+
+    def to_ids(self, sentence):
+        """Maps the tokens to ints, adding the new tokens"""
+        ids = []
+        for token in sentence:
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                token_id = self.token_ids[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(token_id)
+        return ids
+
+    def calculate_batch(self, labs, recs):
+        """
+        Scores the reference and recognised token lists of a batch of utterances. Returns the same results as
+        `Calculator.calculate` for each of them, without modifying the lists.
+        """
+        labs_ids, recs_ids = [], []
+        for lab, rec in zip(labs, recs):
+            labs_ids.append(self.to_ids(lab))
+            recs_ids.append(self.to_ids(rec))
+        if len(self.tokens) > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros((len(self.tokens) - len(self.counts), 5), np.int64)])
+
+        # the paddings never match each other
+        lab_ids, lab_lens = pad_ids(labs_ids, -1)
+        rec_ids, rec_lens = pad_ids(recs_ids, -2)
+        _, ops = edit_distance_tables(lab_ids, rec_ids)
+        steps_ops, steps_i, steps_j = trace_back(ops, lab_lens, rec_lens)
+
+        batch = np.broadcast_to(np.arange(len(labs)), steps_ops.shape)
+        lab_tokens = lab_ids[batch, np.maximum(steps_i - 1, 0)]
+        rec_tokens = rec_ids[batch, np.maximum(steps_j - 1, 0)]
+        on_lab = (steps_ops == COR) | (steps_ops == SUB) | (steps_ops == DEL)
+        np.add.at(self.counts, (lab_tokens[on_lab], ALL), 1)
+        np.add.at(self.counts, (lab_tokens[on_lab], steps_ops[on_lab]), 1)
+        on_rec = steps_ops == INS
+        np.add.at(self.counts, (rec_tokens[on_rec], INS), 1)
+
+        results = []
+        for row, (lab, rec) in enumerate(zip(labs, recs)):
+            path = steps_ops[:, row]
+            path = path[path != NON][::-1]
+            lab_index = steps_i[: len(path), row][::-1] - 1
+            rec_index = steps_j[: len(path), row][::-1] - 1
+            result = {
+                "lab": [lab[i] if op != INS else "" for op, i in zip(path, lab_index)],
+                "rec": [rec[j] if op != DEL else "" for op, j in zip(path, rec_index)],
+            }
+            op_counts = np.bincount(path, minlength=5)
+            result["all"] = int(op_counts[COR] + op_counts[SUB] + op_counts[DEL])
+            result.update({name: int(op_counts[op]) for op, name in OPERATIONS.items()})
+            results.append(result)
+        return results
+
+    def calculate(self, lab, rec):
+        return self.calculate_batch([lab], [rec])[0]
+
+    @staticmethod
+    def _result(counts):
+        return dict(zip(["all", "cor", "sub", "del", "ins"], map(int, counts)))
+
+    @property
+    def data(self):
+        """The statistics of each token, as the `data` of `Calculator`"""
+        return {token: self._result(counts) for token, counts in zip(self.tokens, self.counts)}
+
+    def overall(self):
+        return self._result(self.counts.sum(0))
+
+    def cluster(self, data):
+        token_ids = [self.token_ids[token] for token in data if token in self.token_ids]
+        return self._result(self.counts[token_ids].sum(0))
+
+    def keys(self):
+        return list(self.tokens)
@@ -27,6 +27,10 @@ import sys
 import unicodedata
 import codecs
 
+import numpy as np
+
+from src.utils.batch_cer import BatchCalculator
+
 remove_tag = True
 spacelist = [" ", "\t", "\r", "\n"]
 puncts = ["!", ",", "?", "、", "。", "！", "，", "；", "？", "：", "「", "」", "︰", "『", "』", "《", "》"]
@@ -295,8 +299,22 @@ def usage():
     )
 
 
-def compute_cer(ref, pre, cer_txt, tochar=True, verbose=1):
-    calculator = Calculator()
+def score_utterances(calculator, labs, recs, batch_size):
+    """
+    Scores the utterances with a BatchCalculator, in batches of utterances of similar lengths
+    to limit the padding, and returns the results in the order of the utterances
+    """
+    order = np.argsort([len(lab) + len(rec) for lab, rec in zip(labs, recs)], kind="stable")
+    results = [None] * len(labs)
+    for start in range(0, len(order), batch_size):
+        batch = order[start : start + batch_size]
+        for idx, result in zip(batch, calculator.calculate_batch([labs[i] for i in batch], [recs[i] for i in batch])):
+            results[idx] = result
+    return results
+
+
+def compute_cer(ref, pre, cer_txt, tochar=True, verbose=1, batch_size=256):
+    calculator = BatchCalculator()
     cluster_file = ""
     ignore_words = set()
     padding_symbol = " "
@@ -335,6 +353,7 @@ def compute_cer(ref, pre, cer_txt, tochar=True, verbose=1):
                 rec_set[fid] = normalize(array[1:], ignore_words, case_sensitive, split)
 
         # compute error rate on the interaction of reference file and hyp file
+        fids, labs, recs = [], [], []
         for line in open(ref_file, "r", encoding="utf-8"):
             if tochar:
                 array = characterize(line)
@@ -347,8 +366,9 @@ def compute_cer(ref, pre, cer_txt, tochar=True, verbose=1):
                 continue
             lab = normalize(array[1:], ignore_words, case_sensitive, split)
             rec = rec_set[fid]
-            if verbose:
-                cer_file.write("\nutt: " + str(fid))
+            fids.append(fid)
+            labs.append(lab)
+            recs.append(rec)
 
             for word in rec + lab:
                 if word not in default_words:
@@ -359,8 +379,9 @@ def compute_cer(ref, pre, cer_txt, tochar=True, verbose=1):
                         default_clusters[default_cluster_name][word] = 1
                     default_words[word] = default_cluster_name
 
-            result = calculator.calculate(lab, rec)
+        for fid, result in zip(fids, score_utterances(calculator, labs, recs, batch_size)):
             if verbose:
+                cer_file.write("\nutt: " + str(fid))
                 if result["all"] != 0:
                     wer = float(result["ins"] + result["sub"] + result["del"]) * 100.0 / result["all"]
                 else:
@@ -0,0 +1,78 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from src.utils import compute_cer
+from src.utils.batch_cer import BatchCalculator
+
+
+def synthetic_utterances(num_utterances, vocab, max_len, seed=0):
+    """References and hypotheses with substitutions, deletions and insertions"""
+    rng = np.random.default_rng(seed)
+    labs, recs = [], []
+    for _ in range(num_utterances):
+        lab = list(rng.choice(vocab, rng.integers(0, max_len + 1)))
+        rec = []
+        for token in lab:
+            error = rng.random()
+            if error < 0.1:
+                rec.append(rng.choice(vocab))
+            elif error < 0.2:
+                continue
+            else:
+                rec.append(token)
+            if rng.random() < 0.1:
+                rec.append(rng.choice(vocab))
+        labs.append([str(t) for t in lab])
+        recs.append([str(t) for t in rec])
+    return labs, recs
+
+
+class ReferenceCalculator(compute_cer.Calculator):
+    def calculate_batch(self, labs, recs):
+        return [self.calculate(list(lab), list(rec)) for lab, rec in zip(labs, recs)]
+
+
+@pytest.mark.parametrize("vocab_size, max_len", [(3, 12), (30, 40), (2, 1)])
+def test_batch_calculator_cmp_calculator(vocab_size, max_len):
+    vocab = [chr(ord("a") + i) for i in range(vocab_size)]
+    labs, recs = synthetic_utterances(200, vocab, max_len)
+    labs += [[], [], ["a"]]
+    recs += [[], ["a"], []]
+    reference = compute_cer.Calculator()
+    expected = [reference.calculate(list(lab), list(rec)) for lab, rec in zip(labs, recs)]
+
+    calculator = BatchCalculator()
+    results = calculator.calculate_batch(labs[:57], recs[:57]) + calculator.calculate_batch(labs[57:], recs[57:])
+    assert results == expected
+    assert calculator.data == reference.data
+    assert calculator.keys() == reference.keys()
+    assert calculator.overall() == reference.overall()
+    assert calculator.cluster(vocab[:2] + ["unknown"]) == reference.cluster(vocab[:2] + ["unknown"])
+
+
+def test_compute_cer_cmp_calculator(tmp_path, monkeypatch):
+    words = ["我", "们", "天", "气", "HELLO", "WORLD", "1", "2", "は", "こ"]
+    labs, recs = synthetic_utterances(300, words, 25, seed=1)
+    with open(tmp_path / "ref.txt", "w", encoding="utf-8") as ref, open(tmp_path / "hyp.txt", "w") as hyp:
+        for idx, (lab, rec) in enumerate(zip(labs, recs)):
+            ref.write(f"utt{idx} " + " ".join(lab) + "\n")
+            hyp.write(f"utt{idx} " + " ".join(rec) + "\n")
+
+    compute_cer.compute_cer(tmp_path / "ref.txt", tmp_path / "hyp.txt", tmp_path / "batch.txt", batch_size=64)
+    monkeypatch.setattr(compute_cer, "BatchCalculator", ReferenceCalculator)
+    compute_cer.compute_cer(tmp_path / "ref.txt", tmp_path / "hyp.txt", tmp_path / "reference.txt")
+    assert (tmp_path / "batch.txt").read_text() == (tmp_path / "reference.txt").read_text()
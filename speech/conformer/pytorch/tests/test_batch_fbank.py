@@ -0,0 +1,62 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+
+from src.iterator.processor import batch_compute_fbank, batch_spec_aug, compute_fbank, padding
+
+
+def synthetic_waveforms(num_samples=5, sample_rate=16000, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.randint(400, 3 * sample_rate, (num_samples,), generator=generator).tolist()
+    return [
+        dict(
+            key=key,
+            label=[1] * (key + 1),
+            wav=0.1 * torch.randn(1, length, generator=generator),
+            sample_rate=sample_rate,
+        )
+        for key, length in enumerate(lengths)
+    ]
+
+
+@pytest.mark.parametrize("sample_rate", [8000, 16000])
+@pytest.mark.parametrize("num_mel_bins", [23, 80])
+def test_batch_compute_fbank_matches_compute_fbank(sample_rate, num_mel_bins):
+    samples = synthetic_waveforms(sample_rate=sample_rate)
+    expected = next(padding([list(compute_fbank(iter(samples), num_mel_bins=num_mel_bins))]))
+    output = next(batch_compute_fbank(iter([samples]), num_mel_bins=num_mel_bins))
+    assert output[0] == expected[0]
+    torch.testing.assert_close(output[1], expected[1], rtol=1e-5, atol=1e-4)
+    for value, expected_value in zip(output[2:], expected[2:]):
+        assert value.dtype == expected_value.dtype
+        torch.testing.assert_close(value, expected_value)
+
+
+def test_batch_spec_aug():
+    batch = next(batch_compute_fbank(iter([synthetic_waveforms()]), num_mel_bins=80, dither=1.0, seed=0))
+    keys, feats, labels, feats_lengths, label_lengths = batch
+    augmented = next(batch_spec_aug(iter([batch]), num_t_mask=2, num_f_mask=2, max_t=50, max_f=10, seed=0))
+    torch.testing.assert_close(augmented[1], next(batch_spec_aug(iter([batch]), seed=0))[1])
+    assert augmented[0] == keys and augmented[2] is labels and augmented[3] is feats_lengths
+
+    masked = augmented[1] != feats
+    for idx, length in enumerate(feats_lengths.tolist()):
+        # the masked frames or bins are zeroed entirely, in at most 2 masks of at most 50 frames or 10 bins
+        masked_frames = masked[idx, :length].all(dim=1)
+        masked_bins = masked[idx, :length].all(dim=0)
+        assert torch.equal(masked[idx, :length], masked_frames[:, None] | masked_bins[None, :])
+        assert 0 < masked_frames.sum() <= 100 and 0 < masked_bins.sum() <= 20
+        assert torch.all(augmented[1][idx][masked[idx]] == 0)
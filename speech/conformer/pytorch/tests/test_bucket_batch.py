@@ -0,0 +1,82 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from src.iterator.processor import bucket_batch, optimal_bucket_lengths
+
+
+def padding_frames(lengths, counts, buckets):
+    return sum(count * (min(b for b in buckets if b >= length) - length) for length, count in zip(lengths, counts))
+
+
+def synthetic_samples(num_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        dict(key=key, label=[key % 7 + 1] * (length // 20 + 1), feat=torch.full((length, 3), float(key)))
+        for key, length in enumerate(rng.integers(10, 300, num_samples).tolist())
+    ]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_optimal_bucket_lengths(seed):
+    rng = np.random.default_rng(seed)
+    lengths = np.sort(rng.choice(100, 8, replace=False) + 1)
+    counts = rng.integers(1, 20, 8)
+    for num_buckets in range(1, 5):
+        buckets = optimal_bucket_lengths(lengths, counts, num_buckets)
+        assert len(buckets) == num_buckets and buckets[-1] == lengths[-1]
+        best = min(
+            padding_frames(lengths, counts, list(split) + [lengths[-1]])
+            for split in itertools.combinations(lengths[:-1], num_buckets - 1)
+        )
+        assert padding_frames(lengths, counts, buckets) == best
+
+
+@pytest.mark.parametrize("concat", [False, True])
+def test_bucket_batch(concat):
+    random.seed(0)
+    samples = synthetic_samples(500)
+    batches = list(bucket_batch(iter(samples), batch_size=8, num_buckets=4, window_size=200, concat=concat))
+
+    seen = []
+    shapes = set()
+    for batch in batches:
+        keys, feats, labels, feats_lengths, label_lengths = batch[:5]
+        shapes.add(tuple(feats.shape))
+        assert feats.size(0) == 8
+        if concat:
+            segment_ids = batch[5]
+            utterances = [
+                feats[row, segment_ids[row] == segment_id]
+                for row in range(8)
+                for segment_id in range(1, int(segment_ids[row].max()) + 1)
+            ]
+        else:
+            assert feats_lengths.size(0) == labels.size(0) == 8
+            utterances = [feats[row, : feats_lengths[row]] for row in range(len(keys))]
+            assert torch.all(feats[len(keys) :] == 0) and torch.all(feats_lengths[len(keys) :] == 0)
+        assert len(utterances) == len(keys)
+        for idx, (key, utterance) in enumerate(zip(keys, utterances)):
+            torch.testing.assert_close(utterance, samples[key]["feat"])
+            assert feats_lengths[idx] == samples[key]["feat"].size(0)
+            assert labels[idx, : label_lengths[idx]].tolist() == samples[key]["label"]
+        seen.extend(keys)
+    assert sorted(seen) == list(range(len(samples)))
+    assert len(shapes) <= 4
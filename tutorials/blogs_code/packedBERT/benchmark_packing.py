@@ -0,0 +1,81 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""Runtime of the histogram-packing algorithms on synthetic histograms.
+
+Sequence lengths are drawn from a log-normal distribution and packed with
+SPFHP and LPFHP. With `--dual`, the sequences are also given a second dimension,
+like the edges and nodes of graphs, and packed with dual-LPFHP.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from histogram_packing import pack_dlpfhp, pack_lpfhp, pack_spfhp
+
+
+def synthetic_histogram(rng, num_sequences, max_sequence_length):
+    """Histogram of log-normal sequence lengths, index i counts the sequences of length i + 1."""
+    lengths = rng.lognormal(np.log(max_sequence_length / 4), 0.6, num_sequences)
+    lengths = np.clip(lengths.astype(np.int64), 1, max_sequence_length)
+    return np.bincount(lengths - 1, minlength=max_sequence_length)
+
+
+def synthetic_dual_histogram(rng, num_sequences, max_sequence_length):
+    """Shapes and counts of sequences with a second dimension of about half their length."""
+    lengths = np.clip(rng.lognormal(np.log(max_sequence_length / 4), 0.6, num_sequences), 1, max_sequence_length - 1)
+    second = np.clip(lengths * rng.uniform(0.3, 0.7, num_sequences), 1, max_sequence_length // 2 - 1)
+    shapes, counts = np.unique(np.stack([lengths, second], 1).astype(np.int64), axis=0, return_counts=True)
+    return shapes.tolist(), counts.tolist()
+
+
+def efficiency(strategies, capacities):
+    """Fraction of the capacity of the packs, in every dimension, used by the items."""
+    counts = np.array([count for count, _, _ in strategies])
+    sums = np.array([sums for _, _, sums in strategies])
+    return (counts @ sums) / (counts.sum() * np.array(capacities))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-sequences", type=int, nargs="+", default=[10**4, 10**5, 10**6])
+    parser.add_argument("--max-sequence-lengths", type=int, nargs="+", default=[512, 1024, 4096])
+    parser.add_argument("--max-sequences-per-pack", type=int, default=16)
+    parser.add_argument(
+        "--dual",
+        action="store_true",
+        help="Also run dual-LPFHP on two-dimensional histograms, its runtime grows with the number of distinct shapes",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'algorithm':>10} {'sequences':>10} {'max length':>10} {'packs':>9} {'efficiency':>10} {'runtime (s)':>11}")
+    for max_sequence_length in args.max_sequence_lengths:
+        for num_sequences in args.num_sequences:
+            histogram = synthetic_histogram(rng, num_sequences, max_sequence_length)
+            lengths = [(length,) for length in range(1, max_sequence_length + 1)]
+            runs = [
+                ("SPFHP", lambda: pack_spfhp(lengths, histogram, (max_sequence_length,), args.max_sequences_per_pack)),
+                ("LPFHP", lambda: pack_lpfhp(lengths, histogram, (max_sequence_length,), args.max_sequences_per_pack)),
+            ]
+            capacities = [(max_sequence_length,)] * 2
+            if args.dual:
+                shapes, counts = synthetic_dual_histogram(rng, num_sequences, max_sequence_length)
+                dual_capacities = (max_sequence_length, max_sequence_length // 2)
+                runs.append(
+                    ("DLPFHP", lambda: pack_dlpfhp(shapes, counts, dual_capacities, args.max_sequences_per_pack))
+                )
+                capacities.append(dual_capacities)
+            for (name, run), capacity in zip(runs, capacities):
+                start = time.perf_counter()
+                strategies = run()
+                duration = time.perf_counter() - start
+                packs = sum(count for count, _, _ in strategies)
+                used = " ".join(f"{100 * fraction:.2f}" for fraction in efficiency(strategies, capacity))
+                print(
+                    f"{name:>10} {num_sequences:>10} {max_sequence_length:>10} {packs:>9} {used:>10} {duration:>11.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""K-dimensional histogram-packing.
+
+Packs a histogram of items into packs with per-dimension capacities, for example
+sequences of tokens (one dimension) or graphs made of edges and nodes (two
+dimensions), with at most `max_items_per_pack` items per pack. An item is a
+tuple with its size in every dimension.
+
+Partially filled packs are grouped by a free-space key, the heuristic applied to
+the capacity left in every dimension. The keys are held in a sorted list so the
+best fitting group is found with a bisection instead of a scan over all possible
+offsets, and every pack carries its per-dimension sums so checking whether an
+item fits does not sum the pack again.
+
+The groups are visited, filled and flattened in the same order as the original
+sequence (packedBERT `spfhp.py` and `lpfhp.py`) and graph (message passing
+`pack_using_dlpfhp`) implementations, so the strategies are identical to theirs.
+Each example keeps a copy of the module so that it is self-contained, the message
+passing tests check that the copies are identical.
+"""
+import bisect
+from math import prod
+
+
+def _product(*free_space):
+    return prod(free_space)
+
+
+class FreeSpaceIndex:
+    """Groups of partially filled packs keyed by their free space.
+
+    `groups` maps a key to a list of `(count, items, sums)` entries, where `items`
+    is the list of items in the pack and `sums` the per-dimension total of the
+    items. Groups keep the order in which their keys were first added, like the
+    dictionaries of the original implementations, and `keys` holds the same keys
+    sorted for the bisection.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.keys = []
+
+    def add(self, key, entry):
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = [entry]
+            bisect.insort(self.keys, key)
+        else:
+            group.append(entry)
+
+    def discard_if_empty(self, key):
+        if not self.groups[key]:
+            del self.groups[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def smallest_at_least(self, bound):
+        position = bisect.bisect_left(self.keys, bound)
+        return self.keys[position] if position < len(self.keys) else None
+
+    def largest_at_most(self, bound):
+        position = bisect.bisect_right(self.keys, bound)
+        return self.keys[position - 1] if position else None
+
+
+class HistogramPacker:
+    """Shared state of the packing algorithms."""
+
+    def __init__(self, capacities, max_items_per_pack, heuristic=None):
+        self.capacities = tuple(capacities)
+        self.max_items_per_pack = max_items_per_pack
+        self.heuristic = heuristic if heuristic is not None else _product
+        self.max_key = self.heuristic(*self.capacities)
+        self.index = FreeSpaceIndex()
+        self.final = {}
+
+    def key(self, sums):
+        return self.heuristic(*(capacity - total for capacity, total in zip(self.capacities, sums)))
+
+    def fits(self, entry, item):
+        _, items, sums = entry
+        return len(items) < self.max_items_per_pack and all(
+            total + size <= capacity for total, size, capacity in zip(sums, item, self.capacities)
+        )
+
+    def find_entry(self, key, item):
+        """Position of the last pack of the group `key` that `item` fits in, or None."""
+        group = self.index.groups[key]
+        for position in reversed(range(len(group))):
+            if self.fits(group[position], item):
+                return position
+        return None
+
+    def repeats_in(self, free_space, item):
+        """How many times `item` fits in `free_space`."""
+        return min(space // size for space, size in zip(free_space, item) if size > 0)
+
+    def add_pack(self, items, sums, count):
+        """Filter out packs that have no space left or reached the maximum number of items."""
+        key = self.key(sums)
+        if len(items) == self.max_items_per_pack or key == 0:
+            self.final.setdefault(key, []).append((count, items, sums))
+        else:
+            self.index.add(key, (count, items, sums))
+
+    def strategies(self):
+        """Merges the remaining partial packs into the final ones and flattens them."""
+        for key, group in self.index.groups.items():
+            self.final.setdefault(key, []).extend(group)
+        return [entry for group in self.final.values() for entry in group]
+
+
+def _add(sums, item, repeat=1):
+    return tuple(total + repeat * size for total, size in zip(sums, item))
+
+
+def _sorted_histogram(items, counts, heuristic):
+    """Items from the largest to the smallest key, as (key, item, count) tuples."""
+    histogram = [(heuristic(*item), tuple(item), count) for item, count in zip(items, counts)]
+    histogram.sort(reverse=True)
+    return histogram
+
+
+def pack_spfhp(items, counts, capacities, max_items_per_pack, heuristic=None):
+    """Shortest-pack-first histogram-packing.
+
+    Every item goes to the pack with the most free space it fits in.
+    Returns a list of `(count, items, sums)` strategies.
+    """
+    packer = HistogramPacker(capacities, max_items_per_pack, heuristic)
+    index = packer.index
+    for size, item, n_to_bin in _sorted_histogram(items, counts, packer.heuristic):
+        bound = packer.max_key
+        while n_to_bin > 0:
+            key = index.largest_at_most(bound)
+            if key is None or key < size:
+                # Does not fit anywhere. Create new pack.
+                packer.add_pack([item], item, n_to_bin)
+                break
+            position = packer.find_entry(key, item)
+            if position is None:
+                bound = key - 1
+                continue
+            group = index.groups[key]
+            n_to_pack, pack, sums = group.pop(position)
+            count = min(n_to_pack, n_to_bin)
+            if n_to_pack > n_to_bin:
+                # old pack gets reduced
+                group.append((n_to_pack - n_to_bin, pack, sums))
+                n_to_bin = 0
+            else:
+                n_to_bin -= n_to_pack
+            packer.add_pack(pack + [item], _add(sums, item), count)
+            index.discard_if_empty(key)
+            bound = key
+    return packer.strategies()
+
+
+def pack_lpfhp(items, counts, capacities, max_items_per_pack, heuristic=None, distribute=True):
+    """Longest-pack-first histogram-packing.
+
+    Every item goes to the pack with the least free space it fits in. With
+    `distribute`, an item is repeated as often as it fits in the pack.
+    Returns a list of `(count, items, sums)` strategies.
+    """
+    packer = HistogramPacker(capacities, max_items_per_pack, heuristic)
+    index = packer.index
+    for size, item, n_to_bin in _sorted_histogram(items, counts, packer.heuristic):
+        bound = size
+        while n_to_bin > 0:
+            key = index.smallest_at_least(bound) if bound <= packer.max_key else None
+            if key is None:
+                # Does not fit anywhere. Create new packs, and no longer look for a fit
+                # for the ones left over.
+                bound = packer.max_key + 1
+                repeat = min(packer.repeats_in(packer.capacities, item), max_items_per_pack)
+                while n_to_bin // repeat == 0:
+                    repeat -= 1
+                if not distribute:
+                    repeat = 1
+                packer.add_pack([item] * repeat, _add((0,) * len(item), item, repeat), n_to_bin // repeat)
+                n_to_bin -= n_to_bin // repeat * repeat
+                continue
+            position = packer.find_entry(key, item)
+            if position is None:
+                bound = key + 1
+                continue
+            group = index.groups[key]
+            n_to_pack, pack, sums = group.pop(position)
+            # calculate how often the current item maximally fits in
+            free_space = tuple(capacity - total for capacity, total in zip(packer.capacities, sums))
+            repeat = min(packer.repeats_in(free_space, item), max_items_per_pack - len(pack))
+            # correct dependent on count
+            while n_to_bin // repeat == 0:
+                repeat -= 1
+            if not distribute:
+                repeat = 1
+            count = min(n_to_pack, n_to_bin // repeat)
+            if n_to_pack > count:
+                # old pack gets reduced
+                group.append((n_to_pack - count, pack, sums))
+                n_to_bin -= count * repeat
+            else:
+                n_to_bin -= n_to_pack * repeat
+            packer.add_pack(pack + [item] * repeat, _add(sums, item, repeat), count)
+            index.discard_if_empty(key)
+            # reset in case best fit changed
+            bound = size
+    return packer.strategies()
+
+
+def pack_dlpfhp(items, counts, capacities, max_items_per_pack, heuristic=None):
+    """Dual longest-pack-first histogram-packing.
+
+    Like `pack_lpfhp` without repeating items, where the free-space key does not
+    guarantee a fit, for example the product of the edges and nodes left in a
+    pack of graphs. Packs only become final when they are full on creation.
+    Returns a list of `(count, items, sums)` strategies.
+    """
+    packer = HistogramPacker(capacities, max_items_per_pack, heuristic)
+    index = packer.index
+    max_key = packer.max_key
+    for size, item, n_to_bin in _sorted_histogram(items, counts, packer.heuristic):
+        bound = size
+        while n_to_bin > 0:
+            key = index.smallest_at_least(bound)
+            if key is None:
+                bound = max_key + 1
+            else:
+                position = packer.find_entry(key, item)
+                if position is None:
+                    bound = key + 1
+                else:
+                    group = index.groups[key]
+                    n_to_pack, pack, sums = group.pop(position)
+                    count = min(n_to_pack, n_to_bin)
+                    if n_to_pack > count:
+                        group.append((n_to_pack - count, pack, sums))
+                    index.discard_if_empty(key)
+                    new_sums = _add(sums, item)
+                    index.add(packer.key(new_sums), (count, pack + [item], new_sums))
+                    n_to_bin -= count
+                    # the next search starts above the size of the item
+                    bound = size + 1
+            if bound > max_key:
+                # Does not fit anywhere. Create new pack.
+                new_key = packer.key(item)
+                if new_key == 0:
+                    packer.final.setdefault(0, []).append((n_to_bin, [item], item))
+                else:
+                    index.add(new_key, (n_to_bin, [item], item))
+                break
+    return packer.strategies()
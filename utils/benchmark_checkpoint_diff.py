@@ -0,0 +1,187 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from checkpoint_diff import DEFAULT_CHUNK_ELEMENTS, compare
+
+
+def memory_usage(pid):
+    """RSS and PSS of the process and its children, in MiB."""
+    rss, pss = 0, 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as smaps:
+                for line in smaps:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+            for children in glob.glob(f"/proc/{pid}/task/*/children"):
+                with open(children) as children_file:
+                    pids += [int(child) for child in children_file.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            pass  # the process exited
+    return rss / 1024, pss / 1024
+
+
+class PeakMemory(threading.Thread):
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_rss, self.peak_pss = 0.0, 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss, pss = memory_usage(os.getpid())
+            self.peak_rss, self.peak_pss = max(self.peak_rss, rss), max(self.peak_pss, pss)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.join()
+
+
+def synthetic_tensors(size_gb, tensor_mb, hidden, dtype):
+    """Names and shapes of the [rows, hidden] weights of a checkpoint of `size_gb` GB."""
+    itemsize = np.dtype(dtype).itemsize
+    rows = max(int(tensor_mb * 2**20) // (hidden * itemsize), 1)
+    num_tensors = max(int(size_gb * 2**30) // (rows * hidden * itemsize), 1)
+    return [(f"layer{idx}/weight", (rows, hidden)) for idx in range(num_tensors)]
+
+
+def write_synthetic_checkpoints(folder, fmt, tensors, dtype, seed=0, rows_per_write=1024):
+    """
+    Write two checkpoints of random weights, one element of the last tensor differs by one ULP.
+    The weights are written by slices, so that the writes do not need the checkpoint in memory.
+    """
+    rng = np.random.default_rng(seed)
+    paths = [os.path.join(folder, f"checkpoint{idx}.{fmt}") for idx in (1, 2)]
+    if fmt == "npy":
+        for path in paths:
+            os.makedirs(path)
+    h5_files = []
+    if fmt == "h5":
+        import h5py
+
+        h5_files = [h5py.File(path, "w") for path in paths]
+    torch_tensors = [{}, {}]
+    for name, shape in tensors:
+        if fmt == "h5":
+            outputs = [f.create_dataset(name, shape, dtype=dtype) for f in h5_files]
+        else:
+            # the torch checkpoints are saved from memmaps of scratch .npy files
+            outputs = []
+            for idx, path in enumerate(paths):
+                if fmt == "npy":
+                    npy_path = os.path.join(path, f"{name}.npy")
+                    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+                else:
+                    npy_path = os.path.join(folder, f"scratch{idx}_{name.replace('/', '_')}.npy")
+                outputs.append(np.lib.format.open_memmap(npy_path, "w+", dtype=dtype, shape=shape))
+        for start in range(0, shape[0], rows_per_write):
+            stop = min(start + rows_per_write, shape[0])
+            values = rng.standard_normal((stop - start, shape[1]), dtype=np.float32).astype(dtype)
+            for output in outputs:
+                output[start:stop] = values
+        if name == tensors[-1][0]:
+            outputs[1][-1, -1] = np.nextafter(outputs[1][-1, -1], np.inf, dtype=dtype)
+        for output in outputs:
+            if isinstance(output, np.memmap):
+                output.flush()
+        if fmt == "pt":
+            import torch
+
+            for idx, output in enumerate(outputs):
+                torch_tensors[idx][name] = torch.from_numpy(output)
+    for f in h5_files:
+        f.close()
+    if fmt == "pt":
+        import torch
+
+        for path, state in zip(paths, torch_tensors):
+            torch.save(state, path)
+        for scratch in glob.glob(os.path.join(folder, "scratch*.npy")):
+            os.remove(scratch)
+    return paths
+
+
+def legacy_compare(path1, path2):
+    """The previous comparison of `compare_two_ckpt_sets.py`, which reads both checkpoints in memory."""
+    from inspect_h5_checkpoint import inspect_checkpoint
+
+    weights1 = inspect_checkpoint(file_name=path1, all_tensors=True)
+    weights2 = inspect_checkpoint(file_name=path2, all_tensors=True)
+    return all(np.array_equal(weights1[name], weights2[name]) for name in weights1)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the streaming checkpoint comparison on synthetic checkpoints"
+    )
+    parser.add_argument("--size-gb", type=float, default=2.0, help="Size of each synthetic checkpoint in GB")
+    parser.add_argument("--tensor-mb", type=float, default=64.0, help="Size of each synthetic tensor in MB")
+    parser.add_argument("--hidden-size", type=int, default=4096, help="Size of the last axis of the tensors")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16", help="Type of the weights")
+    parser.add_argument("--formats", choices=["h5", "npy", "pt"], nargs="+", default=["h5", "npy", "pt"])
+    parser.add_argument("--chunk-elements", type=int, nargs="+", default=[DEFAULT_CHUNK_ELEMENTS])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--legacy", action="store_true", help="Also run the in memory comparison of the h5 files")
+    parser.add_argument(
+        "--folder", type=str, default=None, help="Folder of the synthetic checkpoints, temporary if None"
+    )
+    return parser.parse_args()
+
+
+def run(args, folder):
+    tensors = synthetic_tensors(args.size_gb, args.tensor_mb, args.hidden_size, args.dtype)
+    num_bytes = 2 * sum(np.prod(shape) for _, shape in tensors) * np.dtype(args.dtype).itemsize
+    print(
+        f"2 x {len(tensors)} tensors of {tensors[0][1]} {args.dtype}, {num_bytes / 2**30:0.2f} GB read per comparison"
+    )
+    rss, pss = memory_usage(os.getpid())
+    print(f"Memory of the benchmark before the comparisons: RSS {rss:0.0f} MiB, PSS {pss:0.0f} MiB")
+    print(f"{'format':<8}{'chunk elements':>16}{'workers':>9}{'seconds':>10}{'GB/s':>8}{'RSS MiB':>10}{'PSS MiB':>10}")
+    for fmt in args.formats:
+        fmt_folder = os.path.join(folder, fmt)
+        os.makedirs(fmt_folder, exist_ok=True)
+        path1, path2 = write_synthetic_checkpoints(fmt_folder, fmt, tensors, args.dtype)
+        for chunk_elements in args.chunk_elements:
+            for workers in args.workers:
+                with PeakMemory() as memory:
+                    start_time = time.perf_counter()
+                    report = compare([(path1, path2)], chunk_elements=chunk_elements, workers=workers)
+                    elapsed_time = time.perf_counter() - start_time
+                assert not report["equal"], "The synthetic checkpoints differ by one element"
+                print(
+                    f"{fmt:<8}{chunk_elements:>16}{workers:>9}{elapsed_time:>10.1f}"
+                    f"{num_bytes / 2**30 / elapsed_time:>8.2f}{memory.peak_rss:>10.0f}{memory.peak_pss:>10.0f}"
+                )
+        if fmt == "h5" and args.legacy:
+            with PeakMemory() as memory:
+                start_time = time.perf_counter()
+                legacy_compare(path1, path2)
+                elapsed_time = time.perf_counter() - start_time
+            print(
+                f"{'h5 (in memory)':<33}{elapsed_time:>10.1f}{num_bytes / 2**30 / elapsed_time:>8.2f}"
+                f"{memory.peak_rss:>10.0f}{memory.peak_pss:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.folder is not None:
+        run(args, args.folder)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            run(args, folder)
@@ -0,0 +1,502 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""
+Streaming comparison of two checkpoints, or two sets of checkpoints.
+
+Both sides are opened lazily (h5 datasets, numpy memmaps of `.npy` files, torch `mmap=True`
+loads), and each tensor is compared in chunks of `chunk_elements` elements by a pool of
+processes. Only the chunks in flight are resident: the pages of the memory mapped files are
+released after each chunk, so that the peak RSS is bounded by the chunk size and the number of
+workers instead of the size of the checkpoints. Non contiguous tensors (saved transposed, or Fortran
+ordered `.npy` files) are read through their strides, only the elements of the chunk are copied.
+
+For each tensor the report holds the max absolute difference, the relative L2 error and the
+cosine similarity with respect to the first checkpoint, the max distance in units in the last
+place (ULP, for tensors of the same floating point type) and the number of mismatching elements.
+"""
+import argparse
+import ctypes
+import glob
+import json
+import math
+import mmap
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+H5_EXTENSIONS = (".h5", ".hdf5")
+TORCH_EXTENSIONS = (".pt", ".pth", ".bin")
+NUMPY_EXTENSIONS = (".npy",)
+DEFAULT_CHUNK_ELEMENTS = 1 << 22
+
+MADV_DONTNEED = 4
+try:
+    _libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+except OSError:
+    _libc = None
+
+
+def release_pages(array):
+    """
+    Drop the resident pages of a read only memory mapped array, they are read again from the file if touched.
+    The array must be a view of the mapped file: on memory allocated by the process this would corrupt it.
+    """
+    if _libc is None or array.size == 0:
+        return
+    address = array.__array_interface__["data"][0]
+    # the span of a strided view, its strides can be negative
+    offsets = [(size - 1) * stride for size, stride in zip(array.shape, array.strides)]
+    low = address + sum(offset for offset in offsets if offset < 0)
+    high = address + sum(offset for offset in offsets if offset > 0) + array.itemsize
+    start = low - low % mmap.PAGESIZE
+    _libc.madvise(ctypes.c_void_p(start), ctypes.c_size_t(high - start), MADV_DONTNEED)
+
+
+def flat_views(array, start, stop):
+    """
+    Views of `array` holding the elements `start` to `stop` of the flattened array, in order. Flattening a
+    non contiguous array copies it whole, here only the views of the elements of the range are copied.
+    """
+    if array.flags.c_contiguous or array.ndim == 1 or stop <= start:
+        # indexing a 1D array would return a copy of the element, not a view
+        yield array.reshape(-1)[start:stop]
+        return
+    row = math.prod(array.shape[1:])
+    first, last = start // row, (stop - 1) // row
+    if first == last:
+        yield from flat_views(array[first], start - first * row, stop - first * row)
+        return
+    yield from flat_views(array[first], start - first * row, row)
+    if last > first + 1:
+        yield array[first + 1 : last]
+    yield from flat_views(array[last], 0, stop - last * row)
+
+
+def read_mapped(array, start, stop):
+    """Copy of the elements `start` to `stop` of the flattened memory mapped array, releasing their pages."""
+    chunks = []
+    for view in flat_views(array, start, stop):
+        chunks.append(np.array(view).reshape(-1))
+        release_pages(view)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+class H5Checkpoint:
+    """Datasets of an h5 file, read by slices of their leading axis."""
+
+    def __init__(self, path):
+        import h5py
+
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.datasets = {}
+
+        def visit(name, content):
+            if isinstance(content, h5py.Dataset):
+                self.datasets[name] = content
+
+        self.file.visititems(visit)
+
+    def tensors(self):
+        return {name: (dataset.shape, dataset.dtype.name) for name, dataset in self.datasets.items()}
+
+    def alignment(self, name):
+        # a chunk is a whole number of slices of the leading axis
+        return math.prod(self.datasets[name].shape[1:])
+
+    def read(self, name, start, stop):
+        dataset = self.datasets[name]
+        if dataset.ndim == 0:
+            return np.asarray(dataset[()]).reshape(-1)
+        row = self.alignment(name)
+        if row == 0:
+            return np.empty(0, dtype=dataset.dtype)
+        return dataset[start // row : stop // row].reshape(-1)
+
+    def close(self):
+        self.file.close()
+
+
+class NumpyCheckpoint:
+    """A `.npy` file, or a folder of `.npy` files named after the tensors, as read only memmaps."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "**", "*.npy"), recursive=True))
+            self.files = {os.path.splitext(os.path.relpath(file, path))[0]: file for file in files}
+        else:
+            # the file name is not part of the tensor name, to compare two files with different names
+            self.files = {"tensor": path}
+        self.arrays = {name: np.load(file, mmap_mode="r") for name, file in self.files.items()}
+
+    def tensors(self):
+        return {name: (array.shape, array.dtype.name) for name, array in self.arrays.items()}
+
+    def alignment(self, name):
+        return 1
+
+    def read(self, name, start, stop):
+        array = self.arrays[name]
+        if not isinstance(array, np.memmap):
+            # np.load does not memory map empty arrays
+            return array.reshape(-1)[start:stop]
+        # a Fortran ordered file is read through its strides
+        return read_mapped(array, start, stop)
+
+    def close(self):
+        self.arrays = {}
+
+
+class TorchCheckpoint:
+    """A torch checkpoint loaded with `mmap=True`, nested dictionaries are flattened with `/` separated names."""
+
+    def __init__(self, path):
+        import torch
+
+        self.path = path
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        self.state = {}
+        self._flatten(state, "")
+
+    def _flatten(self, state, prefix):
+        import torch
+
+        if isinstance(state, torch.Tensor):
+            self.state[prefix or "tensor"] = state
+        elif isinstance(state, dict):
+            for key, value in state.items():
+                self._flatten(value, f"{prefix}/{key}" if prefix else str(key))
+        elif isinstance(state, (list, tuple)):
+            for idx, value in enumerate(state):
+                self._flatten(value, f"{prefix}/{idx}" if prefix else str(idx))
+
+    def tensors(self):
+        return {
+            name: (tuple(tensor.shape), str(tensor.dtype).replace("torch.", "")) for name, tensor in self.state.items()
+        }
+
+    def alignment(self, name):
+        return 1
+
+    def read(self, name, start, stop):
+        import torch
+
+        tensor = self.state[name]
+        if tensor.dtype == torch.bfloat16:
+            # numpy has no bfloat16, the raw bits are converted by `to_float`
+            tensor = tensor.view(torch.int16)
+        # a view of the memory mapped storage, with the strides of the tensor
+        return read_mapped(tensor.numpy(), start, stop)
+
+    def close(self):
+        self.state = {}
+
+
+def open_checkpoint(path):
+    if os.path.isdir(path):
+        return NumpyCheckpoint(path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in H5_EXTENSIONS:
+        return H5Checkpoint(path)
+    if extension in NUMPY_EXTENSIONS:
+        return NumpyCheckpoint(path)
+    if extension in TORCH_EXTENSIONS:
+        return TorchCheckpoint(path)
+    raise ValueError(
+        f"Unknown checkpoint format of {path}, expected one of {H5_EXTENSIONS + NUMPY_EXTENSIONS + TORCH_EXTENSIONS}"
+    )
+
+
+def to_float(values, dtype):
+    if dtype == "bfloat16":
+        return (values.astype(np.int32) << 16).view(np.float32).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def ordered_bits(values, dtype):
+    """Integers with the order of the floats, consecutive floats differ by 1."""
+    if dtype == "bfloat16":
+        bits = values.view(np.int16)
+    else:
+        bits = values.view({2: np.int16, 4: np.int32, 8: np.int64}[values.dtype.itemsize])
+    lowest = np.iinfo(bits.dtype).min
+    bits = bits.astype(np.int64)
+    return np.where(bits < 0, lowest - bits, bits)
+
+
+def is_float(dtype):
+    return dtype in ("float16", "bfloat16", "float32", "float64")
+
+
+def chunk_stats(values1, values2, dtype1, dtype2, offset, atol=0.0):
+    """Partial statistics of a chunk, merged over the chunks of a tensor by `merge_stats`."""
+    a = to_float(values1, dtype1)
+    if dtype1 == dtype2:
+        # only the elements with different bits can differ, most chunks are identical
+        unsigned = f"u{values1.dtype.itemsize}"
+        index = np.flatnonzero(values1.view(unsigned) != values2.view(unsigned))
+        b = to_float(values2, dtype2) if index.size else a
+    else:
+        index = np.arange(a.size)
+        b = to_float(values2, dtype2)
+    a_diff, b_diff = a[index], b[index]
+    equal = (a_diff == b_diff) | (np.isnan(a_diff) & np.isnan(b_diff))
+    with np.errstate(invalid="ignore"):
+        diff = np.abs(a_diff - b_diff)
+    diff[equal] = 0.0
+    diff[np.isnan(diff)] = np.inf
+    mismatch = diff > atol
+    mismatches = int(np.count_nonzero(mismatch))
+    sum_a2 = float(np.dot(a, a))
+    stats = {
+        "elements": a.size,
+        "max_abs_diff": float(diff.max(initial=0.0)),
+        "sum_diff2": float(np.dot(diff, diff)),
+        "sum_a2": sum_a2,
+        "sum_b2": float(np.dot(b, b)) if b is not a else sum_a2,
+        "sum_ab": float(np.dot(a, b)) if b is not a else sum_a2,
+        "mismatches": mismatches,
+        "first_mismatch": offset + int(index[np.argmax(mismatch)]) if mismatches else None,
+        "max_ulp": None,
+    }
+    if dtype1 == dtype2 and is_float(dtype1):
+        ulp = np.abs(ordered_bits(values1[index], dtype1).astype(np.float64) - ordered_bits(values2[index], dtype2))
+        ulp[equal | np.isnan(a_diff) | np.isnan(b_diff)] = 0
+        stats["max_ulp"] = int(ulp.max(initial=0))
+    return stats
+
+
+def merge_stats(stats, other):
+    if stats is None:
+        return other
+    merged = {
+        key: stats[key] + other[key] for key in ("elements", "sum_diff2", "sum_a2", "sum_b2", "sum_ab", "mismatches")
+    }
+    merged["max_abs_diff"] = max(stats["max_abs_diff"], other["max_abs_diff"])
+    firsts = [first for first in (stats["first_mismatch"], other["first_mismatch"]) if first is not None]
+    merged["first_mismatch"] = min(firsts) if firsts else None
+    merged["max_ulp"] = None if stats["max_ulp"] is None else max(stats["max_ulp"], other["max_ulp"])
+    return merged
+
+
+def _json_float(value):
+    # JSON has no infinity and NaN
+    return value if math.isfinite(value) else str(value)
+
+
+def finalize_stats(stats):
+    norm1, norm2 = math.sqrt(stats["sum_a2"]), math.sqrt(stats["sum_b2"])
+    if norm1 > 0:
+        rel_l2 = math.sqrt(stats["sum_diff2"]) / norm1
+    else:
+        rel_l2 = 0.0 if stats["sum_diff2"] == 0 else math.inf
+    if stats["sum_diff2"] == 0:
+        cosine = 1.0
+    elif norm1 > 0 and norm2 > 0:
+        cosine = stats["sum_ab"] / (norm1 * norm2)
+    else:
+        cosine = 1.0 if norm1 == norm2 else 0.0
+    return {
+        "compared": stats["elements"],
+        "max_abs_diff": _json_float(stats["max_abs_diff"]),
+        "rel_l2": _json_float(rel_l2),
+        "cosine": _json_float(cosine),
+        "max_ulp": stats["max_ulp"],
+        "mismatches": stats["mismatches"],
+        "first_mismatch": stats["first_mismatch"],
+    }
+
+
+_open_checkpoints = {}
+
+
+def _checkpoint(path):
+    # each worker opens the checkpoints once
+    if path not in _open_checkpoints:
+        _open_checkpoints[path] = open_checkpoint(path)
+    return _open_checkpoints[path]
+
+
+def _compare_chunk(path1, path2, name, start, stop, atol):
+    checkpoint1, checkpoint2 = _checkpoint(path1), _checkpoint(path2)
+    dtype1, dtype2 = checkpoint1.tensors()[name][1], checkpoint2.tensors()[name][1]
+    values1 = checkpoint1.read(name, start, stop)
+    values2 = checkpoint2.read(name, start, stop)
+    return chunk_stats(values1, values2, dtype1, dtype2, start, atol)
+
+
+def chunk_ranges(numel, chunk_elements, alignment=1):
+    """Ranges of the flattened tensor, a multiple of `alignment` elements long."""
+    alignment = max(alignment, 1)
+    step = max(chunk_elements // alignment, 1) * alignment
+    return [(start, min(start + step, numel)) for start in range(0, numel, step)] or [(0, 0)]
+
+
+def plan(pairs, chunk_elements):
+    """Report entries of the tensors of each pair of checkpoints and the chunks to compare."""
+    reports, tasks = [], []
+    for path1, path2 in pairs:
+        checkpoint1, checkpoint2 = open_checkpoint(path1), open_checkpoint(path2)
+        tensors1, tensors2 = checkpoint1.tensors(), checkpoint2.tensors()
+        report = {"checkpoint1": path1, "checkpoint2": path2, "tensors": {}}
+        for name in list(tensors1) + [name for name in tensors2 if name not in tensors1]:
+            if name not in tensors2 or name not in tensors1:
+                missing = "checkpoint2" if name not in tensors2 else "checkpoint1"
+                shape, dtype = tensors1.get(name) or tensors2.get(name)
+                report["tensors"][name] = {"status": f"missing in {missing}", "shape": list(shape), "dtype": dtype}
+                continue
+            (shape1, dtype1), (shape2, dtype2) = tensors1[name], tensors2[name]
+            entry = {"status": "not compared", "shape": list(shape1), "dtype1": dtype1, "dtype2": dtype2}
+            report["tensors"][name] = entry
+            if tuple(shape1) != tuple(shape2):
+                entry.update(status="shape mismatch", shape2=list(shape2))
+                continue
+            numel = math.prod(shape1)
+            alignment = max(checkpoint1.alignment(name), checkpoint2.alignment(name))
+            for start, stop in chunk_ranges(numel, chunk_elements, alignment):
+                tasks.append((len(reports), path1, path2, name, start, stop))
+        checkpoint1.close()
+        checkpoint2.close()
+        reports.append(report)
+    return reports, tasks
+
+
+def compare(pairs, chunk_elements=DEFAULT_CHUNK_ELEMENTS, workers=None, atol=0.0, fail_fast=False):
+    """
+    Compare each pair of checkpoint paths, with `workers` processes (all the cores if None, in
+    this process if 0). With `fail_fast` the comparison stops after the first mismatching chunk.
+    Returns the report, a dictionary that can be written as JSON.
+    """
+    reports, tasks = plan(pairs, chunk_elements)
+    stats = {}
+    stopped_early = False
+
+    def collect(task, result):
+        key = (task[0], task[3])
+        stats[key] = merge_stats(stats.get(key), result)
+        return result["mismatches"] > 0
+
+    if workers == 0:
+        for task in tasks:
+            if collect(task, _compare_chunk(*task[1:], atol)) and fail_fast:
+                stopped_early = True
+                break
+    else:
+        workers = workers or os.cpu_count()
+        pending = iter(tasks)
+        in_flight = {}
+        with ProcessPoolExecutor(workers) as executor:
+            # a bounded number of chunks in flight keeps the results of the workers from piling up
+            while True:
+                while not stopped_early and len(in_flight) < 2 * workers:
+                    task = next(pending, None)
+                    if task is None:
+                        break
+                    in_flight[executor.submit(_compare_chunk, *task[1:], atol)] = task
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if collect(in_flight.pop(future), future.result()) and fail_fast:
+                        stopped_early = True
+
+    for (report_idx, name), tensor_stats in stats.items():
+        entry = reports[report_idx]["tensors"][name]
+        entry.update(finalize_stats(tensor_stats))
+        numel = math.prod(entry["shape"])
+        if entry["mismatches"] > 0:
+            entry["status"] = "different"
+        elif entry["compared"] == numel:
+            entry["status"] = "equal"
+    for report in reports:
+        report["equal"] = all(entry["status"] == "equal" for entry in report["tensors"].values())
+    return {
+        "chunk_elements": chunk_elements,
+        "atol": atol,
+        "equal": all(report["equal"] for report in reports),
+        "stopped_early": stopped_early,
+        "checkpoints": reports,
+    }
+
+
+def checkpoint_pairs(path1, path2, pattern="*"):
+    """Pair the checkpoint files of two folders by relative path, or two checkpoint files."""
+    if not (os.path.isdir(path1) and os.path.isdir(path2)):
+        return [(path1, path2)]
+    extensions = H5_EXTENSIONS + TORCH_EXTENSIONS
+
+    def files(folder):
+        paths = glob.glob(os.path.join(folder, "**", pattern), recursive=True)
+        return sorted(os.path.relpath(path, folder) for path in paths if path.lower().endswith(extensions))
+
+    files1, files2 = files(path1), files(path2)
+    if not files1 and not files2:
+        # folders of .npy files
+        return [(path1, path2)]
+    if files1 != files2:
+        raise ValueError(
+            f"The checkpoints in {path1} and {path2} do not match: "
+            f"{sorted(set(files1) ^ set(files2))} are in only one of them."
+        )
+    return [(os.path.join(path1, file), os.path.join(path2, file)) for file in files1]
+
+
+def print_report(report, colored=None):
+    colored = colored or (lambda text, color: text)
+    for checkpoint in report["checkpoints"]:
+        print(f"evaluating {checkpoint['checkpoint1']} and {checkpoint['checkpoint2']}")
+        for name, entry in checkpoint["tensors"].items():
+            if entry["status"] == "equal":
+                print(colored(f"\t{name}", "green"))
+            elif entry["status"] == "different":
+                print(
+                    colored(
+                        f"\t{name} max abs diff {entry['max_abs_diff']}, relative L2 {entry['rel_l2']}, "
+                        f"cosine {entry['cosine']}, max ULP {entry['max_ulp']}, "
+                        f"{entry['mismatches']} mismatches from element {entry['first_mismatch']}",
+                        "red",
+                    )
+                )
+            else:
+                print(colored(f"\t{name} {entry['status']}", "red"))
+    if report["stopped_early"]:
+        print("Stopped at the first mismatch, the tensors not compared are reported as such.")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Streaming comparison of two checkpoints or two sets of checkpoints")
+    parser.add_argument("path1", type=str, help="Checkpoint file, folder of .npy files, or folder of checkpoints")
+    parser.add_argument("path2", type=str, help="Checkpoint file, folder of .npy files, or folder of checkpoints")
+    parser.add_argument("--pattern", type=str, default="*", help="Glob of the checkpoint files in the folders")
+    parser.add_argument(
+        "--chunk-elements", type=int, default=DEFAULT_CHUNK_ELEMENTS, help="Number of elements compared per task"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of processes, all the cores by default, 0 runs in process"
+    )
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute difference above which elements mismatch")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop at the first mismatch")
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report, - for stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = compare(
+        checkpoint_pairs(args.path1, args.path2, args.pattern),
+        chunk_elements=args.chunk_elements,
+        workers=args.workers,
+        atol=args.atol,
+        fail_fast=args.fail_fast,
+    )
+    if args.report == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+        if args.report is not None:
+            with open(args.report, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+    sys.exit(0 if report["equal"] else 1)
@@ -0,0 +1,246 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+
+UTILS_DIR = Path(__file__).absolute().parent.parent
+sys.path.append(str(UTILS_DIR))
+from benchmark_checkpoint_diff import PeakMemory, memory_usage
+from checkpoint_diff import checkpoint_pairs, compare, open_checkpoint
+from inspect_h5_checkpoint import inspect_checkpoint
+
+
+def save(path, tensors):
+    """Write a dictionary of numpy arrays or torch tensors in the format of the extension of the path"""
+    path = str(path)
+    if path.endswith(".h5"):
+        with h5py.File(path, "w") as f:
+            for name, value in tensors.items():
+                f.create_dataset(name, data=value)
+    elif path.endswith(".pt"):
+        torch.save({name: torch.as_tensor(value) for name, value in tensors.items()}, path)
+    else:
+        ((_, value),) = tensors.items()
+        np.save(path, value)
+    return path
+
+
+def single_tensor(report):
+    ((entry,),) = [list(checkpoint["tensors"].values()) for checkpoint in report["checkpoints"]]
+    return entry
+
+
+def weights(seed=0, shape=(37, 11), dtype=np.float32):
+    return np.random.default_rng(seed).normal(size=shape).astype(dtype)
+
+
+@pytest.mark.parametrize("extension", [".h5", ".npy", ".pt"])
+@pytest.mark.parametrize("workers", [0, 2])
+def test_formats(tmp_path, extension, workers):
+    a = weights()
+    b = a.copy()
+    b[20, 3] = np.nextafter(b[20, 3], np.float32(np.inf))
+    path_a = save(tmp_path / f"a{extension}", {"w": a})
+    path_b = save(tmp_path / f"b{extension}", {"w": b})
+
+    report = compare([(path_a, path_a)], chunk_elements=50, workers=workers)
+    assert report["equal"] and single_tensor(report)["status"] == "equal"
+    assert single_tensor(report)["compared"] == a.size
+
+    report = compare([(path_a, path_b)], chunk_elements=50, workers=workers)
+    entry = single_tensor(report)
+    assert not report["equal"]
+    assert entry["status"] == "different"
+    assert entry["max_ulp"] == 1
+    assert entry["mismatches"] == 1
+    assert entry["first_mismatch"] == 20 * 11 + 3
+    assert entry["max_abs_diff"] == pytest.approx(float(b[20, 3]) - float(a[20, 3]))
+
+
+def test_statistics(tmp_path):
+    a = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 0.0], dtype=np.float32)
+    b = np.array([1.0, 2.0, 3.5, 4.0, 4.0, 0.0], dtype=np.float32)
+    report = compare([(save(tmp_path / "a.npy", {"w": a}), save(tmp_path / "b.npy", {"w": b}))], 4, workers=0)
+    entry = single_tensor(report)
+    assert entry["mismatches"] == 2
+    assert entry["first_mismatch"] == 2
+    assert entry["max_abs_diff"] == 1.0
+    # 3.5 is 2**20 float32 ULPs above 3, and 4 is 2**21 ULPs below 5, as the spacing doubles at 4
+    assert entry["max_ulp"] == 2**21
+    assert entry["rel_l2"] == pytest.approx(np.linalg.norm(a - b) / np.linalg.norm(a))
+    assert entry["cosine"] == pytest.approx(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    report = compare([(tmp_path / "a.npy", tmp_path / "b.npy")], 4, workers=0, atol=0.6)
+    assert single_tensor(report)["mismatches"] == 1
+    assert single_tensor(report)["first_mismatch"] == 4
+
+
+def test_nan_and_infinity(tmp_path):
+    a = np.array([np.nan, np.inf, 1.0, 2.0, np.nan], dtype=np.float32)
+    b = np.array([np.nan, np.inf, 1.0, np.nan, 3.0], dtype=np.float32)
+    entry = single_tensor(compare([(save(tmp_path / "a.npy", {"w": a}), save(tmp_path / "b.npy", {"w": b}))], 2, 0))
+    # the NaNs and infinities in the same places are equal, a NaN against a number is an infinite difference
+    assert entry["mismatches"] == 2
+    assert entry["first_mismatch"] == 3
+    assert entry["max_abs_diff"] == "inf"
+
+
+def test_bfloat16(tmp_path):
+    a = torch.randn(64, 5, generator=torch.Generator().manual_seed(0)).to(torch.bfloat16)
+    b = a.clone()
+    b.view(torch.int16)[10, 2] += 3
+    path_a, path_b = save(tmp_path / "a.pt", {"w": a}), save(tmp_path / "b.pt", {"w": b})
+    assert open_checkpoint(path_a).tensors() == {"w": ((64, 5), "bfloat16")}
+
+    entry = single_tensor(compare([(path_a, path_b)], chunk_elements=16, workers=0))
+    assert entry["max_ulp"] == 3
+    assert entry["first_mismatch"] == 52
+    assert entry["max_abs_diff"] == pytest.approx(abs(b[10, 2].item() - a[10, 2].item()))
+
+
+@pytest.mark.parametrize("chunk_elements", [1, 7, 40, 1000])
+def test_non_contiguous(tmp_path, chunk_elements):
+    a = torch.from_numpy(weights(shape=(6, 4, 5)))
+    transposed = a.permute(2, 0, 1)
+    changed = transposed.contiguous()
+    changed[3, 1, 2] += 1.0
+    path_transposed = save(tmp_path / "transposed.pt", {"w": transposed})
+    path_contiguous = save(tmp_path / "contiguous.pt", {"w": transposed.contiguous()})
+    path_changed = save(tmp_path / "changed.pt", {"w": changed})
+
+    report = compare([(path_transposed, path_contiguous)], chunk_elements=chunk_elements, workers=0)
+    assert report["equal"]
+    assert single_tensor(report)["compared"] == a.numel()
+    entry = single_tensor(compare([(path_transposed, path_changed)], chunk_elements=chunk_elements, workers=0))
+    assert entry["mismatches"] == 1
+    assert entry["first_mismatch"] == 3 * 24 + 1 * 4 + 2
+
+
+def test_fortran_order_npy(tmp_path):
+    a = weights()
+    path_fortran = save(tmp_path / "fortran.npy", {"w": np.asfortranarray(a)})
+    path_c = save(tmp_path / "c.npy", {"w": a})
+    report = compare([(path_fortran, path_c)], chunk_elements=13, workers=0)
+    assert report["equal"]
+
+
+@pytest.mark.parametrize("extension", [".h5", ".npy", ".pt"])
+@pytest.mark.parametrize("shape", [(0,), (4, 0), (0, 3)])
+def test_empty_tensors(tmp_path, extension, shape):
+    path_a = save(tmp_path / f"a{extension}", {"w": np.zeros(shape, dtype=np.float32)})
+    path_b = save(tmp_path / f"b{extension}", {"w": np.zeros(shape, dtype=np.float32)})
+    report = compare([(path_a, path_b)], chunk_elements=2, workers=0)
+    assert report["equal"]
+    assert single_tensor(report)["compared"] == 0
+
+
+def test_mismatching_tensors(tmp_path):
+    a = weights()
+    path_a = save(tmp_path / "a.h5", {"same": a, "shape": a, "dtype": a, "only_a": a})
+    path_b = save(tmp_path / "b.h5", {"same": a, "shape": a.T, "dtype": a.astype(np.float16), "only_b": a})
+    report = compare([(path_a, path_b)], chunk_elements=100, workers=0)
+    tensors = report["checkpoints"][0]["tensors"]
+    assert not report["equal"]
+    assert tensors["same"]["status"] == "equal"
+    assert tensors["shape"]["status"] == "shape mismatch"
+    assert tensors["shape"]["shape2"] == [11, 37]
+    # tensors of different types are compared by value, without ULPs
+    assert tensors["dtype"]["status"] == "different"
+    assert tensors["dtype"]["max_ulp"] is None
+    assert tensors["dtype"]["max_abs_diff"] == pytest.approx(np.abs(a - a.astype(np.float16)).max())
+    assert tensors["only_a"]["status"] == "missing in checkpoint2"
+    assert tensors["only_b"]["status"] == "missing in checkpoint1"
+
+
+def test_fail_fast(tmp_path):
+    a = {f"layer{idx}": weights(idx) for idx in range(4)}
+    b = {name: value + 1 for name, value in a.items()}
+    pairs = [(save(tmp_path / "a.h5", a), save(tmp_path / "b.h5", b))]
+    # the chunks of h5 datasets are whole rows, 3 rows of 11 elements
+
+    report = compare(pairs, chunk_elements=33, workers=0, fail_fast=True)
+    tensors = report["checkpoints"][0]["tensors"]
+    assert report["stopped_early"]
+    assert tensors["layer0"] == {**tensors["layer0"], "status": "different", "compared": 33, "first_mismatch": 0}
+    assert [tensors[f"layer{idx}"]["status"] for idx in range(1, 4)] == ["not compared"] * 3
+
+    report = compare(pairs, chunk_elements=33, workers=0)
+    assert not report["stopped_early"]
+    assert all(entry["status"] == "different" for entry in report["checkpoints"][0]["tensors"].values())
+
+
+def test_checkpoint_pairs(tmp_path):
+    for folder in ("set1", "set2"):
+        (tmp_path / folder / "sub").mkdir(parents=True)
+        save(tmp_path / folder / "sub" / "ckpt.h5", {"w": weights()})
+        save(tmp_path / folder / "ckpt.pt", {"w": weights()})
+    pairs = checkpoint_pairs(str(tmp_path / "set1"), str(tmp_path / "set2"))
+    assert [Path(path1).relative_to(tmp_path / "set1") for path1, _ in pairs] == [Path("ckpt.pt"), Path("sub/ckpt.h5")]
+    save(tmp_path / "set1" / "extra.h5", {"w": weights()})
+    with pytest.raises(ValueError, match="extra.h5"):
+        checkpoint_pairs(str(tmp_path / "set1"), str(tmp_path / "set2"))
+
+
+@pytest.mark.parametrize("extension", [".h5", ".npy", ".pt"])
+def test_peak_rss_is_bounded(tmp_path, extension):
+    # 2 x 128 MiB checkpoints, compared in 4 MiB chunks
+    a = np.arange(1 << 25, dtype=np.float32).reshape(1 << 12, 1 << 13)
+    pairs = [(save(tmp_path / f"a{extension}", {"w": a}), save(tmp_path / f"b{extension}", {"w": a}))]
+    del a
+    rss_before, _ = memory_usage("self")
+    with PeakMemory(interval=0.01) as peak:
+        report = compare(pairs, chunk_elements=1 << 20, workers=0)
+    assert report["equal"]
+    # the pages of the files are released, the RSS does not grow with the size of the checkpoints
+    assert peak.peak_rss - rss_before < 64
+
+
+def test_compare_two_ckpt_sets(tmp_path):
+    for folder, offset in (("set1", 0), ("set2", 0), ("set3", 1)):
+        (tmp_path / folder).mkdir()
+        save(tmp_path / folder / "ckpt.h5", {"w": weights() + offset})
+    report_path = tmp_path / "report.json"
+
+    def run(path_set2):
+        command = [sys.executable, "compare_two_ckpt_sets.py", "--path-set1", str(tmp_path / "set1")]
+        command += ["--path-set2", str(tmp_path / path_set2), "--workers", "1", "--report", str(report_path)]
+        return subprocess.run(command, cwd=UTILS_DIR, capture_output=True, text=True)
+
+    assert run("set2").returncode == 0
+    assert json.loads(report_path.read_text())["equal"]
+    result = run("set3")
+    assert result.returncode == 1
+    assert "w max abs diff 1.0" in result.stdout
+    assert json.loads(report_path.read_text())["checkpoints"][0]["tensors"]["w"]["mismatches"] == 37 * 11
+
+
+def test_checkpoint_diff_json_report(tmp_path):
+    path_a = save(tmp_path / "a.npy", {"w": weights()})
+    path_b = save(tmp_path / "b.npy", {"w": weights(1)})
+    command = [sys.executable, "checkpoint_diff.py", path_a, path_b, "--workers", "0", "--report", "-"]
+    result = subprocess.run(command, cwd=UTILS_DIR, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert json.loads(result.stdout)["checkpoints"][0]["tensors"]["tensor"]["status"] == "different"
+
+
+def test_inspect_h5_checkpoint(tmp_path):
+    path = save(tmp_path / "ckpt.h5", {"group/w": weights(dtype=np.float16), "b": np.ones(3, dtype=np.float32)})
+    tensors = inspect_checkpoint(path, all_tensors=True)
+    assert set(tensors) == {"group", "group/w", "b"}
+    assert tensors["group"] is None
+    # the tensors keep the dtype of the checkpoint
+    assert tensors["group/w"].dtype == np.float16
+    np.testing.assert_array_equal(tensors["group/w"], weights(dtype=np.float16))
+
+    assert inspect_checkpoint(path, tensor_names=["b"]).keys() == {"b"}
+    assert inspect_checkpoint(path, all_tensor_names=True) == {"group": None, "group/w": None, "b": None}
+    with pytest.raises(ValueError):
+        inspect_checkpoint(path)
+    with pytest.raises(ValueError, match="does not exist"):
+        inspect_checkpoint(str(tmp_path / "missing.h5"), all_tensors=True)
@@ -1,40 +1,37 @@
 # Copyright (c) 2022 Graphcore Ltd. All rights reserved.
 
-import glob
-import numpy as np
-from os import path
 import argparse
+import json
+import sys
 from termcolor import colored
-from inspect_h5_checkpoint import inspect_checkpoint
+from checkpoint_diff import DEFAULT_CHUNK_ELEMENTS, checkpoint_pairs, compare, print_report
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--path-set1", type=str, default="", help="Base directory with checkpoints.")
     parser.add_argument("--path-set2", type=str, default="", help="Base directory with checkpoints.")
+    parser.add_argument("--pattern", type=str, default="*.h5", help="Glob of the checkpoint files.")
+    parser.add_argument(
+        "--chunk-elements", type=int, default=DEFAULT_CHUNK_ELEMENTS, help="Number of elements compared per task."
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes, all the cores by default.")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute difference above which weights mismatch.")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop at the first mismatch.")
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report.")
     args = parser.parse_args()
     print(args)
 
-    ckpt_filenames1 = glob.glob(path.join(args.path_set1, "*.h5"))
-    ckpt_filenames2 = glob.glob(path.join(args.path_set2, "*.h5"))
-
-    for ckpt1, ckpt2 in zip(ckpt_filenames1, ckpt_filenames2):
-
-        print(f'evaluating {ckpt1.split("/")[-1]}')
-        layers_from_all_ckpts = []
-
-        weights_ckpt1 = inspect_checkpoint(file_name=ckpt1, all_tensors=True)
-        weights_ckpt2 = inspect_checkpoint(file_name=ckpt2, all_tensors=True)
-
-        for (name1, weights1), (name2, weights2) in zip(weights_ckpt1.items(), weights_ckpt2.items()):
-            if name1 != name2:
-                raise ValueError(
-                    f"In comparison of {ckpt1} and {ckpt2} layer names do not match {name1} != {name2}. "
-                    f"Compared models must have the same architecture and follow the same names."
-                )
-
-            if np.array_equal(weights1, weights2):
-                print(colored(f"\t{name1}", "green"))
-            else:
-                total_difference = float(np.sum(np.abs(weights1 - weights2)))
-                print(colored(f"\t{name1} {total_difference:.5f}", "red"))
+    # the checkpoints are streamed in chunks, the host memory does not depend on their size
+    report = compare(
+        checkpoint_pairs(args.path_set1, args.path_set2, args.pattern),
+        chunk_elements=args.chunk_elements,
+        workers=args.workers,
+        atol=args.atol,
+        fail_fast=args.fail_fast,
+    )
+    print_report(report, colored)
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    sys.exit(0 if report["equal"] else 1)
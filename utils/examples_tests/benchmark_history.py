@@ -0,0 +1,372 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+"""History of the metrics of the example test runs, and regression detection over it"""
+
+import os
+import re
+import socket
+import sqlite3
+import subprocess
+import time
+from statistics import mean, median
+from typing import Dict, NamedTuple, Optional
+
+HISTORY_PATH_ENV = "EXAMPLES_BENCHMARK_HISTORY"
+
+# Scale of the median absolute deviation to estimate the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# Smallest robust standard deviation, relative to the median, so that the float noise of a metric
+# whose history is constant, such as the loss of a seeded run, is not reported as a change
+MIN_RELATIVE_SCALE = 1e-4
+
+SPEED_METRICS = {"sec/itr": r"([\d.]+) +sec/itr. +[\d.]+", "items/sec": r"[\d.]+ +sec/itr. +([\d.]+)"}
+ACCURACY_METRICS = {"accuracy": r"Accuracy=([\d.]+)\%"}
+LOSS_METRICS = {"loss": r"Loss=([\d.]+)"}
+
+
+def parse_metrics(output, metrics, reduction=mean):
+    """Parse each metric of a test's output with its regex and reduce its values
+
+    Args:
+        output: String representing the output of a test.
+        metrics: Dictionary of metric names and regexes with one group
+            matching the value of the metric.
+        reduction: Function reducing the list of values of each metric to
+            a single value, for example `mean` or the last value.
+
+    Returns:
+        A dictionary of metric names and values. The metrics which are not
+        found in the output are missing.
+    """
+    values = {}
+    for name, regex in metrics.items():
+        matches = [float(match.group(1)) for match in re.finditer(regex, output)]
+        if matches:
+            values[name] = reduction(matches)
+    return values
+
+
+def git_revision(cwd=None):
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=cwd, stderr=subprocess.DEVNULL).decode().strip()
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return "unknown"
+
+
+class BenchmarkHistory:
+    """
+    SQLite store of the metrics of the test runs. Each run is tagged with
+    the model, the config, the git revision and the host it ran on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp REAL NOT NULL,
+                    model TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    revision TEXT NOT NULL,
+                    host TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS metrics (
+                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                    name TEXT NOT NULL,
+                    value REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS runs_model_config ON runs(model, config);
+                """
+            )
+
+    @classmethod
+    def from_env(cls):
+        """Returns the history at the path of the `EXAMPLES_BENCHMARK_HISTORY` variable, or None if it's not set"""
+        path = os.environ.get(HISTORY_PATH_ENV)
+        return cls(path) if path else None
+
+    def _connect(self):
+        # several test processes may write at the same time
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, model, config, metrics, revision=None, host=None, timestamp=None):
+        """Store the metrics of a run, returns the id of the run"""
+        revision = git_revision() if revision is None else revision
+        host = socket.gethostname() if host is None else host
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (timestamp, model, config, revision, host) VALUES (?, ?, ?, ?, ?)",
+                (timestamp, model, config, revision, host),
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in metrics.items()],
+            )
+        return run_id
+
+    def values(self, model, config, metric, host=None):
+        """Returns the (revision, value) of the metric in each run, oldest first"""
+        query = (
+            "SELECT runs.revision, metrics.value FROM runs JOIN metrics ON metrics.run_id = runs.id "
+            "WHERE runs.model = ? AND runs.config = ? AND metrics.name = ?"
+        )
+        parameters = [model, config, metric]
+        if host is not None:
+            query += " AND runs.host = ?"
+            parameters.append(host)
+        with self._connect() as connection:
+            return connection.execute(query + " ORDER BY runs.timestamp, runs.id", parameters).fetchall()
+
+    def series(self):
+        """Returns the (model, config, metric) of each recorded series"""
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT DISTINCT runs.model, runs.config, metrics.name FROM runs "
+                "JOIN metrics ON metrics.run_id = runs.id ORDER BY runs.model, runs.config, metrics.name"
+            ).fetchall()
+
+
+def robust_std(values):
+    """Standard deviation estimated from the median absolute deviation, insensitive to outliers"""
+    centre = median(values)
+    return MAD_SCALE * median(abs(value - centre) for value in values)
+
+
+def floor_scale(scale, centre):
+    """The robust standard deviation, at least `MIN_RELATIVE_SCALE` of the median"""
+    return max(scale, MIN_RELATIVE_SCALE * abs(centre))
+
+
+def robust_z_score(value, history):
+    """Number of robust standard deviations between the value and the median of the history"""
+    centre = median(history)
+    scale = floor_scale(robust_std(history), centre)
+    if scale == 0:
+        # all the history is zero, any change is significant
+        return 0.0 if value == centre else float("inf") if value > centre else float("-inf")
+    return (value - centre) / scale
+
+
+def change_point(values, min_segment=3):
+    """Find the most likely single shift of the median of a series
+
+    The series is split at each index leaving at least `min_segment` values on
+    both sides, and the split with the largest shift of the median, relative to
+    the robust standard deviation of both segments, is kept.
+
+    Returns:
+        A tuple of the index of the first value after the shift and the shift
+        in robust standard deviations, or None if the series is too short.
+    """
+    best = None
+    for index in range(min_segment, len(values) - min_segment + 1):
+        before, after = values[:index], values[index:]
+        median_before, median_after = median(before), median(after)
+        residuals = [value - median_before for value in before] + [value - median_after for value in after]
+        scale = floor_scale(
+            MAD_SCALE * median(abs(residual) for residual in residuals), max(abs(median_before), abs(median_after))
+        )
+        shift = median_after - median_before
+        score = abs(shift) / scale if scale > 0 else (float("inf") if shift != 0 else 0.0)
+        if best is None or score > abs(best[1]):
+            best = (index, score if shift >= 0 else -score)
+    return best
+
+
+def theil_sen_slope(values):
+    """Median of the slopes between all the pairs of points of the series"""
+    slopes = [(values[j] - values[i]) / (j - i) for i in range(len(values)) for j in range(i + 1, len(values))]
+    return median(slopes) if slopes else 0.0
+
+
+def run_to_run_noise(values):
+    """Robust standard deviation of the noise between consecutive runs, insensitive to trends and shifts"""
+    differences = [after - before for before, after in zip(values, values[1:])]
+    return robust_std(differences) / 2**0.5 if differences else 0.0
+
+
+def is_noisy(values, tolerance=None, max_relative_std=0.05):
+    """A series is noisy if 2 standard deviations of its run to run noise are wider than the tolerance of its checks
+
+    Args:
+        values: The values of a metric in the previous runs.
+        tolerance: The relative tolerance (between 0.0 and 1.0) applied to the
+            metric by the test, if any.
+        max_relative_std: The relative standard deviation of the noise above
+            which a metric is noisy, when no tolerance is given.
+    """
+    centre = median(values)
+    if centre == 0:
+        return False
+    relative_std = run_to_run_noise(values) / abs(centre)
+    if tolerance is not None:
+        return 2 * relative_std > tolerance
+    return relative_std > max_relative_std
+
+
+class Verdict(NamedTuple):
+    metric: str
+    value: float
+    status: str
+    z_score: Optional[float] = None
+    history_size: int = 0
+
+    def __str__(self):
+        if self.z_score is None:
+            return f"{self.metric} = {self.value}: {self.status} ({self.history_size} previous runs)"
+        return (
+            f"{self.metric} = {self.value}: {self.status} "
+            f"(robust z-score {self.z_score:.2f} over {self.history_size} previous runs)"
+        )
+
+
+def check_value(metric, value, history, higher_is_better=True, z_threshold=3.5, min_history=5):
+    """Compare a new value of a metric with its history with a robust z-score
+
+    Returns:
+        A Verdict with the status "regression" or "improvement" if the value
+        is more than `z_threshold` robust standard deviations away from the
+        median of the history, "ok" if it is not, or "insufficient history"
+        if there are less than `min_history` previous values.
+    """
+    if len(history) < min_history:
+        return Verdict(metric, value, "insufficient history", history_size=len(history))
+    z_score = robust_z_score(value, history)
+    better = z_score if higher_is_better else -z_score
+    if better < -z_threshold:
+        status = "regression"
+    elif better > z_threshold:
+        status = "improvement"
+    else:
+        status = "ok"
+    return Verdict(metric, value, status, z_score, len(history))
+
+
+class BenchmarkCheck:
+    """
+    Parses the metrics of a test's output, checks them against the history of
+    the previous runs, then records them in the history.
+
+    Pass it as the `benchmark` argument of `run_test_helper` or of
+    `SubProcessChecker.run_command`. If no history is given, the history
+    at the path of the `EXAMPLES_BENCHMARK_HISTORY` variable is used, and the
+    check does nothing if the variable is not set.
+
+    Args:
+        model: Name of the model.
+        config: Name of the configuration of the test.
+        metrics: Dictionary of metric names and regexes with one group
+            matching the value of the metric.
+        lower_is_better: Names of the metrics for which a decrease is an
+            improvement, such as the loss or the time per iteration.
+        history: Optional BenchmarkHistory.
+        z_threshold: Robust z-score beyond which a value is a regression.
+        min_history: Number of previous runs needed to detect a regression.
+        same_host: Only compare with the previous runs on the same host.
+    """
+
+    def __init__(
+        self,
+        model,
+        config,
+        metrics,
+        lower_is_better=("sec/itr", "loss"),
+        history=None,
+        z_threshold=3.5,
+        min_history=5,
+        same_host=False,
+    ):
+        self.model = model
+        self.config = config
+        self.metrics = metrics
+        self.lower_is_better = set(lower_is_better)
+        self.history = BenchmarkHistory.from_env() if history is None else history
+        self.z_threshold = z_threshold
+        self.min_history = min_history
+        self.same_host = same_host
+
+    def __call__(self, output) -> Dict[str, Verdict]:
+        """
+        Raises:
+            AssertionError: if a metric regressed. The metrics are recorded
+                in the history first.
+        """
+        values = parse_metrics(output, self.metrics)
+        if self.history is None:
+            return {}
+        host = socket.gethostname() if self.same_host else None
+        verdicts = {}
+        for name, value in values.items():
+            history = [previous for _, previous in self.history.values(self.model, self.config, name, host=host)]
+            verdicts[name] = check_value(
+                name, value, history, name not in self.lower_is_better, self.z_threshold, self.min_history
+            )
+        self.history.record(self.model, self.config, values)
+        regressions = [str(verdict) for verdict in verdicts.values() if verdict.status == "regression"]
+        if regressions:
+            raise AssertionError(f"{self.model} {self.config} regressed:\n" + "\n".join(regressions))
+        return verdicts
+
+
+def trend_report(history, tolerances=None, last_runs=20, shift_threshold=3.5):
+    """Table of the trend of each metric in the history
+
+    Args:
+        history: A BenchmarkHistory.
+        tolerances: Optional dictionary of metric names and the relative
+            tolerances (between 0.0 and 1.0) of their static checks, used to
+            flag the noisy metrics.
+        last_runs: Number of runs of each metric the trend is computed on.
+        shift_threshold: Shift of the median, in robust standard deviations,
+            above which the most likely change point is reported.
+
+    Returns:
+        A string with a row for each model, config and metric: the number of
+        runs, the last value, the median, the relative standard deviation of
+        the run to run noise, the slope per run relative to the median, the
+        revision of the most likely shift of the median and whether the
+        metric is noisy.
+    """
+    tolerances = tolerances or {}
+    header = ["model", "config", "metric", "runs", "last", "median", "noise", "slope/run", "shift at", "noisy"]
+    rows = []
+    for model, config, metric in history.series():
+        revisions, values = zip(*history.values(model, config, metric))
+        revisions, values = revisions[-last_runs:], values[-last_runs:]
+        centre = median(values)
+        relative = (lambda value: value / abs(centre)) if centre != 0 else (lambda value: float("nan"))
+        shift = change_point(values)
+        shift_at = f"{revisions[shift[0]][:10]} ({shift[1]:+.1f})" if shift and abs(shift[1]) > shift_threshold else "-"
+        rows.append(
+            [
+                model,
+                config,
+                metric,
+                str(len(values)),
+                f"{values[-1]:.4g}",
+                f"{centre:.4g}",
+                f"{relative(run_to_run_noise(values)):.1%}",
+                f"{relative(theil_sen_slope(values)):+.2%}",
+                shift_at,
+                "yes" if len(values) > 2 and is_noisy(values, tolerances.get(metric)) else "no",
+            ]
+        )
+    widths = [max(len(row[column]) for row in [header] + rows) for column in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header] + rows]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the trend of each metric of the benchmark history")
+    parser.add_argument("--history", default=os.environ.get(HISTORY_PATH_ENV), help="Path of the SQLite history")
+    parser.add_argument("--last-runs", type=int, default=20, help="Number of runs the trends are computed on")
+    args = parser.parse_args()
+    print(trend_report(BenchmarkHistory(args.history), last_runs=args.last_runs))
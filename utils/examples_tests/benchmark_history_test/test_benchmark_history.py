@@ -0,0 +1,117 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import random
+import sys
+
+import pytest
+
+from examples_tests.benchmark_history import (
+    ACCURACY_METRICS,
+    SPEED_METRICS,
+    BenchmarkCheck,
+    BenchmarkHistory,
+    change_point,
+    check_value,
+    parse_metrics,
+    trend_report,
+)
+from examples_tests.test_util import SubProcessChecker, run_test_helper
+
+
+def synthetic_log(items_per_second, sec_per_itr=0.5, accuracy=75.0, steps=3):
+    lines = ["Compiling the model", " On 2 IPUs."]
+    for step in range(steps):
+        lines.append(f"{sec_per_itr:.4f} sec/itr. {items_per_second + step * 0.01:.2f} items/sec")
+    lines.append(f"   Accuracy={accuracy}%")
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def history(tmp_path):
+    return BenchmarkHistory(str(tmp_path / "history.sqlite"))
+
+
+def fill(history, values, model="resnet", config="bs16", host="host0"):
+    for run, value in enumerate(values):
+        history.record(model, config, {"items/sec": value}, revision=f"rev{run}", host=host, timestamp=run)
+
+
+def test_parse_metrics():
+    metrics = parse_metrics(synthetic_log(100.0), {**SPEED_METRICS, **ACCURACY_METRICS})
+    assert metrics == pytest.approx({"sec/itr": 0.5, "items/sec": 100.01, "accuracy": 75.0})
+    assert parse_metrics("no results", SPEED_METRICS) == {}
+
+
+def test_history_round_trip(history):
+    fill(history, [1.0, 2.0], host="host0")
+    fill(history, [3.0], host="host1")
+    assert history.values("resnet", "bs16", "items/sec") == [("rev0", 1.0), ("rev0", 3.0), ("rev1", 2.0)]
+    assert [value for _, value in history.values("resnet", "bs16", "items/sec", host="host1")] == [3.0]
+    assert history.values("resnet", "bs32", "items/sec") == []
+    assert history.series() == [("resnet", "bs16", "items/sec")]
+
+
+def test_check_value():
+    rng = random.Random(0)
+    steady = [100 + rng.gauss(0, 1) for _ in range(20)]
+    assert check_value("items/sec", 100.5, steady).status == "ok"
+    assert check_value("items/sec", 90.0, steady).status == "regression"
+    assert check_value("items/sec", 110.0, steady).status == "improvement"
+    assert check_value("sec/itr", 110.0, steady, higher_is_better=False).status == "regression"
+    assert check_value("items/sec", 10.0, steady[:3]).status == "insufficient history"
+    # an outlier in the history does not hide a regression
+    assert check_value("items/sec", 90.0, steady + [1000.0]).status == "regression"
+
+
+def test_check_value_constant_history():
+    # a deterministic metric, such as the loss of a seeded run
+    constant = [2.345678] * 10
+    assert check_value("loss", 2.345678, constant, higher_is_better=False).status == "ok"
+    assert check_value("loss", 2.345678 + 1e-6, constant, higher_is_better=False).status == "ok"
+    assert check_value("loss", 2.4, constant, higher_is_better=False).status == "regression"
+    assert check_value("loss", 2.3, constant, higher_is_better=False).status == "improvement"
+
+
+def test_run_test_helper_detects_regression(history):
+    rng = random.Random(0)
+    check = BenchmarkCheck("resnet", "bs16", SPEED_METRICS, history=history)
+    for _ in range(10):
+        run_test_helper(synthetic_log, benchmark=check, items_per_second=rng.gauss(100, 1))
+    with pytest.raises(AssertionError, match="items/sec"):
+        run_test_helper(synthetic_log, benchmark=check, items_per_second=80.0)
+    # the regressed run is recorded too
+    assert len(history.values("resnet", "bs16", "items/sec")) == 11
+
+
+def test_check_without_history_only_parses(monkeypatch):
+    monkeypatch.delenv("EXAMPLES_BENCHMARK_HISTORY", raising=False)
+    assert BenchmarkCheck("resnet", "bs16", SPEED_METRICS)(synthetic_log(1.0)) == {}
+
+
+def test_sub_process_checker(history):
+    fill(history, [100.0, 101.0, 99.0, 100.5, 99.5, 100.2])
+    checker = SubProcessChecker()
+    check = BenchmarkCheck("resnet", "bs16", {"items/sec": SPEED_METRICS["items/sec"]}, history=history)
+    command = [sys.executable, "-c", "print('0.5 sec/itr. 50.0 items/sec')"]
+    with pytest.raises(AssertionError, match="regressed"):
+        checker.run_command(command, ".", ["sec/itr"], benchmark=check)
+
+
+def test_change_point():
+    rng = random.Random(0)
+    values = [100 + rng.gauss(0, 1) for _ in range(8)] + [90 + rng.gauss(0, 1) for _ in range(6)]
+    index, shift = change_point(values)
+    assert index == 8 and shift < -3.5
+    assert change_point(values[:5]) is None
+    # float noise on a constant series is not a shift
+    assert abs(change_point([1.0] * 4 + [1.0 + 1e-9] * 4)[1]) < 3.5
+
+
+def test_trend_report(history):
+    rng = random.Random(0)
+    fill(history, [100 + rng.gauss(0, 0.5) for _ in range(8)] + [90 + rng.gauss(0, 0.5) for _ in range(6)])
+    fill(history, [100 + rng.gauss(0, 20) for _ in range(10)], config="noisy")
+    report = trend_report(history, tolerances={"items/sec": 0.1}).splitlines()
+    assert report[0].split()[:4] == ["model", "config", "metric", "runs"]
+    shifted, noisy = report[1].split(), report[2].split()
+    assert noisy[1] == "noisy" and noisy[-1] == "yes"
+    assert shifted[1] == "bs16" and shifted[-1] == "no" and "rev8" in report[1]
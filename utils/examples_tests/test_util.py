@@ -319,7 +319,7 @@ def run_python_script_helper(cwd, script, want_std_err=False, env=None, **kwargs
     return out
 
 
-def run_test_helper(subprocess_function, total_run_time=None, total_run_time_tolerance=0.1, **kwargs):
+def run_test_helper(subprocess_function, total_run_time=None, total_run_time_tolerance=0.1, benchmark=None, **kwargs):
     """Helper function for running tests
 
     Takes in testable parameters, runs the test and checks the relevant
@@ -331,6 +331,9 @@ def run_test_helper(subprocess_function, total_run_time=None, total_run_time_tol
         total_run_time_range: tuple float representing the expected
             upper and lower bounds for the total time taken to run
             the test
+        benchmark: optional - a benchmark_history.BenchmarkCheck which
+            records the metrics of the output and checks them against the
+            history of the previous runs
 
     Returns:
         A String representing the raw output of the models subprocess
@@ -350,6 +353,9 @@ def run_test_helper(subprocess_function, total_run_time=None, total_run_time_tol
         total_run_time_range = range_from_tolerances(total_run_time, total_run_time_tolerance)
         assert_total_run_time(total_time, total_run_time_range)
 
+    if benchmark is not None:
+        benchmark(out)
+
     return out
 
 
@@ -464,7 +470,7 @@ class SubProcessChecker(unittest.TestCase):
                     f"Output of command: '{cmd}' contained no match for: '{must_contain[i]}'\nOutput was:\n{output}"
                 )
 
-    def run_command(self, cmd, working_path, expected_strings, env=None, timeout=None):
+    def run_command(self, cmd, working_path, expected_strings, env=None, timeout=None, benchmark=None):
         """
         Run a command using subprocess, check it ran successfully, and
         check its output.
@@ -480,6 +486,10 @@ class SubProcessChecker(unittest.TestCase):
                 Optionally pass in the Environment variables to use
             timeout:
                 Optionally pass in the timeout for running the command
+            benchmark:
+                Optionally pass in a benchmark_history.BenchmarkCheck to
+                record the metrics of the output and check them against
+                the history of the previous runs
             Returns:
                 Output of the command (combined stderr and stdout).
         """
@@ -520,4 +530,9 @@ class SubProcessChecker(unittest.TestCase):
             )
 
         self._check_output(cmd, combined_output, expected_strings)
+        if benchmark is not None:
+            try:
+                benchmark(combined_output)
+            except AssertionError as error:
+                self.fail(f"{error}\nCommand: {cmd}")
         return combined_output
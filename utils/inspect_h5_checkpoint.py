@@ -1,7 +1,6 @@
 # Copyright (c) 2022 Graphcore Ltd. All rights reserved.
 
 import h5py
-import numpy as np
 import argparse
 import os
 from typing import Union
@@ -27,9 +26,8 @@ def inspect_checkpoint(
             weight_requested = name in tensor_names or all_tensors
             if all_tensor_names or weight_requested:
                 if weight_requested and isinstance(content, h5py.Dataset):
-                    tensor = np.zeros(shape=content.shape)
-                    content.read_direct(tensor)
-                    tensors[name] = tensor
+                    # keep the dtype of the checkpoint, float64 copies of fp16 weights need 4 times their size
+                    tensors[name] = content[()]
                 else:
                     tensors[name] = None
 
@@ -2,4 +2,5 @@
 from .dataset import get_data, datasets_info
 from .preprocess import normalization_parameters, ToFloat, ToHalf, get_preprocessing_pipeline, LoadJpeg
 from .raw_imagenet import ImageNetDataset
+from .batched_jpeg import BatchedImageNetDataset
 from .optimised_jpeg import ExtendedTurboJPEG
@@ -0,0 +1,132 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from torch.utils.data import DataLoader
+import import_helper
+from datasets.batched_jpeg import BatchedImageNetDataset, batch_sampler
+from datasets.host_profiler import make_synthetic_imagenet
+from datasets.preprocess import get_preprocessing_pipeline
+from datasets.raw_imagenet import ImageNetDataset
+
+
+def memory_usage(pid):
+    """RSS and PSS of the process and its children, in MiB."""
+    rss, pss = 0, 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as smaps:
+                for line in smaps:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+            for children in glob.glob(f"/proc/{pid}/task/*/children"):
+                with open(children) as children_file:
+                    pids += [int(child) for child in children_file.read().split()]
+        except FileNotFoundError:
+            pass  # the process exited
+    return rss / 1024, pss / 1024
+
+
+class PeakMemory(threading.Thread):
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_rss, self.peak_pss = 0.0, 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss, pss = memory_usage(os.getpid())
+            self.peak_rss, self.peak_pss = max(self.peak_rss, rss), max(self.peak_pss, pss)
+
+
+def benchmark(dataloader, iterations):
+    memory = PeakMemory()
+    memory.start()
+    throughputs = []
+    for _ in range(iterations):
+        num_images = 0
+        start_time = time.perf_counter()
+        for images, _ in dataloader:
+            num_images += images.size()[0]
+        throughputs.append(num_images / (time.perf_counter() - start_time))
+    memory.stopped.set()
+    memory.join()
+    return max(throughputs), memory.peak_rss, memory.peak_pss
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        add_help=True, description="Compare the batched JPEG decode with the per sample decode of the workers"
+    )
+    parser.add_argument("--micro-batch-size", type=int, default=64, help="Micro batch size")
+    parser.add_argument("--iterations", type=int, default=2, help="Number of epochs, the fastest is reported")
+    parser.add_argument(
+        "--imagenet-data-path",
+        type=str,
+        default=None,
+        help="Path of the raw imagenet data, a synthetic JPEG folder is generated if not provided",
+    )
+    parser.add_argument("--synthetic-images", type=int, default=1024, help="Number of synthetic JPEG images")
+    parser.add_argument(
+        "--synthetic-image-size", type=int, nargs=2, default=[500, 375], help="Width and height of the synthetic images"
+    )
+    parser.add_argument(
+        "--dataloader-worker", type=int, nargs="+", default=[2, 4], help="Numbers of workers of the per sample path"
+    )
+    parser.add_argument(
+        "--decode-threads", type=int, nargs="+", default=[2, 4], help="Numbers of threads of the batched decode"
+    )
+    parser.add_argument(
+        "--batched-dataloader-worker",
+        type=int,
+        default=1,
+        help="Number of workers of the batched path, 0 decodes in the main process",
+    )
+    return parser.parse_args()
+
+
+def run(args, data_path):
+    folder = os.path.join(data_path, "train")
+    print(f"{'path':<40}{'img/sec':>10}{'RSS MiB':>10}{'PSS MiB':>10}")
+    for num_workers in args.dataloader_worker:
+        transform = get_preprocessing_pipeline(train=True, normalize=False, eightbit=True)
+        dataloader = DataLoader(
+            ImageNetDataset(folder, transform=transform),
+            batch_size=args.micro_batch_size,
+            num_workers=num_workers,
+            shuffle=True,
+            drop_last=True,
+            persistent_workers=num_workers > 0,
+        )
+        throughput, rss, pss = benchmark(dataloader, args.iterations)
+        print(f"{f'per sample, {num_workers} workers':<40}{throughput:>10.1f}{rss:>10.0f}{pss:>10.0f}")
+    for num_threads in args.decode_threads:
+        dataset = BatchedImageNetDataset(folder, num_threads=num_threads)
+        dataloader = DataLoader(
+            dataset,
+            sampler=batch_sampler(dataset, args.micro_batch_size),
+            batch_size=None,
+            num_workers=args.batched_dataloader_worker,
+            persistent_workers=args.batched_dataloader_worker > 0,
+        )
+        throughput, rss, pss = benchmark(dataloader, args.iterations)
+        name = f"batched, {num_threads} threads, {args.batched_dataloader_worker} workers"
+        print(f"{name:<40}{throughput:>10.1f}{rss:>10.0f}{pss:>10.0f}")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.imagenet_data_path is not None:
+        run(args, args.imagenet_data_path)
+    else:
+        with tempfile.TemporaryDirectory() as data_path:
+            make_synthetic_imagenet(data_path, args.synthetic_images, image_size=tuple(args.synthetic_image_size))
+            run(args, data_path)
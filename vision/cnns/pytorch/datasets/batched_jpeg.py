@@ -0,0 +1,65 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, RandomSampler, SequentialSampler
+from torchvision import transforms
+from datasets.preprocess import RandomResizedBoxCrop, use_bbox_info_config
+from datasets.raw_imagenet import ImageNetDataset
+
+
+class BatchedImageNetDataset(ImageNetDataset):
+    """
+    ImageNet dataset indexed by whole batches, for training with 8-bit images normalised on the IPU.
+
+    The images of a batch are read and decoded by a pool of threads: the file reads, the TurboJPEG
+    calls and the PIL resizes release the GIL. The crop box of each image is sampled from its JPEG
+    header, so that only the MCU blocks of the crop are decompressed (or the whole image with PIL
+    if TurboJPEG is unavailable), then the crop is resized, randomly flipped, and written into a
+    preallocated uint8 batch tensor. Use it with `batch_sampler` and `batch_size=None`.
+    """
+
+    def __init__(self, *args, input_size=224, num_threads=8, use_bbox_info=False, pin_memory=False, **kwargs):
+        super(BatchedImageNetDataset, self).__init__(*args, **kwargs)
+        self.input_size = input_size
+        self.num_threads = num_threads
+        self.pin_memory = pin_memory
+        self.crop = RandomResizedBoxCrop(input_size, **use_bbox_info_config[use_bbox_info])
+        self.flip = transforms.RandomHorizontalFlip()
+        self._pool = None
+        self._pool_pid = None
+
+    @property
+    def pool(self):
+        # the threads of a pool do not survive a fork, each dataloader worker starts its own pool
+        if self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(self.num_threads)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def __getitem__(self, indices):
+        images = torch.empty(
+            [len(indices), 3, self.input_size, self.input_size], dtype=torch.uint8, pin_memory=self.pin_memory
+        )
+        targets = self.pool.map(self.decode_into, indices, images.numpy())
+        return images, torch.tensor(list(targets))
+
+    def decode_into(self, index, out):
+        path, target, bbox = self.samples[index]
+        img = self.flip(self.crop((self.read(path), bbox)))
+        out[...] = np.asarray(img).transpose(2, 0, 1)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return target
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_pid"] = None
+        return state
+
+
+def batch_sampler(dataset, micro_batch_size, shuffle=True, drop_last=True):
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return BatchSampler(sampler, micro_batch_size, drop_last)
@@ -0,0 +1,283 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, get_worker_info
+from torch.utils.data.dataloader import default_collate
+from torchvision import transforms
+import import_helper
+from datasets.preprocess import RandomResizedBoxCrop, get_preprocessing_pipeline
+from datasets.raw_imagenet import ImageNetDataset
+
+
+class StageTimers:
+    """
+    Seconds spent in each stage of the host pipeline and number of calls, one row per process:
+    row 0 is the main process and row i + 1 the dataloader worker i. The counters are in shared
+    memory, so the workers add to them in place and the main process reads them at the end.
+    """
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.stages = []
+        self.parents = {}
+        self.counters = None
+        self._counters = None
+
+    def register(self, stage, parent=None):
+        if stage not in self.parents:
+            assert self.counters is None, "The stages must be registered before the counters are allocated"
+            self.stages.append(stage)
+            self.parents[stage] = parent
+        return stage
+
+    def allocate(self):
+        self.counters = torch.zeros(self.num_workers + 1, len(self.stages), 2, dtype=torch.float64).share_memory_()
+        self._counters = self.counters.numpy()
+        self._index = {stage: idx for idx, stage in enumerate(self.stages)}
+
+    def add(self, stage, seconds, calls=1):
+        worker_info = get_worker_info()
+        row = 0 if worker_info is None else worker_info.id + 1
+        counters = self._counters[row, self._index[stage]]
+        counters[0] += seconds
+        counters[1] += calls
+
+    def reset(self):
+        self.counters.zero_()
+
+    def seconds(self, exclusive=True):
+        """Seconds of each stage per process, without the seconds of its sub-stages if `exclusive`."""
+        seconds = self.counters[:, :, 0].clone()
+        if exclusive:
+            for stage, parent in self.parents.items():
+                if parent is not None:
+                    seconds[:, self._index[parent]] -= self.counters[:, self._index[stage], 0]
+        return {stage: seconds[:, idx] for idx, stage in enumerate(self.stages)}
+
+    def calls(self):
+        return {stage: self.counters[:, idx, 1] for idx, stage in enumerate(self.stages)}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_counters"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.counters is not None:
+            self._counters = self.counters.numpy()
+
+
+class Timed:
+    """Call `fn` and add its duration to `stage`."""
+
+    def __init__(self, fn, stage, timers):
+        self.fn = fn
+        self.stage = stage
+        self.timers = timers
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        out = self.fn(*args, **kwargs)
+        self.timers.add(self.stage, time.perf_counter() - start)
+        return out
+
+    def __repr__(self):
+        return f"Timed({self.stage}: {self.fn!r})"
+
+
+class ProfiledDataset(Dataset):
+    """
+    Time `__getitem__` of the dataset, its `read` method if it has one, and each step of its
+    `transforms.Compose` transform. The JPEG decode of `RandomResizedBoxCrop` is timed separately
+    from its resize.
+    """
+
+    def __init__(self, dataset, timers):
+        self.dataset = dataset
+        self.getitem = Timed(dataset.__getitem__, timers.register("__getitem__ (rest)"), timers)
+        if hasattr(dataset, "read"):
+            dataset.read = Timed(dataset.read, timers.register("read", parent="__getitem__ (rest)"), timers)
+        if isinstance(dataset.transform, transforms.Compose):
+            steps = []
+            for step in dataset.transform.transforms:
+                stage = timers.register(type(step).__name__, parent="__getitem__ (rest)")
+                if isinstance(step, RandomResizedBoxCrop):
+                    decode = timers.register(f"{stage} decode", parent=stage)
+                    step.jpeg_augment = Timed(step.jpeg_augment, decode, timers)
+                steps.append(Timed(step, stage, timers))
+            dataset.transform.transforms = steps
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.getitem(index)
+
+
+class ProfiledCollate:
+    """Time the collation of the batch and stamp it with the wall clock time it was ready."""
+
+    def __init__(self, collate_fn, timers):
+        self.collate_fn = Timed(collate_fn, timers.register("collate"), timers)
+
+    def __call__(self, samples):
+        batch = self.collate_fn(samples)
+        return batch, time.time()
+
+
+def profile_loader(dataset, timers, micro_batch_size, num_workers, step_time=0.0):
+    """
+    Iterate over the dataset with a DataLoader of `num_workers` workers, waiting `step_time`
+    seconds after each batch to stand for the device step. Returns the number of images,
+    the elapsed seconds, and the per batch seconds the main process waited for a batch and
+    the batches waited in the queue after their collation.
+    """
+    if len(dataset) < micro_batch_size:
+        # the partial batches are dropped, there would be nothing to profile
+        raise ValueError(f"The dataset of {len(dataset)} images has no full micro batch of {micro_batch_size} images.")
+    collate_fn = ProfiledCollate(default_collate, timers)
+    timers.register("wait")
+    timers.register("queue + IPC")
+    if timers.counters is None:
+        timers.allocate()
+    timers.reset()
+    dataloader = DataLoader(
+        dataset,
+        batch_size=micro_batch_size,
+        num_workers=num_workers,
+        shuffle=True,
+        drop_last=True,
+        collate_fn=collate_fn,
+    )
+    num_images = 0
+    start_time = time.perf_counter()
+    iterator = iter(dataloader)
+    while True:
+        wait_start = time.perf_counter()
+        try:
+            (images, _), ready_time = next(iterator)
+        except StopIteration:
+            break
+        timers.add("wait", time.perf_counter() - wait_start)
+        timers.add("queue + IPC", time.time() - ready_time)
+        num_images += images.size()[0]
+        if step_time > 0:
+            time.sleep(step_time)
+    elapsed_time = time.perf_counter() - start_time
+    return num_images, elapsed_time
+
+
+def print_profile(timers, num_workers, num_images, elapsed_time):
+    """Print the per stage breakdown and return the images per second of a single busy worker."""
+    seconds = timers.seconds()
+    calls = timers.calls()
+    num_batches = calls["wait"][0].item()
+    print(
+        f"{num_workers} workers: {num_images / elapsed_time:0.1f} img/sec, the main process waited for data "
+        f"{100 * seconds['wait'][0] / elapsed_time:0.1f}% of the time, "
+        f"{1000 * seconds['queue + IPC'][0] / num_batches:0.2f} ms/batch in queue + IPC"
+    )
+    # the pipeline runs in the main process without workers
+    rows = slice(1, None) if num_workers > 0 else slice(0, 1)
+    pipeline_stages = [stage for stage in timers.stages if stage not in ("wait", "queue + IPC")]
+    busy = sum(seconds[stage][rows] for stage in pipeline_stages)
+    total_busy = busy.sum().item()
+    print(f"  {'stage':<32}{'ms/img':>10}{'share':>10}")
+    for stage in pipeline_stages:
+        stage_seconds = seconds[stage][rows].sum().item()
+        print(f"  {stage:<32}{1000 * stage_seconds / num_images:>10.3f}{100 * stage_seconds / total_busy:>9.1f}%")
+    if num_workers > 0:
+        utilisation = ", ".join(f"{100 * worker_busy / elapsed_time:0.0f}%" for worker_busy in busy.tolist())
+        print(f"  busy time of the workers: {utilisation}")
+    return num_images / total_busy
+
+
+def print_projection(images_per_worker_second, max_workers):
+    """Project the throughput of each worker count, if the workers scale perfectly up to the number of cores."""
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"Max achievable throughput, {images_per_worker_second:0.1f} img/sec per worker, {num_cores} cores:")
+    num_workers = 1
+    while num_workers <= max_workers:
+        throughput = images_per_worker_second * min(num_workers, num_cores)
+        print(f"  {num_workers:>4} workers: {throughput:0.1f} img/sec")
+        num_workers *= 2
+
+
+def make_synthetic_imagenet(path, num_images, num_classes=10, image_size=(500, 375), seed=0):
+    """Write random smooth JPEG images in the folder layout of the raw ImageNet train set."""
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    for idx in range(num_images):
+        class_folder = os.path.join(path, "train", f"n{idx % num_classes:08d}")
+        os.makedirs(class_folder, exist_ok=True)
+        pixels = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+        image.save(os.path.join(class_folder, f"{idx:08d}.JPEG"), quality=90)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(add_help=True, description="Profiling the stages of the host side data pipeline")
+    parser.add_argument("--micro-batch-size", type=int, default=64, help="Micro batch size")
+    parser.add_argument(
+        "--imagenet-data-path",
+        type=str,
+        default=None,
+        help="Path of the raw imagenet data, a synthetic JPEG folder is generated if not provided",
+    )
+    parser.add_argument("--synthetic-images", type=int, default=1024, help="Number of synthetic JPEG images")
+    parser.add_argument(
+        "--synthetic-image-size", type=int, nargs=2, default=[500, 375], help="Width and height of the synthetic images"
+    )
+    parser.add_argument(
+        "--dataloader-worker", type=int, nargs="+", default=[0, 2], help="Numbers of dataloader workers to profile"
+    )
+    parser.add_argument(
+        "--step-time", type=float, default=0.0, help="Seconds the main process spends on each batch (device step)"
+    )
+    parser.add_argument("--precision", choices=["16.16", "32.32"], default="16.16", help="Precision of the images")
+    parser.add_argument(
+        "--normalization-location", choices=["host", "ipu"], default="host", help="Location of the data normalization"
+    )
+    parser.add_argument(
+        "--eight-bit-io",
+        action="store_true",
+        help="Image transfer from host to IPU in 8-bit format, requires normalisation on the IPU",
+    )
+    args = parser.parse_args()
+    if args.imagenet_data_path is None and args.synthetic_images < args.micro_batch_size:
+        parser.error("--synthetic-images must be at least --micro-batch-size, the partial batches are dropped.")
+    return args
+
+
+def profile(args, data_path):
+    images_per_worker_second = []
+    for num_workers in args.dataloader_worker:
+        transform = get_preprocessing_pipeline(
+            train=True,
+            half_precision=args.precision[:3] == "16.",
+            normalize=args.normalization_location == "host",
+            eightbit=args.eight_bit_io,
+        )
+        timers = StageTimers(num_workers)
+        dataset = ProfiledDataset(ImageNetDataset(os.path.join(data_path, "train"), transform=transform), timers)
+        num_images, elapsed_time = profile_loader(dataset, timers, args.micro_batch_size, num_workers, args.step_time)
+        images_per_worker_second.append(print_profile(timers, num_workers, num_images, elapsed_time))
+    # the workers of the runs with more workers than cores share the cores, keep the fastest worker
+    print_projection(max(images_per_worker_second), max(64, *args.dataloader_worker))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.imagenet_data_path is not None:
+        profile(args, args.imagenet_data_path)
+    else:
+        with tempfile.TemporaryDirectory() as data_path:
+            make_synthetic_imagenet(data_path, args.synthetic_images, image_size=tuple(args.synthetic_image_size))
+            profile(args, data_path)
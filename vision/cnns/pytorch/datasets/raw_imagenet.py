@@ -18,8 +18,7 @@ class ImageNetDataset(torchvision.datasets.ImageFolder):
 
     def __getitem__(self, index: int):
         path, target, bbox = self.samples[index]
-        with open(path, "rb") as jpeg_file:
-            img = jpeg_file.read()
+        img = self.read(path)
 
         if self.transform is not None:
             sample = self.transform((img, bbox))
@@ -28,6 +27,10 @@ class ImageNetDataset(torchvision.datasets.ImageFolder):
 
         return sample, target
 
+    def read(self, path):
+        with open(path, "rb") as jpeg_file:
+            return jpeg_file.read()
+
     def load_bboxes(self, file_path):
         bboxes = {}
         if os.path.exists(file_path):
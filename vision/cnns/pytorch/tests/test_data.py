@@ -7,6 +7,7 @@ import poptorch
 from torchvision import transforms
 from pathlib import Path
 import shutil
+import subprocess
 import random
 import import_helper
 from io import BytesIO
@@ -14,6 +15,9 @@ from PIL import Image
 from datasets.augmentations import AugmentationModel
 from datasets.preprocess import IgnoreBboxIfPresent, NormalizeToTensor, get_preprocessing_pipeline
 from datasets.dataset import get_data, _WorkerInit
+from datasets.batched_jpeg import BatchedImageNetDataset, batch_sampler
+from datasets.host_profiler import ProfiledDataset, StageTimers, make_synthetic_imagenet, profile_loader
+from datasets.raw_imagenet import ImageNetDataset
 import models
 from models.models import NormalizeInputModel
 from utils import run_script, get_current_interpreter_executable
@@ -281,6 +285,56 @@ class TestHostBenchmark:
         )
         assert "Throughput of the iteration" in output
 
+    def test_host_profiler_synthetic(self):
+        output = run_script(
+            "datasets/host_profiler.py", "--synthetic-images 64 --micro-batch-size 16 --dataloader-worker 0 2"
+        )
+        assert "RandomResizedBoxCrop decode" in output
+        assert "Max achievable throughput" in output
+
+    @pytest.mark.parametrize("num_workers", [0, 2])
+    def test_stage_timers(self, tmp_path, num_workers):
+        make_synthetic_imagenet(tmp_path, 32, num_classes=2, image_size=(64, 48))
+        timers = StageTimers(num_workers)
+        dataset = ImageNetDataset(str(tmp_path / "train"), transform=get_preprocessing_pipeline(train=True))
+        num_images, _ = profile_loader(ProfiledDataset(dataset, timers), timers, 8, num_workers)
+        assert num_images == 32
+        calls = timers.calls()
+        # the workers count the calls of the pipeline stages in their own rows
+        pipeline_rows = slice(1, None) if num_workers > 0 else slice(0, 1)
+        for stage in ["__getitem__ (rest)", "read", "RandomResizedBoxCrop decode", "NormalizeToTensor"]:
+            assert calls[stage][pipeline_rows].sum() == calls[stage].sum() == 32
+        assert calls["collate"].sum() == calls["wait"][0] == 4
+        for seconds in timers.seconds().values():
+            assert torch.all(seconds >= 0)
+
+    def test_profile_loader_without_full_batch(self, tmp_path):
+        make_synthetic_imagenet(tmp_path, 4, num_classes=2, image_size=(64, 48))
+        timers = StageTimers(0)
+        dataset = ImageNetDataset(str(tmp_path / "train"), transform=get_preprocessing_pipeline(train=True))
+        with pytest.raises(ValueError, match="no full micro batch"):
+            profile_loader(ProfiledDataset(dataset, timers), timers, 8, 0)
+
+    def test_host_profiler_too_few_synthetic_images(self):
+        with pytest.raises(subprocess.CalledProcessError):
+            run_script("datasets/host_profiler.py", "--synthetic-images 32 --micro-batch-size 64")
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_batched_imagenet_dataset(tmp_path, num_workers):
+    make_synthetic_imagenet(tmp_path, 20, num_classes=3, image_size=(96, 64))
+    dataset = BatchedImageNetDataset(str(tmp_path / "train"), input_size=32, num_threads=2)
+    dataloader = torch.utils.data.DataLoader(
+        dataset, sampler=batch_sampler(dataset, 8, shuffle=False), batch_size=None, num_workers=num_workers
+    )
+    batches = list(dataloader)
+    assert len(batches) == 2
+    for batch_idx, (images, targets) in enumerate(batches):
+        assert images.shape == (8, 3, 32, 32) and images.dtype == torch.uint8
+        assert targets.tolist() == [target for _, target, _ in dataset.samples[8 * batch_idx : 8 * (batch_idx + 1)]]
+        # the synthetic images are smooth, a crop is never uniformly black
+        assert torch.all(images.flatten(1).float().std(dim=1) > 0)
+
 
 @pytest.mark.ipus(1)
 @pytest.mark.parametrize("dataset", ["real", "generated"])
@@ -0,0 +1,102 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Images per second of the DINO multi-crop augmentations on synthetic JPEG images.
+
+`DataAugmentationDINO` transforms the fully decoded image, `DraftDataAugmentationDINO`
+samples the crop boxes first and decodes the image in JPEG draft mode at the smallest
+scale they allow. The time of each stage of `DraftDataAugmentationDINO` is printed too.
+"""
+import argparse
+import io
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+from PIL import Image
+
+from core.dataset import DataAugmentationDINO, DraftDataAugmentationDINO
+
+
+def synthetic_jpegs(num_images, size, seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    # smooth images, so that they compress like photos
+    low_res = rng.integers(0, 256, (num_images, height // 16, width // 16, 3), dtype=np.uint8)
+    jpegs = []
+    for pixels in low_res:
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize((width, height), Image.BILINEAR).save(buffer, "JPEG", quality=90)
+        jpegs.append(buffer.getvalue())
+    return jpegs
+
+
+def time_stages(transform, jpegs):
+    stages = defaultdict(float)
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        out = fn(*args)
+        stages[stage] += time.perf_counter() - start
+        return out
+
+    for jpeg in jpegs:
+        image = timed("open", DraftDataAugmentationDINO.lazy_loader, io.BytesIO(jpeg))
+        global_boxes, local_boxes = timed("sample boxes", transform.sample_boxes, *image.size)
+        image, global_boxes, local_boxes = timed("decode", transform.decode, image, global_boxes, local_boxes)
+        out = torch.empty([3, transform.local_size, transform.local_size], dtype=torch.uint8)
+        for box in local_boxes:
+            timed("local crops", transform.crop, image, box, transform.local_size, transform.local_transfo, out)
+        out = torch.empty([3, transform.global_size, transform.global_size], dtype=torch.uint8)
+        for box, global_transfo in zip(global_boxes, [transform.global_transfo1, transform.global_transfo2]):
+            timed("global crops", transform.crop, image, box, transform.global_size, global_transfo, out)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-images", type=int, default=50)
+    parser.add_argument("--image-sizes", type=str, nargs="+", default=["500x375", "1600x1200"])
+    parser.add_argument("--local-crops-number", type=int, default=10)
+    parser.add_argument("--num-threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    scales = dict(global_crops_scale=(0.4, 1.0), local_crops_scale=(0.05, 0.4))
+    transforms = {
+        "DataAugmentationDINO": (
+            DataAugmentationDINO(local_crops_number=args.local_crops_number, **scales),
+            lambda jpeg: Image.open(io.BytesIO(jpeg)).convert("RGB"),
+        ),
+        "DraftDataAugmentationDINO": (
+            DraftDataAugmentationDINO(local_crops_number=args.local_crops_number, **scales),
+            lambda jpeg: DraftDataAugmentationDINO.lazy_loader(io.BytesIO(jpeg)),
+        ),
+    }
+    for image_size in args.image_sizes:
+        jpegs = synthetic_jpegs(args.num_images, tuple(int(side) for side in image_size.split("x")))
+        print(f"{image_size} images, 2 global and {args.local_crops_number} local crops:")
+        for name, (transform, loader) in transforms.items():
+            start = time.perf_counter()
+            for jpeg in jpegs:
+                transform(loader(jpeg))
+            print(f"  {name}: {len(jpegs) / (time.perf_counter() - start):.1f} images/s")
+
+        stages = time_stages(transforms["DraftDataAugmentationDINO"][0], jpegs)
+        for stage, seconds in stages.items():
+            print(f"    {stage}: {1000 * seconds / len(jpegs):.2f} ms/image")
+
+
+if __name__ == "__main__":
+    main()
@@ -124,6 +124,110 @@ class DataAugmentationDINO(object):
         return torch.cat(global_img), torch.cat(crops)
 
 
+def sample_crop_boxes(width, height, n, scale, ratio=(3.0 / 4.0, 4.0 / 3.0), attempts=10):
+    """
+    Sample the boxes of `n` crops at once, with the distribution of `RandomResizedCrop.get_params`:
+    the first of `attempts` random area scales and log aspect ratios fitting in the image, else a
+    center crop. Returns an int64 array of (left, upper, right, lower) boxes.
+    """
+    area = width * height
+    target_area = area * np.random.uniform(scale[0], scale[1], (n, attempts))
+    aspect_ratio = np.exp(np.random.uniform(np.log(ratio[0]), np.log(ratio[1]), (n, attempts)))
+    w = np.round(np.sqrt(target_area * aspect_ratio)).astype(np.int64)
+    h = np.round(np.sqrt(target_area / aspect_ratio)).astype(np.int64)
+    fits = (w > 0) & (w <= width) & (h > 0) & (h <= height)
+    first = fits.argmax(axis=1)
+    found = fits.any(axis=1)
+
+    # center crop fallback
+    in_ratio = width / height
+    if in_ratio < min(ratio):
+        fallback_w, fallback_h = width, int(round(width / min(ratio)))
+    elif in_ratio > max(ratio):
+        fallback_w, fallback_h = int(round(height * max(ratio))), height
+    else:
+        fallback_w, fallback_h = width, height
+    w = np.where(found, w[np.arange(n), first], fallback_w)
+    h = np.where(found, h[np.arange(n), first], fallback_h)
+    x = np.where(found, np.floor(np.random.rand(n) * (width - w + 1)), (width - fallback_w) // 2).astype(np.int64)
+    y = np.where(found, np.floor(np.random.rand(n) * (height - h + 1)), (height - fallback_h) // 2).astype(np.int64)
+    return np.stack([x, y, x + w, y + h], axis=1)
+
+
+class DraftDataAugmentationDINO(object):
+    """
+    Same augmentations as `DataAugmentationDINO`, with the image decoded at a reduced scale.
+
+    The boxes of all the crops are sampled before decoding, so a JPEG image is decoded in
+    draft mode at the smallest DCT scale (1/2, 1/4 or 1/8) keeping every crop at least as
+    large as its output. Each crop is then resized straight from its box in the reduced
+    image, and written into preallocated uint8 tensors. Use `lazy_loader` as the loader of
+    the dataset so that the image is not decoded before this transform is called.
+    """
+
+    def __init__(self, global_crops_scale, local_crops_scale, local_crops_number, global_size=224, local_size=96):
+        self.global_crops_scale = global_crops_scale
+        self.local_crops_scale = local_crops_scale
+        self.local_crops_number = local_crops_number
+        self.global_size = global_size
+        self.local_size = local_size
+        flip_and_color_jitter = transforms.Compose(
+            [
+                transforms.RandomHorizontalFlip(p=0.5),
+                transforms.RandomApply(
+                    [transforms.ColorJitter(brightness=0.4, contrast=0.4, saturation=0.2, hue=0.1)], p=0.8
+                ),
+                transforms.RandomGrayscale(p=0.2),
+            ]
+        )
+        self.global_transfo1 = transforms.Compose([flip_and_color_jitter, GaussianBlur(1.0)])
+        self.global_transfo2 = transforms.Compose([flip_and_color_jitter, GaussianBlur(0.1), Solarization(0.2)])
+        self.local_transfo = transforms.Compose([flip_and_color_jitter, GaussianBlur(p=0.5)])
+
+    @staticmethod
+    def lazy_loader(path):
+        return Image.open(path)
+
+    def sample_boxes(self, width, height):
+        global_boxes = sample_crop_boxes(width, height, 2, self.global_crops_scale)
+        local_boxes = sample_crop_boxes(width, height, self.local_crops_number, self.local_crops_scale)
+        return global_boxes, local_boxes
+
+    def decode(self, image, global_boxes, local_boxes):
+        """
+        Decode the image at the smallest draft scale not shrinking any box below its output size.
+        Returns the RGB image and the boxes scaled to it.
+        """
+        width, height = image.size
+        scale = 0.0
+        for boxes, size in [(global_boxes, self.global_size), (local_boxes, self.local_size)]:
+            if len(boxes) > 0:
+                sides = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+                scale = max(scale, size / sides.min())
+        if scale < 1.0:
+            # no-op for images which are not JPEG or are already decoded
+            image.draft("RGB", (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+        image = image.convert("RGB")
+        box_scale = np.array([image.width / width, image.height / height] * 2)
+        return image, global_boxes * box_scale, local_boxes * box_scale
+
+    @staticmethod
+    def crop(image, box, size, transform, out):
+        crop = image.resize((size, size), Image.BICUBIC, box=tuple(box))
+        out.copy_(torch.from_numpy(np.array(transform(crop))).permute(2, 0, 1))
+
+    def __call__(self, image):
+        global_boxes, local_boxes = self.sample_boxes(*image.size)
+        image, global_boxes, local_boxes = self.decode(image, global_boxes, local_boxes)
+        global_img = torch.empty([2, 3, self.global_size, self.global_size], dtype=torch.uint8)
+        crops = torch.empty([self.local_crops_number, 3, self.local_size, self.local_size], dtype=torch.uint8)
+        self.crop(image, global_boxes[0], self.global_size, self.global_transfo1, global_img[0])
+        self.crop(image, global_boxes[1], self.global_size, self.global_transfo2, global_img[1])
+        for box, out in zip(local_boxes, crops):
+            self.crop(image, box, self.local_size, self.local_transfo, out)
+        return global_img, crops
+
+
 class CustomImageFolder(datasets.ImageFolder):
     def __getitem__(self, index):
         path, target = self.samples[index]
@@ -0,0 +1,81 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from core.dataset import DataAugmentationDINO, DraftDataAugmentationDINO, sample_crop_boxes
+
+
+def jpeg(width, height):
+    pixels = np.random.default_rng(0).integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize((width, height), Image.BILINEAR).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("size", [(500, 375), (1600, 1200), (400, 80)])
+@pytest.mark.parametrize("scale", [(0.4, 1.0), (0.05, 0.4)])
+def test_sample_crop_boxes_distribution(size, scale):
+    np.random.seed(0)
+    torch.manual_seed(0)
+    num_samples = 4000
+    boxes = sample_crop_boxes(*size, num_samples, scale)
+    assert boxes.dtype == np.int64
+    assert np.all(boxes[:, :2] >= 0) and np.all(boxes[:, 2] <= size[0]) and np.all(boxes[:, 3] <= size[1])
+
+    image = Image.new("RGB", size)
+    expected = np.array(
+        [transforms.RandomResizedCrop.get_params(image, scale, (3.0 / 4.0, 4.0 / 3.0)) for _ in range(num_samples)]
+    )
+    widths, heights = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    for value, expected_value in [
+        (widths, expected[:, 3]),
+        (heights, expected[:, 2]),
+        (boxes[:, 0] + widths / 2, expected[:, 1] + expected[:, 3] / 2),
+        (boxes[:, 1] + heights / 2, expected[:, 0] + expected[:, 2] / 2),
+    ]:
+        tolerance = 0.05 * max(expected_value.std(), 1.0)
+        assert abs(value.mean() - expected_value.mean()) < tolerance
+        assert abs(value.std() - expected_value.std()) < 2 * tolerance
+
+
+@pytest.mark.parametrize("size", [(500, 375), (1600, 1200)])
+def test_draft_augmentation(size):
+    data = jpeg(*size)
+    transform = DraftDataAugmentationDINO((0.4, 1.0), (0.05, 0.4), 10)
+    global_img, crops = transform(DraftDataAugmentationDINO.lazy_loader(io.BytesIO(data)))
+    expected_global_img, expected_crops = DataAugmentationDINO((0.4, 1.0), (0.05, 0.4), 10)(
+        Image.open(io.BytesIO(data)).convert("RGB")
+    )
+    for value, expected_value in [(global_img, expected_global_img), (crops, expected_crops)]:
+        assert value.shape == expected_value.shape and value.dtype == expected_value.dtype
+
+    global_boxes, local_boxes = transform.sample_boxes(*size)
+    image, scaled_global_boxes, scaled_local_boxes = transform.decode(
+        DraftDataAugmentationDINO.lazy_loader(io.BytesIO(data)), global_boxes, local_boxes
+    )
+    assert image.mode == "RGB"
+    if image.size != size:
+        # the image is only reduced when no crop gets smaller than its output
+        for boxes, out_size in [(scaled_global_boxes, 224), (scaled_local_boxes, 96)]:
+            assert np.all(boxes[:, 2:] - boxes[:, :2] >= out_size)
+    if size == (1600, 1200):
+        # every crop side is at least (0.05 * 1600 * 1200 * 3 / 4) ** 0.5 = 268 pixels, twice the local size
+        assert image.width <= 800
+    np.testing.assert_allclose(scaled_global_boxes, global_boxes * image.width / size[0])
@@ -35,7 +35,7 @@ from core import utils
 from core import vision_transformer as vits
 from core.dino import DINOLoss, DINOHead, MultiCropWrapper
 from core.gelu import ERF_GELU
-from core.dataset import DataAugmentationDINO, CustomImageFolder, SynthImageFolder
+from core.dataset import DataAugmentationDINO, DraftDataAugmentationDINO, CustomImageFolder, SynthImageFolder
 from core.utils import AverageMeter, save_checkpoint, load_checkpoint, sync_metrics, Precision
 
 import ctypes
@@ -215,6 +215,12 @@ def get_args_parser():
         help="""Scale range of the cropped image before resizing, relatively to the origin image.
         Used for small local view cropping of multi-crop.""",
     )
+    parser.add_argument(
+        "--draft_decode",
+        action="store_true",
+        help="""Sample the crop boxes before decoding and decode the JPEG images at the
+        smallest scale keeping every crop at least as large as its output.""",
+    )
 
     # Misc
     parser.add_argument("--data_path", default="", type=str, help="Please specify path to the ImageNet training data.")
@@ -304,6 +310,14 @@ def train_dino(args):
     # ============ preparing data ... ============
     if args.synthetic_data:
         dataset = SynthImageFolder()
+    elif args.draft_decode:
+        dataset = CustomImageFolder(
+            args.data_path,
+            transform=DraftDataAugmentationDINO(
+                args.global_crops_scale, args.local_crops_scale, args.local_crops_number
+            ),
+            loader=DraftDataAugmentationDINO.lazy_loader,
+        )
     else:
         dataset = CustomImageFolder(
             args.data_path,
@@ -0,0 +1,379 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batched, vectorised multi-class non-maximum suppression.
+
+Computes the same detections as `nms_np.per_class_nms` for a whole batch of
+images at once. Instead of popping one box at a time for every (image, class)
+pair, all the (image, class) groups of the batch are padded into a few arrays
+of similar length and suppressed together:
+
+  * hard and DIoU NMS resolve the suppressions of a block of boxes at a time
+    from the block's pairwise overlap matrix, then remove every later box
+    overlapping a kept box of the block with a single matrix operation.
+  * soft (gaussian and linear) NMS selects one box per group and step, for all
+    the groups of the batch at the same time.
+
+The overlaps use the same float arithmetic as `nms_np`, and boxes with equal
+scores are visited in the same order as by `nms_np`, so the retained boxes and
+their order are identical.
+"""
+import numpy as np
+
+from nms_np import _DUMMY_DETECTION_SCORE
+
+# Upper bound on the number of elements of the overlap matrices computed at once.
+MAX_OVERLAP_ELEMENTS = 1 << 22
+
+
+def box_areas(boxes):
+    """Areas of [..., 4] boxes in [x1, y1, x2, y2] format, as computed by `nms_np`."""
+    return (boxes[..., 2] - boxes[..., 0] + 1) * (boxes[..., 3] - boxes[..., 1] + 1)
+
+
+def pairwise_overlap(boxes1, areas1, boxes2, areas2, method):
+    """IoU (or DIoU) of every pair of boxes of the same group.
+
+    Args:
+      boxes1: boxes with shape [G, N, 4] and format [x1, y1, x2, y2].
+      areas1: areas of boxes1 with shape [G, N].
+      boxes2: boxes with shape [G, M, 4] and format [x1, y1, x2, y2].
+      areas2: areas of boxes2 with shape [G, M].
+      method: one of `hard`, `diou`, `gaussian` or `linear`.
+
+    Returns:
+      numpy.array: the [G, N, M] overlaps.
+    """
+    x1, y1, x2, y2 = [boxes1[:, :, None, i] for i in range(4)]
+    other_x1, other_y1, other_x2, other_y2 = [boxes2[:, None, :, i] for i in range(4)]
+    xx1 = np.maximum(x1, other_x1)
+    yy1 = np.maximum(y1, other_y1)
+    xx2 = np.minimum(x2, other_x2)
+    yy2 = np.minimum(y2, other_y2)
+
+    w = np.maximum(0.0, xx2 - xx1 + 1)
+    h = np.maximum(0.0, yy2 - yy1 + 1)
+    intersection = w * h
+    iou = intersection / (areas1[:, :, None] + areas2[:, None, :] - intersection)
+    if method != "diou":
+        return iou
+
+    square_of_the_diagonal = (np.maximum(x2, other_x2) - np.minimum(x1, other_x1)) ** 2 + (
+        np.maximum(y2, other_y2) - np.minimum(y1, other_y1)
+    ) ** 2
+    square_of_center_distance = ((x1 + x2) / 2 - (other_x1 + other_x2) / 2) ** 2 + (
+        (y1 + y2) / 2 - (other_y1 + other_y2) / 2
+    ) ** 2
+    # Add 1e-10 for numerical stability.
+    return iou - square_of_center_distance / (square_of_the_diagonal + 1e-10)
+
+
+def _compact(mask):
+    """Moves the True entries of every row of a [G, L] mask to the front, keeping their order.
+
+    Returns:
+      A tuple (columns, compacted). Columns [G, K] are the original positions of
+      the entries, where K is the largest number of True entries in a row, and
+      compacted [G, K] the mask of these entries.
+    """
+    columns = np.argsort(~mask, axis=1, kind="stable")[:, : max(1, mask.sum(1).max())]
+    return columns, np.take_along_axis(mask, columns, 1)
+
+
+def greedy_nms(boxes, valid, method, iou_thresh, block_size=64):
+    """Hard or DIoU non-maximum suppression of groups of boxes sorted by score.
+
+    Args:
+      boxes: boxes with shape [G, L, 4] and format [x1, y1, x2, y2], sorted by
+        descending score within each group.
+      valid: a [G, L] boolean mask of the non-padding boxes.
+      method: `hard` or `diou`.
+      iou_thresh: boxes overlapping a kept box with a higher score by more than
+        this threshold are suppressed.
+      block_size: number of boxes suppressed together.
+
+    Returns:
+      numpy.array: a [G, L] boolean mask of the retained boxes.
+    """
+    keep = valid.copy()
+    areas = box_areas(boxes)
+    length = valid.shape[1]
+    for start in range(0, length, block_size):
+        end = min(start + block_size, length)
+        groups = np.flatnonzero(keep[:, start:end].any(1))
+        if groups.size == 0:
+            continue
+
+        # Only the boxes of the block that were not suppressed by the previous blocks are considered.
+        # A box i suppresses a later box j of its group if i is kept and their overlap is above the
+        # threshold. The greedy result is the only fixed point of keep_j = candidate_j & ~any_i<j(keep_i & S_ij),
+        # and iterating from the candidates fixes at least one more box per iteration.
+        columns, candidates = _compact(keep[groups, start:end])
+        columns += start
+        block_boxes, block_areas = boxes[groups[:, None], columns], areas[groups[:, None], columns]
+        overlap = pairwise_overlap(block_boxes, block_areas, block_boxes, block_areas, method)
+        suppresses = ~(overlap <= iou_thresh) & np.triu(np.ones(overlap.shape[1:], dtype=bool), 1)
+        block_keep = candidates
+        while True:
+            updated = candidates & ~(suppresses & block_keep[:, :, None]).any(1)
+            if np.array_equal(updated, block_keep):
+                break
+            block_keep = updated
+        keep[groups, start:end] = False
+        keep[groups[:, None], columns] = block_keep
+
+        # Remove the later boxes overlapping the kept boxes of the block
+        kept_columns, kept = _compact(block_keep)
+        kept_boxes = np.take_along_axis(block_boxes, kept_columns[..., None], 1)
+        kept_areas = np.take_along_axis(block_areas, kept_columns, 1)
+        step = max(1, MAX_OVERLAP_ELEMENTS // kept.size)
+        for later in range(end, length, step):
+            later_end = min(later + step, length)
+            overlap = pairwise_overlap(
+                kept_boxes, kept_areas, boxes[groups, later:later_end], areas[groups, later:later_end], method
+            )
+            suppressed = (~(overlap <= iou_thresh) & kept[:, :, None]).any(1)
+            keep[groups, later:later_end] &= ~suppressed
+    return keep
+
+
+def soft_nms(boxes, scores, valid, method, iou_thresh, sigma, score_thresh):
+    """Soft non-maximum suppression of groups of boxes.
+
+    Args:
+      boxes: boxes with shape [G, L, 4] and format [x1, y1, x2, y2].
+      scores: box scores with shape [G, L].
+      valid: a [G, L] boolean mask of the non-padding boxes.
+      method: `gaussian` or `linear`.
+      iou_thresh: IOU threshold, only for `linear`.
+      sigma: Gaussian parameter, only for `gaussian`.
+      score_thresh: boxes are discarded once their score is below this threshold.
+
+    Returns:
+      A tuple (indices, selected_scores, counts). Indices [G, L] are the positions
+      of the retained boxes of each group in the order they were selected,
+      selected_scores [G, L] their scores when selected and counts [G] the number
+      of retained boxes per group.
+    """
+    num_groups, length = scores.shape
+    areas = box_areas(boxes)
+    scores = scores.copy()
+    active = valid.copy()
+    # Position of each box in the boxes left by `nms_np.soft_nms`, which breaks score ties by position. It swaps
+    # the selected box with its first box before removing it, so the first box takes the selected box's place.
+    ranks = np.broadcast_to(np.arange(length, dtype=np.float64), (num_groups, length)).copy()
+    indices = np.zeros((num_groups, length), dtype=np.int64)
+    selected_scores = np.zeros((num_groups, length), dtype=scores.dtype)
+    counts = np.zeros(num_groups, dtype=np.int64)
+
+    groups = np.flatnonzero(active.any(1))
+    for step in range(length):
+        if groups.size == 0:
+            break
+        group_scores = np.where(active[groups], scores[groups], -np.inf)
+        is_best = active[groups] & (group_scores == group_scores.max(1, keepdims=True))
+        best = np.where(is_best, ranks[groups], np.inf).argmin(1)
+        first = np.where(active[groups], ranks[groups], np.inf).argmin(1)
+        ranks[groups, first] = ranks[groups, best]
+        indices[groups, step] = best
+        selected_scores[groups, step] = scores[groups, best]
+        counts[groups] += 1
+        active[groups, best] = False
+
+        iou = pairwise_overlap(
+            boxes[groups, best][:, None], areas[groups, best][:, None], boxes[groups], areas[groups], method
+        )[:, 0]
+        if method == "linear":
+            weight = np.where(iou > iou_thresh, np.ones_like(iou) - iou, np.ones_like(iou))
+        else:
+            weight = np.exp(-(iou * iou) / sigma)
+        scores[groups] *= weight
+        active[groups] &= scores[groups] >= score_thresh
+        groups = groups[active[groups].any(1)]
+    return indices, selected_scores, counts
+
+
+def _group_lengths(sizes, min_length=8):
+    """Pads the group sizes to powers of two, so that groups of similar size are suppressed together."""
+    return np.maximum(min_length, 1 << np.ceil(np.log2(np.maximum(sizes, 1))).astype(np.int64))
+
+
+def _nms_np_tie_order(order, boxes, scores, group_ids):
+    """Orders the boxes of equal scores of a group as `nms_np` visits them.
+
+    Args:
+      order: the positions of the boxes sorted by group and by descending score,
+        with ties in increasing position.
+      boxes: detection boxes with shape [K, 4].
+      scores: detection scores with shape [K].
+      group_ids: group ids with shape [K].
+
+    Returns:
+      The positions sorted by group and in the `scores.argsort()[::-1]` order of
+      `nms_np` within each group. `argsort` is not stable, so the groups with
+      equal scores are sorted again as `nms_np` sorts them, from the scores of
+      the group's boxes in increasing position, with the dtype of its detections.
+    """
+    sorted_scores = scores[order]
+    sorted_groups = group_ids[order]
+    tied = (sorted_scores[1:] == sorted_scores[:-1]) & (sorted_groups[1:] == sorted_groups[:-1])
+    if not tied.any():
+        return order
+    order = order.copy()
+    group_starts = np.flatnonzero(np.concatenate([[True], sorted_groups[1:] != sorted_groups[:-1]]))
+    group_ends = np.concatenate([group_starts[1:], [order.size]])
+    tied_groups = np.unique(np.searchsorted(group_starts, np.flatnonzero(tied), side="right") - 1)
+    dtype = np.result_type(boxes.dtype, scores.dtype)
+    for start, end in zip(group_starts[tied_groups], group_ends[tied_groups]):
+        members = np.sort(order[start:end])
+        order[start:end] = members[scores[members].astype(dtype).argsort()[::-1]]
+    return order
+
+
+def batched_nms(boxes, scores, group_ids, nms_configs, block_size=64):
+    """Non-maximum suppression of every group of boxes in a single pass.
+
+    Args:
+      boxes: detection boxes with shape [K, 4] and format [x1, y1, x2, y2].
+      scores: detection scores with shape [K].
+      group_ids: non negative ids with shape [K]. Boxes are only suppressed by
+        boxes of the same group, e.g. of the same image and class.
+      nms_configs: a dict config with the same members as for `nms_np.nms`.
+      block_size: number of boxes suppressed together by hard and DIoU NMS.
+
+    Returns:
+      A tuple (indices, scores). Indices are the positions of the retained boxes,
+      sorted by group and in the order `nms_np.nms` retains them within a group,
+      and scores their retained (possibly decayed) scores.
+    """
+    method = nms_configs["method"] or "hard"
+    if method not in ("hard", "diou", "linear", "gaussian"):
+        raise ValueError("Unknown NMS method: {}".format(method))
+    greedy = method in ("hard", "diou")
+
+    # Sort the boxes by group, and by descending score within a group for the greedy methods.
+    sort_keys = (-scores, group_ids) if greedy else (group_ids,)
+    order = np.lexsort(sort_keys)
+    if greedy:
+        order = _nms_np_tie_order(order, boxes, scores, group_ids)
+    group_ids = group_ids[order]
+    group_starts = np.flatnonzero(np.concatenate([[True], group_ids[1:] != group_ids[:-1]])) if order.size else []
+    group_starts = np.asarray(group_starts, dtype=np.int64)
+    group_sizes = np.diff(np.concatenate([group_starts, [order.size]]))
+    group_lengths = _group_lengths(group_sizes)
+
+    retained_indices, retained_scores, retained_groups, retained_positions = [], [], [], []
+    for length in np.unique(group_lengths):
+        bucket = np.flatnonzero(group_lengths == length)
+        position = np.arange(length)
+        valid = position[None, :] < group_sizes[bucket, None]
+        flat = np.where(valid, group_starts[bucket, None] + position[None, :], 0)
+        sorted_indices = order[flat]
+        bucket_boxes = boxes[sorted_indices]
+        bucket_scores = scores[sorted_indices]
+
+        if greedy:
+            retained = greedy_nms(bucket_boxes, valid, method, nms_configs["iou_thresh"] or 0.5, block_size)
+        else:
+            # Default sigma and iou_thresh are from the original soft-nms paper.
+            selected, selected_scores, counts = soft_nms(
+                bucket_boxes,
+                bucket_scores,
+                valid,
+                method,
+                nms_configs["iou_thresh"] or 0.3,
+                nms_configs["sigma"] or 0.5,
+                nms_configs["score_thresh"] or 0.001,
+            )
+            retained = position[None, :] < counts[:, None]
+            sorted_indices = np.take_along_axis(sorted_indices, selected, 1)
+            bucket_scores = selected_scores
+        retained_indices.append(sorted_indices[retained])
+        retained_scores.append(bucket_scores[retained])
+        retained_groups.append(np.broadcast_to(bucket[:, None], retained.shape)[retained])
+        retained_positions.append(np.broadcast_to(position[None, :], retained.shape)[retained])
+
+    if not retained_indices:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=scores.dtype)
+    # Groups are numbered in sorted order, so this restores the group order
+    retained_order = np.lexsort((np.concatenate(retained_positions), np.concatenate(retained_groups)))
+    return np.concatenate(retained_indices)[retained_order], np.concatenate(retained_scores)[retained_order]
+
+
+def batched_per_class_nms(
+    boxes, scores, classes, image_ids, image_scales, num_classes, max_boxes_to_draw, nms_configs, block_size=64
+):
+    """Perform per class nms for a batch of images.
+
+    Args:
+      boxes: a [B, N, 4] array of boxes in [y1, x1, y2, x2] format.
+      scores: a [B, N] array of scores.
+      classes: a [B, N] array of classes, between 0 and num_classes - 1.
+      image_ids: a [B] array of image ids.
+      image_scales: a [B] array of scaling factors of the final boxes.
+      num_classes: number of classes.
+      max_boxes_to_draw: number of detections per image.
+      nms_configs: a dict config with the same members as for `nms_np.nms`.
+      block_size: number of boxes suppressed together by hard and DIoU NMS.
+
+    Returns:
+      numpy.array: [B, max_boxes_to_draw, 7] detections, each of them with the
+        format [image_id, x1, y1, x2, y2, score, class], identical to stacking
+        `nms_np.per_class_nms` of every image.
+    """
+    boxes = np.asarray(boxes)[..., [1, 0, 3, 2]]
+    scores = np.asarray(scores)
+    classes = np.asarray(classes)
+    image_ids = np.asarray(image_ids)
+    image_scales = np.asarray(image_scales)
+    batch_size, num_boxes = scores.shape
+
+    in_range = np.flatnonzero(np.isin(classes, np.arange(num_classes)))
+    image_index = in_range // num_boxes
+    box_classes = classes.reshape(-1)[in_range].astype(np.int64)
+    indices, nms_scores = batched_nms(
+        boxes.reshape(-1, 4)[in_range],
+        scores.reshape(-1)[in_range],
+        image_index * num_classes + box_classes,
+        nms_configs,
+        block_size,
+    )
+    indices = in_range[indices]
+    image_boundaries = np.searchsorted(indices // num_boxes, np.arange(batch_size + 1))
+
+    detections_bs = []
+    for index in range(batch_size):
+        image_id = image_ids[index : index + 1]
+        image_detections = indices[image_boundaries[index] : image_boundaries[index + 1]]
+        if image_detections.size:
+            # Built as nms_np.per_class_nms does, so that the top-k selection breaks ties in the same way
+            detections = np.column_stack(
+                (
+                    np.repeat(image_id, len(image_detections)),
+                    boxes.reshape(-1, 4)[image_detections],
+                    nms_scores[image_boundaries[index] : image_boundaries[index + 1]],
+                    classes.reshape(-1)[image_detections].astype(np.int64) + 1,
+                )
+            )
+            top_indices = np.argsort(-detections[:, -2])
+            detections = np.array(detections[top_indices[0:max_boxes_to_draw]], dtype=np.float32)
+        else:
+            detections = np.zeros((0, 7), dtype=np.float32)
+        # Add dummy detections to fill up to max_boxes_to_draw detections
+        detections_dummy = np.zeros((max(max_boxes_to_draw - len(detections), 0), 7), dtype=np.float32)
+        detections_dummy[:, 0] = image_id[0]
+        detections_dummy[:, 5] = _DUMMY_DETECTION_SCORE
+        detections = np.vstack([detections, detections_dummy])
+        detections[:, 1:5] *= image_scales[index : index + 1]
+        detections_bs.append(detections)
+    return np.stack(detections_bs)
@@ -0,0 +1,120 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Host throughput of the per-image and batched NumPy NMS implementations.
+
+Runs `nms_np.per_class_nms` image by image and `batched_nms_np.batched_per_class_nms`
+on synthetic detections shaped like the output of `pre_nms`, for a range of
+batch sizes, and checks that both produce the same detections.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import batched_nms_np
+import nms_np
+
+
+def synthetic_detections(rng, batch_size, num_boxes, num_classes, image_size=512, num_objects=20):
+    """Boxes clustered around a few objects per image, in [y1, x1, y2, x2] format."""
+    centres = rng.uniform(0, image_size, (batch_size, num_objects, 2))
+    sizes = rng.uniform(0.05, 0.4, (batch_size, num_objects, 2)) * image_size
+    objects = rng.integers(0, num_objects, (batch_size, num_boxes))
+    object_classes = rng.integers(0, num_classes, (batch_size, num_objects))
+
+    box_centres = np.take_along_axis(centres, objects[..., None], 1) + rng.normal(
+        0, 0.02 * image_size, (batch_size, num_boxes, 2)
+    )
+    box_sizes = np.take_along_axis(sizes, objects[..., None], 1) * rng.uniform(0.8, 1.25, (batch_size, num_boxes, 2))
+    boxes = np.concatenate([box_centres - box_sizes / 2, box_centres + box_sizes / 2], -1).astype(np.float32)
+    scores = rng.uniform(0, 1, (batch_size, num_boxes)).astype(np.float32)
+    # Most boxes are predicted with the class of their object
+    classes = np.where(
+        rng.uniform(size=(batch_size, num_boxes)) < 0.7,
+        np.take_along_axis(object_classes, objects, 1),
+        rng.integers(0, num_classes, (batch_size, num_boxes)),
+    )
+    return boxes, scores, classes
+
+
+def per_image_nms(boxes, scores, classes, image_ids, image_scales, num_classes, max_output_size, nms_configs):
+    return np.stack(
+        [
+            nms_np.per_class_nms(
+                boxes[i],
+                scores[i],
+                classes[i],
+                image_ids[i : i + 1],
+                image_scales[i : i + 1],
+                num_classes,
+                max_output_size,
+                nms_configs,
+            )
+            for i in range(boxes.shape[0])
+        ]
+    )
+
+
+def time_fn(fn, args, repeats):
+    fn(*args)
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = fn(*args)
+        durations.append(time.perf_counter() - start)
+    return output, min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Image batch sizes")
+    parser.add_argument(
+        "--num-boxes", type=int, default=nms_np.MAX_DETECTION_POINTS, help="Number of candidate boxes per image"
+    )
+    parser.add_argument("--num-classes", type=int, default=90, help="Number of classes")
+    parser.add_argument(
+        "--methods", nargs="+", default=["hard", "diou", "gaussian"], choices=["hard", "diou", "gaussian", "linear"]
+    )
+    parser.add_argument("--max-output-size", type=int, default=100, help="Detections per image")
+    parser.add_argument("--block-size", type=int, default=64, help="Block size of the batched hard and DIoU NMS")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repeats, the fastest one is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'method':>8} {'batch':>6} {'nms_np (img/s)':>15} {'batched (img/s)':>16} {'speedup':>8} {'match':>6}")
+    for method in args.methods:
+        nms_configs = {"method": method, "iou_thresh": None, "score_thresh": 0.0, "sigma": None}
+        for batch_size in args.batch_sizes:
+            boxes, scores, classes = synthetic_detections(rng, batch_size, args.num_boxes, args.num_classes)
+            image_ids = np.arange(batch_size)
+            image_scales = np.ones(batch_size, dtype=np.float32)
+            inputs = (boxes, scores, classes, image_ids, image_scales, args.num_classes, args.max_output_size)
+
+            expected, reference_time = time_fn(
+                lambda *inputs: per_image_nms(*inputs, nms_configs), inputs, args.repeats
+            )
+            actual, batched_time = time_fn(
+                lambda *inputs: batched_nms_np.batched_per_class_nms(*inputs, nms_configs, args.block_size),
+                inputs,
+                args.repeats,
+            )
+            print(
+                f"{method:>8} {batch_size:>6} {batch_size / reference_time:>15.1f} {batch_size / batched_time:>16.1f}"
+                f" {reference_time / batched_time:>7.1f}x {str(np.array_equal(expected, actual)):>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+import batched_nms_np
+import nms_np
+from nms_benchmark import per_image_nms, synthetic_detections
+
+NUM_CLASSES = 6
+MAX_OUTPUT_SIZE = 50
+
+
+def nms_configs(method):
+    return {"method": method, "iou_thresh": None, "score_thresh": 0.0, "sigma": None}
+
+
+@pytest.mark.parametrize("method", ["hard", "diou", "gaussian", "linear"])
+@pytest.mark.parametrize("batch_size,num_boxes,block_size", [(1, 40, 64), (3, 300, 64), (4, 300, 16)])
+def test_matches_per_image_nms(method, batch_size, num_boxes, block_size):
+    rng = np.random.default_rng(batch_size)
+    boxes, scores, classes = synthetic_detections(rng, batch_size, num_boxes, NUM_CLASSES, num_objects=5)
+    image_ids = np.arange(batch_size) + 10
+    image_scales = rng.uniform(0.5, 2.0, batch_size).astype(np.float32)
+    inputs = (boxes, scores, classes, image_ids, image_scales, NUM_CLASSES, MAX_OUTPUT_SIZE)
+
+    expected = per_image_nms(*inputs, nms_configs(method))
+    actual = batched_nms_np.batched_per_class_nms(*inputs, nms_configs(method), block_size)
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("method", ["hard", "diou", "gaussian", "linear"])
+@pytest.mark.parametrize("seed", range(10))
+def test_tied_scores(method, seed):
+    rng = np.random.default_rng(seed)
+    boxes, scores, classes = synthetic_detections(rng, 2, 300, NUM_CLASSES, num_objects=5)
+    # Many boxes of the same class have equal scores
+    scores = np.round(scores, 2)
+    inputs = (boxes, scores, classes, np.arange(2), np.ones(2, dtype=np.float32), NUM_CLASSES, MAX_OUTPUT_SIZE)
+
+    expected = per_image_nms(*inputs, nms_configs(method))
+    actual = batched_nms_np.batched_per_class_nms(*inputs, nms_configs(method))
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_images_without_detections():
+    rng = np.random.default_rng(0)
+    boxes, scores, classes = synthetic_detections(rng, 3, 20, NUM_CLASSES)
+    # Classes outside of the range are ignored, leaving the second image empty
+    classes[1] = NUM_CLASSES
+    inputs = (boxes, scores, classes, np.arange(3), np.ones(3, dtype=np.float32), NUM_CLASSES, MAX_OUTPUT_SIZE)
+
+    expected = per_image_nms(*inputs, nms_configs("hard"))
+    actual = batched_nms_np.batched_per_class_nms(*inputs, nms_configs("hard"))
+    np.testing.assert_array_equal(actual, expected)
+    assert np.all(actual[1, :, 5] == nms_np._DUMMY_DETECTION_SCORE)
+
+
+def test_groups_are_independent():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [0, 0, 10, 10], [50, 50, 60, 60]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+    indices, retained_scores = batched_nms_np.batched_nms(boxes, scores, np.array([1, 1, 0, 1]), nms_configs("hard"))
+    # The third box only overlaps boxes of another group
+    np.testing.assert_array_equal(indices, [2, 0, 3])
+    np.testing.assert_array_equal(retained_scores, scores[[2, 0, 3]])
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        batched_nms_np.batched_nms(np.zeros((1, 4)), np.zeros(1), np.zeros(1, dtype=np.int64), nms_configs("other"))
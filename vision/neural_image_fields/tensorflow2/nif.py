@@ -30,9 +30,7 @@ def stochastic_uv_samples(rng, sample_count, image_shape, dtype):
     return np.concatenate([u, v], axis=1)
 
 
-def decode_samples(image_shape, uv, values, params):
-    if uv.shape[0] != values.shape[0]:
-        raise ValueError(f"Size mismatch between uv coords: {uv.shape} and values: {values.shape}")
+def decode_values(values, params):
     decoded_values = values * params["max"]
 
     transfer_function = params["transfer_function"]
@@ -44,12 +42,16 @@ def decode_samples(image_shape, uv, values, params):
         decoded_values = np.exp(decoded_values)
     else:
         decoded_values += np.array(params["mean"])
+    return decoded_values
+
+
+def decode_samples(image_shape, uv, values, params):
+    if uv.shape[0] != values.shape[0]:
+        raise ValueError(f"Size mismatch between uv coords: {uv.shape} and values: {values.shape}")
+    decoded_values = decode_values(values, params)
 
     output = np.zeros(shape=image_shape, dtype=np.float32)
-    i = 0
-    for r, c in uv:
-        output[r][c] = decoded_values[i]
-        i += 1
+    output[uv[:, 0], uv[:, 1]] = decoded_values
     return output
 
 
@@ -176,21 +178,23 @@ def make_prediction_dataset(width, height, batch_size, embedding_dimension, embe
 # This is the position encoding the original NERF paper.
 def uv_positional_encode(uv, dimension, sigma):
     print(f"UV samples shape: {uv.shape}")
+    encoded = positional_encode(uv, dimension, sigma)
+    print(f"Position encoded UV shape: {encoded.shape}")
+    return encoded
+
+
+def positional_encode(uv, dimension, sigma):
     powers = np.arange(0.0, dimension, 1.0)
     coeffs = np.power([sigma], powers)
     uv2 = 2 * (uv - 1.0)
-    encoded = np.empty([uv.shape[0], 4 * dimension], dtype=uv.dtype)
-    print(f"Position encoded UV shape: {encoded.shape}")
 
     # Order of components doesn't matter as they will be fed to a fully
     # connected layer so we can concatenate in a more efficient order:
-    i = 0
+    posxy = np.concatenate([uv2[:, 0:1] * coeffs, uv2[:, 1:2] * coeffs], axis=1)
+    encoded = np.empty([uv.shape[0], 4 * dimension], dtype=uv.dtype)
     half_dim = 2 * dimension
-    for px, py in uv2:
-        posxy = np.concatenate([coeffs * px, coeffs * py])
-        encoded[i][0:half_dim] = np.sin(posxy)
-        encoded[i][half_dim:] = np.cos(posxy)
-        i += 1
+    encoded[:, 0:half_dim] = np.sin(posxy)
+    encoded[:, half_dim:] = np.cos(posxy)
     return encoded
 
 
@@ -249,17 +253,27 @@ def color_space_to_bgr_matrix(color_space: str):
 
 class EvalCallback(tf.keras.callbacks.Callback):
     """
-    A Keras callback which logs training info and optionally launches a
-    separate evaluation process to run in parallel with training.
+    A Keras callback which logs training info and optionally evaluates the
+    model. If an evaluator (see `nif_eval.TiledEvaluator`) is given the
+    evaluation runs in-process on the live model weights, otherwise a
+    separate evaluation process is launched to run in parallel with training.
     """
 
-    def __init__(self, original_file, model_path, period, compute_psnr, no_ipu, log_dir=None):
+    def __init__(self, original_file, model_path, period, compute_psnr, no_ipu, log_dir=None, evaluator=None):
         super().__init__()
         self.input_file = original_file
         self.model_path = model_path
         self.period = period
         self.eval_process = None
         self.compute_psnr = compute_psnr
+        self.evaluator = evaluator
+        self.summary_writer = None
+        self.reference = None
+        self.reconstruction = None
+        if evaluator is not None and compute_psnr:
+            self.reference = cv2.imread(self.input_file, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+            if log_dir:
+                self.reconstruction = np.zeros(evaluator.output_shape, dtype=np.float32)
         _, file_extension = os.path.splitext(self.input_file)
         self.tmp_output = os.path.join(self.model_path, "tmp_eval_image" + file_extension)
         self.eval_args = [
@@ -327,6 +341,24 @@ class EvalCallback(tf.keras.callbacks.Callback):
             return stdout, stderr
         return None, None
 
+    def evaluate_in_process(self, epoch):
+        eval_start = time.time()
+        psnr = self.evaluator.evaluate(self.model, reference=self.reference, output=self.reconstruction)
+        eval_time = time.time() - eval_start
+        print(f"In-process evaluation at epoch {epoch} took {eval_time:.2f} seconds.")
+        print(f"RGB PSNR RGB at epoch {epoch}: {psnr['rgb']}")
+        print(f"LUMINAL PSNR at epoch {epoch}: {psnr['l']}")
+        print(f"CHROMATIC PSNR at epoch {epoch}: {psnr['ab']}")
+        if self.summary_writer:
+            with self.summary_writer.as_default():
+                if self.reconstruction is not None:
+                    peak = np.max(self.reference)
+                    img = np.clip(cv2.cvtColor(self.reconstruction, cv2.COLOR_BGR2RGB), 0, peak) / peak
+                    tf.summary.image("Reconstructed Image", np.expand_dims(img, axis=0), step=epoch)
+                tf.summary.scalar("PSNR RGB", psnr["rgb"], step=epoch)
+                tf.summary.scalar("PSNR L", psnr["l"], step=epoch)
+                tf.summary.scalar("PSNR AB", psnr["ab"], step=epoch)
+
     def cleanup(self, epoch):
         stdout, stderr = self.wait_until_finished(epoch - self.period)
 
@@ -337,6 +369,10 @@ class EvalCallback(tf.keras.callbacks.Callback):
         epoch_time = time.time() - self.epoch_start_time
         print(f"Completed epoch {epoch} in {epoch_time:.2f} seconds. Loss: {logs['loss']}")
         if epoch % self.period == 0:
+            if self.evaluator is not None:
+                if self.compute_psnr:
+                    self.evaluate_in_process(epoch)
+                return
             out, err = self.wait_until_finished(epoch - self.period)
             if self.compute_psnr:
                 # Set env so we use executable caching for eval process:
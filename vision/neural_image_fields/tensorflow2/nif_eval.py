@@ -0,0 +1,200 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import collections
+import numpy as np
+import tensorflow as tf
+from skimage import color
+
+import nif
+
+
+def make_tiles(height, width, tile_size, roi=None):
+    """
+    Split the region of interest (row, col, height, width) of an image into
+    tiles (row, col, tile_height, tile_width). The region defaults to the
+    whole image. Tiles on the bottom and right edges may be smaller.
+    """
+    if roi is None:
+        roi = (0, 0, height, width)
+    row0, col0, roi_height, roi_width = roi
+    if row0 < 0 or col0 < 0 or row0 + roi_height > height or col0 + roi_width > width:
+        raise ValueError(f"Region of interest {roi} is outside of the image ({height}, {width})")
+    tiles = []
+    for r in range(row0, row0 + roi_height, tile_size):
+        for c in range(col0, col0 + roi_width, tile_size):
+            tiles.append((r, c, min(tile_size, row0 + roi_height - r), min(tile_size, col0 + roi_width - c)))
+    return tiles
+
+
+def tile_uv_coords(tile, height, width):
+    """The uv coordinates of a tile's pixels, identical to the matching rows of `nif.make_image_grid`."""
+    r, c, tile_height, tile_width = tile
+    u_coords, v_coords = np.mgrid[float(r) : r + tile_height, float(c) : c + tile_width]
+    u_coords /= height
+    v_coords /= width
+    return np.array([u_coords.flatten(), v_coords.flatten()]).transpose()
+
+
+class PSNRAccumulator:
+    """
+    Computes the same peak-signal-to-noise-ratios as `predict_nif.py` (RGB,
+    Lab luminance and Lab chrominance) from tiles of the reconstructed and
+    reference images, without holding either image in memory.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.squared_error = collections.defaultdict(float)
+        self.count = collections.defaultdict(int)
+        self.peak = collections.defaultdict(lambda: -np.inf)
+
+    def _accumulate(self, name, reference, reconstructed):
+        error = reference.astype(np.float64) - reconstructed.astype(np.float64)
+        self.squared_error[name] += np.sum(np.square(error))
+        self.count[name] += error.size
+        self.peak[name] = max(self.peak[name], float(np.max(reference)))
+
+    def update(self, reference_rgb, reconstructed_rgb):
+        self._accumulate("rgb", reference_rgb, reconstructed_rgb)
+        lab_reference = color.rgb2lab(reference_rgb)
+        lab_reconstructed = color.rgb2lab(reconstructed_rgb)
+        self._accumulate("l", lab_reference[..., 0], lab_reconstructed[..., 0])
+        self._accumulate("ab", lab_reference[..., 1:], lab_reconstructed[..., 1:])
+
+    def result(self):
+        psnr = {}
+        for name, squared_error in self.squared_error.items():
+            mse = squared_error / self.count[name]
+            peak = self.peak[name]
+            psnr[name] = 10 * np.log10((peak / mse) * peak)
+        return psnr
+
+
+class TiledEvaluator:
+    """
+    Reconstructs an image (or a region of interest of it) from a NIF model
+    tile by tile and optionally computes its PSNR against a reference image.
+
+    The model is called in-process so the live training weights can be used
+    directly. The (positionally encoded) inputs of each tile only depend on
+    its position, so they are kept in an LRU cache and reused between
+    evaluations. Consecutive tiles are grouped into predict calls of a fixed
+    size (a multiple of `batch_size * steps_per_execution`) so that the
+    prediction program never sees a new shape.
+    """
+
+    def __init__(
+        self,
+        image_shape,
+        encode_params,
+        embedding_dimension,
+        embedding_sigma,
+        tile_size=256,
+        batch_size=None,
+        steps_per_execution=1,
+        roi=None,
+        max_cached_tiles=64,
+        input_dtype=np.float32,
+    ):
+        self.height = image_shape[0]
+        self.width = image_shape[1]
+        self.encode_params = encode_params
+        self.embedding_dimension = embedding_dimension
+        self.embedding_sigma = embedding_sigma
+        self.tiles = make_tiles(self.height, self.width, tile_size, roi)
+        self.roi = roi if roi is not None else (0, 0, self.height, self.width)
+        self.batch_size = batch_size if batch_size is not None else tile_size
+        execution_samples = self.batch_size * steps_per_execution
+        tile_samples = tile_size * tile_size
+        self.samples_per_call = -(-tile_samples // execution_samples) * execution_samples
+        self.max_cached_tiles = max_cached_tiles
+        self.input_dtype = input_dtype
+        self.input_cache = collections.OrderedDict()
+        self.psnr = PSNRAccumulator()
+
+    @property
+    def output_shape(self):
+        return (self.roi[2], self.roi[3], 3)
+
+    def tile_inputs(self, tile):
+        """Model inputs for every pixel of the tile, from the cache when possible."""
+        if tile in self.input_cache:
+            self.input_cache.move_to_end(tile)
+            return self.input_cache[tile]
+        uv = tile_uv_coords(tile, self.height, self.width)
+        if self.embedding_dimension > 0:
+            uv = nif.positional_encode(uv, self.embedding_dimension, self.embedding_sigma)
+        inputs = uv.astype(self.input_dtype)
+        if self.max_cached_tiles > 0:
+            self.input_cache[tile] = inputs
+            if len(self.input_cache) > self.max_cached_tiles:
+                self.input_cache.popitem(last=False)
+        return inputs
+
+    def _predict(self, model, inputs):
+        sample_count = inputs.shape[0]
+        padded_count = -(-sample_count // self.samples_per_call) * self.samples_per_call
+        padded = np.zeros([padded_count, inputs.shape[1]], dtype=inputs.dtype)
+        padded[:sample_count] = inputs
+        ds = tf.data.Dataset.from_tensor_slices(padded).batch(self.batch_size, drop_remainder=True)
+        values = model.predict(x=ds, steps=padded_count // self.batch_size, verbose=0)
+        return values[:sample_count]
+
+    def _write_tile(self, tile, values, reference, output):
+        r, c, tile_height, tile_width = tile
+        decoded = nif.decode_values(values, self.encode_params).astype(np.float32)
+        decoded = decoded.reshape(tile_height, tile_width, -1)
+        if output is not None:
+            out_r = r - self.roi[0]
+            out_c = c - self.roi[1]
+            output[out_r : out_r + tile_height, out_c : out_c + tile_width] = decoded
+        if reference is not None:
+            reference_tile = np.asarray(reference[r : r + tile_height, c : c + tile_width], dtype=np.float32)
+            # Both images are stored in BGR order (OpenCV convention):
+            self.psnr.update(reference_tile[..., ::-1], decoded[..., ::-1])
+
+    def evaluate(self, model, reference=None, output=None):
+        """
+        Decode the region of interest with `model`.
+
+        Args:
+            model: Keras NIF model.
+            reference: Optional full size BGR reference image. Any array-like
+                supporting slicing (e.g. a `np.memmap`) can be used so that it
+                does not need to fit in memory.
+            output: Optional array-like of shape `output_shape` that receives
+                the decoded BGR region of interest.
+
+        Returns:
+            A dict of PSNR values for "rgb", "l" and "ab" if a reference was
+            given, otherwise an empty dict.
+        """
+        self.psnr.reset()
+        pending_tiles = []
+        pending_inputs = []
+        pending_count = 0
+
+        def flush():
+            values = self._predict(model, np.concatenate(pending_inputs))
+            start = 0
+            for tile in pending_tiles:
+                end = start + tile[2] * tile[3]
+                self._write_tile(tile, values[start:end], reference, output)
+                start = end
+            pending_tiles.clear()
+            pending_inputs.clear()
+
+        for tile in self.tiles:
+            inputs = self.tile_inputs(tile)
+            if pending_count + inputs.shape[0] > self.samples_per_call and pending_tiles:
+                flush()
+                pending_count = 0
+            pending_tiles.append(tile)
+            pending_inputs.append(inputs)
+            pending_count += inputs.shape[0]
+        if pending_tiles:
+            flush()
+
+        return self.psnr.result()
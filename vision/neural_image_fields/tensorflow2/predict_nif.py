@@ -7,9 +7,9 @@ import argparse
 import cv2
 import numpy as np
 import nif
+import nif_eval
 import os
 from ipu_tensorflow_addons.keras.optimizers import AdamIpuOptimizer
-from skimage import color, metrics
 
 if tf.__version__[0] != "2":
     raise ImportError("TensorFlow 2 is required")
@@ -17,7 +17,13 @@ if tf.__version__[0] != "2":
 
 def parse_args():
     parser = argparse.ArgumentParser("Neural Image Field (NIF) Generator")
-    parser.add_argument("--output", type=str, default="mlp_samples.png", help="Output image file name.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="mlp_samples.png",
+        help="Output image file name. If the extension is .npy the float BGR image is written to a memory mapped "
+        "NumPy file instead, so that images larger than host memory can be decoded.",
+    )
     parser.add_argument("--model", type=str, default="./saved_model/", help="Input path to load a trained NIF model.")
     parser.add_argument("--width", type=int, default=0, help="Width of generated image.")
     parser.add_argument("--height", type=int, default=0, help="Height of generated image.")
@@ -28,6 +34,15 @@ def parse_args():
         help="If an original reference image is specified then an error "
         "metric will be computed between it and the reconstruction.",
     )
+    parser.add_argument("--tile-size", type=int, default=256, help="Size of the square tiles the image is decoded in.")
+    parser.add_argument(
+        "--roi",
+        type=int,
+        nargs=4,
+        default=None,
+        metavar=("ROW", "COL", "HEIGHT", "WIDTH"),
+        help="Only decode (and evaluate) this region of interest of the image.",
+    )
     parser.add_argument("--no-ipu", action="store_true", help="Set this flag to disable IPU specific code paths.")
     args = parser.parse_args()
     return args
@@ -62,48 +77,35 @@ if __name__ == "__main__":
         model = keras.models.load_model(h5_model_path, custom_objects={"AdamIpuOptimizer": AdamIpuOptimizer})
         model.summary()
 
-        # Reconstruct the entire image from the trained NIF:
-        output_sample_count = width * height
-        prediction_batch_size = max(width, height)
-        prediction_batches = output_sample_count // prediction_batch_size
-        print(f"Required samples: {output_sample_count} and batches: {prediction_batches}")
-        eval_ds, pixel_coords = nif.make_prediction_dataset(
-            width, height, prediction_batch_size, embedding_dimension, embedding_sigma
+        # Reconstruct the image (or region of interest) from the trained NIF tile by tile:
+        evaluator = nif_eval.TiledEvaluator(
+            img_shape, encode_params, embedding_dimension, embedding_sigma, tile_size=args.tile_size, roi=args.roi
         )
-        result = model.predict(x=eval_ds, batch_size=prediction_batch_size, steps=prediction_batches)
-        reconstructed = nif.decode_samples(
-            img_shape, pixel_coords[0:output_sample_count].astype(np.int32), result, encode_params
+        print(
+            f"Decoding {len(evaluator.tiles)} tiles of size {args.tile_size} into output of shape {evaluator.output_shape}"
         )
-        cv2.imwrite(args.output, reconstructed)
-        print(f"Saved image.")
-
+        if args.output.endswith(".npy"):
+            reconstructed = np.lib.format.open_memmap(
+                args.output, mode="w+", dtype=np.float32, shape=evaluator.output_shape
+            )
+        else:
+            reconstructed = np.zeros(evaluator.output_shape, dtype=np.float32)
+
+        reference = None
         if args.original:
-            bgr_img = cv2.imread(args.original, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH).astype(np.float32)
-            rgb_img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
-
-            # Compute PSNR on RGB directly:
-            rgb_max = np.max(rgb_img)
-            rgb_mse = metrics.mean_squared_error(rgb_img, reconstructed)
-            psnr = 10 * np.log10((rgb_max / rgb_mse) * rgb_max)
-            print(f"PSNR RGB: {psnr}")
-
-            # Also compute PSNR separately for luminance and chrominance using the Lab colour space. This colour space
-            # is perceptually linear in theory. (See "Efficient High Dynamic Range Texture Compression", Roimela et. al. 2008)
-            lab_img = color.rgb2lab(rgb_img)
-            lab_reconstructed = color.rgb2lab(reconstructed)
+            reference = cv2.imread(args.original, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
 
-            # Luminance PSNR:
-            lum_img = lab_img[:, :, 0]
-            lum_max = np.max(lum_img)
-            lum_recon = lab_reconstructed[:, :, 0]
-            lum_mse = metrics.mean_squared_error(lum_img, lum_recon)
-            luminal_psnr = 10 * np.log10((lum_max / lum_mse) * lum_max)
-            print(f"PSNR L: {luminal_psnr}")
+        psnr = evaluator.evaluate(model, reference=reference, output=reconstructed)
+        if args.output.endswith(".npy"):
+            reconstructed.flush()
+        else:
+            cv2.imwrite(args.output, reconstructed)
+        print(f"Saved image.")
 
-            # Chrominance PSNR:
-            ab_img = lab_img[:, :, 1:]
-            ab_recon = lab_reconstructed[:, :, 1:]
-            ab_max = np.max(ab_img)
-            ab_mse = metrics.mean_squared_error(ab_img, ab_recon)
-            chromatic_psnr = 10 * np.log10((ab_max / ab_mse) * ab_max)
-            print(f"PSNR AB: {chromatic_psnr}")
+        if args.original:
+            # PSNR is computed on RGB directly and also separately for luminance and chrominance using the Lab colour
+            # space. This colour space is perceptually linear in theory. (See "Efficient High Dynamic Range Texture
+            # Compression", Roimela et. al. 2008)
+            print(f"PSNR RGB: {psnr['rgb']}")
+            print(f"PSNR L: {psnr['l']}")
+            print(f"PSNR AB: {psnr['ab']}")
@@ -0,0 +1,119 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+from pathlib import Path
+import sys
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from skimage import color, metrics
+
+sys.path.append(str(Path(__file__).parent.parent))
+import nif
+import nif_eval
+
+
+HEIGHT = 37
+WIDTH = 53
+EMBEDDING_DIMENSION = 4
+EMBEDDING_SIGMA = 2.0
+
+
+def reference_positional_encode(uv, dimension, sigma):
+    powers = np.arange(0.0, dimension, 1.0)
+    coeffs = np.power([sigma], powers)
+    uv2 = 2 * (uv - 1.0)
+    encoded = np.empty([uv.shape[0], 4 * dimension], dtype=uv.dtype)
+    half_dim = 2 * dimension
+    for i, (px, py) in enumerate(uv2):
+        posxy = np.concatenate([coeffs * px, coeffs * py])
+        encoded[i][0:half_dim] = np.sin(posxy)
+        encoded[i][half_dim:] = np.cos(posxy)
+    return encoded
+
+
+@pytest.fixture
+def model():
+    tf.keras.utils.set_random_seed(0)
+    return tf.keras.Sequential(
+        [
+            tf.keras.Input(shape=(4 * EMBEDDING_DIMENSION,)),
+            tf.keras.layers.Dense(16, activation="relu"),
+            tf.keras.layers.Dense(3),
+        ]
+    )
+
+
+@pytest.fixture
+def encode_params():
+    return {"mean": [100.0, 110.0, 120.0], "max": 255.0, "transfer_function": "linear", "eps": 1e-8}
+
+
+@pytest.fixture
+def reference():
+    rng = np.random.default_rng(0)
+    return rng.uniform(0, 255, size=(HEIGHT, WIDTH, 3)).astype(np.float32)
+
+
+def full_image_reconstruction(model, encode_params):
+    pixel_coords, uv = nif.make_image_grid(WIDTH, HEIGHT)
+    inputs = nif.positional_encode(uv, EMBEDDING_DIMENSION, EMBEDDING_SIGMA).astype(np.float32)
+    values = model.predict(inputs, batch_size=WIDTH, verbose=0)
+    return nif.decode_samples((HEIGHT, WIDTH, 3), pixel_coords.astype(np.int32), values, encode_params)
+
+
+def test_positional_encode_matches_per_sample_loop():
+    _, uv = nif.make_image_grid(WIDTH, HEIGHT)
+    np.testing.assert_array_equal(
+        nif.positional_encode(uv, EMBEDDING_DIMENSION, EMBEDDING_SIGMA),
+        reference_positional_encode(uv, EMBEDDING_DIMENSION, EMBEDDING_SIGMA),
+    )
+
+
+@pytest.mark.parametrize("tile_size", [8, 16, 64])
+def test_tiles_match_image_grid(tile_size):
+    _, uv = nif.make_image_grid(WIDTH, HEIGHT)
+    uv = uv.reshape(HEIGHT, WIDTH, 2)
+    tiles = nif_eval.make_tiles(HEIGHT, WIDTH, tile_size)
+    assert sum(t[2] * t[3] for t in tiles) == HEIGHT * WIDTH
+    for tile in tiles:
+        r, c, h, w = tile
+        np.testing.assert_array_equal(
+            nif_eval.tile_uv_coords(tile, HEIGHT, WIDTH), uv[r : r + h, c : c + w].reshape(-1, 2)
+        )
+
+
+@pytest.mark.parametrize("tile_size,batch_size", [(16, 24), (64, 53)])
+def test_tiled_evaluation_matches_full_image(model, encode_params, reference, tile_size, batch_size):
+    expected = full_image_reconstruction(model, encode_params)
+    evaluator = nif_eval.TiledEvaluator(
+        reference.shape, encode_params, EMBEDDING_DIMENSION, EMBEDDING_SIGMA, tile_size=tile_size, batch_size=batch_size
+    )
+    output = np.zeros(evaluator.output_shape, dtype=np.float32)
+    psnr = evaluator.evaluate(model, reference=reference, output=output)
+    np.testing.assert_allclose(output, expected, rtol=1e-5, atol=1e-3)
+
+    rgb_reference = reference[..., ::-1]
+    rgb_expected = expected[..., ::-1]
+    rgb_psnr = 10 * np.log10(np.max(rgb_reference) ** 2 / metrics.mean_squared_error(rgb_reference, rgb_expected))
+    np.testing.assert_allclose(psnr["rgb"], rgb_psnr, rtol=1e-5)
+    lab_reference = color.rgb2lab(rgb_reference)
+    lab_expected = color.rgb2lab(rgb_expected)
+    l_mse = metrics.mean_squared_error(lab_reference[..., 0], lab_expected[..., 0])
+    np.testing.assert_allclose(psnr["l"], 10 * np.log10(np.max(lab_reference[..., 0]) ** 2 / l_mse), rtol=1e-4)
+    ab_mse = metrics.mean_squared_error(lab_reference[..., 1:], lab_expected[..., 1:])
+    np.testing.assert_allclose(psnr["ab"], 10 * np.log10(np.max(lab_reference[..., 1:]) ** 2 / ab_mse), rtol=1e-4)
+
+
+def test_region_of_interest_and_input_cache(model, encode_params, reference):
+    expected = full_image_reconstruction(model, encode_params)
+    roi = (5, 7, 20, 30)
+    evaluator = nif_eval.TiledEvaluator(
+        reference.shape, encode_params, EMBEDDING_DIMENSION, EMBEDDING_SIGMA, tile_size=8, roi=roi, max_cached_tiles=4
+    )
+    assert evaluator.output_shape == (20, 30, 3)
+    for _ in range(2):
+        output = np.zeros(evaluator.output_shape, dtype=np.float32)
+        evaluator.evaluate(model, output=output)
+        np.testing.assert_allclose(output, expected[5:25, 7:37], rtol=1e-5, atol=1e-3)
+        assert len(evaluator.input_cache) == 4
@@ -9,6 +9,7 @@ import argparse
 import cv2
 import numpy as np
 import nif
+import nif_eval
 import time
 import datetime
 import sys
@@ -145,7 +146,23 @@ def parse_args():
     parser.add_argument(
         "--disable-psnr",
         action="store_true",
-        help="Disable peak signal-to-noise ratio evaluation during training. (Note: evaluation of the PSNR launches a separate process on a separate device which may be undesirable.)",
+        help="Disable peak signal-to-noise ratio evaluation during training.",
+    )
+    parser.add_argument(
+        "--eval-subprocess",
+        action="store_true",
+        help="Evaluate the PSNR by launching predict_nif.py in a separate process on a separate device (which reloads the saved model), instead of in-process with the live model.",
+    )
+    parser.add_argument(
+        "--eval-tile-size", type=int, default=256, help="Size of the square tiles decoded by the in-process evaluation."
+    )
+    parser.add_argument(
+        "--eval-roi",
+        type=int,
+        nargs=4,
+        default=None,
+        metavar=("ROW", "COL", "HEIGHT", "WIDTH"),
+        help="Only decode and evaluate this region of interest of the image in the in-process evaluation.",
     )
     parser.add_argument(
         "--replicas", type=int, default=1, help="Number of IPUs to replicate model over for data parallel training."
@@ -328,6 +345,19 @@ if __name__ == "__main__":
         else:
             tb_logdir = os.path.join(args.tensorboard_dir, f"run_{model_name_str}_{time_string}")
 
+        evaluator = None
+        if not args.eval_subprocess:
+            evaluator = nif_eval.TiledEvaluator(
+                img.shape,
+                encode_params,
+                embedding_dimension,
+                args.embedding_sigma,
+                tile_size=args.eval_tile_size,
+                batch_size=args.batch_size // (args.gradient_accumulation_count * args.replicas),
+                steps_per_execution=1 if args.no_ipu else steps_per_exec,
+                roi=args.eval_roi,
+                input_dtype=train_uv.dtype,
+            )
         eval_callback = nif.EvalCallback(
             original_file=args.input,
             model_path=saved_model_path,
@@ -335,6 +365,7 @@ if __name__ == "__main__":
             compute_psnr=not args.disable_psnr,
             no_ipu=args.no_ipu,
             log_dir=tb_logdir,
+            evaluator=evaluator,
         )
         if args.single_step:
             callbacks = []
@@ -151,3 +151,15 @@ def predict_data_set(args, X):
     if args.use_prefetch:
         ds = ds.prefetch(args.steps_per_execution)
     return ds
+
+
+def predict_images(args, X):
+    """
+    Full resolution [height, width, 1] images for the tiled inference, normalized
+    as the inputs of predict_data_set, they are resized by the tiled inference
+    """
+    for image in X:
+        image = np.asarray(image, dtype=args.dtype)[..., np.newaxis]
+        if not args.host_generated_data:
+            image = image / 127.5 - 1
+        yield image
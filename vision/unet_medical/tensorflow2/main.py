@@ -40,7 +40,11 @@ def main():
     else:
         X, y, X_test = get_images_labels(args)
 
-    ds_infer = predict_data_set(args, X_test)
+    if args.tiled_inference:
+        # the test images are tiled in unet.infer_model
+        ds_infer = X_test
+    else:
+        ds_infer = predict_data_set(args, X_test)
     if args.eval and args.kfold > 1:
         # k fold cross validation
         kfold = KFold(n_splits=args.kfold, shuffle=True)
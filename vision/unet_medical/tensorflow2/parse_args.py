@@ -105,6 +105,33 @@ def parse_params():
     data_group.add_argument("--use-prefetch", action="store_true", help="Use dataset prefetch.")
     data_group.add_argument("--data-dir", type=str, default="data", help="Directory containing TIF image data")
 
+    # Tiled inference arguments
+    tiling_group = parser.add_argument_group("tiled inference")
+    tiling_group.add_argument(
+        "--tiled-inference",
+        action="store_true",
+        help="Infer on the full resolution test images with overlapping tiles of the model input size.",
+    )
+    tiling_group.add_argument(
+        "--tile-stride",
+        type=int,
+        default=192,
+        help="Distance between neighbouring tiles, at most the output size 388. Use a multiple of 16 for seamless outputs.",
+    )
+    tiling_group.add_argument(
+        "--tile-blending",
+        choices=["gaussian", "cosine", "uniform"],
+        default="gaussian",
+        help="Weights of the overlapping tile outputs.",
+    )
+    tiling_group.add_argument(
+        "--tile-input-scale",
+        type=float,
+        default=388 / 512,
+        help="Scale of the images before tiling, the masks are resized back to the full resolution. "
+        "The default matches the training images, which are resized from 512 to 388.",
+    )
+
     args = parser.parse_args()
     if not (args.train or args.infer):
         parser.error("At least one of --train or --infer must be provided")
@@ -115,4 +142,9 @@ def parse_params():
 
     if args.nb_ipus_per_replica != 4 and args.train:
         parser.error("This model has to use 4 IPUs per replica for training.")
+
+    if args.tiled_inference and not 0 < args.tile_stride <= 388:
+        parser.error("--tile-stride must be between 1 and the output size 388.")
+    if args.tiled_inference and args.tile_input_scale <= 0:
+        parser.error("--tile-input-scale must be positive.")
     return args
@@ -0,0 +1,128 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+"""Tests for the tiled inference, with small Keras models on the CPU."""
+import numpy as np
+import pytest
+import tensorflow as tf
+from tensorflow import keras
+
+from tiling import TiledInference, blending_weights, resize, tile_positions
+
+
+def crop_model(margin):
+    """Outputs the center of its input, as the valid convolutions of the UNet"""
+    inputs = keras.Input((None, None, 1))
+    return keras.Model(inputs, keras.layers.Cropping2D(margin)(inputs))
+
+
+def conv_model(seed=0):
+    """Valid convolutions and a 2x2 pooling, 6 pixels of margin on each side and shift equivariant for even shifts"""
+    tf.random.set_seed(seed)
+    inputs = keras.Input((None, None, 1))
+    x = keras.layers.Conv2D(4, 3, activation="relu")(inputs)
+    x = keras.layers.Conv2D(4, 3, activation="relu")(x)
+    x = keras.layers.MaxPool2D(2)(x)
+    x = keras.layers.Conv2D(4, 3, activation="relu")(x)
+    x = keras.layers.Conv2D(4, 3, activation="relu")(x)
+    x = keras.layers.UpSampling2D(2)(x)
+    outputs = keras.layers.Conv2D(2, 1, activation="softmax")(x)
+    return keras.Model(inputs, outputs)
+
+
+def test_tile_positions():
+    assert tile_positions(388, 388, 192).tolist() == [0]
+    assert tile_positions(100, 388, 192).tolist() == [0]
+    assert tile_positions(512, 388, 192).tolist() == [0, 192]
+    assert tile_positions(581, 388, 192).tolist() == [0, 192, 384]
+
+
+@pytest.mark.parametrize("blending", ["gaussian", "cosine", "uniform"])
+def test_blending_weights(blending):
+    weights = blending_weights(388, blending)
+    assert weights.shape == (388, 388)
+    assert np.all(weights > 0)
+    np.testing.assert_allclose(weights, weights.T)
+    np.testing.assert_allclose(weights, weights[::-1, ::-1])
+
+
+@pytest.mark.parametrize("blending", ["gaussian", "cosine"])
+@pytest.mark.parametrize("shape", [(572, 572), (1000, 700), (100, 60), (388, 389)])
+def test_seamless_reconstruction(blending, shape):
+    model = crop_model(92)
+    tiled_inference = TiledInference(model.predict_on_batch, stride=192, batch_size=4, blending=blending)
+    image = np.random.default_rng(0).uniform(-1, 1, size=shape + (1,)).astype(np.float32)
+    (output,) = tiled_inference.predict([image])
+    np.testing.assert_allclose(output, image, atol=1e-5)
+
+
+def test_full_image_prediction():
+    model = conv_model()
+    images = [
+        np.random.default_rng(seed).uniform(-1, 1, size=shape + (1,)).astype(np.float32)
+        for seed, shape in enumerate([(200, 150), (96, 96), (64, 250)])
+    ]
+    tiled_inference = TiledInference(model.predict_on_batch, tile_size=64, output_size=52, stride=16, batch_size=5)
+    for image, output in zip(images, tiled_inference.predict(images)):
+        # the full image prediction sees the same context as the tiles, mirrored at the borders
+        padded = np.pad(image, [(6, 6), (6, 6), (0, 0)], mode="reflect")
+        expected = model.predict_on_batch(padded[np.newaxis])[0]
+        assert output.shape == image.shape[:2] + (2,)
+        np.testing.assert_allclose(output, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("input_scale", [388 / 512, 0.5, 1.5])
+def test_input_scale(input_scale):
+    model = crop_model(92)
+    tiled_inference = TiledInference(model.predict_on_batch, stride=192, batch_size=4, input_scale=input_scale)
+    image = np.random.default_rng(0).uniform(-1, 1, size=(700, 512, 1)).astype(np.float32)
+    (output,) = tiled_inference.predict([image])
+    # the tiles see the resized image, and the output is resized back to the full resolution
+    scaled_shape = (round(700 * input_scale), round(512 * input_scale))
+    assert output.shape == image.shape
+    np.testing.assert_allclose(output, resize(resize(image, scaled_shape), image.shape[:2]), atol=1e-5)
+    assert tiled_inference.num_pixels == 700 * 512
+
+
+def test_streaming():
+    model = crop_model(92)
+    calls = []
+
+    def predict_fn(tiles):
+        calls.append(len(tiles))
+        return model.predict_on_batch(tiles)
+
+    tiled_inference = TiledInference(predict_fn, stride=192, batch_size=3)
+    shapes = [(600, 600), (300, 300), (388, 800)]
+    images = [np.full(shape + (1,), index, dtype=np.float32) for index, shape in enumerate(shapes)]
+    consumed = []
+
+    def stream():
+        for image in images:
+            consumed.append(image)
+            yield image
+
+    outputs = []
+    for output in tiled_inference.predict(stream()):
+        # the images after the ones in flight are not read yet
+        assert len(consumed) <= len(outputs) + 2
+        outputs.append(output)
+
+    for index, (shape, output) in enumerate(zip(shapes, outputs)):
+        assert output.shape == shape + (1,)
+        np.testing.assert_allclose(output, index)
+    # 9 + 1 + 4 tiles in batches of 3, the last one padded
+    assert calls == [3, 3, 3, 3, 3]
+    assert tiled_inference.num_tiles == 14
+    assert tiled_inference.num_pixels == sum(height * width for height, width in shapes)
+    assert tiled_inference.tiles_per_second > 0
+    assert tiled_inference.seconds_per_megapixel > 0
+
+
+def test_invalid_stride():
+    with pytest.raises(ValueError):
+        TiledInference(lambda tiles: tiles, stride=400)
+
+
+def test_invalid_input_scale():
+    with pytest.raises(ValueError):
+        TiledInference(lambda tiles: tiles, input_scale=0)
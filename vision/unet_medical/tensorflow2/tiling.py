@@ -0,0 +1,211 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+import tensorflow as tf
+
+
+def tile_positions(size, output_size, stride):
+    """
+    Origins of the output tiles along one axis of `size` pixels. They are all multiples of the stride, and the
+    last tile can go past the end of the image, which is padded to cover it.
+    """
+    num_tiles = max(int(np.ceil((size - output_size) / stride)), 0) + 1
+    return np.arange(num_tiles) * stride
+
+
+def blending_weights(output_size, blending):
+    """
+    [output_size, output_size] weights of the pixels of an output tile, largest at its center. Overlapping tiles
+    are averaged with these weights, so that the pixels near the borders of the tiles, which see less of the
+    image around them, contribute less and the seams between tiles do not show.
+    """
+    x = np.arange(output_size) + 0.5
+    if blending == "gaussian":
+        sigma = output_size / 8
+        weights = np.exp(-((x - output_size / 2) ** 2) / (2 * sigma**2))
+    elif blending == "cosine":
+        weights = np.sin(np.pi * x / output_size) ** 2
+    elif blending == "uniform":
+        weights = np.ones(output_size)
+    else:
+        raise ValueError(f"Unknown blending {blending}, use 'gaussian', 'cosine' or 'uniform'.")
+    # every pixel of the image has a non-zero weight
+    weights = np.maximum(weights, 1e-3 * weights.max())
+    return np.outer(weights, weights).astype(np.float32)
+
+
+def resize(image, shape):
+    """Bilinear resize of a [height, width] or [height, width, channels] image, as the training inputs"""
+    resized = tf.image.resize(image if image.ndim == 3 else image[..., np.newaxis], shape).numpy()
+    return resized.astype(image.dtype).reshape(shape + image.shape[2:])
+
+
+class _ImageState:
+    """Output buffers of an image with tiles in flight"""
+
+    def __init__(self, image, tiled_inference):
+        self.shape = image.shape[:2]
+        self.scaled_shape = self.shape
+        if tiled_inference.input_scale != 1:
+            self.scaled_shape = tuple(max(int(round(size * tiled_inference.input_scale)), 1) for size in self.shape)
+            image = resize(image, self.scaled_shape)
+        margin = tiled_inference.margin
+        output_size = tiled_inference.output_size
+        self.rows = tile_positions(self.scaled_shape[0], output_size, tiled_inference.stride)
+        self.cols = tile_positions(self.scaled_shape[1], output_size, tiled_inference.stride)
+        padded_shape = (self.rows[-1] + output_size, self.cols[-1] + output_size)
+        # the context of the tiles at the borders is mirrored, as in the UNet paper
+        pad = [
+            (margin, margin + padded_shape[0] - self.scaled_shape[0]),
+            (margin, margin + padded_shape[1] - self.scaled_shape[1]),
+        ]
+        self.image = np.pad(image, pad + [(0, 0)] * (image.ndim - 2), mode="reflect")
+        self.outputs = None
+        self.weights = np.zeros(padded_shape, dtype=np.float32)
+        self.remaining = len(self.rows) * len(self.cols)
+
+    def tiles(self, tile_size):
+        for row in self.rows:
+            for col in self.cols:
+                yield self, row, col, self.image[row : row + tile_size, col : col + tile_size]
+
+    def add(self, row, col, output, weights):
+        if self.outputs is None:
+            self.outputs = np.zeros(self.weights.shape + output.shape[2:], dtype=np.float32)
+        output_size = weights.shape[0]
+        self.outputs[row : row + output_size, col : col + output_size] += output * weights[..., None]
+        self.weights[row : row + output_size, col : col + output_size] += weights
+        self.remaining -= 1
+
+    def result(self):
+        height, width = self.scaled_shape
+        result = self.outputs[:height, :width] / self.weights[:height, :width, None]
+        if self.scaled_shape != self.shape:
+            result = resize(result, self.shape)
+        return result
+
+
+class TiledInference:
+    """
+    Sliding window inference of images of any size with a model of fixed input size.
+
+    :param predict_fn: Maps a [batch_size, tile_size, tile_size, channels] batch of tiles to the
+        [batch_size, output_size, output_size, classes] outputs, for instance `model.predict`.
+    :param tile_size: Input size of the model, 572 for the UNet.
+    :param output_size: Output size of the model, 388 for the UNet. The output of a tile is the center of its
+        input, the margin around it is the context needed by the valid convolutions.
+    :param stride: Distance between the origins of neighbouring tiles. With a stride smaller than output_size
+        the tiles overlap. The UNet outputs only shift with the tiles for multiples of 16, because of its 4 max
+        poolings, so multiples of 16 make the overlapping outputs agree.
+    :param batch_size: Number of tiles of each call of predict_fn. The tiles of consecutive images fill the
+        batches together, and the last batch is padded with empty tiles.
+    :param blending: Weights of the overlapping outputs, "gaussian", "cosine" or "uniform".
+    :param input_scale: Scale of the images before they are tiled, the outputs are resized back to the size of the
+        images. The UNet is trained on 512x512 images resized to 388x388, so the scale of its training inputs is
+        388 / 512 of the native resolution.
+
+    `predict` streams the outputs: the tiles of an image are only cut when there is room for them in the
+    batch, and the output of an image is returned as soon as all its tiles are done, so memory holds one
+    batch of tiles and the buffers of the images with tiles in flight.
+    """
+
+    def __init__(
+        self,
+        predict_fn,
+        tile_size=572,
+        output_size=388,
+        stride=192,
+        batch_size=1,
+        blending="gaussian",
+        input_scale=1.0,
+    ):
+        if (tile_size - output_size) % 2:
+            raise ValueError(f"The tile size {tile_size} and output size {output_size} must have the same parity.")
+        if not 0 < stride <= output_size:
+            raise ValueError(f"The stride {stride} must be between 1 and the output size {output_size}.")
+        if input_scale <= 0:
+            raise ValueError(f"The input scale {input_scale} must be positive.")
+        self.predict_fn = predict_fn
+        self.tile_size = tile_size
+        self.output_size = output_size
+        self.margin = (tile_size - output_size) // 2
+        self.stride = stride
+        self.batch_size = batch_size
+        self.weights = blending_weights(output_size, blending)
+        self.input_scale = input_scale
+        self.num_tiles = 0
+        self.num_pixels = 0
+        self.duration = 0.0
+
+    def _run(self, batch):
+        tiles = np.stack([tile for _, _, _, tile in batch])
+        if len(tiles) < self.batch_size:
+            padding = np.zeros((self.batch_size - len(tiles),) + tiles.shape[1:], dtype=tiles.dtype)
+            tiles = np.concatenate([tiles, padding])
+        outputs = np.asarray(self.predict_fn(tiles))
+        for (state, row, col, _), output in zip(batch, outputs):
+            state.add(row, col, output, self.weights)
+        self.num_tiles += len(batch)
+
+    def predict(self, images):
+        """
+        Yields the [height, width, classes] outputs of the [height, width] or [height, width, channels] images,
+        in order, as soon as they are done.
+        """
+        images = iter(images)
+        in_flight = deque()
+        tiles = iter(())
+        batch = []
+        start = perf_counter()
+        while True:
+            tile = next(tiles, None)
+            if tile is None:
+                image = next(images, None)
+                if image is None:
+                    break
+                state = _ImageState(image, self)
+                in_flight.append(state)
+                tiles = state.tiles(self.tile_size)
+                continue
+            batch.append(tile)
+            if len(batch) == self.batch_size:
+                self._run(batch)
+                batch = []
+                yield from self._finished(in_flight, start)
+                start = perf_counter()
+        if batch:
+            self._run(batch)
+        yield from self._finished(in_flight, start)
+
+    def _finished(self, in_flight, start):
+        while in_flight and in_flight[0].remaining == 0:
+            state = in_flight.popleft()
+            self.num_pixels += state.shape[0] * state.shape[1]
+            result = state.result()
+            self.duration += perf_counter() - start
+            start = perf_counter()
+            yield result
+        self.duration += perf_counter() - start
+
+    @property
+    def tiles_per_second(self):
+        return self.num_tiles / self.duration if self.duration else 0.0
+
+    @property
+    def seconds_per_megapixel(self):
+        return self.duration / (self.num_pixels / 1e6) if self.num_pixels else 0.0
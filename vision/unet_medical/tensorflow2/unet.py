@@ -21,10 +21,12 @@ from tensorflow import keras
 from tensorflow.python import ipu
 from time import perf_counter
 
+from dataset import predict_images
 from model import model_fn
 from model_utils import set_pipeline_options
 from utils import configure_ipu, PerfCallback
 from losses import dice_coef_accuracy_fn, dice_ce_loss, ce_loss
+from tiling import TiledInference
 
 
 logger = logging.getLogger(__name__)
@@ -139,8 +141,53 @@ def train_model(args, model, ds_train, ds_eval):
     return eval_accuracy, eval_loss
 
 
-def infer_model(args, model, ds_infer):
+def save_masks(args, masks):
+    output_dir = os.path.join(args.model_dir, "predictions")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    masks[0].save(
+        os.path.join(output_dir, "test-masks.tif"),
+        compression="tiff_deflate",
+        save_all=True,
+        append_images=masks[1:],
+    )
+
+    logger.info(f"Predictions saved at {output_dir}.")
+
+
+def infer_tiled(args, model, images):
+    """Inference on full resolution images with overlapping tiles of the model input size"""
+    batch_size = args.micro_batch_size * args.steps_per_execution
+    tiled_inference = TiledInference(
+        lambda tiles: model.predict(tiles, batch_size=args.micro_batch_size),
+        stride=args.tile_stride,
+        batch_size=batch_size,
+        blending=args.tile_blending,
+        input_scale=args.tile_input_scale,
+    )
     if args.benchmark:
+        # Warmup
+        model.predict(np.zeros((batch_size, 572, 572, 1), dtype=args.dtype), batch_size=args.micro_batch_size)
+    elif args.model_dir:
+        model.load_weights(os.path.join(args.model_dir, "checkpoints")).expect_partial()
+
+    masks = []
+    for prediction in tiled_inference.predict(predict_images(args, images)):
+        if not args.benchmark:
+            masks.append(Image.fromarray(np.argmax(prediction, axis=-1).astype(np.uint8) * 255))
+    logger.info(
+        f"Tiled inference\t Tiles: {tiled_inference.num_tiles}\t "
+        f"throughput: {tiled_inference.tiles_per_second:0.3f} tiles/sec\t "
+        f"latency: {tiled_inference.seconds_per_megapixel:0.3f} seconds/megapixel."
+    )
+    if masks:
+        save_masks(args, masks)
+
+
+def infer_model(args, model, ds_infer):
+    if args.tiled_inference:
+        infer_tiled(args, model, ds_infer)
+    elif args.benchmark:
         # Warmup
         model.predict(ds_infer, steps=args.steps_per_execution)
 
@@ -159,17 +206,7 @@ def infer_model(args, model, ds_infer):
         prediction_tif = [
             Image.fromarray(mask).resize(size=(512, 512), resample=Image.BILINEAR) for mask in binary_masks
         ]
-        output_dir = os.path.join(args.model_dir, "predictions")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        prediction_tif[0].save(
-            os.path.join(output_dir, "test-masks.tif"),
-            compression="tiff_deflate",
-            save_all=True,
-            append_images=prediction_tif[1:],
-        )
-
-        logger.info(f"Predictions saved at {output_dir}.")
+        save_masks(args, prediction_tif)
 
 
 def get_strategy(args):
@@ -0,0 +1,92 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from utils.config import get_cfg_defaults
+from utils.dataset import Dataset, ImageCache
+
+
+IMAGE_SHAPES = [(40, 64), (64, 30), (32, 32), (80, 50), (21, 77), (64, 64)]
+
+
+@pytest.fixture(name="dataset_root")
+def dataset_root_fixture(tmp_path):
+    """Creates a tiny COCO-like dataset with images of different shapes and their labels"""
+    rng = np.random.default_rng(0)
+    images_dir = tmp_path / "coco" / "images" / "train"
+    labels_dir = tmp_path / "coco" / "labels" / "train"
+    images_dir.mkdir(parents=True)
+    labels_dir.mkdir(parents=True)
+    images = []
+    for i, (height, width) in enumerate(IMAGE_SHAPES):
+        image_path = images_dir / ("%012d.jpg" % (i + 1))
+        Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(image_path)
+        labels = np.concatenate(
+            [rng.integers(0, 80, (3, 1)), rng.uniform(0.3, 0.7, (3, 2)), rng.uniform(0.1, 0.3, (3, 2))], 1
+        )
+        np.savetxt(labels_dir / ("%012d.txt" % (i + 1)), labels, fmt="%g")
+        images.append(str(image_path))
+    # A corrupted image is skipped by the verification
+    (images_dir / "000000000099.jpg").write_bytes(b"not an image")
+    images.append(str(images_dir / "000000000099.jpg"))
+    (tmp_path / "coco" / "train.txt").write_text("\n".join(images))
+    return tmp_path
+
+
+def make_dataset(dataset_root, cache_data, mosaic, num_workers=2):
+    cfg = get_cfg_defaults()
+    cfg.model.image_size = 64
+    cfg.model.ipu = False
+    cfg.system.num_workers = num_workers
+    cfg.dataset.train.file = "train.txt"
+    cfg.dataset.train.cache_path = str(dataset_root / "cache" / "train")
+    cfg.dataset.train.cache_data = cache_data
+    cfg.dataset.train.data_aug = True
+    cfg.dataset.mosaic = mosaic
+    cfg.dataset.color = True
+    return Dataset(str(dataset_root) + "/", cfg, "train")
+
+
+def sample(dataset, index, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    return dataset[index]
+
+
+@pytest.mark.parametrize("mosaic", [True, False])
+def test_cached_samples_match_decoded_samples(dataset_root, mosaic):
+    dataset = make_dataset(dataset_root, cache_data=False, mosaic=mosaic)
+    cached_dataset = make_dataset(dataset_root, cache_data=True, mosaic=mosaic)
+    assert len(dataset) == len(IMAGE_SHAPES)
+    assert cached_dataset.image_cache is not None
+    for index in range(len(dataset)):
+        for actual, expected in zip(sample(cached_dataset, index, index), sample(dataset, index, index)):
+            assert torch.equal(actual, expected)
+
+
+def test_image_cache_reused_and_invalidated(dataset_root):
+    dataset = make_dataset(dataset_root, cache_data=True, mosaic=True, num_workers=1)
+    cache_file = dataset.image_cache.cache_file
+    modified = os.path.getmtime(cache_file)
+    for index, (height, width) in enumerate(IMAGE_SHAPES):
+        image = dataset.image_cache[index]
+        assert image.dtype == np.uint8
+        assert max(image.shape[:2]) == 64
+        np.testing.assert_array_equal(image, np.asarray(dataset.resize_image((dataset.get_image(index), None))[0]))
+
+    make_dataset(dataset_root, cache_data=True, mosaic=True)
+    assert os.path.getmtime(cache_file) == modified
+
+    rebuilt = ImageCache(
+        dataset.dataset.cache_path, dataset.images_path[:-1], dataset.images_shapes[:-1], 64, 3, num_workers=1
+    )
+    assert len(rebuilt) == len(IMAGE_SHAPES) - 1
+    assert rebuilt.is_valid(dataset.images_path[:-1], dataset.image_cache.shapes[:-1])
+    assert not rebuilt.is_valid(dataset.images_path, dataset.image_cache.shapes)
+    np.testing.assert_array_equal(rebuilt[2], dataset.image_cache[2])
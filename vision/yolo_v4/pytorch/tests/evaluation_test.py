@@ -0,0 +1,158 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import numpy as np
+import pytest
+import torch
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+
+from utils.evaluation import DetectionEvaluator
+from utils.tools import ap_per_class, clip_coords, iou, xywh_to_xyxy
+
+
+IOU_VALUES = torch.linspace(0.5, 0.95, 10)
+COCO_91_CLASS = list(range(1, 81))
+
+
+def reference_record(labels, predictions, image_size, image_id):
+    """The per-image, per-class loop previously used in StatRecorder.record_eval_stats"""
+    num_labels = len(labels)
+    target_cls = labels[:, 0].tolist() if num_labels else []
+    if predictions is None:
+        return (np.zeros((0, 10), dtype=bool), np.zeros(0), np.zeros(0), target_cls), []
+    bboxes = xywh_to_xyxy(predictions[:, :4]).detach()
+    scores = predictions[:, 4].cpu().detach().numpy()
+    class_pred = predictions[:, 5].cpu().detach().numpy()
+    clip_coords(bboxes, image_size)
+    bbox_summary = []
+    for i, bbox in enumerate(bboxes):
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
+        bbox_summary.append(
+            {
+                "image_id": int(image_id),
+                "category_id": COCO_91_CLASS[int(class_pred[i])],
+                "bbox": [bbox[0].item(), bbox[1].item(), width.item(), height.item()],
+                "score": scores[i].item(),
+            }
+        )
+    correct = torch.zeros(predictions.shape[0], 10, dtype=torch.bool)
+    if num_labels:
+        detected = []
+        target_cls_tensor = labels[:, 0]
+        target_box = xywh_to_xyxy(labels[:, 1:])
+        for cls in torch.unique(target_cls_tensor):
+            target_indx = (cls == target_cls_tensor).nonzero(as_tuple=False).view(-1)
+            pred_indx = (cls == predictions[:, 5]).nonzero(as_tuple=False).view(-1)
+            if pred_indx.shape[0]:
+                best_ious, best_indxs = iou(bboxes[pred_indx, :4], target_box[target_indx]).max(1)
+                detected_set = set()
+                for iou_indx in (best_ious > IOU_VALUES[0]).nonzero(as_tuple=False):
+                    detected_target = target_indx[best_indxs[iou_indx]]
+                    if detected_target.item() not in detected_set:
+                        detected_set.add(detected_target.item())
+                        detected.append(detected_target)
+                        correct[pred_indx[iou_indx]] = best_ious[iou_indx] > IOU_VALUES
+                        if len(detected) == num_labels:
+                            break
+    return (correct.numpy(), scores, class_pred, target_cls), bbox_summary
+
+
+def random_batch(rng, batch_size, num_classes=4):
+    labels_batch, predictions_batch, image_sizes, image_ids = [], [], [], []
+    for i in range(batch_size):
+        num_labels = rng.integers(0, 8)
+        centres = rng.uniform(20, 300, size=(num_labels, 2))
+        sizes = rng.uniform(10, 100, size=(num_labels, 2))
+        cls = rng.integers(0, num_classes, size=(num_labels, 1))
+        labels = np.concatenate([cls, centres, sizes], axis=1)
+        # Predictions are jittered copies of the targets (some duplicated) plus random false positives
+        num_preds = rng.integers(0, 20)
+        if num_preds == 0 and rng.uniform() < 0.5:
+            predictions = None
+        else:
+            source = rng.integers(0, max(num_labels, 1), size=num_preds)
+            if num_labels:
+                boxes = labels[source, 1:] + rng.normal(0, 8, size=(num_preds, 4))
+                pred_cls = np.where(rng.uniform(size=num_preds) < 0.8, labels[source, 0], rng.integers(0, num_classes))
+            else:
+                boxes = rng.uniform(10, 300, size=(num_preds, 4))
+                pred_cls = rng.integers(0, num_classes, size=num_preds)
+            scores = np.sort(rng.uniform(size=num_preds))[::-1]
+            predictions = torch.tensor(
+                np.concatenate([boxes, scores[:, None], pred_cls[:, None]], axis=1), dtype=torch.float32
+            )
+        labels_batch.append(torch.tensor(labels, dtype=torch.float32))
+        predictions_batch.append(predictions)
+        image_sizes.append(torch.tensor([320.0, 300.0]))
+        image_ids.append(str(100 + len(image_ids) + 1000 * rng.integers(0, 10)))
+    return labels_batch, predictions_batch, image_sizes, image_ids
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+def test_batched_matching_matches_per_image_loop(batch_size):
+    rng = np.random.default_rng(batch_size)
+    evaluator = DetectionEvaluator(IOU_VALUES.numpy(), COCO_91_CLASS, capacity=8)
+    reference_stats, reference_summary = [], []
+    for _ in range(5):
+        batch = random_batch(rng, batch_size)
+        evaluator.record_batch(*batch)
+        for labels, predictions, image_size, image_id in zip(*batch):
+            stats, summary = reference_record(labels, predictions, image_size, image_id)
+            reference_stats.append(stats)
+            reference_summary += summary
+
+    reference_stats = [np.concatenate(x, 0) for x in zip(*reference_stats)]
+    for actual, expected in zip(evaluator.eval_stats(), reference_stats):
+        np.testing.assert_array_equal(actual, expected)
+    assert evaluator.seen == 5 * batch_size
+
+    results = evaluator.coco_results()
+    expected_results = np.array(
+        [[d["image_id"], *d["bbox"], d["score"], d["category_id"]] for d in reference_summary]
+    ).reshape(-1, 7)
+    np.testing.assert_array_equal(results, expected_results)
+
+    assert reference_stats[0].any()
+    for actual, expected in zip(ap_per_class(*evaluator.eval_stats()), ap_per_class(*reference_stats)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_coco_results_parity_with_json_detections():
+    rng = np.random.default_rng(0)
+    evaluator = DetectionEvaluator(IOU_VALUES.numpy(), COCO_91_CLASS)
+    images, annotations, reference_summary = [], [], []
+    for _ in range(3):
+        batch = random_batch(rng, 4)
+        evaluator.record_batch(*batch)
+        for labels, predictions, image_size, image_id in zip(*batch):
+            reference_summary += reference_record(labels, predictions, image_size, image_id)[1]
+            images.append({"id": int(image_id), "height": 300, "width": 320})
+            boxes = xywh_to_xyxy(labels[:, 1:]).numpy()
+            for cls, box in zip(labels[:, 0].numpy(), boxes):
+                annotations.append(
+                    {
+                        "id": len(annotations) + 1,
+                        "image_id": int(image_id),
+                        "category_id": COCO_91_CLASS[int(cls)],
+                        "bbox": [float(box[0]), float(box[1]), float(box[2] - box[0]), float(box[3] - box[1])],
+                        "area": float((box[2] - box[0]) * (box[3] - box[1])),
+                        "iscrowd": 0,
+                    }
+                )
+    ground_truth = COCO()
+    ground_truth.dataset = {
+        "images": list({image["id"]: image for image in images}.values()),
+        "annotations": annotations,
+        "categories": [{"id": i} for i in COCO_91_CLASS],
+    }
+    ground_truth.createIndex()
+
+    def evaluate(results):
+        coco_eval = COCOeval(ground_truth, ground_truth.loadRes(results), iouType="bbox")
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+        coco_eval.summarize()
+        return coco_eval.stats
+
+    np.testing.assert_array_equal(evaluate(evaluator.coco_results()), evaluate(reference_summary))
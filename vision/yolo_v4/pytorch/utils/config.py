@@ -138,7 +138,7 @@ config.model.max_nlabels_p5 = mask_n * len(config.model.anchors.p3width) * confi
 
 config.dataset.train = CN()
 config.dataset.test = CN()
-# Cache the images on ram instead of reading them from disk
+# Cache the decoded images, resized to the model image size, in a memory mapped file next to cache_path
 config.dataset.train.cache_data = False
 config.dataset.test.cache_data = False
 # Path to the annotations of the coco dataset
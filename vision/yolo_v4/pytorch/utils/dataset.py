@@ -3,6 +3,7 @@ import os
 import io
 import re
 import PIL
+import multiprocessing
 import yacs
 import torch
 import random
@@ -11,7 +12,7 @@ import numpy as np
 from pathlib import Path
 from PIL import Image
 from tqdm import tqdm
-from typing import Tuple, List, Any
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
 from torchvision.transforms import Compose
 from utils.preprocessing import (
     HSV,
@@ -26,6 +27,150 @@ from utils.preprocessing import (
 )
 
 
+def convert_channels(image: PIL.Image.Image, input_channels: int) -> PIL.Image.Image:
+    """
+    Converts the image to the mode matching the number of input channels of the model
+    Parameters:
+        image: PIL image
+        input_channels: number of input channels of the model
+    Return:
+        image: converted image
+    """
+    if input_channels == 3:
+        return image.convert("RGB")
+    elif input_channels == 1:
+        return image.convert("LA")
+    else:
+        raise RuntimeError("Unsupported number of channels! Supported: [1, 3]")
+
+
+def parallel_map(function: Callable, items: Iterable, num_workers: int, desc: str, total: int) -> List[Any]:
+    """
+    Applies function to every item with a pool of num_workers processes, keeping the order of the items
+    Parameters:
+        function: a picklable function of one argument
+        items: the arguments to apply the function to
+        num_workers: number of worker processes, with 1 or less the function is applied in this process
+        desc: description of the progress bar
+        total: number of items
+    Return:
+        results: list with the result of each item
+    """
+    if num_workers <= 1:
+        return list(tqdm(map(function, items), desc=desc, total=total))
+    with multiprocessing.Pool(num_workers) as pool:
+        chunksize = max(1, min(64, total // (4 * num_workers)))
+        return list(tqdm(pool.imap(function, items, chunksize=chunksize), desc=desc, total=total))
+
+
+def _verify_image(image_path: str) -> Tuple[Optional[Tuple[int, int]], str]:
+    try:
+        image = Image.open(image_path)
+        image.verify()
+        return image.size, ""
+    except Exception as e:
+        return None, str(e)
+
+
+def _cache_image(item: Tuple[str, str, int, Tuple[int, int, int], int, int]) -> None:
+    cache_file, image_path, offset, shape, image_size, input_channels = item
+    image = convert_channels(Image.open(image_path), input_channels)
+    image, _ = ResizeImage(image_size)((image, None))
+    image = np.asarray(image)
+    if image.shape != tuple(shape):
+        raise RuntimeError(
+            "Image " + image_path + " has shape " + str(image.shape) + " but " + str(tuple(shape)) + " was expected"
+        )
+    cache = np.load(cache_file, mmap_mode="r+")
+    cache[offset : offset + image.size] = image.reshape(-1)
+    cache.flush()
+
+
+class ImageCache(object):
+    """
+    Disk cache of the decoded dataset images, resized to the model image size.
+
+    The images are decoded and resized in parallel once, and stored back to back in a single
+    uint8 memory mapped file (`<cache_path>.images<image_size>.npy`), so there is no padding
+    stored for the letterboxing. The file is shared by all the data loader workers through the
+    page cache and each sample becomes a zero copy view instead of a JPEG decode and a resize.
+    The cache is only reused if it was built for the same images, image size and channels.
+    Call function:
+        Parameters:
+            index: the position of the image in the dataset
+        Return:
+            image: HxWxC uint8 array, identical to ResizeImage applied to the decoded image
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        images_path: List[str],
+        images_shapes: List[Tuple[int, int]],
+        image_size: int,
+        input_channels: int,
+        num_workers: int = 1,
+    ):
+        self.cache_file = cache_path + ".images" + str(image_size) + ".npy"
+        self.index_file = cache_path + ".images" + str(image_size) + ".index.npz"
+        self.images = None
+
+        # Same arithmetic as ResizeImage, from the (width, height) of the original images
+        channels = 3 if input_channels == 3 else 2
+        original_shapes = np.array(images_shapes, dtype=np.int64).reshape(-1, 2)
+        ratio = image_size / original_shapes.max(1, keepdims=True)
+        resized = np.where(ratio != 1, (original_shapes * ratio).astype(np.int64), original_shapes)
+        shapes = np.stack([resized[:, 1], resized[:, 0], np.full(len(resized), channels)], 1)
+        offsets = np.concatenate([[0], np.cumsum(np.prod(shapes, 1))])
+
+        if not self.is_valid(images_path, shapes):
+            if os.path.isfile(self.index_file):
+                os.remove(self.index_file)
+            np.lib.format.open_memmap(self.cache_file, mode="w+", dtype=np.uint8, shape=(int(offsets[-1]),)).flush()
+            items = [
+                (self.cache_file, image_path, int(offset), tuple(shape), image_size, input_channels)
+                for image_path, offset, shape in zip(images_path, offsets, shapes)
+            ]
+            parallel_map(_cache_image, items, num_workers, "Caching images", len(items))
+            # The index is only written once all the images are in the cache
+            np.savez(self.index_file, images_path=np.array(images_path), offsets=offsets, shapes=shapes)
+
+        self.offsets = offsets
+        self.shapes = shapes
+
+    def is_valid(self, images_path: List[str], shapes: np.array) -> bool:
+        """
+        Checks whether the cache on disk was built for these images
+        Parameters:
+            images_path: the paths to the images of the dataset
+            shapes: the Nx3 resized shapes of the images
+        Return:
+            valid: True if the cache can be used
+        """
+        if not (os.path.isfile(self.index_file) and os.path.isfile(self.cache_file)):
+            return False
+        with np.load(self.index_file) as index:
+            return (
+                index["shapes"].shape == shapes.shape
+                and (index["shapes"] == shapes).all()
+                and index["images_path"].tolist() == images_path
+            )
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, index: int) -> np.array:
+        # Opened lazily, so that every data loader worker maps the file instead of receiving a pickled copy
+        if self.images is None:
+            self.images = np.load(self.cache_file, mmap_mode="r")
+        return self.images[self.offsets[index] : self.offsets[index + 1]].reshape(self.shapes[index])
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["images"] = None
+        return state
+
+
 class Dataset(torch.utils.data.Dataset):
     def __init__(self, path: str, cfg: yacs.config.CfgNode, mode: str):
         self.cfg = cfg
@@ -42,6 +187,7 @@ class Dataset(torch.utils.data.Dataset):
         self.images_path = None
         self.labels_path = None
         self.img_data = None
+        self.image_cache = None
 
         # Change the data type of the dataloader depending of the options
         if self.cfg.model.uint_io:
@@ -118,7 +264,14 @@ class Dataset(torch.utils.data.Dataset):
             self.labels = self.get_labels()
 
             if self.dataset.cache_data:
-                print("Not available")
+                self.image_cache = ImageCache(
+                    self.dataset.cache_path,
+                    self.images_path,
+                    self.images_shapes,
+                    self.cfg.model.image_size,
+                    self.cfg.model.input_channels,
+                    self.cfg.system.num_workers,
+                )
 
         if not self.dataset.data_aug:
             if self.cfg.dataset.mosaic:
@@ -219,21 +372,21 @@ class Dataset(torch.utils.data.Dataset):
         tmp_images_path = []
         tmp_images_shapes = []
         tmp_images_id = []
-        pbar = tqdm(images_path, desc="Verifying images", total=len(images_path))
-        for image_path in pbar:
-            try:
-                image = Image.open(image_path)
-                image.verify()
-                height, width = image.size
-                min_size = 10
-                if height > min_size and width > min_size:
-                    tmp_images_path.append(image_path)
-                    tmp_images_shapes.append([height, width])
-                    tmp_images_id.append(int(Path(image_path).stem))
-                else:
-                    print("Warning!!! Invalid image, image smaller than " + str(min_size) + " pixels: " + image_path)
-            except Exception as e:
-                print("Warning!!! Invalid image: " + image_path + str(e))
+        results = parallel_map(
+            _verify_image, images_path, self.cfg.system.num_workers, "Verifying images", len(images_path)
+        )
+        for image_path, (size, error) in zip(images_path, results):
+            if size is None:
+                print("Warning!!! Invalid image: " + image_path + error)
+                continue
+            height, width = size
+            min_size = 10
+            if height > min_size and width > min_size:
+                tmp_images_path.append(image_path)
+                tmp_images_shapes.append([height, width])
+                tmp_images_id.append(int(Path(image_path).stem))
+            else:
+                print("Warning!!! Invalid image, image smaller than " + str(min_size) + " pixels: " + image_path)
         return tmp_images_path, tmp_images_shapes, tmp_images_id
 
     def __len__(self) -> int:
@@ -254,18 +407,16 @@ class Dataset(torch.utils.data.Dataset):
             image: transformed image in the index position
             labels: transformed labels in the index position
         """
-        image = self.get_image(index)
-        labels = self.labels[
+        transformed_image, size = self.get_resized_image(index)
+        transformed_labels = self.labels[
             index
         ].copy()  # Format: [0] is the Class, [1, 2] is the Center x, y point and [3, 4] is the width and height of the box
-        size = torch.as_tensor(image.size)
-
-        transformed_image, transformed_labels = self.resize_image((image, labels))
+        size = torch.as_tensor(size)
 
         if self.cfg.dataset.mosaic and self.dataset.data_aug:
             # sample other 3 images to stitch with the current image
             indices = np.random.randint(0, self.__len__(), 3)
-            mosaic_candidates = [self.resize_image((self.get_image(i), self.labels[i].copy())) for i in indices]
+            mosaic_candidates = [(self.get_resized_image(i)[0], self.labels[i].copy()) for i in indices]
             mosaic_candidates = [(transformed_image, transformed_labels)] + mosaic_candidates
             transformed_image, transformed_labels = self.mosaic(tuple(mosaic_candidates))
             transformed_image, transformed_labels = self.random_perspective_mosaic(
@@ -274,6 +425,8 @@ class Dataset(torch.utils.data.Dataset):
 
         else:
             # Pad if we don't do the mosaic
+            if not isinstance(transformed_image, Image.Image):
+                transformed_image = Image.fromarray(transformed_image)
             transformed_image, transformed_labels = self.pad((transformed_image, transformed_labels))
 
         if self.dataset.data_aug:
@@ -311,9 +464,19 @@ class Dataset(torch.utils.data.Dataset):
         else:
             image = Image.open(self.images_path[index])
 
-        if self.cfg.model.input_channels == 3:
-            return image.convert("RGB")
-        elif self.cfg.model.input_channels == 1:
-            return image.convert("LA")
-        else:
-            raise RuntimeError("Unsupported number of channels! Supported: [1, 3]")
+        return convert_channels(image, self.cfg.model.input_channels)
+
+    def get_resized_image(self, index: int) -> Tuple[Union[PIL.Image.Image, np.array], Tuple[int, int]]:
+        """
+        Returns the index image of the dataset resized to the model image size, read from
+        the image cache when it is enabled
+        Parameters:
+            index: the position of the image in the dataset
+        Return:
+            image: resized image in the index position, as a PIL image or a HxWxC uint8 array if cached
+            size: size of the original image
+        """
+        if self.image_cache is not None:
+            return self.image_cache[index], tuple(self.images_shapes[index])
+        image = self.get_image(index)
+        return self.resize_image((image, None))[0], image.size
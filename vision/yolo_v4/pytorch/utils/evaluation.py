@@ -0,0 +1,241 @@
+# Copyright (c) 2023 Graphcore Ltd. All rights reserved.
+
+import numpy as np
+import torch
+from typing import List, Optional, Sequence, Tuple, Union
+
+
+def to_numpy(x: Union[np.array, torch.Tensor]) -> np.array:
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def batched_box_iou(boxes1: np.array, boxes2: np.array) -> np.array:
+    """
+    Return the intersection-over-union of every pair of boxes of the same batch element,
+    using the same float32 arithmetic as `utils.tools.iou`.
+    Both sets of boxes are expected to be in (xmin, ymin, xmax, ymax) format
+    Parameters:
+        boxes1 (np.array): a BxNx4 array of boxes
+        boxes2 (np.array): a BxMx4 array of boxes
+    Returns:
+        np.array: the BxNxM array of pairwise IoU values
+    """
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+
+    wh = np.minimum(boxes1[:, :, None, 2:], boxes2[:, None, :, 2:]) - np.maximum(
+        boxes1[:, :, None, :2], boxes2[:, None, :, :2]
+    )
+    wh = np.maximum(wh, 0)
+    inter = wh[..., 0] * wh[..., 1]
+    union = area1[:, :, None] + np.finfo(np.float32).eps + area2[:, None, :] - inter
+    return inter / union
+
+
+def match_predictions(
+    pred_boxes: np.array,
+    pred_cls: np.array,
+    pred_mask: np.array,
+    target_boxes: np.array,
+    target_cls: np.array,
+    target_mask: np.array,
+    iou_values: np.array,
+) -> np.array:
+    """
+    Greedy matching of the predictions to the targets of a whole batch of images.
+
+    Each prediction is compared against the target of the same class and image it overlaps most.
+    It is a true positive if that IoU is above the first threshold and no earlier prediction
+    (in the order given) claimed the same target. This is the same rule as the per-image,
+    per-class loop historically used by `StatRecorder.record_eval_stats`.
+    Parameters:
+        pred_boxes (np.array): BxPx4 padded xyxy prediction boxes
+        pred_cls (np.array): BxP predicted classes
+        pred_mask (np.array): BxP mask of valid (non-padding) predictions
+        target_boxes (np.array): BxTx4 padded xyxy target boxes
+        target_cls (np.array): BxT target classes
+        target_mask (np.array): BxT mask of valid (non-padding) targets
+        iou_values (np.array): the K IoU thresholds
+    Returns:
+        np.array: BxPxK boolean array of the predictions that are correct at each IoU threshold
+    """
+    batch_size, num_preds = pred_cls.shape
+    num_targets = target_cls.shape[1]
+    correct = np.zeros((batch_size, num_preds, iou_values.shape[0]), dtype=bool)
+    if num_preds == 0 or num_targets == 0:
+        return correct
+
+    ious = batched_box_iou(pred_boxes, target_boxes)
+    same_class = (pred_cls[:, :, None] == target_cls[:, None, :]) & pred_mask[:, :, None] & target_mask[:, None, :]
+    ious = np.where(same_class, ious, np.float32(-1.0))
+    best_targets = ious.argmax(axis=2)
+    best_ious = np.take_along_axis(ious, best_targets[..., None], axis=2)[..., 0]
+
+    # Row-major flattening keeps the prediction order within each image, so the first
+    # occurrence of each (image, target) key is the prediction that claims the target.
+    candidates = np.flatnonzero(best_ious > iou_values[0])
+    keys = (candidates // num_preds) * num_targets + best_targets.reshape(-1)[candidates]
+    _, first = np.unique(keys, return_index=True)
+    matched = candidates[first]
+
+    correct = correct.reshape(batch_size * num_preds, -1)
+    correct[matched] = best_ious.reshape(-1)[matched, None] > iou_values[None, :]
+    return correct.reshape(batch_size, num_preds, -1)
+
+
+class _Columns:
+    """Preallocated, growable numpy columns that share a row count."""
+
+    def __init__(self, columns: dict, capacity: int = 4096):
+        self.size = 0
+        self.capacity = capacity
+        self.data = {
+            name: np.zeros((capacity,) + tuple(shape), dtype=dtype) for name, (shape, dtype) in columns.items()
+        }
+
+    def reset(self):
+        self.size = 0
+
+    def append(self, **values):
+        count = len(next(iter(values.values())))
+        if self.size + count > self.capacity:
+            self.capacity = max(2 * self.capacity, self.size + count)
+            for name, column in self.data.items():
+                grown = np.zeros((self.capacity,) + column.shape[1:], dtype=column.dtype)
+                grown[: self.size] = column[: self.size]
+                self.data[name] = grown
+        for name, value in values.items():
+            self.data[name][self.size : self.size + count] = value
+        self.size += count
+
+    def __getitem__(self, name: str) -> np.array:
+        return self.data[name][: self.size]
+
+
+class DetectionEvaluator:
+    """
+    Accumulates the matches between predictions and targets a batch at a time, keeping
+    every detection in preallocated numpy columns, from which the AP metrics and the
+    COCO results array are computed without per-box Python work.
+    """
+
+    def __init__(self, iou_values: np.array, coco_91_class: Optional[Sequence[int]] = None, capacity: int = 4096):
+        self.iou_values = np.asarray(iou_values, dtype=np.float32)
+        self.coco_91_class = np.asarray(coco_91_class) if coco_91_class is not None else None
+        self.detections = _Columns(
+            {
+                "image_id": ((), np.int64),
+                "bbox": ((4,), np.float32),
+                "score": ((), np.float32),
+                "pred_class": ((), np.float32),
+                "correct": ((self.iou_values.shape[0],), bool),
+            },
+            capacity,
+        )
+        self.targets = _Columns({"target_class": ((), np.float32)}, capacity)
+        self.seen = 0
+
+    def reset(self):
+        self.detections.reset()
+        self.targets.reset()
+        self.seen = 0
+
+    def record_batch(
+        self,
+        labels_batch: List[Union[np.array, torch.Tensor]],
+        predictions_batch: List[Optional[Union[np.array, torch.Tensor]]],
+        image_sizes: List[Union[np.array, torch.Tensor]],
+        image_ids: List[Union[int, str]],
+    ):
+        """
+        Records the matches of a batch of images
+        Parameters:
+            labels_batch: per image, N X 5 array of labels (class, x, y, w, h)
+            predictions_batch: per image, M X 6 array of predictions (x, y, w, h, score, class) or None
+            image_sizes: per image, the original image size used to clip the predictions
+            image_ids: per image, the COCO image id
+        """
+        batch_size = len(labels_batch)
+        self.seen += batch_size
+        labels_batch = [to_numpy(labels).astype(np.float32).reshape(-1, 5) for labels in labels_batch]
+        predictions_batch = [
+            to_numpy(predictions)[:, :6].astype(np.float32) if predictions is not None else np.zeros((0, 6), np.float32)
+            for predictions in predictions_batch
+        ]
+        num_labels = np.array([labels.shape[0] for labels in labels_batch])
+        num_preds = np.array([predictions.shape[0] for predictions in predictions_batch])
+
+        self.targets.append(target_class=np.concatenate(labels_batch)[:, 0])
+
+        # Images without predictions only contribute targets
+        if num_preds.sum() == 0:
+            return
+
+        max_preds = num_preds.max()
+        max_labels = num_labels.max()
+        pred_mask = np.arange(max_preds)[None, :] < num_preds[:, None]
+        target_mask = np.arange(max_labels)[None, :] < num_labels[:, None]
+        predictions = np.zeros((batch_size, max_preds, 6), dtype=np.float32)
+        predictions[pred_mask] = np.concatenate(predictions_batch)
+        labels = np.zeros((batch_size, max_labels, 5), dtype=np.float32)
+        labels[target_mask] = np.concatenate(labels_batch)
+
+        pred_boxes = xywh_to_xyxy_np(predictions[..., :4])
+        image_sizes = np.stack([to_numpy(size).astype(np.float32).reshape(-1)[:2] for size in image_sizes])
+        pred_boxes[..., 0::2] = np.clip(pred_boxes[..., 0::2], 0, image_sizes[:, None, 0:1])
+        pred_boxes[..., 1::2] = np.clip(pred_boxes[..., 1::2], 0, image_sizes[:, None, 1:2])
+
+        correct = match_predictions(
+            pred_boxes,
+            predictions[..., 5],
+            pred_mask,
+            xywh_to_xyxy_np(labels[..., 1:]),
+            labels[..., 0],
+            target_mask,
+            self.iou_values,
+        )
+
+        image_ids = np.array([int(image_id) for image_id in image_ids], dtype=np.int64)
+        self.detections.append(
+            image_id=np.broadcast_to(image_ids[:, None], pred_mask.shape)[pred_mask],
+            bbox=pred_boxes[pred_mask],
+            score=predictions[..., 4][pred_mask],
+            pred_class=predictions[..., 5][pred_mask],
+            correct=correct[pred_mask],
+        )
+
+    def eval_stats(self) -> Tuple[np.array, np.array, np.array, np.array]:
+        """The (correct, score, predicted class, target class) arrays expected by `utils.tools.ap_per_class`"""
+        return (
+            self.detections["correct"],
+            self.detections["score"],
+            self.detections["pred_class"],
+            self.targets["target_class"],
+        )
+
+    def coco_results(self) -> np.array:
+        """
+        Detections as an N X 7 array of (image_id, x, y, w, h, score, category_id),
+        the in-memory results format accepted by `pycocotools.coco.COCO.loadRes`
+        """
+        if self.coco_91_class is None:
+            raise ValueError("The COCO category ids are needed to produce COCO results.")
+        bbox = self.detections["bbox"]
+        return np.column_stack(
+            (
+                self.detections["image_id"],
+                bbox[:, :2].astype(np.float64),
+                (bbox[:, 2:] - bbox[:, :2]).astype(np.float64),
+                self.detections["score"].astype(np.float64),
+                self.coco_91_class[self.detections["pred_class"].astype(np.int64)],
+            )
+        )
+
+
+def xywh_to_xyxy_np(boxes: np.array) -> np.array:
+    """Convert centerx, centery, width, height to xmin, ymin, xmax, ymax, as `utils.tools.xywh_to_xyxy`"""
+    xmin = boxes[..., 0] - boxes[..., 2] / 2
+    ymin = boxes[..., 1] - boxes[..., 3] / 2
+    return np.stack((xmin, ymin, xmin + boxes[..., 2], ymin + boxes[..., 3]), axis=-1)
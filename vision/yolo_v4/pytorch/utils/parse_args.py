@@ -35,6 +35,7 @@ opt_to_cfg_map = {
     "max_bbox_per_scale": "dataset.max_bbox_per_scale",
     "train_file": "dataset.train.file",
     "test_file": "dataset.test.file",
+    "cache_data": "dataset.train.cache_data",
     "no_eval": "eval.metrics",
     "verbose": "eval.verbose",
     "pre_nms_topk_k": "inference.pre_nms_topk_k",
@@ -150,6 +151,12 @@ def parse_args():
 
     parser.add_argument("--train-file", type=str, help="Path to the train annotations (default: train2017.txt)")
     parser.add_argument("--test-file", type=str, help="Path to the test annotations (default: val2017.txt)")
+    parser.add_argument(
+        "--cache-data",
+        action="store_true",
+        default=None,
+        help="Cache the decoded and resized training images on disk (default: False)",
+    )
 
     parser.add_argument(
         "--print-summary", action="store_true", default=False, help="Print out the model architecture (default: False)"
@@ -275,7 +275,7 @@ class Mosaic(object):
     def __call__(self, item: Tuple[Tuple[Image.Image, np.array]]) -> Tuple[Image.Image, np.array]:
 
         # base image of size self.image_size * 2 x self.image_size * 2
-        base_img = np.full((self.image_size * 2, self.image_size * 2, self.input_channels), 114)
+        base_img = np.full((self.image_size * 2, self.image_size * 2, self.input_channels), 114, dtype=np.uint8)
         base_label = []
         # each grid in the base_img will be of size self.image_size x self.image_size
         center_x, center_y = self.image_size, self.image_size
@@ -337,7 +337,7 @@ class Mosaic(object):
             base_label = np.concatenate(base_label, 0)
         np.clip(base_label[:, 1:], 0, self.image_size, out=base_label[:, 1:])
 
-        return Image.fromarray(np.uint8(base_img)), base_label
+        return Image.fromarray(base_img), base_label
 
 
 class RandomPerspective(object):
@@ -1,8 +1,6 @@
 # Copyright (c) 2021 Graphcore Ltd. All rights reserved.
 import argparse
 import collections
-from datetime import datetime
-import json
 import math
 import numpy as np
 import os
@@ -18,6 +16,7 @@ import wandb
 from yacs.config import CfgNode
 
 from utils.anchors import AnchorBoxes
+from utils.evaluation import DetectionEvaluator
 
 
 class StatRecorder:
@@ -37,8 +36,6 @@ class StatRecorder:
         self.inference_times = []
         self.inference_throughputs = []
         self.total_throughputs = []
-        self.eval_stats = []
-        self.bbox_summary = []
         self.image_count = cfg.model.micro_batch_size * cfg.ipuopts.device_iterations
         self.cfg = cfg
         coco_metadata = yaml.safe_load(
@@ -46,9 +43,9 @@ class StatRecorder:
         )
         self.class_names = coco_metadata["class_names"]
         self.coco_91_class = coco_metadata["coco_91_class"]
-        self.seen = 0
         self.iou_values = torch.linspace(0.5, 0.95, 10)
         self.num_ious = self.iou_values.numel()
+        self.evaluator = DetectionEvaluator(self.iou_values.numpy(), self.coco_91_class)
         self.data_path = data_path
 
         # Training stat initialization
@@ -77,84 +74,44 @@ class StatRecorder:
         self.moving_avg_loss = torch.zeros(4)
         self.throughput = 0.0
 
+    @property
+    def seen(self):
+        return self.evaluator.seen
+
     def reset_eval_stats(self):
-        self.eval_stats = []
-        self.seen = 0
-        self.bbox_summary = []
+        self.evaluator.reset()
 
     def record_eval_stats(
         self, labels: np.array, predictions: np.array, image_size: torch.Tensor, image_id: str, run_coco_eval: bool
     ):
         """
-        Records the statistics needed to compute the metrics
+        Records the statistics needed to compute the metrics for a single image
         Parameters:
             labels (np.array): N X 5 array of labels
             predictions (np.array): M X 85 array of predictions
             image_size (torch.Tensor): contains the original image size
+            image_id (str): the COCO image id
+            run_coco_eval (bool): unused, the detections needed by COCO eval are always recorded
         """
-        num_labels = len(labels)
-        target_cls = labels[:, 0].tolist() if num_labels else []
-        self.seen = self.seen + 1
-
-        # Handle case where we get no predictions
-        if predictions is None:
-            if num_labels:
-                self.eval_stats.append(
-                    (torch.zeros(0, self.num_ious, dtype=torch.bool), torch.Tensor(), torch.Tensor(), target_cls)
-                )
-        else:
-            bboxes = xywh_to_xyxy(predictions[:, :4]).detach()
-            scores = predictions[:, 4].cpu().detach().numpy()
-            class_pred = predictions[:, 5].cpu().detach().numpy()
-
-            clip_coords(bboxes, image_size)
-
-            # save the predictions in json format for COCOeval [{"image_id":42,"category_id":18,"bbox":[258.15,41.29,348.26,243.78],"score":0.236}]
-            if run_coco_eval:
-                for i, bbox in enumerate(bboxes):
-                    width = bbox[2] - bbox[0]
-                    height = bbox[3] - bbox[1]
-                    self.bbox_summary.append(
-                        {
-                            "image_id": int(image_id),
-                            "category_id": self.coco_91_class[int(class_pred[i])],
-                            "bbox": [bbox[0].item(), bbox[1].item(), width.item(), height.item()],
-                            "score": scores[i].item(),
-                        }
-                    )
-            # Assign all predictions as inccorect
-            correct = torch.zeros(predictions.shape[0], self.num_ious, dtype=torch.bool)
-
-            if num_labels:
-                detected = []
-                target_cls_tensor = labels[:, 0]
-
-                # target boxes
-                target_box = xywh_to_xyxy(labels[:, 1:])
-
-                # Per target class
-                for cls in torch.unique(target_cls_tensor):
-                    target_indx = (cls == target_cls_tensor).nonzero(as_tuple=False).view(-1)  # target indices
-                    pred_indx = (cls == predictions[:, 5]).nonzero(as_tuple=False).view(-1)  # prediction indices
-
-                    # Search for detections
-                    if pred_indx.shape[0]:
-                        # Prediction to target ious
-                        best_ious, best_indxs = iou(bboxes[pred_indx, :4], target_box[target_indx]).max(
-                            1
-                        )  # best ious, indices
-                        # Appended detections
-                        detected_set = set()
-                        for iou_indx in (best_ious > self.iou_values[0]).nonzero(as_tuple=False):
-                            detected_target = target_indx[best_indxs[iou_indx]]
-                            if detected_target.item() not in detected_set:
-                                detected_set.add(detected_target.item())
-                                detected.append(detected_target)
-                                correct[pred_indx[iou_indx]] = best_ious[iou_indx] > self.iou_values  # iou_thres is 1xn
-                                if len(detected) == num_labels:  # all targets already located in image
-                                    break
-
-            self.eval_stats.append((correct.cpu().detach().numpy(), scores, class_pred, target_cls))
+        self.record_eval_batch([labels], [predictions], [image_size], [image_id])
+
+    def record_eval_batch(
+        self,
+        labels_batch: List[np.array],
+        predictions_batch: List[np.array],
+        image_sizes: List[torch.Tensor],
+        image_ids: List[str],
+    ):
+        """
+        Records the statistics needed to compute the metrics for a batch of images,
+        matching all the predictions of the batch to their targets at once
+        Parameters:
+            labels_batch (List[np.array]): per image, N X 5 array of labels
+            predictions_batch (List[np.array]): per image, M X 85 array of predictions, or None
+            image_sizes (List[torch.Tensor]): per image, the original image size
+            image_ids (List[str]): per image, the COCO image id
+        """
+        self.evaluator.record_batch(labels_batch, predictions_batch, image_sizes, image_ids)
 
     def compute_and_print_eval_metrics(self, output_function):
         """
@@ -163,8 +120,8 @@ class StatRecorder:
         s = ("%20s" + "%12s" * 6) % ("Class", "Images", "Targets", "P", "R", "mAP@.5", "mAP@.5:.95")
         precision, recall, f1, mean_precision, mean_recall, m_ap50, m_ap = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
         ap = []
-        eval_stats = [np.concatenate(x, 0) for x in zip(*self.eval_stats)]
-        valid_eval = len(eval_stats) and eval_stats[0].any()
+        eval_stats = self.evaluator.eval_stats()
+        valid_eval = eval_stats[0].any()
         if valid_eval:
             precision, recall, ap, f1, ap_class = ap_per_class(*eval_stats)
             precision, recall, ap50, ap = precision[:, 0], recall[:, 0], ap[:, 0], ap.mean(1)
@@ -189,22 +146,20 @@ class StatRecorder:
         return self.seen, nt.sum(), mean_precision, mean_recall, m_ap50, m_ap
 
     def write_and_eval_coco(self):
-        temp_pred_file = "temp_detections_{}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S.%f")[:-4])
-        with open(temp_pred_file, "w") as f:
-            json.dump(self.bbox_summary, f)
+        """Evaluates the recorded detections with pycocotools, for exact parity with the official COCO metrics"""
         annotation_file = (
             self.data_path + "/" + self.cfg.dataset.name + "/annotations/" + self.cfg.dataset.test.annotation
         )
         try:
             ground_truth = COCO(annotation_file)
-            predictions = ground_truth.loadRes(temp_pred_file)
+            # pycocotools accepts the detections as an in-memory array, no need to go through a JSON file
+            predictions = ground_truth.loadRes(self.evaluator.coco_results())
             coco_eval = COCOeval(ground_truth, predictions, iouType="bbox")
             coco_eval.evaluate()
             coco_eval.accumulate()
             coco_eval.summarize()
         except Exception as e:
             print("pycocotools failed with: ", e)
-        os.remove(temp_pred_file)
 
     def record_inference_stats(self, inference_round_trip_time: Tuple[float, float, float], inference_step_time: float):
         """Storages in the class the latency, inference time and postprocessing time of a model